@@ -1,17 +1,85 @@
+import asyncio
+import atexit
+import json
 import logging
-import math
+import os
+import secrets
+import time
 import typing as t
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Union
-
-import sqlalchemy as sa
-from flask import Flask, redirect, render_template, request, url_for
+from typing import Any, Iterator, Optional, Union
+
+import click
+from flask import (
+    Flask,
+    g,
+    redirect,
+    render_template,
+    request,
+    session,
+    stream_with_context,
+    url_for,
+)
 
 try:
-    from app.trade import CONST_VALUE, NameOperation, Trade
+    from app.async_trade import AsyncTrade, SyncTradeReader
+    from app.database import DatabaseSettings, create_async_engine, create_engine
+    from app.export import EXPORT_FORMATS
+    from app.http_cache import (
+        compress_response,
+        directory_digest,
+        is_compressible,
+        make_etag,
+    )
+    from app.journal import recover
+    from app.ledger import LedgerSettings, LedgerTrade, restore_database
+    from app.logging_config import setup_logging
+    from app.market import MarketModel, MarketSettings
+    from app.metrics import (
+        REGISTRY,
+        REQUEST_DB_QUERIES,
+        REQUEST_DURATION,
+        REQUESTS,
+        TRADE_OPERATIONS,
+        finish_request_queries,
+        start_request_queries,
+    )
+    from app.price_stream import format_price_event
+    from app.render_cache import Fragment, RenderCache, make_fragment
+    from app.scheduler import PriceTickScheduler, SchedulerSettings
+    from app.trade import CONST_VALUE, HistoryFilter, NameOperation, Trade
 except ImportError:  # pragma: no cover
-    from trade import CONST_VALUE, NameOperation, Trade  # type: ignore
+    from async_trade import AsyncTrade, SyncTradeReader  # type: ignore
+    from database import (  # type: ignore
+        DatabaseSettings,
+        create_async_engine,
+        create_engine,
+    )
+    from export import EXPORT_FORMATS  # type: ignore
+    from http_cache import (  # type: ignore
+        compress_response,
+        directory_digest,
+        is_compressible,
+        make_etag,
+    )
+    from journal import recover  # type: ignore
+    from ledger import LedgerSettings, LedgerTrade, restore_database  # type: ignore
+    from logging_config import setup_logging  # type: ignore
+    from market import MarketModel, MarketSettings  # type: ignore
+    from metrics import (  # type: ignore
+        REGISTRY,
+        REQUEST_DB_QUERIES,
+        REQUEST_DURATION,
+        REQUESTS,
+        TRADE_OPERATIONS,
+        finish_request_queries,
+        start_request_queries,
+    )
+    from price_stream import format_price_event  # type: ignore
+    from render_cache import Fragment, RenderCache, make_fragment  # type: ignore
+    from scheduler import PriceTickScheduler, SchedulerSettings  # type: ignore
+    from trade import CONST_VALUE, HistoryFilter, NameOperation, Trade  # type: ignore
 
 if t.TYPE_CHECKING:
     from werkzeug.wrappers.response import Response
@@ -24,11 +92,80 @@ logger = logging.getLogger(__name__)
 class Application:
     app: Flask
     trade: Trade
-    now_user_login: str
+    # Чтения асинхронных представлений, None - читать через trade
+    async_trade: Optional[AsyncTrade] = None
+    scheduler: Optional[PriceTickScheduler] = None
+    # Отрендеренные фрагменты страниц, см. app/render_cache.py
+    render_cache: RenderCache = field(default_factory=RenderCache)
 
 
 logger.info('Запускаем сервер')
-application = Application(Flask(__name__), None, '')  # type: ignore
+application = Application(Flask(__name__), None)  # type: ignore
+# Ключ подписи cookie сессии. Процессы одного сервиса должны подписывать
+# одним ключом, иначе пользователь будет разлогиниваться при переходе между
+# процессами
+application.app.secret_key = os.environ.get('APP_SECRET_KEY')
+if not application.app.secret_key:
+    logger.warning('APP_SECRET_KEY не задан, сессии будут жить до перезапуска')
+    application.app.secret_key = secrets.token_hex(32)
+application.app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+# Хэш шаблонов входит в ETag страниц: после их изменения клиенты получат
+# новую разметку, а не 304
+TEMPLATES_DIGEST = directory_digest(
+    os.path.join(application.app.root_path, application.app.template_folder)
+)
+
+
+def get_user_login() -> str:
+    # Пустая строка, если пользователь не авторизован
+    return session.get('user_login', '')
+
+
+def get_trade_reader() -> Union[AsyncTrade, SyncTradeReader]:
+    if application.async_trade is not None:
+        return application.async_trade
+    return SyncTradeReader(application.trade)
+
+
+def get_cryptocurrency_table(user_login: str) -> Fragment:
+    # Список валют меняется только с эпохой цен, а от пользователя зависит
+    # лишь то, показывать ли формы покупки и продажи. Эпоху берём до цен:
+    # если цены обновятся между ними, под старой эпохой окажутся новые цены
+    key = (application.trade.price_cache.epoch, user_login != '')
+    table = application.render_cache.get('cryptocurrency_list', key)
+    if table is None:
+        table = make_fragment(
+            render_template(
+                '_cryptocurrency_list.html',
+                user_login=user_login,
+                cryptocurrency_list=application.trade.get_all_crypto(),
+            )
+        )
+        application.render_cache.put('cryptocurrency_list', key, table)
+    return table
+
+
+def get_version_not_modified(*parts: Any) -> Optional['Response']:
+    # ETag по версии пользователя из базы, цене и курсорам проверяется до
+    # кэша фрагментов: на 304 не нужны ни запросы страницы, ни рендеринг.
+    # Версии леджера живут в памяти, для него ETag считается по содержимому
+    if not application.trade.durable_user_versions:
+        return None
+    return get_not_modified('version', *parts)
+
+
+def get_not_modified(*parts: Any) -> Optional['Response']:
+    # ETag страницы - хэш шаблонов и того, из чего она рендерится: версии
+    # пользователя или (для леджера) баланса и хэшей фрагментов.
+    # Если такая страница у клиента уже есть, отвечаем 304 без рендеринга
+    etag = make_etag(TEMPLATES_DIGEST, request.endpoint, *parts)
+    g.etag = etag
+    # Сжатая страница - другое представление, у неё свой ETag
+    for tag in (etag, f'{etag}-gzip'):
+        if request.if_none_match.contains(tag):
+            g.etag = tag
+            return application.app.response_class(status=304)
+    return None
 
 
 def init_trade_operation() -> None:  # pragma: no cover -- Функции ниже тестируются отдельно
@@ -45,73 +182,198 @@ def init_trade_operation() -> None:  # pragma: no cover -- Функции ниж
     application.trade.create_operation(NameOperation.Sell.value)
 
 
+def create_market() -> Optional[MarketModel]:
+    # APP_PRICE_MODEL=gbm меняет цены по модели рынка из app/market.py
+    # вместо случайных -10..10% за тик
+    price_model = os.environ.get('APP_PRICE_MODEL', 'random')
+    if price_model == 'random':
+        return None
+    if price_model != 'gbm':
+        raise ValueError(f'Неизвестный APP_PRICE_MODEL: {price_model}')
+    return MarketModel.from_settings(
+        MarketSettings.from_env(), SchedulerSettings.from_env().interval
+    )
+
+
+def create_trade(engine: Any) -> Trade:
+    # APP_TRADE_BACKEND=ledger держит балансы в памяти и пишет сделки в базу
+    # в фоне, см. app/ledger.py
+    backend = os.environ.get('APP_TRADE_BACKEND', 'sql')
+    market = create_market()
+    if backend == 'ledger':
+        logger.info('Балансы и портфели хранятся в памяти')
+        return LedgerTrade(engine, market=market)
+    if backend != 'sql':
+        raise ValueError(f'Неизвестный APP_TRADE_BACKEND: {backend}')
+    return Trade(engine, market=market)
+
+
+def create_async_trade(
+    trade: Trade, settings: DatabaseSettings
+) -> Optional[AsyncTrade]:
+    # Пока представления Flask выполняются в потоке запроса, каждый запрос к
+    # базе через AsyncTrade - ещё два перехода между потоками, и поток не
+    # освобождается: по tests/bench/test_bench_async.py синхронные чтения не
+    # медленнее. Поэтому асинхронные чтения включаются только APP_ASYNC_READS=1
+    if os.environ.get('APP_ASYNC_READS', '0') != '1':
+        return None
+    # Леджер держит балансы в памяти, база у него отстаёт - читаем через него
+    if isinstance(trade, LedgerTrade):
+        return None
+    return AsyncTrade(trade, create_async_engine(settings))
+
+
 def init_trade() -> None:
     logger.info('Идет подключение к базе данных')
 
-    name_base = 'main.db'
-    path_base = f'sqlite:///{name_base}'
-    if Path(name_base).exists():
+    settings = DatabaseSettings.from_env()
+    if Path(settings.path).exists():
         logger.info('Подключимся к существующей базе данных')
-        engine = sa.create_engine(path_base)
-        application.trade = Trade(engine)
+        engine = create_engine(settings)
+        application.trade = create_trade(engine)
+        application.trade.base_migrate()
     else:
         logger.info('Создадим новую базу данных')
-        engine = sa.create_engine(path_base)
-        application.trade = Trade(engine)
+        engine = create_engine(settings)
+        application.trade = create_trade(engine)
         init_trade_operation()
-    application.trade.regular_update_cost()
+    if isinstance(application.trade, LedgerTrade):
+        # Второй процесс с леджером остановится сразу, а не на первой сделке
+        application.trade.open()
+    application.async_trade = create_async_trade(application.trade, settings)
+    # Под WSGI-сервером каждый подписчик на цены держит поток сервера
+    if 'APP_STREAM_MAX_SUBSCRIBERS' in os.environ:
+        application.trade.price_publisher.max_subscribers = int(
+            os.environ['APP_STREAM_MAX_SUBSCRIBERS']
+        )
+    # Ключи кэша страниц - эпохи цен и версии пользователей этого trade
+    application.render_cache = RenderCache(
+        int(os.environ.get('APP_RENDER_CACHE_SIZE', '1024'))
+    )
+    application.scheduler = PriceTickScheduler(
+        application.trade, SchedulerSettings.from_env()
+    )
+    application.scheduler.start()
+    atexit.register(application.scheduler.stop)
 
 
 def init_application() -> None:
+    setup_logging()
     init_trade()
 
 
+@application.app.before_request
+def start_request_metrics() -> None:
+    g.request_started = time.perf_counter()
+    start_request_queries()
+
+
+@application.app.after_request
+def finish_request_metrics(response: 'Response') -> 'Response':
+    # Для потоковых ответов это время до начала выдачи
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_DURATION.observe(
+        time.perf_counter() - g.request_started, endpoint, request.method
+    )
+    REQUESTS.inc(endpoint, request.method, str(response.status_code))
+    REQUEST_DB_QUERIES.observe(finish_request_queries(), endpoint)
+    return response
+
+
+@application.app.after_request
+def finish_page_response(response: 'Response') -> 'Response':
+    etag = g.get('etag')
+    if etag is not None:
+        # Страница своя у каждого пользователя и должна перепроверяться
+        response.vary.update(('Cookie', 'Accept-Encoding'))
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    if is_compressible(response) and request.accept_encodings.quality('gzip') > 0:
+        compress_response(response)
+        if etag is not None:
+            etag = f'{etag}-gzip'
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+@application.app.route('/metrics')
+def get_metrics() -> 'Response':
+    # Счётчики только этого процесса: под сервером с несколькими процессами
+    # каждый ответ описывает один процесс, pid в первой строке
+    return application.app.response_class(
+        f'# process {os.getpid()}\n' + REGISTRY.render(),
+        mimetype='text/plain; version=0.0.4',
+    )
+
+
 @application.app.route('/index')
 @application.app.route('/list_cryptocurrency')
-def list_cryptocurrency() -> str:
-    user_balance = ''
+async def list_cryptocurrency() -> Union[str, 'Response']:
+    user_login = get_user_login()
+    reader = get_trade_reader()
+    user_balance: Any = ''
+    version = None
 
-    if application.now_user_login != '':
-        user_balance = application.trade.get_user_balance(application.now_user_login)
+    if user_login != '':
+        user_balance, version = await reader.get_user_balance_and_version(user_login)
 
-    cryptocurrency_list = application.trade.get_all_crypto()
+    not_modified = get_version_not_modified(
+        user_login, version, application.trade.get_price_snapshot().digest
+    )
+    if not_modified is not None:
+        return not_modified
+
+    table = get_cryptocurrency_table(user_login)
+    if 'etag' not in g:
+        not_modified = get_not_modified(user_login, str(user_balance), table.digest)
+        if not_modified is not None:
+            return not_modified
 
     return render_template(
         'index.html',
-        user_login=application.now_user_login,
-        cryptocurrency_list=cryptocurrency_list,
+        user_login=user_login,
+        cryptocurrency_table=table.html,
         user_balance=user_balance,
     )
 
 
 @application.app.route('/authorization_user', methods=['POST'])
 def authorization_user() -> 'Response':
-    application.now_user_login = str(request.form.get('user_login_in'))
+    user_login = str(request.form.get('user_login_in'))
 
-    if not application.trade.is_user_exist(application.now_user_login):
-        application.trade.create_user(application.now_user_login)
+    if not application.trade.is_user_exist(user_login):
+        try:
+            application.trade.create_user(user_login)
+        except ValueError:
+            # Между проверкой и созданием пользователя создал другой запрос
+            logger.info('Пользователь %s уже создан другим запросом', user_login)
 
-    logger.info('Пользователь %s авторизовался', application.now_user_login)
+    # Логин хранится в подписанной cookie, поэтому любой процесс сервера
+    # узнает пользователя без общего состояния
+    session['user_login'] = user_login
+    logger.info('Пользователь %s авторизовался', user_login)
 
     return redirect(url_for('list_cryptocurrency'))
 
 
 @application.app.route('/exit_user', methods=['POST'])
 def exit_user() -> 'Response':
-    logger.info('Пользователь %s вышел', application.now_user_login)
-    application.now_user_login = ''
+    logger.info('Пользователь %s вышел', get_user_login())
+    session.pop('user_login', None)
     return redirect(url_for('list_cryptocurrency'))
 
 
 @application.app.route('/user_buy_cryptocurrency', methods=['POST'])
 def user_buy_cryptocurrency() -> Union[str, 'Response']:
+    user_login = get_user_login()
     count_str = str(request.form.get('count_buy_crypto'))
     crypto_name = str(request.args.get('crypto_name'))
     crypto_cost = str(request.args.get('crypto_cost'))
 
     logger.info(
         'Пользователь %s хочет купить %s %s по цене %s',
-        application.now_user_login,
+        user_login,
         count_str,
         crypto_name,
         crypto_cost,
@@ -124,6 +386,7 @@ def user_buy_cryptocurrency() -> Union[str, 'Response']:
         count_int = int(count_str)
     except ValueError:
         is_error = True
+        TRADE_OPERATIONS.inc(NameOperation.Buy.value, 'invalid_count')
         text_error = 'Введено некорректное значение в поле количества'
 
     if not is_error:
@@ -131,24 +394,24 @@ def user_buy_cryptocurrency() -> Union[str, 'Response']:
         new_cost = str(application.trade.get_cryptocurrency_cost(crypto_name))
         if new_cost != crypto_cost:
             is_error = True
+            TRADE_OPERATIONS.inc(NameOperation.Buy.value, 'stale_price')
             text_error = 'Цена криптовалюты изменилась. Пожалуйста, обновите страницу'
 
     if not is_error:
         try:
             application.trade.user_buy_cryptocurrency(
-                application.now_user_login, crypto_name, count_int
+                user_login, crypto_name, count_int
             )
         except ValueError as error:
             is_error = True
             text_error = str(error)
 
     if is_error:
-        user_balance = application.trade.get_user_balance(application.now_user_login)
-        cryptocurrency_list = application.trade.get_all_crypto()
+        user_balance = application.trade.get_user_balance(user_login)
         return render_template(
             'index_error.html',
-            user_login=application.now_user_login,
-            cryptocurrency_list=cryptocurrency_list,
+            user_login=user_login,
+            cryptocurrency_table=get_cryptocurrency_table(user_login).html,
             user_balance=user_balance,
             text_error=text_error,
         )
@@ -158,12 +421,13 @@ def user_buy_cryptocurrency() -> Union[str, 'Response']:
 
 @application.app.route('/user_sell_cryptocurrency', methods=['POST'])
 def user_sell_cryptocurrency() -> Union[str, 'Response']:
+    user_login = get_user_login()
     count_str = str(request.form.get('count_sell_crypto'))
     crypto_name = str(request.args.get('crypto_name'))
 
     logger.info(
         'Пользователь %s хочет продать %s %s',
-        application.now_user_login,
+        user_login,
         count_str,
         crypto_name,
     )
@@ -175,23 +439,23 @@ def user_sell_cryptocurrency() -> Union[str, 'Response']:
         count_int = int(count_str)
     except ValueError:
         is_error = True
+        TRADE_OPERATIONS.inc(NameOperation.Sell.value, 'invalid_count')
         text_error = 'Введено некорректное значение в поле количества'
 
     if not is_error:
         try:
             application.trade.user_sell_cryptocurrency(
-                application.now_user_login, crypto_name, count_int
+                user_login, crypto_name, count_int
             )
         except ValueError as error:
             is_error = True
             text_error = str(error)
     if is_error:
-        user_balance = application.trade.get_user_balance(application.now_user_login)
-        cryptocurrency_list = application.trade.get_all_crypto()
+        user_balance = application.trade.get_user_balance(user_login)
         return render_template(
             'index_error.html',
-            user_login=application.now_user_login,
-            cryptocurrency_list=cryptocurrency_list,
+            user_login=user_login,
+            cryptocurrency_table=get_cryptocurrency_table(user_login).html,
             user_balance=user_balance,
             text_error=text_error,
         )
@@ -199,135 +463,292 @@ def user_sell_cryptocurrency() -> Union[str, 'Response']:
 
 
 @application.app.route('/user_portfolio')
-def get_user_portfolio() -> str:
-    if application.now_user_login != '':
+async def get_user_portfolio() -> Union[str, 'Response']:
+    user_login = get_user_login()
+    if user_login != '':
         logger.info(
             'Пользователь %s хочет получить свой портфель криптовалют',
-            application.now_user_login,
+            user_login,
         )
     else:
         logger.info(
             'Выведем сообщение, что нужно авторизоваться для просмотра портфеля криптовалют'
         )
 
-    user_portfolio = None
+    user_portfolio_table = None
     user_balance = None
 
-    if application.now_user_login != '':
-        user_portfolio = application.trade.get_user_portfolio(
-            application.now_user_login
+    if user_login != '':
+        reader = get_trade_reader()
+        # Портфель меняется со сделками пользователя и с ценами. Версию и
+        # эпоху читаем до позиций, чтобы под ключом не оказались старые данные
+        epoch = application.trade.price_cache.epoch
+        user_balance, version = await reader.get_user_balance_and_version(user_login)
+        not_modified = get_version_not_modified(
+            user_login, version, application.trade.get_price_snapshot().digest
+        )
+        if not_modified is not None:
+            return not_modified
+        key = (user_login, version, epoch)
+        user_portfolio_table = application.render_cache.get('user_portfolio', key)
+        if user_portfolio_table is None:
+            user_portfolio = await reader.get_user_positions(user_login)
+            user_portfolio_table = make_fragment(
+                render_template('_user_portfolio.html', user_portfolio=user_portfolio)
+            )
+            application.render_cache.put('user_portfolio', key, user_portfolio_table)
+
+    if 'etag' not in g:
+        not_modified = get_not_modified(
+            user_login,
+            str(user_balance),
+            user_portfolio_table and user_portfolio_table.digest,
         )
-        user_balance = application.trade.get_user_balance(application.now_user_login)
+        if not_modified is not None:
+            return not_modified
 
     return render_template(
         'user_portfolio.html',
-        user_login=application.now_user_login,
-        user_portfolio=user_portfolio,
+        user_login=user_login,
+        user_portfolio_table=user_portfolio_table and user_portfolio_table.html,
         user_balance=user_balance,
     )
 
 
 @application.app.route('/history_operations')
-def get_history_operation() -> Union['Response', str]:
-    if application.now_user_login != '':
-        logger.info(
-            'Получим историю операций пользователя %s', application.now_user_login
-        )
+async def get_history_operation() -> Union['Response', str]:
+    user_login = get_user_login()
+    if user_login != '':
+        logger.info('Получим историю операций пользователя %s', user_login)
     else:
         logger.info(
             'Выведем сообщение, что нужно авторизоваться для просмотра истории операций'
         )
         render_template('user_history_operations.html')
 
-    page_str = str(request.args.get('page'))
-
-    if page_str == 'None':
-        number_page = 1
-    else:
+    # Страницы адресуются курсорами: before - id, старше которого показать
+    # операции, after - id, новее которого показать операции
+    cursors: dict[str, int] = {}
+    for cursor_name in ('before', 'after'):
+        cursor_str = request.args.get(cursor_name)
+        if cursor_str is None:
+            continue
         try:
-            number_page = int(page_str)
+            cursors[cursor_name] = int(cursor_str)
         except ValueError:
             logger.error(
-                'Передан некорректный номер страницы для получения истории пользователя: %s',
-                page_str,
+                'Передан некорректный курсор для получения истории пользователя: %s',
+                cursor_str,
             )
             return render_template('error_404.html')
 
-    if not number_page > 0:
-        render_template('error_404.html')
-        logger.error('Передано неверной число для получения страницы: %d', number_page)
-        return render_template('error_404.html')
+        if not cursors[cursor_name] > 0:
+            logger.error(
+                'Передано неверное число для получения страницы: %d',
+                cursors[cursor_name],
+            )
+            return render_template('error_404.html')
 
-    user_history_operations = None
+    user_history_table = None
     user_balance = None
-    url_next = None
-    url_prev = None
 
-    if application.now_user_login != '':
+    if user_login != '':
         logger.info(
-            'Для пользователя %s получим %d страницу последних операций',
-            application.now_user_login,
-            number_page,
+            'Для пользователя %s получим страницу последних операций %s',
+            user_login,
+            cursors,
         )
 
-        user_history_operations = application.trade.get_user_history_operation(
-            application.now_user_login
+        reader = get_trade_reader()
+        # История меняется только со сделками пользователя. Версию читаем
+        # до страницы, чтобы под ключом не оказались старые данные
+        user_balance, version = await reader.get_user_balance_and_version(user_login)
+        not_modified = get_version_not_modified(
+            user_login, version, cursors.get('before'), cursors.get('after')
+        )
+        if not_modified is not None:
+            return not_modified
+        key = (user_login, version, cursors.get('before'), cursors.get('after'))
+        user_history_table = application.render_cache.get('user_history', key)
+
+        if user_history_table is None:
+            history_page, count_operation = await asyncio.gather(
+                reader.get_user_history_operation_page(
+                    user_login,
+                    CONST_VALUE.COUNT_OPERATION_ON_PAGE.value,
+                    before_id=cursors.get('before'),
+                    after_id=cursors.get('after'),
+                ),
+                reader.count_user_history_operation(user_login),
+            )
+
+            if cursors and not history_page.operations:
+                logger.info(
+                    'У пользователя %s нет страницы %s',
+                    user_login,
+                    cursors,
+                )
+                return render_template('error_404.html')
+
+            url_next = None
+            url_prev = None
+
+            # Ссылка на предыдущую (более новую) страницу, если она есть
+            if history_page.prev_cursor is not None:
+                url_prev = f'history_operations?after={history_page.prev_cursor}'
+
+            # Ссылка на следующую (более старую) страницу, если она есть
+            if history_page.next_cursor is not None:
+                url_next = f'history_operations?before={history_page.next_cursor}'
+
+            user_history_table = make_fragment(
+                render_template(
+                    '_user_history_operations.html',
+                    user_history_operations=history_page.operations,
+                    count_operation=count_operation,
+                    url_next=url_next,
+                    url_prev=url_prev,
+                )
+            )
+            application.render_cache.put('user_history', key, user_history_table)
+
+    if 'etag' not in g:
+        not_modified = get_not_modified(
+            user_login,
+            str(user_balance),
+            user_history_table and user_history_table.digest,
         )
-        user_balance = application.trade.get_user_balance(application.now_user_login)
+        if not_modified is not None:
+            return not_modified
 
-        # Реализуем пагинацию
-        all_count_operation = len(user_history_operations)
-        count_operation_on_page = CONST_VALUE.COUNT_OPERATION_ON_PAGE.value
+    return render_template(
+        'user_history_operations.html',
+        user_login=user_login,
+        user_history_table=user_history_table and user_history_table.html,
+        user_balance=user_balance,
+    )
 
-        min_number_page = 1
-        # Максимум нужен, чтобы пустой список отрабатывался корректно
-        max_number_page = max(
-            math.ceil(all_count_operation / count_operation_on_page), 1
+
+@application.app.route('/stream/prices')
+def stream_prices() -> 'Response':
+    # Поток для WSGI-сервера и make up: подписчик держит поток сервера. Под
+    # ASGI (app/asgi.py) этот маршрут обслуживается без потоков
+    publisher = application.trade.price_publisher
+    if not publisher.subscribe():
+        # Задан APP_STREAM_MAX_SUBSCRIBERS, и все места заняты: цены на
+        # странице останутся такими, какими их отрисовал сервер
+        logger.warning('Нет места для нового подписчика на цены')
+        return application.app.response_class(
+            'Слишком много подписчиков', status=503, headers={'Retry-After': '60'}
         )
 
-        if not min_number_page <= number_page <= max_number_page:
-            logger.info(
-                'У пользователя %s нет страницы с номером %d',
-                application.now_user_login,
-                number_page,
+    def generate() -> Iterator[str]:
+        # Сначала отдадим все цены, дальше только изменения
+        snapshot = application.trade.get_price_snapshot()
+        last_epoch = snapshot.epoch
+        yield format_price_event(last_epoch, snapshot.prices)
+
+        while True:
+            updates = publisher.wait_for_updates(
+                last_epoch, CONST_VALUE.PRICE_STREAM_HEARTBEAT.value
             )
-            return render_template('error_404.html')
+            if updates is None:
+                # Подписчик отстал, пришлём цены целиком
+                snapshot = application.trade.get_price_snapshot()
+                last_epoch = snapshot.epoch
+                yield format_price_event(last_epoch, snapshot.prices)
+            elif not updates:
+                # Комментарий не даёт прокси закрыть простаивающее соединение
+                yield ': heartbeat\n\n'
+            for update in updates or []:
+                last_epoch = update.epoch
+                yield format_price_event(update.epoch, update.prices)
+
+    response = application.app.response_class(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    # Место освобождается и тогда, когда поток так и не начали читать
+    response.call_on_close(publisher.unsubscribe)
+    return response
 
-        start_page = count_operation_on_page * (number_page - 1)
-        end_page = count_operation_on_page * (number_page - 1) + count_operation_on_page
 
-        user_history_operations = user_history_operations[start_page:end_page]
+@application.app.route('/candles')
+def get_candles() -> 'Response':
+    # Свечи отдаются массивами [начало, open, high, low, close], чтобы ответ
+    # на год истории оставался компактным
+    try:
+        crypto_name = request.args['crypto_name']
+        interval = int(request.args.get('interval', 60))
+        end = int(request.args.get('end', time.time()))
+        start = int(request.args.get('start', end - 24 * 60 * 60))
+        max_points_str = request.args.get('max_points')
+        max_points = None if max_points_str is None else int(max_points_str)
+        candles = application.trade.get_candles(
+            crypto_name, interval, start, end, max_points
+        )
+    except (KeyError, ValueError) as e:
+        logger.error('Не удалось получить свечи: %s', e)
+        return application.app.response_class(
+            json.dumps({'error': str(e)}), status=400, mimetype='application/json'
+        )
 
-        # Ссылка на предыдущую страницу (если такой нет, то оставим None)
-        prev_page = number_page - 1
-        if min_number_page <= prev_page <= max_number_page:
-            url_prev = f'history_operations?page={prev_page}'
+    data = json.dumps(
+        {
+            'crypto_name': crypto_name,
+            'candles': [[candle.start, *map(str, candle[1:])] for candle in candles],
+        }
+    )
+    return application.app.response_class(data, mimetype='application/json')
 
-        # Ссылку на следующую страницу (если такой нет, то оставим None)
-        next_page = number_page + 1
-        if min_number_page <= next_page <= max_number_page:
-            url_next = f'history_operations?page={next_page}'
 
-    return render_template(
-        'user_history_operations.html',
-        user_login=application.now_user_login,
-        user_history_operations=user_history_operations,
-        user_balance=user_balance,
-        url_next=url_next,
-        url_prev=url_prev,
+# Пользователь выгружает только свою историю, вся история выгружается
+# командой flask export-history
+@application.app.route('/export/history')
+def export_history() -> 'Response':
+    user_login = get_user_login()
+    if user_login == '':
+        logger.error('Выгрузка истории без авторизации')
+        return application.app.response_class('Нужно авторизоваться', status=403)
+
+    export_format = request.args.get('format', 'csv')
+    try:
+        mimetype, format_history = EXPORT_FORMATS[export_format]
+        history_filter = HistoryFilter(
+            user_login=user_login,
+            cryptocurrency_name=request.args.get('crypto_name'),
+            **{
+                name: int(request.args[name])
+                for name in ('start_id', 'end_id', 'start_time', 'end_time')
+                if name in request.args
+            },
+        )
+        chunks = application.trade.iter_history(history_filter)
+    except (KeyError, ValueError) as e:
+        logger.error('Не удалось выгрузить историю: %s', e)
+        return application.app.response_class(str(e), status=400)
+
+    return application.app.response_class(
+        stream_with_context(format_history(chunks)),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename=history.{export_format}'
+        },
     )
 
 
 # Доступ к ней только когда пользователь авторизован
 @application.app.route('/add_cryptocurrency', methods=['POST'])
 def add_cryptocurrency() -> Union[str, 'Response']:
+    user_login = get_user_login()
 
     crypto_name = str(request.form.get('crypto_name'))
     crypto_cost = str(request.form.get('crypto_cost'))
 
     logger.info(
         'Пользователь %s хочет добавить новую криптовалюту %s со стоимостью %s',
-        application.now_user_login,
+        user_login,
         crypto_name,
         crypto_cost,
     )
@@ -349,12 +770,11 @@ def add_cryptocurrency() -> Union[str, 'Response']:
             text_error = e
 
     if is_error:
-        user_balance = application.trade.get_user_balance(application.now_user_login)
-        cryptocurrency_list = application.trade.get_all_crypto()
+        user_balance = application.trade.get_user_balance(user_login)
         return render_template(
             'index_error.html',
-            user_login=application.now_user_login,
-            cryptocurrency_list=cryptocurrency_list,
+            user_login=user_login,
+            cryptocurrency_table=get_cryptocurrency_table(user_login).html,
             user_balance=user_balance,
             text_error=text_error,
         )
@@ -362,6 +782,86 @@ def add_cryptocurrency() -> Union[str, 'Response']:
     return redirect(url_for('list_cryptocurrency'))
 
 
+@application.app.cli.command('export-history')
+@click.option(
+    '--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='csv'
+)
+@click.option('--user-login')
+@click.option('--crypto-name')
+@click.option('--start-id', type=int)
+@click.option('--end-id', type=int)
+@click.option('--start-time', type=int, help='Секунды unix, включительно')
+@click.option('--end-time', type=int, help='Секунды unix, включительно')
+@click.option('--chunk-size', type=int, default=10000)
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-')
+def export_history_command(  # pylint: disable=too-many-arguments
+    export_format: str,
+    user_login: Optional[str],
+    crypto_name: Optional[str],
+    start_id: Optional[int],
+    end_id: Optional[int],
+    start_time: Optional[int],
+    end_time: Optional[int],
+    chunk_size: int,
+    output: t.TextIO,
+) -> None:
+    if application.trade is None:
+        settings = DatabaseSettings.from_env()
+        if not Path(settings.path).exists():
+            raise click.ClickException(f'База данных {settings.path} не найдена')
+        application.trade = Trade(create_engine(settings))
+        application.trade.base_migrate()
+
+    history_filter = HistoryFilter(
+        user_login, crypto_name, start_id, end_id, start_time, end_time
+    )
+    try:
+        chunks = application.trade.iter_history(history_filter, chunk_size)
+    except ValueError as e:
+        raise click.ClickException(str(e)) from e
+
+    _, format_history = EXPORT_FORMATS[export_format]
+    for text in format_history(chunks):
+        output.write(text)
+
+
+@application.app.cli.command('simulate-history')
+@click.option('--steps', type=int, required=True, help='Число тиков истории')
+@click.option('--seed', type=int)
+def simulate_history_command(steps: int, seed: Optional[int]) -> None:
+    # Заполнить историю цен до первого тика в базе по модели рынка
+    # (APP_MARKET_*), чтобы были графики и данные для проверок
+    settings = DatabaseSettings.from_env()
+    if not Path(settings.path).exists():
+        raise click.ClickException(f'База данных {settings.path} не найдена')
+    market = MarketModel.from_settings(
+        MarketSettings.from_env(), SchedulerSettings.from_env().interval, seed
+    )
+    trade = Trade(create_engine(settings))
+    trade.base_migrate()
+    count = trade.simulate_history(market, steps)
+    click.echo(f'Записали тиков: {count}')
+
+
+@application.app.cli.command('restore-ledger')
+@click.option('--until-seq', type=int, help='Последнее событие журнала')
+@click.option('--until-time', type=int, help='Секунды unix, включительно')
+@click.option('--output', required=True, help='Путь к новой базе данных')
+def restore_ledger_command(
+    until_seq: Optional[int], until_time: Optional[int], output: str
+) -> None:
+    # Восстановить балансы и позиции на момент времени из снимков и журнала
+    # леджера в отдельную базу
+    if Path(output).exists():
+        raise click.ClickException(f'База данных {output} уже существует')
+    state = recover(LedgerSettings.from_env().directory, until_seq, until_time)
+    restore_database(create_engine(DatabaseSettings(path=output)), state)
+    click.echo(
+        f'Восстановили событие {state.seq}: пользователей {len(state.accounts)},'
+        f' валют {len(state.cryptocurrencies)}'
+    )
+
+
 if __name__ == '__main__':  # pragma: no cover
     init_application()
     logger.info('Сервер запущен')
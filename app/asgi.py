@@ -0,0 +1,134 @@
+import asyncio
+import os
+import weakref
+from typing import Any, Awaitable, Callable
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+
+try:
+    from app.app import application, init_application
+    from app.price_stream import AsyncPriceFeed, format_price_event
+    from app.trade import CONST_VALUE
+except ImportError:  # pragma: no cover
+    from price_stream import AsyncPriceFeed, format_price_event  # type: ignore
+    from trade import CONST_VALUE  # type: ignore
+
+    from app import application, init_application  # type: ignore
+
+Scope = dict[str, Any]
+Receive = Callable[[], Awaitable[dict[str, Any]]]
+Send = Callable[[dict[str, Any]], Awaitable[None]]
+
+# Точка входа для ASGI-сервера (make serve):
+#   APP_SECRET_KEY=... gunicorn --workers 4 \
+#       --worker-class uvicorn.workers.UvicornWorker 'app.asgi:app'
+# Поток цен обслуживается в цикле событий: подписчик - это корутина с
+# очередью, а не поток сервера, поэтому открытых страниц могут быть тысячи.
+# Остальные запросы идут во Flask, каждый в своём потоке. Лог, как и в
+# app/wsgi.py, каждый процесс пишет в свой файл
+HEARTBEAT_SECONDS = CONST_VALUE.PRICE_STREAM_HEARTBEAT.value
+
+_flask_app = WsgiToAsgi(application.app)
+_feeds: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncPriceFeed]' = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_price_feed() -> AsyncPriceFeed:
+    # Одна рассылка на цикл событий и текущего издателя цен
+    loop = asyncio.get_running_loop()
+    publisher = application.trade.price_publisher
+    feed = _feeds.get(loop)
+    if feed is None or feed.publisher is not publisher:
+        if feed is not None:
+            feed.close()
+        feed = _feeds[loop] = AsyncPriceFeed(publisher, loop)
+    return feed
+
+
+async def _wait_for_disconnect(receive: Receive) -> None:
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _send_text(send: Send, text: str) -> None:
+    await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
+
+
+async def _send_snapshot(send: Send) -> int:
+    # Снимок обычно уже в памяти, но при промахе кэша читается из базы
+    snapshot = await asyncio.get_running_loop().run_in_executor(
+        None, application.trade.get_price_snapshot
+    )
+    await _send_text(send, format_price_event(snapshot.epoch, snapshot.prices))
+    return snapshot.epoch
+
+
+async def stream_prices(scope: Scope, receive: Receive, send: Send) -> None:
+    feed = get_price_feed()
+    # Подписываемся до снимка, чтобы не потерять обновления между ними
+    queue = feed.subscribe()
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                ],
+            }
+        )
+        last_epoch = await _send_snapshot(send)
+        while not disconnected.done():
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                {getter, disconnected},
+                timeout=HEARTBEAT_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if getter not in done:
+                getter.cancel()
+                if not done:
+                    # Комментарий не даёт прокси закрыть простаивающее соединение
+                    await _send_text(send, ': heartbeat\n\n')
+                continue
+            update = getter.result()
+            if update is None:
+                # Подписчик отстал, пришлём цены целиком
+                last_epoch = await _send_snapshot(send)
+            elif update.epoch > last_epoch:
+                last_epoch = update.epoch
+                await _send_text(send, format_price_event(update.epoch, update.prices))
+    finally:
+        disconnected.cancel()
+        feed.unsubscribe(queue)
+
+
+async def _lifespan(receive: Receive, send: Send) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope: Scope, receive: Receive, send: Send) -> None:
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/stream/prices':
+        await stream_prices(scope, receive, send)
+    else:
+        # Без своего контекста asgiref выполнял бы все синхронные запросы
+        # процесса в одном потоке
+        async with ThreadSensitiveContext():
+            await _flask_app(scope, receive, send)
+
+
+os.environ.setdefault('APP_LOG_FILE', 'app.{pid}.log')
+init_application()
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import threading
+from decimal import Decimal
+from typing import Any, Coroutine, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+try:
+    from app.metrics import instrument_engine
+    from app.positions import PositionSummary
+    from app.price_cache import PriceSnapshot
+    from app.trade import (
+        HistoryPage,
+        Trade,
+        make_history_page,
+        select_count_user_history_operation,
+        select_history_page,
+        select_user_balance,
+        select_user_balance_and_version,
+        select_user_id,
+        select_user_positions,
+        summarize_positions,
+    )
+except ImportError:  # pragma: no cover
+    from metrics import instrument_engine  # type: ignore
+    from positions import PositionSummary  # type: ignore
+    from price_cache import PriceSnapshot  # type: ignore
+    from trade import (  # type: ignore
+        HistoryPage,
+        Trade,
+        make_history_page,
+        select_count_user_history_operation,
+        select_history_page,
+        select_user_balance,
+        select_user_balance_and_version,
+        select_user_id,
+        select_user_positions,
+        summarize_positions,
+    )
+
+logger = logging.getLogger(__name__)
+
+
+# Чтения для асинхронных представлений через асинхронный движок (aiosqlite).
+# Запросы те же, что у Trade. Сделки, тики и добавление валют остаются за
+# синхронным Trade, и кэш цен у процесса один - его же читает AsyncTrade.
+#
+# Flask выполняет каждое асинхронное представление в новом цикле событий,
+# а пул соединений движка работает только в одном цикле. Поэтому запросы
+# к базе выполняются в собственном цикле AsyncTrade в отдельном потоке,
+# а представление ждёт их результат, не занимая свой цикл.
+class AsyncTrade:
+    def __init__(self, trade: Trade, engine_db: AsyncEngine) -> None:
+        self.trade = trade
+        self.engine = engine_db
+        instrument_engine(self.engine.sync_engine)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name='async-trade', daemon=True
+        )
+        self._thread.start()
+
+    async def _run(self, coroutine: Coroutine[Any, Any, Any]) -> Any:
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        )
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.engine.dispose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def get_price_snapshot(self) -> PriceSnapshot:
+        # Промах кэша бывает только при запуске и после добавления валюты,
+        # цены тогда загрузит Trade
+        return self.trade.get_price_snapshot()
+
+    async def _execute(self, statement: Any) -> Any:
+        async with self.engine.connect() as connection:
+            return (await connection.execute(statement)).all()
+
+    async def _scalar(self, statement: Any) -> Any:
+        rows = await self._run(self._execute(statement))
+        return rows[0][0] if rows else None
+
+    async def _all(self, statement: Any) -> list[Any]:
+        return await self._run(self._execute(statement))
+
+    async def get_all_crypto(self) -> list[tuple[str, Any]]:
+        return list(self.get_price_snapshot().prices)
+
+    async def get_user_balance(self, user_login: str) -> Decimal:
+        logger.debug('Получим баланс пользователя %s', user_login)
+        balance = await self._scalar(select_user_balance(user_login))
+        if balance is None:
+            logger.error('Пользователя %s не существует', user_login)
+            raise ValueError(f'Пользователя {user_login} не существует')
+        return balance
+
+    async def get_user_balance_and_version(self, user_login: str) -> tuple[Any, int]:
+        rows = await self._all(select_user_balance_and_version(user_login))
+        if not rows:
+            logger.error('Пользователя %s не существует', user_login)
+            raise ValueError(f'Пользователя {user_login} не существует')
+        return rows[0][0], rows[0][1]
+
+    async def get_user_positions(self, user_login: str) -> list[PositionSummary]:
+        logger.debug('Получим позиции пользователя %s', user_login)
+        prices = self.get_price_snapshot().by_name
+        rows = await self._all(select_user_positions(user_login))
+        return summarize_positions(user_login, rows, prices)
+
+    async def get_user_history_operation_page(
+        self,
+        user_login: str,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+    ) -> HistoryPage:
+        logger.debug(
+            'Получим страницу истории операций пользователя %s (before=%s, after=%s)',
+            user_login,
+            before_id,
+            after_id,
+        )
+        user_id = await self._scalar(select_user_id(user_login))
+        if user_id is None:
+            logger.error('Пользователя %s не существует', user_login)
+            raise ValueError(f'Пользователя {user_login} не существует')
+        rows = await self._all(select_history_page(user_id, limit, before_id, after_id))
+        return make_history_page(rows, limit, before_id, after_id)
+
+    async def count_user_history_operation(self, user_login: str) -> int:
+        return await self._scalar(select_count_user_history_operation(user_login))
+
+
+# Те же чтения поверх синхронного Trade: для леджера, у которого балансы
+# в памяти, а база отстаёт, и когда асинхронный движок не создан
+class SyncTradeReader:
+    def __init__(self, trade: Trade) -> None:
+        self.trade = trade
+
+    async def get_all_crypto(self) -> list[tuple[str, Any]]:
+        return self.trade.get_all_crypto()
+
+    async def get_user_balance(self, user_login: str) -> Any:
+        return self.trade.get_user_balance(user_login)
+
+    async def get_user_balance_and_version(self, user_login: str) -> tuple[Any, int]:
+        return self.trade.get_user_balance_and_version(user_login)
+
+    async def get_user_positions(self, user_login: str) -> list[PositionSummary]:
+        return self.trade.get_user_positions(user_login)
+
+    async def get_user_history_operation_page(
+        self,
+        user_login: str,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+    ) -> HistoryPage:
+        return self.trade.get_user_history_operation_page(
+            user_login, limit, before_id=before_id, after_id=after_id
+        )
+
+    async def count_user_history_operation(self, user_login: str) -> int:
+        return self.trade.count_user_history_operation(user_login)
@@ -0,0 +1,272 @@
+from collections import Counter
+from typing import Any, Callable, NamedTuple, Optional, Protocol
+
+import numpy as np
+
+try:
+    from app.market import MarketModel, round_cents
+    from app.positions import buy_position, sell_position
+except ImportError:  # pragma: no cover
+    from market import MarketModel, round_cents  # type: ignore
+    from positions import buy_position, sell_position  # type: ignore
+
+# Проверка стратегий на истории цен без базы. Все суммы в целых копейках,
+# как в app/positions.py: покупка проходит, только если хватает денег на всю
+# заявку, продажа - только если хватает монет, частичных исполнений нет,
+# как у Trade.user_buy_cryptocurrency и user_sell_cryptocurrency.
+
+
+class PriceSeries(NamedTuple):
+    names: list[str]
+    # Время шага, секунды unix
+    times: np.ndarray
+    # Цены в копейках: строка - шаг, столбец - валюта; 0 - цены ещё нет
+    cents: np.ndarray
+
+
+class BacktestFill(NamedTuple):
+    step: int
+    index: int
+    # Положительное - покупка, отрицательное - продажа
+    count: int
+    price: int
+
+
+def load_price_series(
+    engine: Any,
+    names: Optional[list[str]] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> PriceSeries:
+    # Тики из PriceTick на общей сетке времени: если у валюты в этот момент
+    # тика не было, берётся её предыдущая цена
+    query = (
+        'SELECT c.name, t.time, CAST(round(t.cost * 100) AS INTEGER) '
+        'FROM "PriceTick" t JOIN cryptocurrency c ON c.id = t.cryptocurrency_id '
+        'WHERE t.time >= ? AND t.time < ? ORDER BY t.time'
+    )
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            query,
+            (
+                -(2**62) if start is None else start,
+                2**62 if end is None else end,
+            ),
+        ).all()
+    if names is None:
+        names = sorted({name for name, _, _ in rows})
+    columns = {name: index for index, name in enumerate(names)}
+    rows = [row for row in rows if row[0] in columns]
+
+    tick_names, tick_times, tick_cents = zip(*rows) if rows else ((), (), ())
+    times = np.unique(np.array(tick_times, dtype=np.int64))
+    steps = np.searchsorted(times, np.array(tick_times, dtype=np.int64))
+    indexes = np.array([columns[name] for name in tick_names], dtype=np.int64)
+    cents = np.zeros((len(times), len(names)), dtype=np.int64)
+    present = np.zeros((len(times), len(names)), dtype=bool)
+    cents[steps, indexes] = tick_cents
+    present[steps, indexes] = True
+
+    # Протягиваем последнюю известную цену вперёд
+    last = np.where(present, np.arange(len(times))[:, None], 0)
+    np.maximum.accumulate(last, axis=0, out=last)
+    return PriceSeries(names, times, cents[last, np.arange(len(names))])
+
+
+def simulate_price_series(
+    market: MarketModel,
+    names: list[str],
+    start_cents: np.ndarray,
+    steps: int,
+    start_time: int = 0,
+) -> PriceSeries:
+    # Ряд цен по модели рынка; первая строка - start_cents
+    start_cents = np.asarray(start_cents, dtype=np.float64)
+    paths = market.paths(start_cents, steps - 1)
+    tick_seconds = max(1, round(market.tick_seconds))
+    return PriceSeries(
+        names,
+        start_time + tick_seconds * np.arange(steps, dtype=np.int64),
+        round_cents(np.vstack([start_cents, paths])),
+    )
+
+
+class BacktestAccount:
+    def __init__(self, names: list[str], balance: int) -> None:
+        self.names = names
+        self.balance = balance
+        self.counts = [0] * len(names)
+        self.cost_basis = [0] * len(names)
+        self.realised_pnl = [0] * len(names)
+        self.fills: list[BacktestFill] = []
+        self.rejected: Counter[str] = Counter()
+        self.step = 0
+        self.prices: list[int] = [0] * len(names)
+
+    def buy(self, index: int, count: int) -> bool:
+        if count <= 0:
+            raise ValueError('Количество должно быть положительным')
+        price = self.prices[index]
+        if price <= 0:
+            self.rejected['no_price'] += 1
+            return False
+        if self.balance < price * count:
+            self.rejected['insufficient_funds'] += 1
+            return False
+        self.balance -= price * count
+        self.counts[index] += count
+        self.cost_basis[index] = buy_position(self.cost_basis[index], price, count)
+        self.fills.append(BacktestFill(self.step, index, count, price))
+        return True
+
+    def sell(self, index: int, count: int) -> bool:
+        if count <= 0:
+            raise ValueError('Количество должно быть положительным')
+        price = self.prices[index]
+        if price <= 0:
+            self.rejected['no_price'] += 1
+            return False
+        if self.counts[index] < count:
+            self.rejected['insufficient_cryptocurrency'] += 1
+            return False
+        self.balance += price * count
+        self.cost_basis[index], realised_pnl = sell_position(
+            self.cost_basis[index], self.counts[index], price, count
+        )
+        self.realised_pnl[index] += realised_pnl
+        self.counts[index] -= count
+        self.fills.append(BacktestFill(self.step, index, -count, price))
+        return True
+
+
+class TickStrategy(Protocol):
+    def on_tick(
+        self, step: int, prices: np.ndarray, account: BacktestAccount
+    ) -> None: ...
+
+
+class BacktestResult(NamedTuple):
+    series: PriceSeries
+    start_balance: int
+    # Деньги плюс монеты по текущим ценам на каждом шаге, в копейках
+    equity: np.ndarray
+    account: BacktestAccount
+
+    @property
+    def pnl(self) -> int:
+        return int(self.equity[-1]) - self.start_balance if len(self.equity) else 0
+
+    @property
+    def realised_pnl(self) -> int:
+        return sum(self.account.realised_pnl)
+
+    @property
+    def max_drawdown(self) -> int:
+        if not len(self.equity):
+            return 0
+        return int(np.max(np.maximum.accumulate(self.equity) - self.equity))
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            'steps': len(self.series.times),
+            'fills': len(self.account.fills),
+            'rejected': dict(self.account.rejected),
+            'balance': self.account.balance,
+            'equity': int(self.equity[-1]) if len(self.equity) else self.start_balance,
+            'pnl': self.pnl,
+            'realised_pnl': self.realised_pnl,
+            'max_drawdown': self.max_drawdown,
+        }
+
+
+def equity_curve(
+    series: PriceSeries, balance: int, fills: list[BacktestFill]
+) -> np.ndarray:
+    # Между сделками портфель не меняется, поэтому стоимость на отрезке -
+    # одно произведение цен на количества монет
+    equity = np.empty(len(series.times), dtype=np.int64)
+    counts = np.zeros(len(series.names), dtype=np.int64)
+    start = 0
+    for fill in fills + [BacktestFill(len(series.times), 0, 0, 0)]:
+        if fill.step > start:
+            equity[start : fill.step] = (
+                balance + series.cents[start : fill.step] @ counts
+            )
+            start = fill.step
+        balance -= fill.count * fill.price
+        counts[fill.index] += fill.count
+    return equity
+
+
+def run_orders(
+    series: PriceSeries,
+    orders: np.ndarray,
+    balance: int,
+) -> BacktestResult:
+    # orders - заявки массивом той же формы, что и цены: сколько монет купить
+    # (больше нуля) или продать (меньше нуля) на этом шаге. Перебираются
+    # только ненулевые заявки
+    if orders.shape != series.cents.shape:
+        raise ValueError(
+            f'Заявки формы {orders.shape}, а цены формы {series.cents.shape}'
+        )
+    account = BacktestAccount(series.names, balance)
+    steps, indexes = np.nonzero(orders)
+    counts = orders[steps, indexes]
+    prices = series.cents[steps, indexes]
+    for step, index, count, price in zip(
+        steps.tolist(), indexes.tolist(), counts.tolist(), prices.tolist()
+    ):
+        account.step = step
+        account.prices[index] = price
+        if count > 0:
+            account.buy(index, count)
+        else:
+            account.sell(index, -count)
+    return BacktestResult(
+        series, balance, equity_curve(series, balance, account.fills), account
+    )
+
+
+def run_strategy(
+    series: PriceSeries,
+    strategy: TickStrategy,
+    balance: int,
+) -> BacktestResult:
+    # Стратегия вызывается на каждом шаге и торгует через account по ценам
+    # этого шага. Медленнее заявок массивом: вызов Python на каждый шаг
+    account = BacktestAccount(series.names, balance)
+    for step, prices in enumerate(series.cents):
+        account.step = step
+        account.prices = prices.tolist()
+        strategy.on_tick(step, prices, account)
+    return BacktestResult(
+        series, balance, equity_curve(series, balance, account.fills), account
+    )
+
+
+def moving_average_crossover(
+    short: int, long: int, count: int
+) -> Callable[[PriceSeries], np.ndarray]:
+    # Пример стратегии заявками: купить count монет, когда короткая средняя
+    # пересекает длинную снизу, и продать count, когда сверху
+    if not 0 < short < long:
+        raise ValueError('Короткое окно должно быть меньше длинного')
+
+    def orders(series: PriceSeries) -> np.ndarray:
+        sums = np.cumsum(series.cents, axis=0, dtype=np.float64)
+        sums = np.vstack([np.zeros((1, sums.shape[1])), sums])
+        steps = len(series.times)
+        short_mean = np.full(series.cents.shape, np.nan)
+        long_mean = np.full(series.cents.shape, np.nan)
+        short_mean[short - 1 :] = (sums[short:] - sums[:-short]) / short
+        long_mean[long - 1 :] = (sums[long:] - sums[:-long]) / long
+        above = short_mean > long_mean
+        result = np.zeros(series.cents.shape, dtype=np.int64)
+        if steps > long:
+            crossed = above[long:] != above[long - 1 : -1]
+            result[long:][crossed & above[long:]] = count
+            result[long:][crossed & ~above[long:]] = -count
+        return result
+
+    return orders
@@ -0,0 +1,166 @@
+import math
+from decimal import Decimal
+from typing import Any, NamedTuple, Optional, Sequence
+
+import numpy as np
+from sqlalchemy.engine import Connection
+
+# Свечи, которые поддерживаются в базе при каждом тике: 1 минута, 5 минут,
+# 1 час и 1 день. Дневные свечи нужны, чтобы график за год читал сотни строк
+CANDLE_INTERVALS = (60, 300, 3600, 86400)
+
+
+class Candle(NamedTuple):
+    start: int
+    open: Any
+    high: Any
+    low: Any
+    close: Any
+
+
+def record_ticks(
+    connection: Connection, tick_time: int, prices: list[tuple[int, Any]]
+) -> None:
+    # Тик дописывается в историю и сразу вливается в текущие свечи каждого
+    # интервала одним upsert, без пересчёта по истории тиков
+    if not prices:
+        return
+
+    connection.exec_driver_sql(
+        'INSERT INTO "PriceTick" (cryptocurrency_id, time, cost) VALUES (?, ?, ?)',
+        [(crypto_id, tick_time, float(cost)) for crypto_id, cost in prices],
+    )
+    connection.exec_driver_sql(
+        'INSERT INTO "PriceCandle" '
+        '(cryptocurrency_id, interval, start, open, high, low, close) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT (cryptocurrency_id, interval, start) DO UPDATE SET '
+        'high = max(high, excluded.high), '
+        'low = min(low, excluded.low), '
+        'close = excluded.close',
+        [
+            (crypto_id, interval, tick_time - tick_time % interval, *[float(cost)] * 4)
+            for interval in CANDLE_INTERVALS
+            for crypto_id, cost in prices
+        ],
+    )
+
+
+def prepend_history(
+    connection: Connection,
+    cryptocurrency_ids: list[int],
+    times: np.ndarray,
+    cents: np.ndarray,
+) -> None:
+    # Сразу много тиков, которые все раньше тиков в базе: times - время
+    # каждого шага по возрастанию, cents - цены в копейках, строка на шаг и
+    # столбец на валюту. Свечи собираются массивами, а на стыке с
+    # существующей свечой из новых тиков берётся её начало
+    costs = cents / 100
+    connection.exec_driver_sql(
+        'INSERT INTO "PriceTick" (cryptocurrency_id, time, cost) VALUES (?, ?, ?)',
+        [
+            (crypto_id, tick_time, cost)
+            for tick_time, row in zip(times.tolist(), costs.tolist())
+            for crypto_id, cost in zip(cryptocurrency_ids, row)
+        ],
+    )
+
+    rows = []
+    for interval in CANDLE_INTERVALS:
+        starts = times - times % interval
+        bounds = np.flatnonzero(np.diff(starts)) + 1
+        first = np.concatenate(([0], bounds))
+        last = np.concatenate((bounds, [len(times)])) - 1
+        candles = zip(
+            starts[first].tolist(),
+            costs[first].tolist(),
+            np.maximum.reduceat(costs, first).tolist(),
+            np.minimum.reduceat(costs, first).tolist(),
+            costs[last].tolist(),
+        )
+        rows += [
+            (crypto_id, interval, start, *prices)
+            for start, *columns in candles
+            for crypto_id, prices in zip(cryptocurrency_ids, zip(*columns))
+        ]
+    connection.exec_driver_sql(
+        'INSERT INTO "PriceCandle" '
+        '(cryptocurrency_id, interval, start, open, high, low, close) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT (cryptocurrency_id, interval, start) DO UPDATE SET '
+        'open = excluded.open, '
+        'high = max(high, excluded.high), '
+        'low = min(low, excluded.low)',
+        rows,
+    )
+
+
+def select_candles(
+    connection: Connection,
+    cryptocurrency_id: int,
+    interval: int,
+    start: int,
+    end: int,
+    max_points: Optional[int] = None,
+) -> list[Candle]:
+    if not any(interval % stored == 0 for stored in CANDLE_INTERVALS):
+        raise ValueError(
+            f'Интервал {interval} должен быть кратен одному из {CANDLE_INTERVALS}'
+        )
+    requested_interval = interval
+    if max_points is not None:
+        # Укрупняем свечи, чтобы точек было не больше max_points
+        interval *= max(1, math.ceil((end - start) / interval / max_points))
+
+    # Берём самые крупные хранимые свечи, из которых складывается интервал.
+    # При прореживании интервал можно округлить вверх до кратного более
+    # крупным свечам, если он от этого вырастет меньше чем вдвое
+    stored_interval = interval
+    for stored in sorted(CANDLE_INTERVALS, reverse=True):
+        if interval % stored == 0:
+            stored_interval = stored
+            break
+        step = math.lcm(requested_interval, stored)
+        rounded_interval = math.ceil(interval / step) * step
+        if max_points is not None and rounded_interval < 2 * interval:
+            interval, stored_interval = rounded_interval, stored
+            break
+
+    # Цены читаем в целых копейках через DBAPI: так свечи складываются точно
+    # и в Decimal переводятся только итоговые точки
+    rows = connection.exec_driver_sql(
+        'SELECT start, CAST(round(open * 100) AS INTEGER), '
+        'CAST(round(high * 100) AS INTEGER), CAST(round(low * 100) AS INTEGER), '
+        'CAST(round(close * 100) AS INTEGER) FROM "PriceCandle" '
+        'WHERE cryptocurrency_id = ? AND interval = ? AND start >= ? AND start < ? '
+        'ORDER BY start',
+        (cryptocurrency_id, stored_interval, start - start % interval, end),
+    ).all()
+
+    if interval != stored_interval:
+        rows = merge_candles(rows, interval)
+    return [
+        Candle(
+            candle_start,
+            Decimal(open_cost).scaleb(-2),
+            Decimal(high).scaleb(-2),
+            Decimal(low).scaleb(-2),
+            Decimal(close).scaleb(-2),
+        )
+        for candle_start, open_cost, high, low, close in rows
+    ]
+
+
+def merge_candles(candles: Sequence[Sequence[Any]], interval: int) -> list[Candle]:
+    res: list[Candle] = []
+    for candle_start, open_cost, high, low, close in candles:
+        candle_start -= candle_start % interval
+        if res and res[-1].start == candle_start:
+            last = res[-1]
+            res[-1] = Candle(
+                candle_start, last.open, max(last.high, high), min(last.low, low), close
+            )
+        else:
+            res.append(Candle(candle_start, open_cost, high, low, close))
+    return res
@@ -0,0 +1,125 @@
+import os
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import create_async_engine as sa_create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+@dataclass
+class DatabaseSettings:
+    path: str = 'main.db'
+    # WAL позволяет читать базу параллельно с записью тика цен и сделок
+    journal_mode: Optional[str] = 'WAL'
+    # В режиме WAL уровень NORMAL не теряет целостность при сбое процесса
+    synchronous: Optional[str] = 'NORMAL'
+    # Сколько ждать освобождения блокировки вместо ошибки "database is locked"
+    busy_timeout_ms: Optional[int] = 5000
+    cache_size_kib: Optional[int] = 64 * 1024
+    mmap_size: Optional[int] = 256 * 1024 * 1024
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30
+
+    @classmethod
+    def from_env(cls) -> 'DatabaseSettings':
+        default = cls()
+        return cls(
+            path=os.environ.get('APP_DB_PATH', default.path),
+            journal_mode=_get_str_env('APP_DB_JOURNAL_MODE', default.journal_mode),
+            synchronous=_get_str_env('APP_DB_SYNCHRONOUS', default.synchronous),
+            busy_timeout_ms=_get_int_env(
+                'APP_DB_BUSY_TIMEOUT_MS', default.busy_timeout_ms
+            ),
+            cache_size_kib=_get_int_env(
+                'APP_DB_CACHE_SIZE_KIB', default.cache_size_kib
+            ),
+            mmap_size=_get_int_env('APP_DB_MMAP_SIZE', default.mmap_size),
+            pool_size=int(os.environ.get('APP_DB_POOL_SIZE', default.pool_size)),
+            max_overflow=int(
+                os.environ.get('APP_DB_MAX_OVERFLOW', default.max_overflow)
+            ),
+            pool_timeout=float(
+                os.environ.get('APP_DB_POOL_TIMEOUT', default.pool_timeout)
+            ),
+        )
+
+    def get_pragmas(self) -> list[tuple[str, Any]]:
+        pragmas: list[tuple[str, Any]] = [
+            ('journal_mode', self.journal_mode),
+            ('synchronous', self.synchronous),
+            ('busy_timeout', self.busy_timeout_ms),
+            # Отрицательное значение cache_size задаётся в килобайтах
+            (
+                'cache_size',
+                None if self.cache_size_kib is None else -self.cache_size_kib,
+            ),
+            ('mmap_size', self.mmap_size),
+        ]
+        return [(name, value) for name, value in pragmas if value is not None]
+
+
+def _get_str_env(name: str, default: Optional[str]) -> Optional[str]:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    # Пустое значение отключает PRAGMA
+    return value or None
+
+
+def _get_int_env(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    # Пустое значение отключает PRAGMA
+    return int(value) if value != '' else None
+
+
+def _set_pragmas_on_connect(engine: Engine, settings: DatabaseSettings) -> None:
+    pragmas = settings.get_pragmas()
+
+    @sa.event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
+
+
+def create_engine(settings: Optional[DatabaseSettings] = None) -> Engine:
+    if settings is None:
+        settings = DatabaseSettings.from_env()
+
+    engine = sa.create_engine(
+        f'sqlite:///{settings.path}',
+        poolclass=QueuePool,
+        pool_size=settings.pool_size,
+        max_overflow=settings.max_overflow,
+        pool_timeout=settings.pool_timeout,
+        # Соединения из пула переходят между потоками Flask и тика цен
+        connect_args={'check_same_thread': False},
+    )
+    _set_pragmas_on_connect(engine, settings)
+    return engine
+
+
+def create_async_engine(settings: Optional[DatabaseSettings] = None) -> AsyncEngine:
+    if settings is None:
+        settings = DatabaseSettings.from_env()
+
+    # Пул соединений привязан к циклу событий, в котором им пользуются.
+    # AsyncTrade держит для движка свой цикл, см. app/async_trade.py
+    engine = sa_create_async_engine(
+        f'sqlite+aiosqlite:///{settings.path}',
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=settings.pool_size,
+        max_overflow=settings.max_overflow,
+        pool_timeout=settings.pool_timeout,
+    )
+    _set_pragmas_on_connect(engine.sync_engine, settings)
+    return engine
@@ -0,0 +1,45 @@
+import csv
+import io
+import json
+from typing import Any, Callable, Iterable, Iterator
+
+EXPORT_COLUMNS = (
+    'id',
+    'created_at',
+    'user_login',
+    'operation',
+    'cryptocurrency',
+    'count',
+    'price',
+)
+
+
+# Форматеры получают историю порциями и отдают по строке текста на порцию,
+# поэтому выгрузка не накапливает в памяти больше одной порции
+
+
+def format_csv(chunks: Iterable[list[tuple[Any, ...]]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def format_jsonl(chunks: Iterable[list[tuple[Any, ...]]]) -> Iterator[str]:
+    for rows in chunks:
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str) + '\n'
+            for row in rows
+        )
+
+
+EXPORT_FORMATS: dict[str, tuple[str, Callable[..., Iterator[str]]]] = {
+    'csv': ('text/csv', format_csv),
+    'jsonl': ('application/x-ndjson', format_jsonl),
+}
@@ -0,0 +1,48 @@
+import gzip
+import hashlib
+import os
+from typing import Any
+
+from werkzeug.wrappers import Response
+
+# Типы ответов, которые стоит сжимать. Потоковые ответы (экспорт истории,
+# поток цен) не сжимаются: их тело неизвестно заранее
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/plain', 'application/json'}
+# Меньшие ответы сжатие почти не уменьшает
+GZIP_MIN_SIZE = 500
+
+
+def make_etag(*parts: Any) -> str:
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def directory_digest(path: str) -> str:
+    # Хэш всех файлов каталога: после изменения шаблонов старые ETag
+    # перестают совпадать
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode())
+            with open(file_path, 'rb') as file:
+                digest.update(file.read())
+    return digest.hexdigest()
+
+
+def is_compressible(response: Response, min_size: int = GZIP_MIN_SIZE) -> bool:
+    return (
+        response.status_code == 200
+        and response.mimetype in COMPRESSIBLE_MIMETYPES
+        and not response.is_streamed
+        and not response.direct_passthrough
+        and 'Content-Encoding' not in response.headers
+        and response.content_length is not None
+        and response.content_length >= min_size
+    )
+
+
+def compress_response(response: Response, level: int = 6) -> None:
+    response.set_data(gzip.compress(response.get_data(), compresslevel=level))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
@@ -0,0 +1,543 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Iterator, NamedTuple, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Журнал событий, меняющих балансы, и снимки состояния леджера.
+#
+# Журнал - это сегменты journal-<seq первой записи>.bin в одном каталоге.
+# Запись: длина тела и его crc32, затем тело: тип события, seq и поля
+# события. Новый сегмент начинается после каждого снимка, поэтому старые
+# сегменты можно удалять вместе со старыми снимками.
+#
+# Снимок snapshot-<seq>.bin хранит валюты с ценами, пользователей с балансами
+# и позиции со стоимостью на момент события seq. Восстановление читает последний целый
+# снимок и применяет события журнала после него.
+
+FRAME = struct.Struct('<II')
+EVENT_HEADER = struct.Struct('<BQ')
+USER = struct.Struct('<Iq')
+LISTING = struct.Struct('<Iq')
+TICK = struct.Struct('<q')
+TICK_PRICE = struct.Struct('<Iq')
+TRADE = struct.Struct('<qBIIqqqqqq')
+# Заголовок и сделка целиком, для быстрого повтора журнала
+TRADE_EVENT = struct.Struct('<BQqBIIqqqqqq')
+
+KIND_USER = 1
+KIND_LISTING = 2
+KIND_TICK = 3
+KIND_TRADE = 4
+
+OPERATIONS = ('Buy', 'Sell')
+
+SNAPSHOT_MAGIC = b'LSNP0002'
+SNAPSHOT_HEADER = struct.Struct('<QqIII')
+SNAPSHOT_ENTRY = struct.Struct('<IqH')
+SNAPSHOT_POSITION = struct.Struct('<IIqqq')
+SNAPSHOT_CRC = struct.Struct('<I')
+
+JOURNAL_PREFIX = 'journal-'
+SNAPSHOT_PREFIX = 'snapshot-'
+SUFFIX = '.bin'
+
+
+# Деньги во всех событиях - целые копейки. Сделка хранит баланс, позицию,
+# её стоимость и реализованную прибыль после себя, поэтому повтор события не зависит от предыдущего состояния
+class UserCreated(NamedTuple):
+    seq: int
+    user_id: int
+    login: str
+    balance: int
+
+
+class CryptocurrencyListed(NamedTuple):
+    seq: int
+    cryptocurrency_id: int
+    name: str
+    cost: int
+
+
+class PriceTicked(NamedTuple):
+    seq: int
+    time: int
+    prices: list[tuple[int, int]]
+
+
+class TradeExecuted(NamedTuple):
+    seq: int
+    time: int
+    operation: str
+    user_id: int
+    cryptocurrency_id: int
+    count: int
+    price: int
+    balance: int
+    position: int
+    cost_basis: int
+    realised_pnl: int
+
+
+Event = Union[UserCreated, CryptocurrencyListed, PriceTicked, TradeExecuted]
+
+
+def encode_event(event: Event) -> bytes:
+    if isinstance(event, TradeExecuted):
+        body = EVENT_HEADER.pack(KIND_TRADE, event.seq) + TRADE.pack(
+            event.time,
+            OPERATIONS.index(event.operation),
+            event.user_id,
+            event.cryptocurrency_id,
+            event.count,
+            event.price,
+            event.balance,
+            event.position,
+            event.cost_basis,
+            event.realised_pnl,
+        )
+    elif isinstance(event, UserCreated):
+        body = (
+            EVENT_HEADER.pack(KIND_USER, event.seq)
+            + USER.pack(event.user_id, event.balance)
+            + event.login.encode()
+        )
+    elif isinstance(event, CryptocurrencyListed):
+        body = (
+            EVENT_HEADER.pack(KIND_LISTING, event.seq)
+            + LISTING.pack(event.cryptocurrency_id, event.cost)
+            + event.name.encode()
+        )
+    else:
+        body = b''.join(
+            [EVENT_HEADER.pack(KIND_TICK, event.seq), TICK.pack(event.time)]
+            + [TICK_PRICE.pack(*price) for price in event.prices]
+        )
+    return FRAME.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode_event(body: bytes) -> Event:
+    kind, seq = EVENT_HEADER.unpack_from(body)
+    offset = EVENT_HEADER.size
+    if kind == KIND_TRADE:
+        (
+            event_time,
+            operation,
+            user_id,
+            crypto_id,
+            count,
+            price,
+            balance,
+            position,
+            cost_basis,
+            realised_pnl,
+        ) = TRADE.unpack_from(body, offset)
+        return TradeExecuted(
+            seq,
+            event_time,
+            OPERATIONS[operation],
+            user_id,
+            crypto_id,
+            count,
+            price,
+            balance,
+            position,
+            cost_basis,
+            realised_pnl,
+        )
+    if kind == KIND_USER:
+        user_id, balance = USER.unpack_from(body, offset)
+        login = body[offset + USER.size :].decode()
+        return UserCreated(seq, user_id, login, balance)
+    if kind == KIND_LISTING:
+        crypto_id, cost = LISTING.unpack_from(body, offset)
+        name = body[offset + LISTING.size :].decode()
+        return CryptocurrencyListed(seq, crypto_id, name, cost)
+    if kind == KIND_TICK:
+        (event_time,) = TICK.unpack_from(body, offset)
+        prices = list(TICK_PRICE.iter_unpack(body[offset + TICK.size :]))
+        return PriceTicked(seq, event_time, prices)
+    raise ValueError(f'Неизвестный тип события журнала: {kind}')
+
+
+def _list_files(directory: str, prefix: str) -> list[tuple[int, str]]:
+    # Пары (seq из имени файла, путь) по возрастанию seq
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(SUFFIX):
+            seq = name[len(prefix) : -len(SUFFIX)]
+            if seq.isdigit():
+                files.append((int(seq), os.path.join(directory, name)))
+    return sorted(files)
+
+
+def list_segments(directory: str) -> list[tuple[int, str]]:
+    return _list_files(directory, JOURNAL_PREFIX)
+
+
+def list_snapshots(directory: str) -> list[tuple[int, str]]:
+    return _list_files(directory, SNAPSHOT_PREFIX)
+
+
+def _segment_path(directory: str, first_seq: int) -> str:
+    return os.path.join(directory, f'{JOURNAL_PREFIX}{first_seq:020d}{SUFFIX}')
+
+
+def _snapshot_path(directory: str, seq: int) -> str:
+    return os.path.join(directory, f'{SNAPSHOT_PREFIX}{seq:020d}{SUFFIX}')
+
+
+def _read_segment(path: str) -> Iterator[tuple[int, bytes]]:
+    # Тела целых записей и смещение конца каждой. Чтение останавливается на
+    # недописанной или повреждённой записи: дальше в сегменте ничего нет
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = 0
+            while position + FRAME.size <= size:
+                length, crc = FRAME.unpack_from(data, position)
+                end = position + FRAME.size + length
+                if end > size:
+                    break
+                body = data[position + FRAME.size : end]
+                if zlib.crc32(body) != crc:
+                    break
+                yield end, body
+                position = end
+            if position != size:
+                logger.warning(
+                    'Журнал %s обрывается на смещении %d из %d', path, position, size
+                )
+
+
+def _iter_bodies(directory: str, after_seq: int) -> Iterator[tuple[int, bytes]]:
+    segments = list_segments(directory)
+    for index, (_, path) in enumerate(segments):
+        # Сегмент целиком до after_seq можно не читать
+        if index + 1 < len(segments) and segments[index + 1][0] <= after_seq + 1:
+            continue
+        for end, body in _read_segment(path):
+            _, seq = EVENT_HEADER.unpack_from(body)
+            if seq > after_seq:
+                yield end, body
+
+
+def iter_events(directory: str, after_seq: int = 0) -> Iterator[Event]:
+    for _, body in _iter_bodies(directory, after_seq):
+        yield decode_event(body)
+
+
+def repair_segment(path: str) -> None:
+    # Отрезаем недописанный при сбое хвост, иначе новые записи после него
+    # не прочитаются
+    end = 0
+    for end, _ in _read_segment(path):
+        pass
+    if os.path.getsize(path) != end:
+        with open(path, 'r+b') as file:
+            file.truncate(end)
+            os.fsync(file.fileno())
+
+
+def _fsync_directory(directory: str) -> None:
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class JournalWriter:
+    # Дописывает события в последний сегмент. Запись попадает в буфер файла
+    # под блокировкой леджера, а fsync делается группой: поток, который
+    # первым дошёл до sync, сбрасывает на диск записи всех ждущих потоков
+    def __init__(self, directory: str, next_seq: int) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._sync_lock = threading.Lock()
+        self._written_seq = next_seq - 1
+        self._synced_seq = next_seq - 1
+        segments = list_segments(directory)
+        if segments:
+            path = segments[-1][1]
+            repair_segment(path)
+        else:
+            path = _segment_path(directory, next_seq)
+        self._file = open(path, 'ab')  # pylint: disable=consider-using-with
+        _fsync_directory(directory)
+
+    def append(self, event: Event) -> None:
+        self._file.write(encode_event(event))
+        self._written_seq = event.seq
+
+    def sync(self, seq: int) -> None:
+        if self._synced_seq >= seq:
+            return
+        with self._sync_lock:
+            if self._synced_seq >= seq:
+                return
+            written_seq = self._written_seq
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._synced_seq = written_seq
+
+    def size(self) -> int:
+        return self._file.tell()
+
+    def rotate(self) -> None:
+        # Следующее событие начнёт новый сегмент
+        with self._sync_lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._synced_seq = self._written_seq
+            self._file = open(  # pylint: disable=consider-using-with
+                _segment_path(self.directory, self._written_seq + 1), 'ab'
+            )
+        _fsync_directory(self.directory)
+
+    def close(self) -> None:
+        with self._sync_lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+class Account:
+    __slots__ = ('id', 'login', 'balance', 'positions', 'costs')
+
+    def __init__(self, user_id: int, login: str, balance: int) -> None:
+        self.id = user_id
+        self.login = login
+        # Баланс в копейках
+        self.balance = balance
+        # id криптовалюты -> количество
+        self.positions: dict[int, int] = {}
+        # id криптовалюты -> (стоимость позиции, реализованная прибыль)
+        self.costs: dict[int, tuple[int, int]] = {}
+
+
+class LedgerState:
+    def __init__(self) -> None:
+        # Последнее применённое событие и время последнего события со временем
+        self.seq = 0
+        self.time = 0
+        self.accounts: dict[str, Account] = {}
+        self.accounts_by_id: dict[int, Account] = {}
+        # id криптовалюты -> (имя, цена в копейках)
+        self.cryptocurrencies: dict[int, tuple[str, int]] = {}
+
+    def add_account(self, account: Account) -> None:
+        self.accounts[account.login] = account
+        self.accounts_by_id[account.id] = account
+
+    def apply(self, event: Event) -> None:
+        if isinstance(event, TradeExecuted):
+            account = self.accounts_by_id[event.user_id]
+            account.balance = event.balance
+            account.positions[event.cryptocurrency_id] = event.position
+            account.costs[event.cryptocurrency_id] = (
+                event.cost_basis,
+                event.realised_pnl,
+            )
+            self.time = event.time
+        elif isinstance(event, UserCreated):
+            self.add_account(Account(event.user_id, event.login, event.balance))
+        elif isinstance(event, CryptocurrencyListed):
+            self.cryptocurrencies[event.cryptocurrency_id] = (event.name, event.cost)
+        else:
+            for crypto_id, cost in event.prices:
+                name, _ = self.cryptocurrencies[crypto_id]
+                self.cryptocurrencies[crypto_id] = (name, cost)
+            self.time = event.time
+        self.seq = event.seq
+
+
+def encode_snapshot(state: LedgerState) -> bytes:
+    parts = [
+        SNAPSHOT_MAGIC,
+        SNAPSHOT_HEADER.pack(
+            state.seq,
+            state.time,
+            len(state.cryptocurrencies),
+            len(state.accounts_by_id),
+            sum(len(account.positions) for account in state.accounts_by_id.values()),
+        ),
+    ]
+    for crypto_id, (name, cost) in sorted(state.cryptocurrencies.items()):
+        encoded = name.encode()
+        parts.append(SNAPSHOT_ENTRY.pack(crypto_id, cost, len(encoded)) + encoded)
+    for user_id, account in sorted(state.accounts_by_id.items()):
+        encoded = account.login.encode()
+        parts.append(
+            SNAPSHOT_ENTRY.pack(user_id, account.balance, len(encoded)) + encoded
+        )
+    for user_id, account in sorted(state.accounts_by_id.items()):
+        for crypto_id, count in account.positions.items():
+            cost_basis, realised_pnl = account.costs.get(crypto_id, (0, 0))
+            parts.append(
+                SNAPSHOT_POSITION.pack(
+                    user_id, crypto_id, count, cost_basis, realised_pnl
+                )
+            )
+    data = b''.join(parts)
+    return data + SNAPSHOT_CRC.pack(zlib.crc32(data))
+
+
+def decode_snapshot(data: bytes) -> LedgerState:
+    body = memoryview(data)[: -SNAPSHOT_CRC.size]
+    (crc,) = SNAPSHOT_CRC.unpack_from(data, len(data) - SNAPSHOT_CRC.size)
+    if not data.startswith(SNAPSHOT_MAGIC) or zlib.crc32(body) != crc:
+        raise ValueError('Снимок леджера повреждён')
+
+    state = LedgerState()
+    offset = len(SNAPSHOT_MAGIC)
+    (
+        state.seq,
+        state.time,
+        count_crypto,
+        count_users,
+        count_positions,
+    ) = SNAPSHOT_HEADER.unpack_from(body, offset)
+    offset += SNAPSHOT_HEADER.size
+
+    entries = []
+    for _ in range(count_crypto + count_users):
+        entry_id, value, length = SNAPSHOT_ENTRY.unpack_from(body, offset)
+        offset += SNAPSHOT_ENTRY.size
+        entries.append(
+            (entry_id, value, bytes(body[offset : offset + length]).decode())
+        )
+        offset += length
+    for crypto_id, cost, name in entries[:count_crypto]:
+        state.cryptocurrencies[crypto_id] = (name, cost)
+    for user_id, balance, login in entries[count_crypto:]:
+        state.add_account(Account(user_id, login, balance))
+
+    positions_end = offset + count_positions * SNAPSHOT_POSITION.size
+    for (
+        user_id,
+        crypto_id,
+        count,
+        cost_basis,
+        realised_pnl,
+    ) in SNAPSHOT_POSITION.iter_unpack(body[offset:positions_end]):
+        account = state.accounts_by_id[user_id]
+        account.positions[crypto_id] = count
+        account.costs[crypto_id] = (cost_basis, realised_pnl)
+    return state
+
+
+def write_snapshot(directory: str, seq: int, data: bytes) -> str:
+    # Снимок появляется под своим именем только целиком записанным на диск.
+    # Данные кодируются отдельно, чтобы леджер мог сделать это под своей
+    # блокировкой, а писать на диск уже без неё
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory, seq)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+    _fsync_directory(directory)
+    return path
+
+
+def load_snapshot(
+    directory: str,
+    until_seq: Optional[int] = None,
+    until_time: Optional[int] = None,
+) -> LedgerState:
+    # Последний целый снимок не новее заданной точки
+    for seq, path in reversed(list_snapshots(directory)):
+        if until_seq is not None and seq > until_seq:
+            continue
+        with open(path, 'rb') as file:
+            data = file.read()
+        try:
+            state = decode_snapshot(data)
+        except (ValueError, struct.error):
+            logger.warning('Пропустим повреждённый снимок %s', path)
+            continue
+        if until_time is not None and state.time > until_time:
+            continue
+        return state
+    return LedgerState()
+
+
+def recover(
+    directory: str,
+    until_seq: Optional[int] = None,
+    until_time: Optional[int] = None,
+) -> LedgerState:
+    # Состояние после события until_seq или после последнего события не
+    # позже until_time. Без границ - состояние после последнего события
+    state = load_snapshot(directory, until_seq, until_time)
+    snapshot_seq = state.seq
+    last_seq = until_seq if until_seq is not None else float('inf')
+    last_time = until_time if until_time is not None else float('inf')
+    accounts_by_id = state.accounts_by_id
+    for _, body in _iter_bodies(directory, state.seq):
+        # Сделок в журнале большинство, их применяем без создания события
+        if body[0] == KIND_TRADE:
+            (
+                _,
+                seq,
+                event_time,
+                _,
+                user_id,
+                crypto_id,
+                _,
+                _,
+                balance,
+                position,
+                cost_basis,
+                realised_pnl,
+            ) = TRADE_EVENT.unpack(body)
+            if seq > last_seq or event_time > last_time:
+                break
+            account = accounts_by_id[user_id]
+            account.balance = balance
+            account.positions[crypto_id] = position
+            account.costs[crypto_id] = (cost_basis, realised_pnl)
+            state.time = event_time
+            state.seq = seq
+            continue
+        event = decode_event(body)
+        if event.seq > last_seq or (
+            isinstance(event, PriceTicked) and event.time > last_time
+        ):
+            break
+        state.apply(event)
+    logger.info(
+        'Восстановили леджер: снимок %d, событий после снимка %d',
+        snapshot_seq,
+        state.seq - snapshot_seq,
+    )
+    return state
+
+
+def prune(directory: str, keep_snapshots: int, applied_seq: int) -> None:
+    # Оставляем keep_snapshots последних снимков и сегменты, нужные для
+    # восстановления от самого старого из них и для записи в базу событий
+    # новее applied_seq
+    snapshots = list_snapshots(directory)
+    if len(snapshots) < keep_snapshots or keep_snapshots <= 0:
+        return
+    kept = snapshots[-keep_snapshots:]
+    for _, path in snapshots[:-keep_snapshots]:
+        os.remove(path)
+    floor = min(kept[0][0], applied_seq)
+    segments = list_segments(directory)
+    for (_, path), (next_first_seq, _) in zip(segments, segments[1:]):
+        if next_first_seq <= floor + 1:
+            os.remove(path)
@@ -0,0 +1,854 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Collection, Iterable, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection, Engine
+
+try:
+    from app.journal import (
+        Account,
+        CryptocurrencyListed,
+        Event,
+        JournalWriter,
+        LedgerState,
+        PriceTicked,
+        TradeExecuted,
+        UserCreated,
+        encode_snapshot,
+        iter_events,
+        list_segments,
+        list_snapshots,
+        prune,
+        recover,
+        write_snapshot,
+    )
+    from app.market import MarketModel
+    from app.metrics import TRADE_OPERATIONS
+    from app.models import LedgerCheckpoint, LimitOrder, User
+    from app.positions import (
+        PositionSummary,
+        buy_position,
+        sell_position,
+        summarize_position,
+    )
+    from app.scheduler import LeaderLock
+    from app.trade import HistoryPage, NameOperation, Trade
+except ImportError:  # pragma: no cover
+    from journal import (  # type: ignore
+        Account,
+        CryptocurrencyListed,
+        Event,
+        JournalWriter,
+        LedgerState,
+        PriceTicked,
+        TradeExecuted,
+        UserCreated,
+        encode_snapshot,
+        iter_events,
+        list_segments,
+        list_snapshots,
+        prune,
+        recover,
+        write_snapshot,
+    )
+    from market import MarketModel  # type: ignore
+    from metrics import TRADE_OPERATIONS  # type: ignore
+    from models import LedgerCheckpoint, LimitOrder, User  # type: ignore
+    from positions import (  # type: ignore
+        PositionSummary,
+        buy_position,
+        sell_position,
+        summarize_position,
+    )
+    from scheduler import LeaderLock  # type: ignore
+    from trade import HistoryPage, NameOperation, Trade  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Версии пользователей леджера живут только в памяти. Счётчик общий для
+# процесса, чтобы после перезагрузки состояния версии не повторялись
+_versions = itertools.count(1)
+
+
+@dataclass
+class LedgerSettings:
+    # Каталог с сегментами журнала и снимками, см. app/journal.py
+    directory: str = 'ledger'
+    # Подтверждать сделку только после fsync журнала. Без этого сделки
+    # последних миллисекунд могут потеряться при сбое машины
+    sync_commit: bool = True
+    # Как часто фоновый поток переносит сделки из памяти в базу
+    flush_interval: float = 0.05
+    batch_size: int = 10000
+    # Снимок пишется каждые snapshot_every событий и при остановке
+    snapshot_every: int = 100000
+    keep_snapshots: int = 3
+
+    @classmethod
+    def from_env(cls) -> 'LedgerSettings':
+        default = cls()
+        return cls(
+            directory=os.environ.get('APP_LEDGER_DIR', default.directory),
+            sync_commit=os.environ.get('APP_LEDGER_SYNC_COMMIT', '1') != '0',
+            flush_interval=float(
+                os.environ.get('APP_LEDGER_FLUSH_INTERVAL', default.flush_interval)
+            ),
+            batch_size=int(os.environ.get('APP_LEDGER_BATCH_SIZE', default.batch_size)),
+            snapshot_every=int(
+                os.environ.get('APP_LEDGER_SNAPSHOT_EVERY', default.snapshot_every)
+            ),
+            keep_snapshots=int(
+                os.environ.get('APP_LEDGER_KEEP_SNAPSHOTS', default.keep_snapshots)
+            ),
+        )
+
+
+# Каталоги леджера, заблокированные этим процессом. Блокировка держится до
+# выхода из процесса, внутри процесса леджер можно открывать заново
+_directory_locks: dict[str, LeaderLock] = {}
+_directory_locks_lock = threading.Lock()
+
+
+def _lock_directory(directory: str) -> None:
+    # Журнал пишет один процесс: второй процесс сервера с тем же каталогом
+    # дописывал бы в журнал и в базу свои балансы
+    path = os.path.realpath(directory)
+    with _directory_locks_lock:
+        if path in _directory_locks:
+            return
+        os.makedirs(path, exist_ok=True)
+        lock = LeaderLock(os.path.join(path, 'ledger.lock'))
+        if not lock.acquire():
+            raise RuntimeError(
+                f'Леджер {directory} уже открыт другим процессом: '
+                'с APP_TRADE_BACKEND=ledger сервер работает одним процессом'
+            )
+        _directory_locks[path] = lock
+
+
+# Торговля с балансами и портфелями в памяти. Сделка проверяется и
+# применяется в памяти под одной блокировкой, пишется в журнал и ставится в
+# очередь; фоновый поток пачками переносит сделки в таблицы user,
+# UserCryptocurrency и HistoryOperation вместе с номером последнего
+# перенесённого события журнала. Пользователи, валюты и тики цен сначала
+# пишутся в базу, а потом в журнал.
+#
+# При запуске состояние восстанавливается из снимка и журнала, события новее
+# номера в базе дописываются в базу, а то, что есть в базе, но не попало в
+# журнал, дописывается в журнал.
+#
+# История операций в базе отстаёт от памяти не больше чем на flush_interval.
+# Историю пользователя леджер отдаёт, только дописав в базу его сделки.
+# Леджер рассчитан на один процесс, который единственный меняет балансы:
+# каталог журнала блокируется файлом ledger.lock.
+class LedgerTrade(Trade):
+    # Версии пользователей леджера живут в памяти и после перезапуска
+    # начинаются заново
+    durable_user_versions = False
+
+    def __init__(
+        self,
+        engine_db: Engine,
+        bulk_tick: bool = False,
+        settings: Optional[LedgerSettings] = None,
+        market: Optional[MarketModel] = None,
+    ) -> None:
+        super().__init__(engine_db, bulk_tick, market)
+        self.settings = settings or LedgerSettings.from_env()
+        self._ledger_lock = threading.Lock()
+        self._state: Optional[LedgerState] = None
+        self._journal: Optional[JournalWriter] = None
+        self._pending: list[TradeExecuted] = []
+        self._applied_seq = 0
+        self._snapshot_seq = 0
+        self._snapshot_lock = threading.Lock()
+        self._flushed = threading.Condition()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._writer: Optional[threading.Thread] = None
+        # Версия меняется с каждой сделкой пользователя, как User.version
+        self._user_versions: dict[str, int] = {}
+        # Номер события последней сделки пользователя: история из базы
+        # читается только после того, как эта сделка в неё записана
+        self._user_seqs: dict[str, int] = {}
+        self._base_version = 0
+
+    def _load(self) -> LedgerState:
+        # Вызывается под блокировкой леджера
+        if self._state is not None:
+            return self._state
+
+        self._check_limit_orders()
+        directory = self.settings.directory
+        _lock_directory(directory)
+        checkpoint = self._get_checkpoint()
+        state = None
+        if list_segments(directory) or list_snapshots(directory):
+            state = recover(directory)
+            if state.seq < checkpoint:
+                logger.warning(
+                    'Журнал леджера (%d) отстаёт от базы (%d), загрузим базу',
+                    state.seq,
+                    checkpoint,
+                )
+                state = None
+            else:
+                self._catch_up(iter_events(directory, checkpoint))
+
+        if state is None:
+            state = self._select_state(checkpoint)
+            write_snapshot(directory, state.seq, encode_snapshot(state))
+        self._snapshot_seq = max(
+            [seq for seq, _ in list_snapshots(directory)], default=0
+        )
+        self._journal = JournalWriter(directory, state.seq + 1)
+        self._state = state
+        self._user_versions = {}
+        self._user_seqs = {}
+        self._base_version = next(_versions)
+        self._reconcile()
+        self._applied_seq = state.seq
+        logger.info('Загрузили в память %d пользователей', len(state.accounts))
+        return state
+
+    def _check_limit_orders(self) -> None:
+        # Открытые заявки держат деньги и валюту пользователей, а исполнять
+        # их леджер не умеет: с ними балансы в памяти разошлись бы с базой
+        with self.engine.connect() as connection:
+            count = connection.execute(
+                sa.select(sa.func.count()).select_from(LimitOrder)
+            ).scalar()
+        if count:
+            raise ValueError(
+                f'В базе {count} открытых лимитных заявок, леджер их не исполняет: '
+                'отмените их или запустите APP_TRADE_BACKEND=sql'
+            )
+
+    def _get_checkpoint(self) -> int:
+        with self.engine.connect() as connection:
+            seq = connection.execute(
+                sa.select(LedgerCheckpoint.seq).where(LedgerCheckpoint.id == 1)
+            ).scalar()
+        return seq or 0
+
+    def _select_state(self, seq: int) -> LedgerState:
+        state = LedgerState()
+        state.seq = seq
+        state.time = int(time.time())
+        with self.engine.connect() as connection:
+            for crypto_id, name, cost in self._select_cryptocurrencies(connection):
+                state.cryptocurrencies[crypto_id] = (name, cost)
+            for user_id, login, balance in self._select_users(connection):
+                state.add_account(Account(user_id, login, balance))
+            for (
+                user_id,
+                crypto_id,
+                count,
+                cost_basis,
+                realised_pnl,
+            ) in connection.exec_driver_sql(
+                'SELECT user_id, cryptocurrency_id, count, '
+                'CAST(round(cost_basis * 100) AS INTEGER), '
+                'CAST(round(realised_pnl * 100) AS INTEGER) '
+                'FROM "UserCryptocurrency"'
+            ):
+                account = state.accounts_by_id[user_id]
+                account.positions[crypto_id] = count
+                account.costs[crypto_id] = (cost_basis, realised_pnl)
+        return state
+
+    @staticmethod
+    def _select_cryptocurrencies(connection: Connection) -> Any:
+        return connection.exec_driver_sql(
+            'SELECT id, name, CAST(round(cost * 100) AS INTEGER) FROM cryptocurrency'
+        )
+
+    @staticmethod
+    def _select_users(connection: Connection) -> Any:
+        return connection.exec_driver_sql(
+            'SELECT id, login, CAST(round(balance * 100) AS INTEGER) FROM user'
+        )
+
+    def _catch_up(self, events: Iterable[Event]) -> None:
+        # Дописываем в базу события, которые не успел перенести фоновый поток
+        batch: list[Event] = []
+        count = 0
+        for event in events:
+            if isinstance(event, PriceTicked):
+                continue
+            batch.append(event)
+            if len(batch) >= self.settings.batch_size:
+                with self.engine.begin() as connection:
+                    self._apply_events(connection, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            with self.engine.begin() as connection:
+                self._apply_events(connection, batch)
+            count += len(batch)
+        if count:
+            logger.info('Дописали в базу %d событий из журнала', count)
+
+    def _reconcile(self) -> None:
+        # Пользователи и валюты попадают в журнал после базы, и при сбое
+        # между этими записями их не будет в журнале
+        state = self._state
+        assert state is not None and self._journal is not None
+        events: list[Event] = []
+        with self.engine.connect() as connection:
+            for crypto_id, name, cost in self._select_cryptocurrencies(connection):
+                if crypto_id not in state.cryptocurrencies:
+                    events.append(
+                        CryptocurrencyListed(
+                            state.seq + len(events) + 1, crypto_id, name, cost
+                        )
+                    )
+            for user_id, login, balance in self._select_users(connection):
+                if user_id not in state.accounts_by_id:
+                    events.append(
+                        UserCreated(
+                            state.seq + len(events) + 1, user_id, login, balance
+                        )
+                    )
+        for event in events:
+            self._journal.append(event)
+            state.apply(event)
+        if events:
+            logger.warning('Дописали в журнал %d событий из базы', len(events))
+            self._journal.sync(state.seq)
+
+    def _apply_events(self, connection: Connection, events: list[Event]) -> None:
+        # Сделки содержат баланс и позицию со стоимостью после себя, поэтому из пачки
+        # в базу идут только последние значения. Пользователи и валюты уже
+        # могут быть в базе
+        users = []
+        cryptocurrencies = []
+        balances: dict[int, int] = {}
+        positions: dict[tuple[int, int], tuple[int, int, int]] = {}
+        history = []
+        for event in events:
+            if isinstance(event, TradeExecuted):
+                balances[event.user_id] = event.balance
+                positions[(event.user_id, event.cryptocurrency_id)] = (
+                    event.position,
+                    event.cost_basis,
+                    event.realised_pnl,
+                )
+                history.append(
+                    (
+                        event.user_id,
+                        self._get_operation_id(event.operation),
+                        event.cryptocurrency_id,
+                        event.count,
+                        event.price / 100,
+                        event.time,
+                    )
+                )
+            elif isinstance(event, UserCreated):
+                users.append((event.user_id, event.login, event.balance / 100))
+            elif isinstance(event, CryptocurrencyListed):
+                cryptocurrencies.append(
+                    (event.cryptocurrency_id, event.name, event.cost / 100)
+                )
+
+        if cryptocurrencies:
+            connection.exec_driver_sql(
+                'INSERT OR IGNORE INTO cryptocurrency (id, name, cost) VALUES (?, ?, ?)',
+                cryptocurrencies,
+            )
+        if users:
+            connection.exec_driver_sql(
+                'INSERT OR IGNORE INTO user (id, login, balance) VALUES (?, ?, ?)',
+                users,
+            )
+        if history:
+            connection.exec_driver_sql(
+                'UPDATE user SET balance = ? WHERE id = ?',
+                [(balance / 100, user_id) for user_id, balance in balances.items()],
+            )
+            connection.exec_driver_sql(
+                'INSERT INTO "UserCryptocurrency" '
+                '(user_id, cryptocurrency_id, count, cost_basis, realised_pnl) '
+                'VALUES (?, ?, ?, ?, ?) ON CONFLICT (user_id, cryptocurrency_id) '
+                'DO UPDATE SET count = excluded.count, '
+                'cost_basis = excluded.cost_basis, '
+                'realised_pnl = excluded.realised_pnl',
+                [
+                    (user_id, crypto_id, count, cost_basis / 100, realised_pnl / 100)
+                    for (user_id, crypto_id), (
+                        count,
+                        cost_basis,
+                        realised_pnl,
+                    ) in positions.items()
+                ],
+            )
+            connection.exec_driver_sql(
+                'INSERT INTO "HistoryOperation" '
+                '(user_id, operation_id, cryptocurrency_id, count, price, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                history,
+            )
+        connection.exec_driver_sql(
+            'INSERT INTO "LedgerCheckpoint" (id, seq) VALUES (1, ?) '
+            'ON CONFLICT (id) DO UPDATE SET seq = excluded.seq',
+            (events[-1].seq,),
+        )
+
+    def _start_writer(self) -> None:
+        if self._writer is None:
+            self._stopping = False
+            self._writer = threading.Thread(
+                target=self._write_behind_loop, name='ledger-write-behind', daemon=True
+            )
+            self._writer.start()
+
+    def _write_behind_loop(self) -> None:
+        while True:
+            self._wake.wait(self.settings.flush_interval)
+            self._wake.clear()
+            stopping = self._stopping
+            self._write_pending()
+            state = self._state
+            if (
+                not stopping
+                and state is not None
+                and state.seq - self._snapshot_seq >= self.settings.snapshot_every
+            ):
+                self.snapshot()
+            if stopping:
+                return
+
+    def _write_pending(self) -> None:
+        while True:
+            with self._ledger_lock:
+                batch = self._pending[: self.settings.batch_size]
+            if not batch:
+                return
+            try:
+                with self.engine.begin() as connection:
+                    self._apply_events(connection, batch)
+            except Exception:  # pylint: disable=broad-except
+                # Сделки остаются в очереди и в журнале, повторим позже
+                logger.exception('Не удалось записать сделки в базу')
+                return
+
+            with self._ledger_lock:
+                del self._pending[: len(batch)]
+                self._applied_seq = batch[-1].seq
+            with self._flushed:
+                self._flushed.notify_all()
+
+    def open(self) -> None:
+        # Загрузить леджер сразу, а не при первом обращении
+        with self._ledger_lock:
+            self._load()
+
+    def snapshot(self) -> None:
+        # Состояние кодируется под блокировкой леджера, чтобы снимок
+        # соответствовал ровно одному seq; на диск он пишется уже без неё
+        with self._snapshot_lock:
+            with self._ledger_lock:
+                state = self._load()
+                assert self._journal is not None
+                seq = state.seq
+                if seq == self._snapshot_seq:
+                    return
+                data = encode_snapshot(state)
+                self._journal.rotate()
+                applied_seq = self._applied_seq if self._pending else seq
+            write_snapshot(self.settings.directory, seq, data)
+            self._snapshot_seq = seq
+            prune(self.settings.directory, self.settings.keep_snapshots, applied_seq)
+        logger.info('Записали снимок леджера на событии %d', seq)
+
+    def flush(self) -> None:
+        # Дождаться, пока все принятые сделки окажутся в базе
+        with self._ledger_lock:
+            seq = self._pending[-1].seq if self._pending else 0
+        self._wait_applied(seq)
+
+    def _flush_user(self, user_login: str) -> None:
+        # Дождаться, пока в базе окажутся сделки пользователя. Иначе страница
+        # истории, закэшированная под новой версией, останется без сделки
+        with self._ledger_lock:
+            seq = self._user_seqs.get(user_login, 0)
+        self._wait_applied(seq)
+
+    def _wait_applied(self, seq: int) -> None:
+        if self._writer is None:
+            return
+        with self._flushed:
+            while self._applied_seq < seq:
+                self._wake.set()
+                self._flushed.wait(self.settings.flush_interval)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._stopping = True
+            self._wake.set()
+            self._writer.join()
+            self._writer = None
+        if self._state is not None and self._state.seq > self._snapshot_seq:
+            # Следующий запуск прочитает только этот снимок
+            self.snapshot()
+        self._close_journal()
+
+    def _close_journal(self) -> None:
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self._state = None
+
+    def _reset_ledger(self) -> None:
+        if self._writer is not None:
+            self._stopping = True
+            self._wake.set()
+            self._writer.join()
+            self._writer = None
+        self._close_journal()
+        self._pending = []
+        for _, path in list_segments(self.settings.directory) + list_snapshots(
+            self.settings.directory
+        ):
+            os.remove(path)
+
+    def base_drop_all(self) -> None:
+        self._reset_ledger()
+        super().base_drop_all()
+
+    def base_create_all(self) -> None:
+        self._reset_ledger()
+        super().base_create_all()
+
+    def base_migrate(self) -> list[int]:
+        self.flush()
+        self.close()
+        return super().base_migrate()
+
+    def _append(self, event: Event) -> None:
+        # Вызывается под блокировкой леджера
+        assert self._state is not None and self._journal is not None
+        self._journal.append(event)
+        self._state.apply(event)
+
+    def create_user(self, login: str) -> None:
+        # Пользователь сразу пишется в базу, чтобы чтение истории и прочие
+        # запросы к базе видели его без ожидания фоновой записи
+        with self._ledger_lock:
+            state = self._load()
+            if login in state.accounts:
+                raise ValueError(f'Пользователь {login} уже существует')
+            with self._create_session() as session:
+                user = User(login=login, balance='1000')
+                session.add(user)
+                session.flush()
+                user_id = user.id
+            event = UserCreated(state.seq + 1, user_id, login, 100000)
+            self._append(event)
+        self._sync(event.seq)
+        logger.info('Добавили пользователя: %s', login)
+
+    def create_cryptocurrency(self, name: str, cost: str) -> None:
+        super().create_cryptocurrency(name, cost)
+        snapshot = self.get_price_snapshot()
+        crypto_id = snapshot.ids[name]
+        with self._ledger_lock:
+            state = self._load()
+            # Состояние, загруженное только что, уже знает о валюте из базы
+            if crypto_id in state.cryptocurrencies:
+                return
+            event = CryptocurrencyListed(
+                state.seq + 1, crypto_id, name, int(snapshot.by_name[name].scaleb(2))
+            )
+            self._append(event)
+        self._sync(event.seq)
+
+    def update_cost(
+        self,
+        seed: Optional[int] = None,
+        tick_time: Optional[int] = None,
+        names: Optional[Collection[str]] = None,
+    ) -> None:
+        super().update_cost(seed, tick_time, names)
+        snapshot = self.get_price_snapshot()
+        with self._ledger_lock:
+            state = self._load()
+            prices = [
+                (snapshot.ids[name], int(cost.scaleb(2)))
+                for name, cost in snapshot.prices
+                if snapshot.ids[name] in state.cryptocurrencies
+                and (names is None or name in names)
+            ]
+            self._append(
+                PriceTicked(state.seq + 1, self._get_tick_time(tick_time), prices)
+            )
+
+    def _sync(self, seq: int) -> None:
+        if self.settings.sync_commit and self._journal is not None:
+            self._journal.sync(seq)
+
+    def _trade(
+        self, operation: str, user_login: str, cryptocurrency_name: str, count: int
+    ) -> None:
+        snapshot = self.get_price_snapshot()
+        cryptocurrency_id = snapshot.ids.get(cryptocurrency_name)
+        self._get_operation_id(operation)
+        with self._ledger_lock:
+            state = self._load()
+            account = state.accounts.get(user_login)
+            if account is None:
+                TRADE_OPERATIONS.inc(operation, 'unknown_user')
+                logger.error('Пользователя %s не существует', user_login)
+                raise ValueError(f'Пользователя {user_login} не существует')
+            if cryptocurrency_id is None:
+                TRADE_OPERATIONS.inc(operation, 'unknown_cryptocurrency')
+                logger.error('Криптовалюты %s не существует', cryptocurrency_name)
+                raise ValueError('Такой криптовалюты не существует')
+
+            price = int(snapshot.by_name[cryptocurrency_name].scaleb(2))
+            position = account.positions.get(cryptocurrency_id)
+            cost_basis, realised_pnl = account.costs.get(cryptocurrency_id, (0, 0))
+            if operation == NameOperation.Buy.value:
+                if account.balance < price * count:
+                    TRADE_OPERATIONS.inc(operation, 'insufficient_funds')
+                    logger.error(
+                        'У пользователя %s на счету %s, а для покупки надо %s',
+                        user_login,
+                        Decimal(account.balance).scaleb(-2),
+                        Decimal(price * count).scaleb(-2),
+                    )
+                    raise ValueError('Недостаточно средств')
+                account.balance -= price * count
+                cost_basis = buy_position(cost_basis, price, count)
+                position = (position or 0) + count
+            else:
+                if not position:
+                    TRADE_OPERATIONS.inc(operation, 'insufficient_cryptocurrency')
+                    logger.error(
+                        'У пользователя %s нет криптовалюты %s',
+                        user_login,
+                        cryptocurrency_name,
+                    )
+                    raise ValueError(
+                        f'У пользователя {user_login} нет криптовалюты {cryptocurrency_name}'
+                    )
+                if position < count:
+                    TRADE_OPERATIONS.inc(operation, 'insufficient_cryptocurrency')
+                    logger.error(
+                        'У пользователя %s есть %d %s, а для продажи надо %d',
+                        user_login,
+                        position,
+                        cryptocurrency_name,
+                        count,
+                    )
+                    raise ValueError(
+                        f'У пользователя {user_login} есть {position} {cryptocurrency_name}, а для продажи надо {count}'  # pylint: disable=line-too-long
+                    )
+                account.balance += price * count
+                cost_basis, realised = sell_position(cost_basis, position, price, count)
+                realised_pnl += realised
+                position -= count
+            account.positions[cryptocurrency_id] = position
+            account.costs[cryptocurrency_id] = (cost_basis, realised_pnl)
+
+            event = TradeExecuted(
+                state.seq + 1,
+                int(time.time()),
+                operation,
+                account.id,
+                cryptocurrency_id,
+                count,
+                price,
+                account.balance,
+                position,
+                cost_basis,
+                realised_pnl,
+            )
+            self._append(event)
+            self._pending.append(event)
+            self._user_versions[user_login] = next(_versions)
+            self._user_seqs[user_login] = event.seq
+            self._start_writer()
+
+        self._sync(event.seq)
+        TRADE_OPERATIONS.inc(operation, 'ok')
+        logger.debug(
+            'Пользователь %s: %s %d %s по цене %s',
+            user_login,
+            operation,
+            count,
+            cryptocurrency_name,
+            Decimal(price).scaleb(-2),
+        )
+
+    def user_buy_cryptocurrency(
+        self, user_login: str, cryptocurrency_name: str, count: int
+    ) -> None:
+        self._trade(NameOperation.Buy.value, user_login, cryptocurrency_name, count)
+
+    def user_sell_cryptocurrency(
+        self, user_login: str, cryptocurrency_name: str, count: int
+    ) -> None:
+        self._trade(NameOperation.Sell.value, user_login, cryptocurrency_name, count)
+
+    def place_limit_order(
+        self,
+        user_login: str,
+        cryptocurrency_name: str,
+        operation_name: str,
+        price: str,
+        count: int,
+    ) -> int:
+        # Как и другие отказы в сделке - ошибка предметной области
+        raise ValueError(
+            'Лимитные заявки не поддерживаются леджером, '
+            'они доступны с APP_TRADE_BACKEND=sql'
+        )
+
+    def cancel_limit_order(self, user_login: str, order_id: int) -> None:
+        # Леджер не запускается с открытыми заявками, отменять нечего
+        raise ValueError(f'Заявки {order_id} не существует')
+
+    def is_user_exist(self, user_login: str) -> bool:
+        with self._ledger_lock:
+            return user_login in self._load().accounts
+
+    def _get_account(self, user_login: str) -> Account:
+        account = self._load().accounts.get(user_login)
+        if account is None:
+            logger.error('Пользователя %s не существует', user_login)
+            raise ValueError(f'Пользователя {user_login} не существует')
+        return account
+
+    def get_user_balance(self, user_login: str) -> str:
+        with self._ledger_lock:
+            return Decimal(self._get_account(user_login).balance).scaleb(-2)
+
+    def get_user_balance_and_version(self, user_login: str) -> tuple[Any, int]:
+        with self._ledger_lock:
+            balance = Decimal(self._get_account(user_login).balance).scaleb(-2)
+            return balance, self._user_versions.get(user_login, self._base_version)
+
+    def get_user_history_operation(self, user_login: str) -> list[tuple[str, str, str]]:
+        self._flush_user(user_login)
+        return super().get_user_history_operation(user_login)
+
+    def get_user_history_operation_page(
+        self,
+        user_login: str,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+    ) -> HistoryPage:
+        self._flush_user(user_login)
+        return super().get_user_history_operation_page(
+            user_login, limit, before_id=before_id, after_id=after_id
+        )
+
+    def count_user_history_operation(self, user_login: str) -> int:
+        self._flush_user(user_login)
+        return super().count_user_history_operation(user_login)
+
+    def get_user_portfolio(self, user_login: str) -> list[tuple[str, str]]:
+        names = {
+            crypto_id: name for name, crypto_id in self.get_price_snapshot().ids.items()
+        }
+        with self._ledger_lock:
+            positions = sorted(self._get_account(user_login).positions.items())
+        return [
+            (count, names[crypto_id]) for crypto_id, count in positions if count != 0
+        ]
+
+    def get_user_positions(self, user_login: str) -> list[PositionSummary]:
+        snapshot = self.get_price_snapshot()
+        names = {crypto_id: name for name, crypto_id in snapshot.ids.items()}
+        with self._ledger_lock:
+            account = self._get_account(user_login)
+            positions = [
+                (crypto_id, count, *account.costs.get(crypto_id, (0, 0)))
+                for crypto_id, count in sorted(account.positions.items())
+            ]
+        return [
+            summarize_position(
+                names[crypto_id],
+                count,
+                cost_basis,
+                realised_pnl,
+                int(snapshot.by_name[names[crypto_id]].scaleb(2)),
+            )
+            for crypto_id, count, cost_basis, realised_pnl in positions
+            if count != 0 or realised_pnl != 0
+        ]
+
+    def get_all_users(self) -> list[tuple[Any, Any, list[tuple[Any, Any]]]]:
+        names = {
+            crypto_id: name for name, crypto_id in self.get_price_snapshot().ids.items()
+        }
+        with self._ledger_lock:
+            accounts = sorted(
+                self._load().accounts.values(), key=lambda account: account.id
+            )
+            return [
+                (
+                    account.login,
+                    Decimal(account.balance).scaleb(-2),
+                    [
+                        (names[crypto_id], count)
+                        for crypto_id, count in sorted(account.positions.items())
+                    ],
+                )
+                for account in accounts
+            ]
+
+
+def restore_database(engine: Engine, state: LedgerState) -> None:
+    # Новая база с валютами, пользователями и позициями из состояния леджера.
+    # Журнал не хранит историю сделок до снимка, поэтому история операций
+    # в такой базе пустая
+    trade = Trade(engine)
+    trade.base_create_all()
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    with engine.begin() as connection:
+        if state.cryptocurrencies:
+            connection.exec_driver_sql(
+                'INSERT INTO cryptocurrency (id, name, cost) VALUES (?, ?, ?)',
+                [
+                    (crypto_id, name, cost / 100)
+                    for crypto_id, (name, cost) in state.cryptocurrencies.items()
+                ],
+            )
+        if state.accounts_by_id:
+            connection.exec_driver_sql(
+                'INSERT INTO user (id, login, balance) VALUES (?, ?, ?)',
+                [
+                    (account.id, account.login, account.balance / 100)
+                    for account in state.accounts_by_id.values()
+                ],
+            )
+        positions = [
+            (
+                account.id,
+                crypto_id,
+                count,
+                *(cost / 100 for cost in account.costs.get(crypto_id, (0, 0))),
+            )
+            for account in state.accounts_by_id.values()
+            for crypto_id, count in account.positions.items()
+        ]
+        if positions:
+            connection.exec_driver_sql(
+                'INSERT INTO "UserCryptocurrency" '
+                '(user_id, cryptocurrency_id, count, cost_basis, realised_pnl) '
+                'VALUES (?, ?, ?, ?, ?)',
+                positions,
+            )
+        connection.exec_driver_sql(
+            'INSERT INTO "LedgerCheckpoint" (id, seq) VALUES (1, ?)', (state.seq,)
+        )
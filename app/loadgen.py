@@ -0,0 +1,427 @@
+import argparse
+import http.cookiejar
+import itertools
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Any, Callable, NamedTuple, Optional, Protocol
+
+import numpy as np
+
+try:
+    from app.app import application, init_trade_operation
+    from app.database import DatabaseSettings, create_engine
+    from app.logging_config import setup_logging
+    from app.scheduler import PriceTickScheduler, SchedulerSettings
+    from app.trade import CONST_VALUE, Trade
+except ImportError:  # pragma: no cover
+    from database import DatabaseSettings, create_engine  # type: ignore
+    from logging_config import setup_logging  # type: ignore
+    from scheduler import PriceTickScheduler, SchedulerSettings  # type: ignore
+    from trade import CONST_VALUE, Trade  # type: ignore
+
+    from app import application, init_trade_operation  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ('login', 'index', 'buy', 'sell', 'portfolio', 'history')
+
+# Цены на странице /index: <label ... data-crypto-cost="crypto_1">123.23</label>
+PRICE_PATTERN = re.compile(r'data-crypto-cost="([^"]+)">([^<]+)<')
+STALE_PRICE_TEXT = 'Цена криптовалюты изменилась'
+
+
+class TraceOperation(NamedTuple):
+    op: str
+    user: str
+    crypto: Optional[str] = None
+    count: int = 1
+    # Цена, по которой покупает пользователь. Если не задана, берётся цена
+    # с последней загруженной им страницы /index
+    cost: Optional[str] = None
+    # Курсор страницы истории
+    before: Optional[int] = None
+
+
+def load_trace(path: str) -> list[TraceOperation]:
+    trace = []
+    with open(path, encoding='utf-8') as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if data.get('op') not in OPERATIONS or 'user' not in data:
+                raise ValueError(
+                    f'{path}:{line_number}: ожидается операция {OPERATIONS} с полем user'
+                )
+            trace.append(TraceOperation(**data))
+    return trace
+
+
+def generate_trace(
+    count_operations: int,
+    count_users: int,
+    cryptocurrency_names: list[str],
+    seed: Optional[int] = None,
+) -> list[dict[str, Any]]:
+    # Каждый пользователь сначала входит и смотрит цены, дальше операции
+    # выбираются случайно с перевесом в сторону чтения
+    rng = random.Random(seed)
+    users = [f'load_user_{i}' for i in range(count_users)]
+    trace: list[dict[str, Any]] = []
+    for user in users:
+        trace.append({'op': 'login', 'user': user})
+        trace.append({'op': 'index', 'user': user})
+    weights = {'index': 3, 'buy': 2, 'sell': 1, 'portfolio': 2, 'history': 2}
+    while len(trace) < count_operations:
+        op = rng.choices(list(weights), list(weights.values()))[0]
+        entry: dict[str, Any] = {'op': op, 'user': rng.choice(users)}
+        if op in ('buy', 'sell'):
+            entry['crypto'] = rng.choice(cryptocurrency_names)
+            entry['count'] = rng.randint(1, 3)
+        trace.append(entry)
+    return trace[:count_operations]
+
+
+class Response(NamedTuple):
+    status: int
+    text: str
+
+
+class Client(Protocol):
+    def request(
+        self, method: str, path: str, data: Optional[dict[str, str]] = None
+    ) -> Response: ...
+
+
+class InProcessClient:
+    # Запросы к application.app внутри процесса, без сети
+    def __init__(self) -> None:
+        self._client = application.app.test_client()
+
+    def request(
+        self, method: str, path: str, data: Optional[dict[str, str]] = None
+    ) -> Response:
+        res = self._client.open(path, method=method, data=data)
+        return Response(res.status_code, res.get_data(as_text=True))
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args: Any, **kwargs: Any) -> None:
+        return None
+
+
+class HttpClient:
+    # Запросы к запущенному серверу. У каждого виртуального пользователя свои
+    # cookies, редиректы не выполняются, как и у тестового клиента
+    def __init__(self, base_url: str, timeout: float = 30) -> None:
+        self._base_url = base_url.rstrip('/')
+        self._timeout = timeout
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect(),
+        )
+
+    def request(
+        self, method: str, path: str, data: Optional[dict[str, str]] = None
+    ) -> Response:
+        body = None if data is None else urllib.parse.urlencode(data).encode()
+        req = urllib.request.Request(self._base_url + path, data=body, method=method)
+        try:
+            with self._opener.open(req, timeout=self._timeout) as res:
+                return Response(res.status, res.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            return Response(e.code, e.read().decode('utf-8'))
+
+
+class VirtualUser:
+    def __init__(self, client: Client) -> None:
+        self.client = client
+        self.prices: dict[str, str] = {}
+
+    def load_index(self) -> Response:
+        res = self.client.request('GET', '/index')
+        self.prices.update(PRICE_PATTERN.findall(res.text))
+        return res
+
+    def run(self, operation: TraceOperation) -> tuple[str, str]:
+        # Возвращает маршрут и исход: ok, rejected (отказ в операции),
+        # stale_price (цена изменилась) или error (ошибка сервера)
+        if operation.op == 'login':
+            route = '/authorization_user'
+            res = self.client.request('POST', route, {'user_login_in': operation.user})
+        elif operation.op == 'index':
+            route = '/index'
+            res = self.load_index()
+        elif operation.op == 'buy':
+            route = '/user_buy_cryptocurrency'
+            cost = operation.cost or self.prices.get(str(operation.crypto), '')
+            query = urllib.parse.urlencode(
+                {'crypto_name': operation.crypto, 'crypto_cost': cost}
+            )
+            res = self.client.request(
+                'POST', f'{route}?{query}', {'count_buy_crypto': str(operation.count)}
+            )
+        elif operation.op == 'sell':
+            route = '/user_sell_cryptocurrency'
+            query = urllib.parse.urlencode({'crypto_name': operation.crypto})
+            res = self.client.request(
+                'POST', f'{route}?{query}', {'count_sell_crypto': str(operation.count)}
+            )
+        elif operation.op == 'portfolio':
+            route = '/user_portfolio'
+            res = self.client.request('GET', route)
+        else:
+            route = '/history_operations'
+            path = route
+            if operation.before is not None:
+                path = f'{route}?before={operation.before}'
+            res = self.client.request('GET', path)
+
+        if res.status >= 400:
+            return route, 'error'
+        if operation.op in ('buy', 'sell') and res.status != 302:
+            # Отказ приходит страницей с текстом ошибки
+            if STALE_PRICE_TEXT in res.text:
+                # Цена устарела: пользователь обновил бы страницу
+                self.load_index()
+                return route, 'stale_price'
+            return route, 'rejected'
+        return route, 'ok'
+
+
+@dataclass
+class RouteStats:
+    latencies: list[float] = field(default_factory=list)
+    outcomes: Counter[str] = field(default_factory=Counter)
+
+
+@dataclass
+class LoadReport:
+    duration: float = 0
+    routes: dict[str, RouteStats] = field(default_factory=dict)
+
+    def add(self, route: str, outcome: str, latency: float) -> None:
+        stats = self.routes.setdefault(route, RouteStats())
+        stats.latencies.append(latency)
+        stats.outcomes[outcome] += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        routes = {}
+        for route, stats in sorted(self.routes.items()):
+            count = len(stats.latencies)
+            p50, p95, p99 = np.percentile(stats.latencies, [50, 95, 99]).tolist()
+            routes[route] = {
+                'count': count,
+                'throughput': count / self.duration if self.duration else None,
+                'p50': p50,
+                'p95': p95,
+                'p99': p99,
+                'outcomes': dict(stats.outcomes),
+                'error_rate': 1 - stats.outcomes['ok'] / count,
+            }
+        count = sum(len(stats.latencies) for stats in self.routes.values())
+        return {
+            'duration': self.duration,
+            'count': count,
+            'throughput': count / self.duration if self.duration else None,
+            'routes': routes,
+        }
+
+    def format(self) -> str:
+        data = self.to_dict()
+        lines = [
+            f'{data["count"]} запросов за {data["duration"]:.2f} с'
+            f' ({data["throughput"] or 0:.1f} в секунду)',
+            f'{"маршрут":<28}{"запросов":>9}{"в сек":>9}{"p50 мс":>9}'
+            f'{"p95 мс":>9}{"p99 мс":>9}{"ошибки":>9}  исходы',
+        ]
+        for route, stats in data['routes'].items():
+            outcomes = ', '.join(
+                f'{k}={v}' for k, v in sorted(stats['outcomes'].items())
+            )
+            lines.append(
+                f'{route:<28}{stats["count"]:>9}{stats["throughput"] or 0:>9.1f}'
+                f'{stats["p50"] * 1000:>9.2f}{stats["p95"] * 1000:>9.2f}'
+                f'{stats["p99"] * 1000:>9.2f}{stats["error_rate"]:>9.1%}  {outcomes}'
+            )
+        return '\n'.join(lines)
+
+
+def replay(
+    trace: list[TraceOperation],
+    client_factory: Callable[[], Client],
+    concurrency: int = 1,
+    rate: Optional[float] = None,
+) -> LoadReport:
+    # Операции одного пользователя выполняет один поток в порядке трассы.
+    # При заданной частоте операции выдаются по расписанию, и задержка
+    # считается от запланированного момента: так в неё попадает и ожидание
+    # в очереди, если сервер не успевает
+    report = LoadReport()
+    report_lock = threading.Lock()
+    queues: list['queue.SimpleQueue[Optional[tuple[TraceOperation, float]]]'] = [
+        queue.SimpleQueue() for _ in range(concurrency)
+    ]
+    workers_by_user: dict[str, int] = {}
+    next_worker = itertools.cycle(range(concurrency))
+
+    def work(
+        operations: 'queue.SimpleQueue[Optional[tuple[TraceOperation, float]]]',
+    ) -> None:
+        users: dict[str, VirtualUser] = {}
+        while True:
+            item = operations.get()
+            if item is None:
+                return
+            operation, scheduled = item
+            user = users.get(operation.user)
+            if user is None:
+                user = users[operation.user] = VirtualUser(client_factory())
+            started = scheduled or time.perf_counter()
+            try:
+                route, outcome = user.run(operation)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Не удалось выполнить операцию %s', operation)
+                route, outcome = operation.op, 'error'
+            with report_lock:
+                report.add(route, outcome, time.perf_counter() - started)
+
+    threads = [
+        threading.Thread(target=work, args=(operations,), daemon=True)
+        for operations in queues
+    ]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    for i, operation in enumerate(trace):
+        scheduled = start
+        if rate:
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        worker = workers_by_user.get(operation.user)
+        if worker is None:
+            worker = workers_by_user[operation.user] = next(next_worker)
+        queues[worker].put((operation, scheduled if rate else 0))
+
+    for operations in queues:
+        operations.put(None)
+    for thread in threads:
+        thread.join()
+    report.duration = time.perf_counter() - start
+    return report
+
+
+def _init_in_process_trade(path: str) -> None:
+    # Торговля внутри процесса как в init_trade, но без вечного потока тика
+    settings = replace(DatabaseSettings.from_env(), path=path)
+    is_new_base = not Path(settings.path).exists()
+    application.trade = Trade(create_engine(settings))
+    if is_new_base:
+        init_trade_operation()
+    else:
+        application.trade.base_migrate()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Нагрузка на биржу по трассе операций в формате JSONL'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help='Сгенерировать трассу')
+    generate_parser.add_argument('output')
+    generate_parser.add_argument('--operations', type=int, default=1000)
+    generate_parser.add_argument('--users', type=int, default=10)
+    generate_parser.add_argument(
+        '--crypto', nargs='+', default=[f'crypto_{i}' for i in range(1, 6)]
+    )
+    generate_parser.add_argument('--seed', type=int)
+
+    replay_parser = subparsers.add_parser('replay', help='Воспроизвести трассу')
+    replay_parser.add_argument('trace')
+    replay_parser.add_argument(
+        '--url', help='Адрес запущенного сервера; без него запросы идут внутри процесса'
+    )
+    replay_parser.add_argument('--concurrency', type=int, default=1)
+    replay_parser.add_argument(
+        '--rate', type=float, help='Операций в секунду; без него без пауз'
+    )
+    replay_parser.add_argument(
+        '--tick-interval',
+        type=float,
+        default=CONST_VALUE.TIME_UPDATE.value,
+        help='Период тика цен внутри процесса в секундах, 0 - без тика',
+    )
+    replay_parser.add_argument(
+        '--db',
+        help='База для запросов внутри процесса; без него - временная база, '
+        'чтобы синтетические пользователи и сделки не попали в рабочую',
+    )
+    replay_parser.add_argument('--json', help='Сохранить отчёт в JSON')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        with open(args.output, 'w', encoding='utf-8') as file:
+            for entry in generate_trace(
+                args.operations, args.users, args.crypto, args.seed
+            ):
+                file.write(json.dumps(entry) + '\n')
+        return 0
+
+    trace = load_trace(args.trace)
+    scheduler: Optional[PriceTickScheduler] = None
+    temp_dir: Optional[tempfile.TemporaryDirectory[str]] = None
+    client_factory: Callable[[], Client]
+    if args.url is not None:
+        client_factory = lambda: HttpClient(args.url)  # noqa: E731
+    else:
+        setup_logging()
+        db_path = args.db
+        if db_path is None:
+            temp_dir = tempfile.TemporaryDirectory(prefix='loadgen-')
+            db_path = str(Path(temp_dir.name) / 'loadgen.db')
+        logger.info('Нагрузка внутри процесса идёт в базу %s', db_path)
+        _init_in_process_trade(db_path)
+        client_factory = InProcessClient
+        if args.tick_interval > 0:
+            scheduler = PriceTickScheduler(
+                application.trade,
+                replace(SchedulerSettings.from_env(), interval=args.tick_interval),
+            )
+            scheduler.start()
+
+    try:
+        report = replay(trace, client_factory, args.concurrency, args.rate)
+    finally:
+        if scheduler is not None:
+            scheduler.stop()
+        if temp_dir is not None:
+            application.trade.engine.dispose()
+            temp_dir.cleanup()
+
+    print(report.format())
+    if args.json is not None:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report.to_dict(), file, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import atexit
+import copy
+import logging
+import logging.handlers
+import os
+import queue
+from dataclasses import dataclass
+from typing import Optional
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+@dataclass
+class LoggingSettings:
+    level: str = 'INFO'
+    # {pid} в имени заменяется на номер процесса: каждый процесс сервера
+    # пишет и ротирует свой файл
+    filename: str = 'app.log'
+    # Ротация по размеру файла
+    max_bytes: int = 10 * 1024 * 1024
+    backup_count: int = 5
+    # Ротация по времени ('midnight', 'H', ...), если задана, вместо ротации по размеру
+    when: Optional[str] = None
+
+    @classmethod
+    def from_env(cls) -> 'LoggingSettings':
+        default = cls()
+        return cls(
+            level=os.environ.get('APP_LOG_LEVEL', default.level).upper(),
+            filename=os.environ.get('APP_LOG_FILE', default.filename),
+            max_bytes=int(os.environ.get('APP_LOG_MAX_BYTES', default.max_bytes)),
+            backup_count=int(
+                os.environ.get('APP_LOG_BACKUP_COUNT', default.backup_count)
+            ),
+            when=os.environ.get('APP_LOG_ROTATE_WHEN', default.when),
+        )
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # Стандартный QueueHandler форматирует всю строку лога ещё в потоке запроса.
+    # Здесь в потоке запроса только подставляются аргументы сообщения: к
+    # моменту записи изменяемые аргументы могли поменяться, а ORM-объекты
+    # подгружали бы атрибуты из чужого потока. Время, уровень и имя логгера
+    # в строку добавляет уже фоновый поток
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+
+
+def _create_file_handler(settings: LoggingSettings) -> logging.Handler:
+    handler: logging.Handler
+    filename = settings.filename.format(pid=os.getpid())
+    if settings.when is not None:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            filename,
+            when=settings.when,
+            backupCount=settings.backup_count,
+            encoding='utf-8',
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            filename,
+            maxBytes=settings.max_bytes,
+            backupCount=settings.backup_count,
+            encoding='utf-8',
+        )
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    return handler
+
+
+def setup_logging(
+    settings: Optional[LoggingSettings] = None,
+) -> logging.handlers.QueueListener:
+    # Потоки запросов только кладут записи в очередь, а форматирование и запись
+    # в файл выполняет фоновый поток QueueListener
+    global _listener, _queue_handler  # pylint: disable=global-statement
+
+    if settings is None:
+        settings = LoggingSettings.from_env()
+    stop_logging()
+
+    log_queue: 'queue.SimpleQueue[logging.LogRecord]' = queue.SimpleQueue()
+    _queue_handler = DeferredQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(
+        log_queue, _create_file_handler(settings), respect_handler_level=True
+    )
+
+    root = logging.getLogger()
+    root.setLevel(settings.level)
+    root.addHandler(_queue_handler)
+    _listener.start()
+    return _listener
+
+
+def stop_logging() -> None:
+    # Дожидается записи всех сообщений из очереди и закрывает файл
+    global _listener, _queue_handler  # pylint: disable=global-statement
+
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,193 @@
+import os
+from dataclasses import dataclass
+from typing import Hashable, Optional, Sequence, Union
+
+import numpy as np
+
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
+
+Parameter = Union[float, np.ndarray]
+
+
+@dataclass
+class MarketSettings:
+    # Доходность и волатильность годовые, корреляция - одна на все пары валют
+    drift: float = 0.0
+    volatility: float = 0.8
+    correlation: float = 0.5
+
+    @classmethod
+    def from_env(cls) -> 'MarketSettings':
+        default = cls()
+        return cls(
+            drift=float(os.environ.get('APP_MARKET_DRIFT', default.drift)),
+            volatility=float(
+                os.environ.get('APP_MARKET_VOLATILITY', default.volatility)
+            ),
+            correlation=float(
+                os.environ.get('APP_MARKET_CORRELATION', default.correlation)
+            ),
+        )
+
+
+# Геометрическое броуновское движение для всех валют сразу: за время dt
+# логарифм цены меняется на (mu - sigma^2 / 2) dt + sigma sqrt(dt) Z, где
+# Z - коррелированные нормальные величины. Все шаги всех валют считаются
+# одним массивом.
+#
+# drift и volatility - число для всех валют или массив по валютам.
+# correlation - число (все пары коррелированы одинаково, тогда валют может
+# быть сколько угодно) или матрица корреляций по валютам.
+class MarketModel:
+    def __init__(
+        self,
+        drift: Parameter = 0.0,
+        volatility: Parameter = 0.8,
+        correlation: Parameter = 0.5,
+        tick_seconds: float = 1.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.drift = np.asarray(drift, dtype=np.float64)
+        self.volatility = np.asarray(volatility, dtype=np.float64)
+        self.correlation = np.asarray(correlation, dtype=np.float64)
+        self.tick_seconds = tick_seconds
+        self.rng = np.random.default_rng(seed)
+        # Точные цены валют до округления до копейки, по ключам из next_cents
+        self._prices: dict[Hashable, float] = {}
+
+        if np.any(self.volatility < 0):
+            raise ValueError('Волатильность не может быть отрицательной')
+        if self.correlation.ndim == 0:
+            if not 0 <= self.correlation <= 1:
+                raise ValueError('Общая корреляция должна быть от 0 до 1')
+            self._cholesky = None
+        else:
+            if (
+                self.correlation.ndim != 2
+                or self.correlation.shape[0] != self.correlation.shape[1]
+                or not np.allclose(self.correlation, self.correlation.T)
+                or not np.allclose(np.diag(self.correlation), 1)
+            ):
+                raise ValueError(
+                    'Матрица корреляций должна быть симметричной с 1 на диагонали'
+                )
+            self._cholesky = self._factor(self.correlation)
+
+    @classmethod
+    def from_settings(
+        cls, settings: MarketSettings, tick_seconds: float, seed: Optional[int] = None
+    ) -> 'MarketModel':
+        return cls(
+            settings.drift,
+            settings.volatility,
+            settings.correlation,
+            tick_seconds,
+            seed,
+        )
+
+    @staticmethod
+    def _factor(correlation: np.ndarray) -> np.ndarray:
+        try:
+            return np.linalg.cholesky(correlation)
+        except np.linalg.LinAlgError as error:
+            raise ValueError('Матрица корреляций не положительно определена') from error
+
+    def _select(
+        self, parameter: np.ndarray, count: int, index: Optional[np.ndarray]
+    ) -> np.ndarray:
+        if parameter.ndim == 0:
+            return parameter
+        if index is not None:
+            parameter = parameter[index]
+        if len(parameter) != count:
+            raise ValueError(
+                f'Параметры модели заданы для {len(parameter)} валют, а не {count}'
+            )
+        return parameter
+
+    def _normals(
+        self,
+        steps: int,
+        count: int,
+        index: Optional[np.ndarray],
+        rng: np.random.Generator,
+    ) -> np.ndarray:
+        normals = rng.standard_normal((steps, count))
+        if self._cholesky is None:
+            # Однофакторная модель: общий для рынка фактор и свой у валюты
+            rho = float(self.correlation)
+            if rho == 0:
+                return normals
+            market = rng.standard_normal((steps, 1))
+            return np.sqrt(rho) * market + np.sqrt(1 - rho) * normals
+        if index is None:
+            cholesky = self._cholesky
+        else:
+            cholesky = self._factor(self.correlation[np.ix_(index, index)])
+        if len(cholesky) != count:
+            raise ValueError(
+                f'Матрица корреляций задана для {len(cholesky)} валют, а не {count}'
+            )
+        return normals @ cholesky.T
+
+    def log_returns(
+        self,
+        count: int,
+        steps: int,
+        dt: Optional[float] = None,
+        index: Optional[np.ndarray] = None,
+        rng: Optional[np.random.Generator] = None,
+    ) -> np.ndarray:
+        # Логарифмы изменений цен: строка - шаг, столбец - валюта. index -
+        # номера валют, если считаем не все валюты, для которых задана модель
+        years = (self.tick_seconds if dt is None else dt) / SECONDS_PER_YEAR
+        drift = self._select(self.drift, count, index)
+        volatility = self._select(self.volatility, count, index)
+        normals = self._normals(steps, count, index, rng or self.rng)
+        return (drift - volatility**2 / 2) * years + volatility * np.sqrt(
+            years
+        ) * normals
+
+    def paths(
+        self, start_prices: np.ndarray, steps: int, dt: Optional[float] = None
+    ) -> np.ndarray:
+        # Цены после каждого из steps шагов от start_prices
+        start_prices = np.asarray(start_prices, dtype=np.float64)
+        returns = self.log_returns(len(start_prices), steps, dt)
+        return start_prices * np.exp(np.cumsum(returns, axis=0))
+
+    def backward_paths(
+        self, end_prices: np.ndarray, steps: int, dt: Optional[float] = None
+    ) -> np.ndarray:
+        # Цены за steps шагов до end_prices: путь, который приходит в end_prices
+        end_prices = np.asarray(end_prices, dtype=np.float64)
+        returns = self.log_returns(len(end_prices), steps, dt)
+        return end_prices * np.exp(-np.cumsum(returns[::-1], axis=0)[::-1])
+
+    def next_cents(
+        self,
+        cents: np.ndarray,
+        index: Optional[np.ndarray] = None,
+        rng: Optional[np.random.Generator] = None,
+        keys: Optional[Sequence[Hashable]] = None,
+    ) -> np.ndarray:
+        # Один тик для цен в копейках; цена не опускается ниже копейки.
+        # По keys модель помнит точные цены и ведёт путь от них: если
+        # округлять каждый тик, движения меньше полкопейки пропадают и
+        # дешёвые валюты почти не меняются
+        cents = np.asarray(cents, dtype=np.int64)
+        prices = cents.astype(np.float64)
+        if keys is not None:
+            exact = np.array([self._prices.get(key, np.nan) for key in keys])
+            # Цену, изменённую в обход модели, берём как есть
+            known = ~np.isnan(exact) & (round_cents(np.nan_to_num(exact)) == cents)
+            prices = np.where(known, exact, prices)
+        returns = self.log_returns(len(cents), 1, index=index, rng=rng)[0]
+        prices = prices * np.exp(returns)
+        if keys is not None:
+            self._prices.update(zip(keys, prices.tolist()))
+        return round_cents(prices)
+
+
+def round_cents(prices: np.ndarray) -> np.ndarray:
+    return np.maximum(np.rint(prices), 1).astype(np.int64)
@@ -0,0 +1,246 @@
+import bisect
+import contextvars
+import threading
+from typing import Any, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Engine
+
+# Метрики процесса в текстовом формате Prometheus. Запись в метрику - это
+# поиск по словарю и сложение под блокировкой самой метрики, без аллокаций
+# на горячем пути, кроме первой записи для нового набора меток
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format_labels(labelnames: tuple[str, ...], labels: tuple[str, ...]) -> str:
+    if not labelnames:
+        return ''
+    pairs = ','.join(
+        f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)
+    )
+    return f'{{{pairs}}}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} counter',
+        ]
+        for labels, value in values:
+            lines.append(
+                f'{self.name}{_format_labels(self.labelnames, labels)}'
+                f' {_format_value(value)}'
+            )
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # Для каждого набора меток: счётчики по корзинам (последняя - +Inf),
+        # сумма и количество наблюдений
+        self._values: dict[tuple[str, ...], list[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def get_count(self, *labels: str) -> int:
+        state = self._values.get(labels)
+        return 0 if state is None else state[2]
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            values = sorted(
+                (labels, (list(counts), total, count))
+                for labels, (counts, total, count) in self._values.items()
+            )
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        labelnames = self.labelnames + ('le',)
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(
+                    labelnames, labels + (_format_value(bound),)
+                )
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            own_labels = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{own_labels} {_format_value(float(total))}')
+            lines.append(f'{self.name}_count{own_labels} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: list[Any] = []
+
+    def register(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(
+    Histogram(
+        'http_request_duration_seconds',
+        'Время обработки запроса',
+        ('endpoint', 'method'),
+    )
+)
+REQUESTS = REGISTRY.register(
+    Counter(
+        'http_requests_total',
+        'Обработанные запросы',
+        ('endpoint', 'method', 'status'),
+    )
+)
+REQUEST_DB_QUERIES = REGISTRY.register(
+    Histogram(
+        'http_request_db_queries',
+        'Число запросов к базе на один HTTP-запрос',
+        ('endpoint',),
+        buckets=(1, 2, 3, 5, 10, 20, 50, 100),
+    )
+)
+DB_QUERIES = REGISTRY.register(Counter('db_queries_total', 'Запросы к базе данных'))
+TRADE_OPERATIONS = REGISTRY.register(
+    Counter(
+        'trade_operations_total',
+        'Сделки по исходу: ok или причина отказа',
+        ('operation', 'result'),
+    )
+)
+PRICE_TICK_DURATION = REGISTRY.register(
+    Histogram(
+        'price_tick_duration_seconds',
+        'Время обновления курсов валют',
+        ('mode',),
+    )
+)
+PRICE_TICK_LAG = REGISTRY.register(
+    Histogram(
+        'price_tick_lag_seconds',
+        'Опоздание начала тика цен относительно расписания',
+        ('interval',),
+    )
+)
+PRICE_TICKS = REGISTRY.register(
+    Counter(
+        'price_ticks_total',
+        'Тики цен: tick у лидера, reload - перечитывание цен у остальных процессов',
+        ('interval', 'role'),
+    )
+)
+PRICE_TICKS_SKIPPED = REGISTRY.register(
+    Counter(
+        'price_ticks_skipped_total',
+        'Тики цен, слитые с предыдущим из-за опоздания',
+        ('interval',),
+    )
+)
+RENDER_CACHE = REGISTRY.register(
+    Counter(
+        'render_cache_total',
+        'Фрагменты страниц из кэша: hit или miss',
+        ('fragment', 'result'),
+    )
+)
+
+# Счётчик запросов к базе текущего HTTP-запроса. В потоках вне запроса
+# (тик цен) он не задан, и считается только общий счётчик
+_request_queries: contextvars.ContextVar[Optional[list[int]]] = contextvars.ContextVar(
+    'request_queries', default=None
+)
+
+
+def _count_query(*args: Any) -> None:
+    DB_QUERIES.inc()
+    queries = _request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+
+
+def instrument_engine(engine: Engine) -> None:
+    if not sa.event.contains(engine, 'before_cursor_execute', _count_query):
+        sa.event.listen(engine, 'before_cursor_execute', _count_query)
+
+
+def start_request_queries() -> None:
+    _request_queries.set([0])
+
+
+def finish_request_queries() -> int:
+    queries = _request_queries.get()
+    _request_queries.set(None)
+    return 0 if queries is None else queries[0]
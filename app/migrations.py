@@ -0,0 +1,237 @@
+import logging
+from typing import Callable, NamedTuple
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection, Engine
+
+try:
+    from app.models import (
+        HistoryOperation,
+        LedgerCheckpoint,
+        LimitOrder,
+        PriceCandle,
+        PriceTick,
+        SchemaVersion,
+        User,
+        UserCryptocurrency,
+    )
+    from app.positions import buy_position, sell_position
+except ImportError:  # pragma: no cover
+    from models import (  # type: ignore
+        HistoryOperation,
+        LedgerCheckpoint,
+        LimitOrder,
+        PriceCandle,
+        PriceTick,
+        SchemaVersion,
+        User,
+        UserCryptocurrency,
+    )
+    from positions import buy_position, sell_position  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _create_limit_order_table(connection: Connection) -> None:
+    LimitOrder.__table__.create(connection, checkfirst=True)
+
+
+def _create_history_operation_user_index(connection: Connection) -> None:
+    for index in HistoryOperation.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _create_price_history_tables(connection: Connection) -> None:
+    PriceTick.__table__.create(connection, checkfirst=True)
+    PriceCandle.__table__.create(connection, checkfirst=True)
+
+
+def _add_history_operation_created_at(connection: Connection) -> None:
+    columns = sa.inspect(connection).get_columns(HistoryOperation.__tablename__)
+    if 'created_at' not in {column['name'] for column in columns}:
+        connection.exec_driver_sql(
+            'ALTER TABLE "HistoryOperation" ADD COLUMN created_at INTEGER'
+        )
+
+
+def _create_ledger_checkpoint_table(connection: Connection) -> None:
+    LedgerCheckpoint.__table__.create(connection, checkfirst=True)
+
+
+def _add_position_costs(connection: Connection) -> None:
+    for table, names in (
+        (UserCryptocurrency.__tablename__, ('cost_basis', 'realised_pnl')),
+        (LimitOrder.__tablename__, ('cost_basis',)),
+    ):
+        columns = {
+            column['name'] for column in sa.inspect(connection).get_columns(table)
+        }
+        for name in names:
+            if name not in columns:
+                connection.exec_driver_sql(
+                    f'ALTER TABLE "{table}" '
+                    f'ADD COLUMN {name} NUMERIC(12, 2) NOT NULL DEFAULT 0'
+                )
+    backfill_position_costs(connection)
+
+
+def _add_user_version(connection: Connection) -> None:
+    columns = sa.inspect(connection).get_columns(User.__tablename__)
+    if 'version' not in {column['name'] for column in columns}:
+        connection.exec_driver_sql(
+            'ALTER TABLE user ADD COLUMN version INTEGER NOT NULL DEFAULT 0'
+        )
+
+
+def backfill_position_costs(connection: Connection) -> None:
+    # Стоимость и прибыль позиций по всей истории операций. История читается
+    # одним проходом, в памяти только суммы по позициям
+    positions: dict[tuple[int, int], list[int]] = {}
+    rows = connection.exec_driver_sql(
+        'SELECT h.user_id, h.cryptocurrency_id, o.name, h.count, '
+        'CAST(round(h.price * 100) AS INTEGER) '
+        'FROM "HistoryOperation" AS h JOIN operation AS o ON o.id = h.operation_id '
+        'ORDER BY h.id'
+    )
+    for user_id, crypto_id, operation, count, price in rows:
+        position = positions.setdefault((user_id, crypto_id), [0, 0, 0])
+        if operation == 'Buy':
+            position[1] = buy_position(position[1], price, count)
+            position[0] += count
+        elif position[0] > 0:
+            sold = min(count, position[0])
+            position[1], realised = sell_position(position[1], position[0], price, sold)
+            position[2] += realised
+            position[0] -= sold
+
+    # Монеты открытых заявок на продажу уже списаны с позиции, но по истории
+    # ещё принадлежат ей: стоимость делится между позицией и заявками
+    orders: dict[tuple[int, int], list[tuple[int, int]]] = {}
+    for order_id, user_id, crypto_id, count in connection.exec_driver_sql(
+        'SELECT l.id, l.user_id, l.cryptocurrency_id, l.count '
+        'FROM "LimitOrder" AS l JOIN operation AS o ON o.id = l.operation_id '
+        "WHERE o.name = 'Sell' ORDER BY l.id"
+    ):
+        orders.setdefault((user_id, crypto_id), []).append((order_id, count))
+
+    position_updates = []
+    order_updates = []
+    mismatched = 0
+    for user_id, crypto_id, count in connection.exec_driver_sql(
+        'SELECT user_id, cryptocurrency_id, count FROM "UserCryptocurrency"'
+    ):
+        replayed_count, cost_basis, realised_pnl = positions.get(
+            (user_id, crypto_id), (0, 0, 0)
+        )
+        reserved = orders.get((user_id, crypto_id), [])
+        total_count = count + sum(order_count for _, order_count in reserved)
+        if replayed_count != total_count:
+            # Позиция менялась не только сделками из истории: берём среднюю
+            # цену из истории, а без неё стоимость неизвестна
+            mismatched += 1
+            logger.debug(
+                'Позиция %d/%d: по истории %d монет, в портфеле и заявках %d',
+                user_id,
+                crypto_id,
+                replayed_count,
+                total_count,
+            )
+            cost_basis = (
+                cost_basis * total_count // replayed_count if replayed_count else 0
+            )
+        for order_id, order_count in reserved:
+            # Продажа по нулевой цене: убыток равен стоимости снятых монет
+            cost_basis, reserved_cost = sell_position(
+                cost_basis, total_count, 0, order_count
+            )
+            total_count -= order_count
+            order_updates.append((-reserved_cost / 100, order_id))
+        position_updates.append(
+            (cost_basis / 100, realised_pnl / 100, user_id, crypto_id)
+        )
+    if position_updates:
+        connection.exec_driver_sql(
+            'UPDATE "UserCryptocurrency" SET cost_basis = ?, realised_pnl = ? '
+            'WHERE user_id = ? AND cryptocurrency_id = ?',
+            position_updates,
+        )
+    if order_updates:
+        connection.exec_driver_sql(
+            'UPDATE "LimitOrder" SET cost_basis = ? WHERE id = ?', order_updates
+        )
+    if mismatched:
+        logger.warning(
+            'У %d позиций количество не сходится с историей, '
+            'стоимость посчитана по средней цене из истории',
+            mismatched,
+        )
+    logger.info('Пересчитали стоимость %d позиций по истории', len(position_updates))
+
+
+# Миграции применяются по возрастанию версии. Каждая должна быть идемпотентной:
+# DDL в SQLite выполняется вне транзакции, и после сбоя миграция повторится
+MIGRATIONS = [
+    Migration(1, 'Таблица лимитных заявок', _create_limit_order_table),
+    Migration(
+        2,
+        'Индекс истории операций по пользователю',
+        _create_history_operation_user_index,
+    ),
+    Migration(3, 'История цен и свечи', _create_price_history_tables),
+    Migration(4, 'Время операций в истории', _add_history_operation_created_at),
+    Migration(5, 'Контрольная точка леджера', _create_ledger_checkpoint_table),
+    Migration(6, 'Стоимость и прибыль позиций', _add_position_costs),
+    Migration(7, 'Версия пользователя', _add_user_version),
+]
+
+
+def get_schema_version(engine: Engine) -> int:
+    with engine.connect() as connection:
+        if not sa.inspect(connection).has_table(SchemaVersion.__tablename__):
+            return 0
+        version = connection.execute(
+            sa.select(sa.func.max(SchemaVersion.version))
+        ).scalar()
+        return version or 0
+
+
+def upgrade(engine: Engine) -> list[int]:
+    SchemaVersion.__table__.create(engine, checkfirst=True)
+    current_version = get_schema_version(engine)
+    logger.info('Текущая версия схемы базы данных: %d', current_version)
+
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= current_version:
+            continue
+        logger.info(
+            'Применим миграцию %d: %s', migration.version, migration.description
+        )
+        with engine.begin() as connection:
+            migration.upgrade(connection)
+            connection.execute(
+                sa.insert(SchemaVersion).values(
+                    version=migration.version, description=migration.description
+                )
+            )
+        applied.append(migration.version)
+    return applied
+
+
+def stamp(engine: Engine) -> None:
+    # Схема, созданная через create_all, уже соответствует последней версии
+    with engine.begin() as connection:
+        connection.execute(sa.delete(SchemaVersion))
+        connection.execute(
+            sa.insert(SchemaVersion),
+            [
+                {'version': migration.version, 'description': migration.description}
+                for migration in MIGRATIONS
+            ],
+        )
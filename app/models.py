@@ -1,3 +1,4 @@
+import time
 from typing import Any
 
 import sqlalchemy as sa
@@ -14,6 +15,14 @@ class UserCryptocurrency(Base):
     cryptocurrency_id = sa.Column(sa.ForeignKey('cryptocurrency.id'), primary_key=True)
 
     count = sa.Column(sa.Integer, nullable=False)
+    # Стоимость оставшихся монет по средней цене покупки и прибыль от
+    # продаж, см. app/positions.py
+    cost_basis = sa.Column(
+        sa.Numeric(12, 2), nullable=False, default=0, server_default='0'
+    )
+    realised_pnl = sa.Column(
+        sa.Numeric(12, 2), nullable=False, default=0, server_default='0'
+    )
 
     users = relationship('User', back_populates='portfolio')
     cryptocurrencies = relationship('Cryptocurrency', back_populates='users')
@@ -41,6 +50,9 @@ class User(Base):
     id = sa.Column(sa.Integer, primary_key=True)
     login = sa.Column(sa.String(20), nullable=False, unique=True)
     balance = sa.Column(sa.Numeric(10, 2), nullable=False)
+    # Растёт с каждым изменением баланса, позиций или истории пользователя,
+    # по нему кэш страниц узнаёт устаревшие фрагменты
+    version = sa.Column(sa.Integer, nullable=False, default=0, server_default='0')
 
     portfolio = relationship('UserCryptocurrency', back_populates='users')
     history_operations = relationship('HistoryOperation', back_populates='user')
@@ -63,6 +75,10 @@ class Operation(Base):
 
 class HistoryOperation(Base):
     __tablename__ = 'HistoryOperation'
+    __table_args__ = (
+        # История пользователя читается страницами по убыванию id
+        sa.Index('ix_HistoryOperation_user_id_id', 'user_id', 'id'),
+    )
 
     id = sa.Column(sa.Integer, primary_key=True)
     user_id = sa.Column(sa.ForeignKey('user.id'), nullable=False)
@@ -70,6 +86,9 @@ class HistoryOperation(Base):
     cryptocurrency_id = sa.Column(sa.ForeignKey('cryptocurrency.id'), nullable=False)
     count = sa.Column(sa.Integer, nullable=False)
     price = sa.Column(sa.Numeric(10, 2), nullable=False)
+    # Время операции в секундах unix. У операций, записанных до появления
+    # колонки, оно неизвестно
+    created_at = sa.Column(sa.Integer, default=lambda: int(time.time()))
 
     user = relationship('User', back_populates='history_operations')
     operation = relationship('Operation', back_populates='all_history_operation')
@@ -77,3 +96,81 @@ class HistoryOperation(Base):
 
     def __repr__(self) -> str:
         return f'HistoryOperation({self.user.login}, {self.operation.name}, {self.count}, {self.cryptocurrency.name}, {self.price})'  # pylint: disable=line-too-long
+
+
+class LimitOrder(Base):
+    __tablename__ = 'LimitOrder'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    user_id = sa.Column(sa.ForeignKey('user.id'), nullable=False)
+    operation_id = sa.Column(sa.ForeignKey('operation.id'), nullable=False)
+    cryptocurrency_id = sa.Column(sa.ForeignKey('cryptocurrency.id'), nullable=False)
+    price = sa.Column(sa.Numeric(10, 2), nullable=False)
+    # Оставшееся (ещё не исполненное) количество
+    count = sa.Column(sa.Integer, nullable=False)
+    # У заявки на продажу - стоимость зарезервированных монет, списанная
+    # с позиции продавца
+    cost_basis = sa.Column(
+        sa.Numeric(12, 2), nullable=False, default=0, server_default='0'
+    )
+
+    user = relationship('User')
+    operation = relationship('Operation')
+    cryptocurrency = relationship('Cryptocurrency')
+
+    def __repr__(self) -> str:
+        return f'LimitOrder({self.id}, {self.user_id}, {self.operation_id}, {self.cryptocurrency_id}, {self.price}, {self.count})'  # pylint: disable=line-too-long
+
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    description = sa.Column(sa.String(100), nullable=False)
+
+    def __repr__(self) -> str:
+        return f'SchemaVersion({self.version}, {self.description})'
+
+
+class PriceTick(Base):
+    __tablename__ = 'PriceTick'
+    __table_args__ = (
+        sa.Index('ix_PriceTick_cryptocurrency_id_time', 'cryptocurrency_id', 'time'),
+    )
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    cryptocurrency_id = sa.Column(sa.ForeignKey('cryptocurrency.id'), nullable=False)
+    # Время тика в секундах unix
+    time = sa.Column(sa.Integer, nullable=False)
+    cost = sa.Column(sa.Numeric(10, 2), nullable=False)
+
+    def __repr__(self) -> str:
+        return f'PriceTick({self.cryptocurrency_id}, {self.time}, {self.cost})'
+
+
+class PriceCandle(Base):
+    __tablename__ = 'PriceCandle'
+
+    cryptocurrency_id = sa.Column(sa.ForeignKey('cryptocurrency.id'), primary_key=True)
+    # Длительность свечи в секундах
+    interval = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    start = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    open = sa.Column(sa.Numeric(10, 2), nullable=False)
+    high = sa.Column(sa.Numeric(10, 2), nullable=False)
+    low = sa.Column(sa.Numeric(10, 2), nullable=False)
+    close = sa.Column(sa.Numeric(10, 2), nullable=False)
+
+    def __repr__(self) -> str:
+        return f'PriceCandle({self.cryptocurrency_id}, {self.interval}, {self.start}, {self.open}, {self.high}, {self.low}, {self.close})'  # pylint: disable=line-too-long
+
+
+class LedgerCheckpoint(Base):
+    __tablename__ = 'LedgerCheckpoint'
+
+    # Единственная строка с id = 1
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    # Номер последней записи журнала леджера, перенесённой в базу
+    seq = sa.Column(sa.Integer, nullable=False)
+
+    def __repr__(self) -> str:
+        return f'LedgerCheckpoint({self.seq})'
@@ -0,0 +1,164 @@
+import heapq
+from collections import deque
+from dataclasses import dataclass
+from typing import NamedTuple, Optional
+
+
+@dataclass
+class Order:
+    id: int
+    user_id: int
+    is_buy: bool
+    # Цена в копейках, чтобы сравнение уровней было точным
+    price: int
+    count: int
+
+
+class Fill(NamedTuple):
+    buy_order: Order
+    sell_order: Order
+    price: int
+    count: int
+
+
+class PriceLevel(NamedTuple):
+    price: int
+    count: int
+
+
+# Книга заявок одной криптовалюты с приоритетом цена-время. Уровни цен лежат
+# в куче (для покупок с обратным знаком), внутри уровня заявки стоят в очереди
+# FIFO. Снятые заявки удаляются лениво при сведении.
+class OrderBook:
+    def __init__(self) -> None:
+        self._bids: list[int] = []
+        self._asks: list[int] = []
+        self._bid_levels: dict[int, deque[Order]] = {}
+        self._ask_levels: dict[int, deque[Order]] = {}
+        self._orders: dict[int, Order] = {}
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def get_order(self, order_id: int) -> Optional[Order]:
+        return self._orders.get(order_id)
+
+    def best_bid(self) -> Optional[int]:
+        return self._best_price(self._bids, self._bid_levels, -1)
+
+    def best_ask(self) -> Optional[int]:
+        return self._best_price(self._asks, self._ask_levels, 1)
+
+    def submit(self, order: Order) -> list[Fill]:
+        if order.is_buy:
+            fills = self._match(order, self._asks, self._ask_levels, 1)
+        else:
+            fills = self._match(order, self._bids, self._bid_levels, -1)
+
+        if order.count > 0:
+            self.add(order)
+        return fills
+
+    def add(self, order: Order) -> None:
+        # Кладём заявку в книгу без сведения (например, при загрузке из базы)
+        if order.is_buy:
+            heap, levels, sign = self._bids, self._bid_levels, -1
+        else:
+            heap, levels, sign = self._asks, self._ask_levels, 1
+
+        level = levels.get(order.price)
+        if level is None:
+            level = levels[order.price] = deque()
+            heapq.heappush(heap, sign * order.price)
+        level.append(order)
+        self._orders[order.id] = order
+
+    def cancel(self, order_id: int) -> Optional[Order]:
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            # Сама заявка останется в очереди уровня, пока её не встретит сведение
+            order.count = 0
+        return order
+
+    def depth(self, is_buy: bool, limit: int) -> list[PriceLevel]:
+        if is_buy:
+            levels, prices = self._bid_levels, sorted(self._bid_levels, reverse=True)
+        else:
+            levels, prices = self._ask_levels, sorted(self._ask_levels)
+
+        res = []
+        for price in prices:
+            count = sum(order.count for order in levels[price])
+            if count > 0:
+                res.append(PriceLevel(price, count))
+            if len(res) == limit:
+                break
+        return res
+
+    def _match(
+        self,
+        order: Order,
+        heap: list[int],
+        levels: dict[int, deque[Order]],
+        sign: int,
+    ) -> list[Fill]:
+        fills = []
+        while order.count > 0:
+            best_price = self._best_price(heap, levels, sign)
+            if best_price is None:
+                break
+            if (order.is_buy and best_price > order.price) or (
+                not order.is_buy and best_price < order.price
+            ):
+                break
+
+            level = levels[best_price]
+            while order.count > 0 and level:
+                resting = level[0]
+                if resting.count == 0:
+                    level.popleft()
+                    continue
+                count = min(order.count, resting.count)
+                order.count -= count
+                resting.count -= count
+                if order.is_buy:
+                    fills.append(Fill(order, resting, best_price, count))
+                else:
+                    fills.append(Fill(resting, order, best_price, count))
+                if resting.count == 0:
+                    level.popleft()
+                    del self._orders[resting.id]
+        return fills
+
+    @staticmethod
+    def _best_price(
+        heap: list[int], levels: dict[int, deque[Order]], sign: int
+    ) -> Optional[int]:
+        while heap:
+            price = sign * heap[0]
+            level = levels[price]
+            # Пропустим заявки, снятые с книги
+            while level and level[0].count == 0:
+                level.popleft()
+            if level:
+                return price
+            heapq.heappop(heap)
+            del levels[price]
+        return None
+
+
+class MatchingEngine:
+    def __init__(self) -> None:
+        self.books: dict[int, OrderBook] = {}
+
+    def get_book(self, cryptocurrency_id: int) -> OrderBook:
+        book = self.books.get(cryptocurrency_id)
+        if book is None:
+            book = self.books[cryptocurrency_id] = OrderBook()
+        return book
+
+    def submit(self, cryptocurrency_id: int, order: Order) -> list[Fill]:
+        return self.get_book(cryptocurrency_id).submit(order)
+
+    def cancel(self, cryptocurrency_id: int, order_id: int) -> Optional[Order]:
+        return self.get_book(cryptocurrency_id).cancel(order_id)
@@ -0,0 +1,59 @@
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+# Стоимость позиции считается по средней цене: покупка добавляет к стоимости
+# уплаченное, продажа списывает долю стоимости, равную доле проданных монет,
+# а разница между выручкой и списанной стоимостью - реализованная прибыль.
+# Все суммы здесь в целых копейках, чтобы SQL-торговля, леджер и пересчёт по
+# истории округляли одинаково
+
+
+class PositionSummary(NamedTuple):
+    name: str
+    count: int
+    cost_basis: Decimal
+    # None у закрытой позиции
+    average_price: Optional[Decimal]
+    realised_pnl: Decimal
+    price: Decimal
+    unrealised_pnl: Decimal
+
+
+def _divide(numerator: int, denominator: int) -> int:
+    # Деление с округлением половины вверх
+    quotient, remainder = divmod(numerator, denominator)
+    return quotient + (2 * remainder >= denominator)
+
+
+def buy_position(cost_basis: int, price: int, count: int) -> int:
+    return cost_basis + price * count
+
+
+def sell_position(
+    cost_basis: int, count_before: int, price: int, count: int
+) -> tuple[int, int]:
+    # Новая стоимость позиции и реализованная прибыль от продажи
+    sold_cost = _divide(cost_basis * count, count_before)
+    return cost_basis - sold_cost, price * count - sold_cost
+
+
+def to_cents(value: Decimal) -> int:
+    return int(Decimal(value).scaleb(2).to_integral_value())
+
+
+def from_cents(value: int) -> Decimal:
+    return Decimal(value).scaleb(-2)
+
+
+def summarize_position(
+    name: str, count: int, cost_basis: int, realised_pnl: int, price: int
+) -> PositionSummary:
+    return PositionSummary(
+        name,
+        count,
+        from_cents(cost_basis),
+        from_cents(_divide(cost_basis, count)) if count else None,
+        from_cents(realised_pnl),
+        from_cents(price),
+        from_cents(price * count - cost_basis),
+    )
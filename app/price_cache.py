@@ -0,0 +1,66 @@
+import hashlib
+import threading
+from typing import Any, NamedTuple, Optional
+
+
+class PriceSnapshot(NamedTuple):
+    epoch: int
+    prices: list[tuple[str, Any]]
+    by_name: dict[str, Any]
+    # Справочник имя -> id криптовалюты меняется вместе с ценами
+    ids: dict[str, int]
+    # Хэш цен: одинаковый в любом процессе с теми же ценами, в отличие от эпохи
+    digest: str = ''
+
+
+# Кэш цен криптовалют в памяти процесса. Снимок цен заменяется целиком,
+# поэтому читатели обходятся без блокировки и не видят частично обновлённых
+# цен. Эпоха цен монотонно растёт при каждой замене снимка.
+class PriceCache:
+    def __init__(self) -> None:
+        # Блокировку берут только писатели (тик цен, добавление валюты,
+        # загрузка при промахе), чтобы не перезаписать свежий снимок старым
+        self.lock = threading.RLock()
+        self._snapshot: Optional[PriceSnapshot] = None
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch
+
+    def get_snapshot(self) -> Optional[PriceSnapshot]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return snapshot
+
+    def peek(self) -> Optional[PriceSnapshot]:
+        return self._snapshot
+
+    def refresh(self, rows: list[tuple[int, str, Any]]) -> PriceSnapshot:
+        with self.lock:
+            self._epoch += 1
+            prices = [(name, cost) for _, name, cost in rows]
+            snapshot = PriceSnapshot(
+                self._epoch,
+                prices,
+                dict(prices),
+                {name: crypto_id for crypto_id, name, _ in rows},
+                hashlib.sha1(repr(prices).encode()).hexdigest(),
+            )
+            self._snapshot = snapshot
+            return snapshot
+
+    def invalidate(self) -> None:
+        # Эпоха растёт и здесь: после пересоздания базы данные, помеченные
+        # старой эпохой, уже неверны
+        with self.lock:
+            self._epoch += 1
+            self._snapshot = None
+
+    def stats(self) -> dict[str, int]:
+        return {'epoch': self._epoch, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import Any, Callable, NamedTuple, Optional
+
+
+class PriceUpdate(NamedTuple):
+    epoch: int
+    # Только изменившиеся цены
+    prices: list[tuple[str, Any]]
+
+
+def format_price_event(epoch: int, prices: list[tuple[str, Any]]) -> str:
+    data = json.dumps(
+        {'epoch': epoch, 'prices': {name: str(cost) for name, cost in prices}}
+    )
+    return f'id: {epoch}\ndata: {data}\n\n'
+
+
+# Рассылка изменений цен подписчикам потока /stream/prices. Подписчики
+# WSGI-сервера не заводят отдельных очередей: все ждут на одном Condition и
+# сами забирают из общего кольцевого буфера обновления новее своей эпохи.
+# Такой подписчик занимает поток сервера на всё время соединения, поэтому
+# max_subscribers может ограничить их число в процессе. Асинхронные
+# подписчики (AsyncPriceFeed) получают обновления через слушателей.
+class PricePublisher:
+    def __init__(
+        self, history_size: int = 100, max_subscribers: Optional[int] = None
+    ) -> None:
+        self._condition = threading.Condition()
+        self._updates: deque[PriceUpdate] = deque(maxlen=history_size)
+        self._epoch = 0
+        # Эпоха последнего обновления, вытесненного из буфера
+        self._dropped_epoch = 0
+        self.count_subscribers = 0
+        self.max_subscribers = max_subscribers
+        self._listeners: list[Callable[[PriceUpdate], None]] = []
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch
+
+    def publish(self, epoch: int, prices: list[tuple[str, Any]]) -> None:
+        with self._condition:
+            if len(self._updates) == self._updates.maxlen:
+                self._dropped_epoch = self._updates[0].epoch
+            update = PriceUpdate(epoch, prices)
+            self._updates.append(update)
+            self._epoch = epoch
+            self._condition.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(update)
+
+    def add_listener(self, listener: Callable[[PriceUpdate], None]) -> None:
+        # Слушатель вызывается в потоке тика и не должен блокироваться
+        with self._condition:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[PriceUpdate], None]) -> None:
+        with self._condition:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def wait_for_updates(
+        self, last_epoch: int, timeout: Optional[float] = None
+    ) -> Optional[list[PriceUpdate]]:
+        # Возвращает None, если подписчик отстал больше, чем хранит буфер,
+        # и ему нужно заново получить все цены
+        with self._condition:
+            self._condition.wait_for(lambda: self._epoch > last_epoch, timeout)
+            if last_epoch < self._dropped_epoch:
+                return None
+            return [update for update in self._updates if update.epoch > last_epoch]
+
+    def subscribe(self) -> bool:
+        # False, если подписчиков уже столько, сколько разрешено
+        with self._condition:
+            if (
+                self.max_subscribers is not None
+                and self.count_subscribers >= self.max_subscribers
+            ):
+                return False
+            self.count_subscribers += 1
+            return True
+
+    def unsubscribe(self) -> None:
+        with self._condition:
+            self.count_subscribers -= 1
+
+
+# Подписчики потока цен в цикле событий ASGI-сервера: у каждого своя
+# asyncio.Queue, и ни один не держит поток. Издатель зовёт одного слушателя
+# на весь цикл, а по очередям обновления раскладываются уже в потоке цикла.
+# В очередь отставшего подписчика вместо обновлений кладётся None - ему
+# нужно заново получить все цены.
+class AsyncPriceFeed:
+    def __init__(
+        self,
+        publisher: PricePublisher,
+        loop: asyncio.AbstractEventLoop,
+        queue_size: int = 100,
+    ) -> None:
+        self.publisher = publisher
+        self._loop = loop
+        self._queue_size = queue_size
+        self._queues: set['asyncio.Queue[Optional[PriceUpdate]]'] = set()
+        publisher.add_listener(self._on_publish)
+
+    @property
+    def count_subscribers(self) -> int:
+        return len(self._queues)
+
+    def _on_publish(self, update: PriceUpdate) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._fan_out, update)
+        except RuntimeError:
+            # Цикл событий уже закрыт
+            self.close()
+
+    def _fan_out(self, update: PriceUpdate) -> None:
+        for queue in self._queues:
+            try:
+                queue.put_nowait(update)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def subscribe(self) -> 'asyncio.Queue[Optional[PriceUpdate]]':
+        queue: 'asyncio.Queue[Optional[PriceUpdate]]' = asyncio.Queue(self._queue_size)
+        self._queues.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: 'asyncio.Queue[Optional[PriceUpdate]]') -> None:
+        self._queues.discard(queue)
+
+    def close(self) -> None:
+        self.publisher.remove_listener(self._on_publish)
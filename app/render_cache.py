@@ -0,0 +1,73 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, NamedTuple, Optional
+
+from markupsafe import Markup
+
+try:
+    from app.metrics import RENDER_CACHE
+except ImportError:  # pragma: no cover
+    from metrics import RENDER_CACHE  # type: ignore
+
+
+class Fragment(NamedTuple):
+    html: Markup
+    # Хэш разметки: одинаковый у одинаковых фрагментов в любом процессе,
+    # из него складываются ETag страниц
+    digest: str
+
+
+def make_fragment(html: str) -> Fragment:
+    return Fragment(Markup(html), hashlib.sha1(html.encode()).hexdigest())
+
+
+# Кэш отрендеренных фрагментов страниц в памяти процесса. В ключ входит всё,
+# от чего зависит фрагмент: эпоха цен, версия пользователя. Поэтому записи не
+# нужно сбрасывать явно - устаревшие просто перестают запрашиваться и
+# вытесняются, когда записей становится больше max_entries.
+class RenderCache:
+    def __init__(self, max_entries: int = 1024) -> None:
+        # 0 - кэш выключен
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[Hashable, ...], Any] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, fragment: str, key: tuple[Hashable, ...]) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get((fragment, *key))
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end((fragment, *key))
+                self.hits += 1
+        RENDER_CACHE.inc(fragment, 'miss' if value is None else 'hit')
+        return value
+
+    def put(self, fragment: str, key: tuple[Hashable, ...], value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[(fragment, *key)] = value
+            self._entries.move_to_end((fragment, *key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
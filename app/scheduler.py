@@ -0,0 +1,197 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import IO, Callable, Optional
+
+try:
+    from app.metrics import PRICE_TICK_LAG, PRICE_TICKS, PRICE_TICKS_SKIPPED
+    from app.trade import CONST_VALUE, Trade
+except ImportError:  # pragma: no cover
+    from metrics import PRICE_TICK_LAG, PRICE_TICKS, PRICE_TICKS_SKIPPED  # type: ignore
+    from trade import CONST_VALUE, Trade  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SchedulerSettings:
+    # Период тика цен в секундах
+    interval: float = CONST_VALUE.TIME_UPDATE.value
+    # Свои периоды для отдельных валют: имя -> секунды
+    intervals: dict[str, float] = field(default_factory=dict)
+    # Цены меняет только процесс, который держит блокировку этого файла
+    lock_path: str = 'price_tick.lock'
+
+    @classmethod
+    def from_env(cls) -> 'SchedulerSettings':
+        default = cls()
+        # APP_TICK_INTERVALS=crypto_1=5,crypto_2=30
+        intervals = {}
+        for item in os.environ.get('APP_TICK_INTERVALS', '').split(','):
+            if item.strip():
+                name, interval = item.split('=')
+                intervals[name.strip()] = float(interval)
+        return cls(
+            interval=float(os.environ.get('APP_TICK_INTERVAL', default.interval)),
+            intervals=intervals,
+            lock_path=os.environ.get('APP_TICK_LOCK', default.lock_path),
+        )
+
+
+# Блокировка лидера между процессами на flock. Её держит открытый файл,
+# поэтому после падения процесса её снимает система
+class LeaderLock:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file: Optional[IO[str]] = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        if self._file is not None:
+            return True
+        file = open(
+            self.path, 'a+', encoding='utf-8'
+        )  # pylint: disable=consider-using-with
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+        file.truncate(0)
+        file.write(f'{os.getpid()}\n')
+        file.flush()
+        self._file = file
+        return True
+
+    def release(self) -> None:
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+@dataclass
+class TickJob:
+    interval: float
+    # None - все валюты без своего периода
+    names: Optional[frozenset[str]]
+    due: float = 0.0
+
+    @property
+    def label(self) -> str:
+        return f'{self.interval:g}'
+
+
+# Тик цен с фиксированной частотой: тики идут в моменты start + k * interval
+# и не сдвигаются на время самого тика. Если тик не успел до следующего
+# момента, пропущенные тики не догоняются, а сливаются в один.
+#
+# Цены меняет только лидер - процесс с блокировкой файла. Остальные процессы
+# в те же моменты перечитывают цены из базы в свой кэш и пытаются стать
+# лидером, так что после остановки лидера тик подхватит другой процесс.
+class PriceTickScheduler:
+    def __init__(
+        self,
+        trade: Trade,
+        settings: Optional[SchedulerSettings] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.trade = trade
+        self.settings = settings or SchedulerSettings()
+        self._clock = clock
+        self.leader_lock = LeaderLock(self.settings.lock_path)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        by_interval: dict[float, set[str]] = {}
+        for name, interval in self.settings.intervals.items():
+            by_interval.setdefault(interval, set()).add(name)
+        self.jobs = [TickJob(self.settings.interval, None)] + [
+            TickJob(interval, frozenset(names))
+            for interval, names in sorted(by_interval.items())
+        ]
+        started = self._clock()
+        for job in self.jobs:
+            job.due = started + job.interval
+
+    def _get_names(self, job: TickJob) -> Optional[list[str]]:
+        if job.names is not None:
+            return sorted(job.names)
+        if not self.settings.intervals:
+            return None
+        return [
+            name
+            for name, _ in self.trade.get_price_snapshot().prices
+            if name not in self.settings.intervals
+        ]
+
+    def _tick(self, job: TickJob) -> None:
+        names = self._get_names(job)
+        if names is not None and not names:
+            return
+        self.trade.update_cost(names=names)
+
+    def run_pending(self) -> float:
+        # Выполнить наступившие тики и вернуть время следующего
+        now = self._clock()
+        is_leader = self.leader_lock.acquire()
+        reloaded = False
+        for job in self.jobs:
+            if now < job.due:
+                continue
+            PRICE_TICK_LAG.observe(now - job.due, job.label)
+            try:
+                if is_leader:
+                    self._tick(job)
+                    PRICE_TICKS.inc(job.label, 'tick')
+                elif not reloaded:
+                    self.trade.reload_prices()
+                    reloaded = True
+                    PRICE_TICKS.inc(job.label, 'reload')
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(
+                    'Тик цен с периодом %s с завершился ошибкой', job.label
+                )
+
+            job.due += job.interval
+            finished = self._clock()
+            if finished >= job.due:
+                skipped = int((finished - job.due) // job.interval) + 1
+                job.due += skipped * job.interval
+                PRICE_TICKS_SKIPPED.inc(job.label, amount=skipped)
+                logger.warning(
+                    'Тик цен с периодом %s с не успел, пропустили тиков: %d',
+                    job.label,
+                    skipped,
+                )
+        return min(job.due for job in self.jobs)
+
+    def _run(self) -> None:
+        logger.info('Запустили тик цен')
+        while not self._stop.is_set():
+            next_due = self.run_pending()
+            self._stop.wait(max(next_due - self._clock(), 0))
+        self.leader_lock.release()
+        logger.info('Остановили тик цен')
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='price-tick', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        # Начатый тик доводится до конца, новые не начинаются
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        else:
+            self.leader_lock.release()
@@ -3,29 +3,71 @@ import random
 import threading
 import time
 from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation
 from enum import Enum
-from typing import Any, Generator, Optional
+from typing import Any, Collection, Generator, Iterator, NamedTuple, Optional
 
+import numpy as np
+import sqlalchemy as sa
 from sqlalchemy.orm import Session, sessionmaker
 
 try:
+    from app.candles import Candle, prepend_history, record_ticks, select_candles
+    from app.market import MarketModel, round_cents
+    from app.metrics import PRICE_TICK_DURATION, TRADE_OPERATIONS, instrument_engine
+    from app.migrations import stamp, upgrade
     from app.models import (
         Base,
         Cryptocurrency,
         HistoryOperation,
+        LimitOrder,
         Operation,
         User,
         UserCryptocurrency,
     )
+    from app.order_book import Fill, MatchingEngine, Order
+    from app.positions import (
+        PositionSummary,
+        from_cents,
+        sell_position,
+        summarize_position,
+        to_cents,
+    )
+    from app.price_cache import PriceCache, PriceSnapshot
+    from app.price_stream import PricePublisher
 except ImportError:  # pragma: no cover
+    from candles import (  # type: ignore
+        Candle,
+        prepend_history,
+        record_ticks,
+        select_candles,
+    )
+    from market import MarketModel, round_cents  # type: ignore
+    from metrics import (  # type: ignore
+        PRICE_TICK_DURATION,
+        TRADE_OPERATIONS,
+        instrument_engine,
+    )
+    from migrations import stamp, upgrade  # type: ignore
     from models import (  # type: ignore
         Base,
         Cryptocurrency,
         HistoryOperation,
+        LimitOrder,
         Operation,
         User,
         UserCryptocurrency,
     )
+    from order_book import Fill, MatchingEngine, Order  # type: ignore
+    from positions import (  # type: ignore
+        PositionSummary,
+        from_cents,
+        sell_position,
+        summarize_position,
+        to_cents,
+    )
+    from price_cache import PriceCache, PriceSnapshot  # type: ignore
+    from price_stream import PricePublisher  # type: ignore
 
 
 class NameOperation(Enum):
@@ -36,47 +78,335 @@ class NameOperation(Enum):
 class CONST_VALUE(Enum):
     COUNT_OPERATION_ON_PAGE = 5
     TIME_UPDATE = 10
+    PRICE_STREAM_HEARTBEAT = 15
+
+
+class HistoryPage(NamedTuple):
+    operations: list[tuple[str, str, int]]
+    # Курсор для ссылки на более старые операции (?before=)
+    next_cursor: Optional[int]
+    # Курсор для ссылки на более новые операции (?after=)
+    prev_cursor: Optional[int]
+
+
+class HistoryFilter(NamedTuple):
+    user_login: Optional[str] = None
+    cryptocurrency_name: Optional[str] = None
+    # Диапазоны включают обе границы
+    start_id: Optional[int] = None
+    end_id: Optional[int] = None
+    start_time: Optional[int] = None
+    end_time: Optional[int] = None
 
 
 logger = logging.getLogger(__name__)
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    filename='app.log',
-    filemode='w',
-    format='%(name)s - %(levelname)s - %(message)s',
-    encoding='utf-8',
-)
+
+# Запросы чтения, общие для Trade и AsyncTrade (app/async_trade.py)
+
+
+def select_user_balance(user_login: str) -> Any:
+    return sa.select(User.balance).where(User.login == user_login)
+
+
+def select_user_balance_and_version(user_login: str) -> Any:
+    return sa.select(User.balance, User.version).where(User.login == user_login)
+
+
+def select_user_id(user_login: str) -> Any:
+    return sa.select(User.id).where(User.login == user_login)
+
+
+def select_user_positions(user_login: str) -> Any:
+    # Внешнее соединение оставит строку пользователя и без позиций. Закрытые
+    # позиции остаются, пока по ним есть реализованная прибыль
+    return (
+        sa.select(
+            Cryptocurrency.name,
+            UserCryptocurrency.count,
+            UserCryptocurrency.cost_basis,
+            UserCryptocurrency.realised_pnl,
+        )
+        .select_from(User)
+        .outerjoin(
+            UserCryptocurrency,
+            sa.and_(
+                UserCryptocurrency.user_id == User.id,
+                sa.or_(
+                    UserCryptocurrency.count != 0,
+                    UserCryptocurrency.realised_pnl != 0,
+                ),
+            ),
+        )
+        .outerjoin(
+            Cryptocurrency,
+            UserCryptocurrency.cryptocurrency_id == Cryptocurrency.id,
+        )
+        .where(User.login == user_login)
+        .order_by(UserCryptocurrency.cryptocurrency_id)
+    )
+
+
+def summarize_positions(
+    user_login: str, rows: list[Any], prices: dict[str, Any]
+) -> list[PositionSummary]:
+    if not rows:
+        logger.error('Пользователя %s не существует', user_login)
+        raise ValueError(f'Пользователя {user_login} не существует')
+
+    return [
+        summarize_position(
+            name,
+            count,
+            to_cents(cost_basis),
+            to_cents(realised_pnl),
+            to_cents(prices[name]),
+        )
+        for name, count, cost_basis, realised_pnl in rows
+        if name is not None
+    ]
+
+
+def select_history_page(
+    user_id: int, limit: int, before_id: Optional[int], after_id: Optional[int]
+) -> Any:
+    # Операции идут от новых к старым. Страница выбирается по ключу (id),
+    # поэтому база читает только limit + 1 строк независимо от длины истории
+    query = (
+        sa.select(
+            HistoryOperation.id,
+            Operation.name,
+            Cryptocurrency.name,
+            HistoryOperation.count,
+        )
+        .join(Operation, HistoryOperation.operation_id == Operation.id)
+        .join(
+            Cryptocurrency,
+            HistoryOperation.cryptocurrency_id == Cryptocurrency.id,
+        )
+        .where(HistoryOperation.user_id == user_id)
+    )
+    if after_id is not None:
+        return (
+            query.where(HistoryOperation.id > after_id)
+            .order_by(HistoryOperation.id)
+            .limit(limit + 1)
+        )
+    if before_id is not None:
+        query = query.where(HistoryOperation.id < before_id)
+    return query.order_by(HistoryOperation.id.desc()).limit(limit + 1)
+
+
+def make_history_page(
+    rows: list[Any], limit: int, before_id: Optional[int], after_id: Optional[int]
+) -> HistoryPage:
+    if after_id is not None:
+        has_newer = len(rows) > limit
+        rows = rows[:limit][::-1]
+        has_older = True
+    else:
+        has_older = len(rows) > limit
+        rows = rows[:limit]
+        has_newer = before_id is not None
+
+    return HistoryPage(
+        [(operation, crypto, count) for _, operation, crypto, count in rows],
+        rows[-1][0] if rows and has_older else None,
+        rows[0][0] if rows and has_newer else None,
+    )
+
+
+def select_count_user_history_operation(user_login: str) -> Any:
+    return (
+        sa.select(sa.func.count(HistoryOperation.id))
+        .join(User, HistoryOperation.user_id == User.id)
+        .where(User.login == user_login)
+    )
 
 
 class Trade:
-    def __init__(self, engine_db: int) -> None:
+    # User.version хранится в базе и одна во всех процессах: по ней можно
+    # проверять, изменились ли страницы пользователя, ничего не рендеря
+    durable_user_versions = True
+
+    def __init__(
+        self,
+        engine_db: int,
+        bulk_tick: bool = False,
+        market: Optional[MarketModel] = None,
+    ) -> None:
         self.engine = engine_db
+        instrument_engine(self.engine)
         self.Session = sessionmaker(bind=self.engine)
+        self.price_cache = PriceCache()
+        self.price_publisher = PricePublisher()
+        self.bulk_tick = bulk_tick
+        # Модель рынка для тика; без неё цена меняется на случайные -10..10%
+        self.market = market
+        # Книги лимитных заявок загружаются из базы при первом обращении
+        self.matching_engine: Optional[MatchingEngine] = None
+        self._order_lock = threading.Lock()
+        self._operation_ids: dict[str, int] = {}
+
+    def update_cost(
+        self,
+        seed: Optional[int] = None,
+        tick_time: Optional[int] = None,
+        names: Optional[Collection[str]] = None,
+    ) -> None:
+        # names - обновить только эти валюты, по умолчанию все
+        started = time.perf_counter()
+        if self.market is not None:
+            self.update_cost_bulk(seed, tick_time, names)
+            PRICE_TICK_DURATION.observe(time.perf_counter() - started, 'market')
+            return
+        if self.bulk_tick:
+            self.update_cost_bulk(seed, tick_time, names)
+            PRICE_TICK_DURATION.observe(time.perf_counter() - started, 'bulk')
+            return
+
+        self._update_cost_orm(seed, tick_time, names)
+        PRICE_TICK_DURATION.observe(time.perf_counter() - started, 'orm')
 
-    def update_cost(self, seed: Optional[int] = None) -> None:
+    def _update_cost_orm(
+        self,
+        seed: Optional[int],
+        tick_time: Optional[int],
+        names: Optional[Collection[str]],
+    ) -> None:
         logger.info('Обновим курс каждой валюты')
-        with self._create_session() as session:
-            list_cryptocurrency = session.query(Cryptocurrency).all()
-            for crypto in list_cryptocurrency:
-                old_cost = crypto.cost
-                if seed is not None:
-                    random.seed(seed)
-                crypto.cost = round(
-                    random.randint(-10, 10) * crypto.cost / 100 + crypto.cost, 2
+        # Кэш меняем под той же блокировкой, что и базу, чтобы новая эпоха
+        # цен появилась ровно вместе с закоммиченными ценами
+        with self.price_cache.lock:
+            with self._create_session() as session:
+                query = session.query(Cryptocurrency)
+                if names is not None:
+                    query = query.where(Cryptocurrency.name.in_(names))
+                list_cryptocurrency = query.all()
+                for crypto in list_cryptocurrency:
+                    old_cost = crypto.cost
+                    if seed is not None:
+                        random.seed(seed)
+                    crypto.cost = round(
+                        random.randint(-10, 10) * crypto.cost / 100 + crypto.cost, 2
+                    )
+                    logger.debug(
+                        'Криптовалюта %s: %s --> %s', crypto.name, old_cost, crypto.cost
+                    )
+                session.flush()
+                prices = self._select_prices(session)
+                record_ticks(
+                    session.connection(),
+                    self._get_tick_time(tick_time),
+                    [(crypto.id, crypto.cost) for crypto in list_cryptocurrency],
                 )
-                logger.info(
-                    'Криптовалюта %s: %s --> %s', crypto.name, old_cost, crypto.cost
+            self._publish_prices(prices)
+
+    def update_cost_bulk(
+        self,
+        seed: Optional[int] = None,
+        tick_time: Optional[int] = None,
+        names: Optional[Collection[str]] = None,
+    ) -> None:
+        # Все изменения цен генерируем одним массивом и пишем одним executemany
+        # прямо через DBAPI, не создавая ORM-объектов и не логируя каждую валюту
+        logger.info('Обновим курс всех валют одним запросом')
+        with self.price_cache.lock:
+            with self._create_session() as session:
+                connection = session.connection()
+                # Считаем в целых копейках, чтобы округление совпадало с round()
+                rows = connection.exec_driver_sql(
+                    'SELECT id, name, CAST(round(cost * 100) AS INTEGER) '
+                    'FROM cryptocurrency ORDER BY id'
+                ).all()
+                # Меняем только выбранные валюты, но снимок цен собираем из всех
+                selected = [
+                    index
+                    for index, (_, name, _) in enumerate(rows)
+                    if names is None or name in names
+                ]
+                if not selected:
+                    return
+
+                ids, all_names, all_cents = zip(*rows)
+                cents = np.array(all_cents, dtype=np.int64)[selected]
+                if self.market is not None:
+                    # Параметры модели по валютам идут в порядке id
+                    new_cents = self.market.next_cents(
+                        cents,
+                        None if len(selected) == len(rows) else np.array(selected),
+                        None if seed is None else np.random.default_rng(seed),
+                        keys=[ids[index] for index in selected],
+                    )
+                else:
+                    moves = np.random.default_rng(seed).integers(
+                        -10, 11, size=len(selected)
+                    )
+                    quotient, remainder = np.divmod(cents * (100 + moves), 100)
+                    # Банковское округление, как у Decimal
+                    round_up = (remainder > 50) | (
+                        (remainder == 50) & (quotient % 2 == 1)
+                    )
+                    new_cents = quotient + round_up
+
+                new_costs = (new_cents / 100).tolist()
+                changed = list(zip(np.array(ids)[selected].tolist(), new_costs))
+                connection.exec_driver_sql(
+                    'UPDATE cryptocurrency SET cost = ? WHERE id = ?',
+                    [(cost, crypto_id) for crypto_id, cost in changed],
                 )
+                record_ticks(connection, self._get_tick_time(tick_time), changed)
+            price_cents = list(all_cents)
+            for index, cost in zip(selected, new_cents.tolist()):
+                price_cents[index] = cost
+            prices = [
+                (crypto_id, name, Decimal(cost).scaleb(-2))
+                for crypto_id, name, cost in zip(ids, all_names, price_cents)
+            ]
+            self._publish_prices(prices)
+        logger.info('Обновили курс %d валют', len(selected))
 
-    def _loop_for_update_cost(self) -> None:
-        while True:
-            self.update_cost()
-            time.sleep(CONST_VALUE.TIME_UPDATE.value)
+    def simulate_history(self, market: MarketModel, steps: int) -> int:
+        # История цен за steps тиков по модели рынка, которая приходит в
+        # текущие цены и заканчивается перед первым тиком в базе. Текущие
+        # цены не меняются. Возвращает число записанных тиков
+        tick_seconds = max(1, round(market.tick_seconds))
+        with self._create_session() as session:
+            connection = session.connection()
+            rows = connection.exec_driver_sql(
+                'SELECT id, CAST(round(cost * 100) AS INTEGER) '
+                'FROM cryptocurrency ORDER BY id'
+            ).all()
+            if not rows or steps <= 0:
+                return 0
+            first_tick = connection.exec_driver_sql(
+                'SELECT min(time) FROM "PriceTick"'
+            ).scalar()
+            end_time = self._get_tick_time(None) if first_tick is None else first_tick
+            ids, cents = zip(*rows)
+            paths = market.backward_paths(np.array(cents, dtype=np.float64), steps)
+            times = end_time - tick_seconds * np.arange(steps, 0, -1)
+            prepend_history(connection, list(ids), times, round_cents(paths))
+        logger.info('Записали историю цен: %d тиков %d валют', steps, len(ids))
+        return steps * len(ids)
+
+    @staticmethod
+    def _get_tick_time(tick_time: Optional[int]) -> int:
+        return int(time.time()) if tick_time is None else tick_time
 
-    def regular_update_cost(self) -> None:
-        thread = threading.Thread(target=self._loop_for_update_cost)
-        thread.start()
+    def reload_prices(self) -> bool:
+        # Цены меняет тик другого процесса: перечитаем их из базы. Эпоха
+        # растёт, только если цены действительно изменились
+        with self.price_cache.lock:
+            with self._create_session() as session:
+                prices = self._select_prices(session)
+            snapshot = self.price_cache.peek()
+            if snapshot is not None and prices == [
+                (snapshot.ids[name], name, cost) for name, cost in snapshot.prices
+            ]:
+                return False
+            self._publish_prices(prices)
+            return True
 
     @contextmanager
     def _create_session(
@@ -92,29 +422,105 @@ class Trade:
         finally:
             new_session.close()
 
+    @contextmanager
+    def _create_write_session(self) -> Generator[Session, Session, None]:
+        # Сделка читает баланс и позиции и записывает их новыми значениями.
+        # pysqlite начинает транзакцию только перед первой записью, и две
+        # сделки одного пользователя в разных процессах прочитали бы один
+        # баланс. BEGIN IMMEDIATE берёт блокировку записи до чтения
+        with self._create_session() as session:
+            session.execute(sa.text('BEGIN IMMEDIATE'))
+            yield session
+
     def base_drop_all(self) -> None:
         Base.metadata.drop_all(self.engine)
+        self.price_cache.invalidate()
+        self.matching_engine = None
+        self._operation_ids = {}
 
     def base_create_all(self) -> None:
         Base.metadata.create_all(self.engine)
+        stamp(self.engine)
+        self.price_cache.invalidate()
+        self.matching_engine = None
+        self._operation_ids = {}
+
+    def base_migrate(self) -> list[int]:
+        applied = upgrade(self.engine)
+        self.price_cache.invalidate()
+        self.matching_engine = None
+        self._operation_ids = {}
+        return applied
+
+    @staticmethod
+    def _select_prices(session: Session) -> list[tuple[int, str, Any]]:
+        return [
+            (crypto_id, name, cost)
+            for crypto_id, name, cost in session.query(
+                Cryptocurrency.id, Cryptocurrency.name, Cryptocurrency.cost
+            ).order_by(Cryptocurrency.id)
+        ]
+
+    def _publish_prices(self, prices: list[tuple[int, str, Any]]) -> None:
+        # Подписчикам потока цен отправляем только изменившиеся цены
+        old_snapshot = self.price_cache.peek()
+        snapshot = self.price_cache.refresh(prices)
+        changed = [
+            (name, cost)
+            for name, cost in snapshot.prices
+            if old_snapshot is None or old_snapshot.by_name.get(name) != cost
+        ]
+        if changed:
+            self.price_publisher.publish(snapshot.epoch, changed)
+
+    def get_price_snapshot(self) -> PriceSnapshot:
+        snapshot = self.price_cache.get_snapshot()
+        if snapshot is not None:
+            return snapshot
+
+        with self.price_cache.lock:
+            # Пока ждали блокировку, цены мог загрузить другой поток
+            snapshot = self.price_cache.peek()
+            if snapshot is not None:
+                return snapshot
+            logger.debug('Загрузим цены криптовалют в кэш')
+            with self._create_session() as session:
+                prices = self._select_prices(session)
+            return self.price_cache.refresh(prices)
 
     def create_user(self, login: str) -> None:
-        with self._create_session() as session:
-            user = User(login=login, balance='1000')
-            session.add(user)
+        try:
+            with self._create_session() as session:
+                user = User(login=login, balance='1000')
+                session.add(user)
+        except sa.exc.IntegrityError as error:
+            # Пользователя мог создать параллельный запрос другого процесса
+            raise ValueError(f'Пользователь {login} уже существует') from error
         logger.info('Добавили пользователя: %s', login)
 
     def create_cryptocurrency(self, name: str, cost: str) -> None:
-        with self._create_session() as session:
-            crypto = (
-                session.query(Cryptocurrency).where(Cryptocurrency.name == name).first()
-            )
-            if crypto is not None:
-                logger.error('Криптовалюта с именем %s уже существует', name)
-                raise ValueError(f'Криптовалюта с именем {name} уже существует')
+        with self.price_cache.lock:
+            with self._create_session() as session:
+                crypto = (
+                    session.query(Cryptocurrency)
+                    .where(Cryptocurrency.name == name)
+                    .first()
+                )
+                if crypto is not None:
+                    logger.error('Криптовалюта с именем %s уже существует', name)
+                    raise ValueError(f'Криптовалюта с именем {name} уже существует')
 
-            cryptocurrency = Cryptocurrency(name=name, cost=cost)
-            session.add(cryptocurrency)
+                cryptocurrency = Cryptocurrency(name=name, cost=cost)
+                session.add(cryptocurrency)
+                session.flush()
+                prices = self._select_prices(session)
+                # Цена при добавлении валюты открывает её историю
+                record_ticks(
+                    session.connection(),
+                    self._get_tick_time(None),
+                    [(cryptocurrency.id, cryptocurrency.cost)],
+                )
+            self._publish_prices(prices)
 
         logger.info('Добавили криптовалюту: %s со стоимостью %s', name, cost)
 
@@ -122,112 +528,118 @@ class Trade:
         with self._create_session() as session:
             operation = Operation(name=name)
             session.add(operation)
+            session.flush()
+            operation_id = operation.id
+        if self._operation_ids:
+            self._operation_ids = {**self._operation_ids, name: operation_id}
         logger.info('Добавили операцию: %s', name)
 
     def user_buy_cryptocurrency(
         self, user_login: str, cryptocurrency_name: str, count: int
     ) -> None:
-        logger.info(
+        logger.debug(
             'Пользователю %s хочет купить %d %s',
             user_login,
             count,
             cryptocurrency_name,
         )
-        with self._create_session() as session:
+        cryptocurrency_id = self._get_cryptocurrency_id(cryptocurrency_name)
+        operation_id = self._get_operation_id(NameOperation.Buy.value)
+        with self._create_write_session() as session:
             user = session.query(User).where(User.login == user_login).first()
             if user is None:
                 logger.error('Пользователя %s не существует', user_login)
+                TRADE_OPERATIONS.inc(NameOperation.Buy.value, 'unknown_user')
                 raise ValueError('Такого пользователя не существует')
 
-            cryptocurrency = (
-                session.query(Cryptocurrency)
-                .where(Cryptocurrency.name == cryptocurrency_name)
-                .first()
-            )
-            if cryptocurrency is None:
+            cost = self._select_cost(session, cryptocurrency_id)
+            if cost is None:
                 logger.error('Криптовалюты %s не существует', cryptocurrency_name)
+                TRADE_OPERATIONS.inc(NameOperation.Buy.value, 'unknown_cryptocurrency')
                 raise ValueError('Такой криптовалюты не существует')
 
             # Получим запись Пользователь - Криптовалюта
-            notes_user_crypto = (
-                session.query(UserCryptocurrency)
-                .where(UserCryptocurrency.users == user)
-                .where(UserCryptocurrency.cryptocurrencies == cryptocurrency)
-                .first()
+            notes_user_crypto = session.get(
+                UserCryptocurrency, (user.id, cryptocurrency_id)
             )
 
             # Проверим, что у пользователя хватает средств для покупки
-            if user.balance >= cryptocurrency.cost * count:
-                user.balance -= cryptocurrency.cost * count
+            if user.balance >= cost * count:
+                user.balance -= cost * count
+                user.version += 1
             else:
                 logger.error(
                     'У пользователя %s на счету %s, а для покупки надо %s',
                     user_login,
                     user.balance,
-                    cryptocurrency.cost * count,
+                    cost * count,
                 )
+                TRADE_OPERATIONS.inc(NameOperation.Buy.value, 'insufficient_funds')
                 raise ValueError('Недостаточно средств')
 
             # У пользователя нет такой валюты ещё
             if notes_user_crypto is None:
-                new_notes = UserCryptocurrency(count=count)
-                new_notes.users = user
-                new_notes.cryptocurrencies = cryptocurrency
+                session.add(
+                    UserCryptocurrency(
+                        user_id=user.id,
+                        cryptocurrency_id=cryptocurrency_id,
+                        count=count,
+                        cost_basis=cost * count,
+                        realised_pnl=0,
+                    )
+                )
             else:
                 notes_user_crypto.count += count
+                notes_user_crypto.cost_basis += cost * count
 
             # Запишем операцию в историю
-            operation = (
-                session.query(Operation)
-                .where(Operation.name == NameOperation.Buy.value)
-                .first()
+            session.add(
+                HistoryOperation(
+                    user_id=user.id,
+                    operation_id=operation_id,
+                    cryptocurrency_id=cryptocurrency_id,
+                    count=count,
+                    price=cost,
+                )
             )
 
-            new_operations = HistoryOperation(count=count)
-            new_operations.user = user
-            new_operations.operation = operation
-            new_operations.cryptocurrency = cryptocurrency
-            new_operations.price = cryptocurrency.cost
-
             logger.info(
                 'Пользователь %s купил %d %s по цене %s и заплатил %s',
                 user_login,
                 count,
                 cryptocurrency_name,
-                cryptocurrency.cost,
-                cryptocurrency.cost * count,
+                cost,
+                cost * count,
             )
+        TRADE_OPERATIONS.inc(NameOperation.Buy.value, 'ok')
 
     def user_sell_cryptocurrency(
         self, user_login: str, cryptocurrency_name: str, count: int
     ) -> None:
-        logger.info(
+        logger.debug(
             'Пользователь %s хочет продать %d %s',
             user_login,
             count,
             cryptocurrency_name,
         )
-        with self._create_session() as session:
+        cryptocurrency_id = self._get_cryptocurrency_id(cryptocurrency_name)
+        operation_id = self._get_operation_id(NameOperation.Sell.value)
+        with self._create_write_session() as session:
             user = session.query(User).where(User.login == user_login).first()
             if user is None:
                 logger.error('Пользователя %s не существует', user_login)
+                TRADE_OPERATIONS.inc(NameOperation.Sell.value, 'unknown_user')
                 raise ValueError(f'Пользователя {user_login} не существует')
 
-            cryptocurrency = (
-                session.query(Cryptocurrency)
-                .where(Cryptocurrency.name == cryptocurrency_name)
-                .first()
-            )
-            if cryptocurrency is None:
+            cost = self._select_cost(session, cryptocurrency_id)
+            if cost is None:
                 logger.error('Криптовалюты %s не существует', cryptocurrency_name)
+                TRADE_OPERATIONS.inc(NameOperation.Sell.value, 'unknown_cryptocurrency')
                 raise ValueError('Криптовалюты не существует')
 
             # Получим запись Пользователь - Криптовалюта
-            notes_user_crypto = (
-                session.query(UserCryptocurrency)
-                .where(UserCryptocurrency.users == user)
-                .where(UserCryptocurrency.cryptocurrencies == cryptocurrency)
-                .first()
+            notes_user_crypto = session.get(
+                UserCryptocurrency, (user.id, cryptocurrency_id)
             )
 
             if notes_user_crypto is None or notes_user_crypto.count == 0:
@@ -237,14 +649,26 @@ class Trade:
                     user_login,
                     cryptocurrency_name,
                 )
+                TRADE_OPERATIONS.inc(
+                    NameOperation.Sell.value, 'insufficient_cryptocurrency'
+                )
                 raise ValueError(
                     f'У пользователя {user_login} нет криптовалюты {cryptocurrency_name}'
                 )
 
             # Проверим, что у пользователя хватает криптовалюты на счету
             if notes_user_crypto.count >= count:
-                user.balance += cryptocurrency.cost * count
+                user.balance += cost * count
+                user.version += 1
+                cost_basis, realised_pnl = sell_position(
+                    to_cents(notes_user_crypto.cost_basis),
+                    notes_user_crypto.count,
+                    to_cents(cost),
+                    count,
+                )
                 notes_user_crypto.count -= count
+                notes_user_crypto.cost_basis = from_cents(cost_basis)
+                notes_user_crypto.realised_pnl += from_cents(realised_pnl)
             else:
                 logger.error(
                     'У пользователя %s есть %d %s, а для продажи надо %d',
@@ -253,52 +677,380 @@ class Trade:
                     cryptocurrency_name,
                     count,
                 )
+                TRADE_OPERATIONS.inc(
+                    NameOperation.Sell.value, 'insufficient_cryptocurrency'
+                )
                 raise ValueError(
                     f'У пользователя {user_login} есть {notes_user_crypto.count} {cryptocurrency_name}, а для продажи надо {count}'  # pylint: disable=line-too-long
                 )
 
             # Запишем операцию в историю
-            operation = (
-                session.query(Operation)
-                .where(Operation.name == NameOperation.Sell.value)
-                .first()
+            session.add(
+                HistoryOperation(
+                    user_id=user.id,
+                    operation_id=operation_id,
+                    cryptocurrency_id=cryptocurrency_id,
+                    count=count,
+                    price=cost,
+                )
             )
 
-            new_operations = HistoryOperation(count=count)
-            new_operations.user = user
-            new_operations.operation = operation
-            new_operations.cryptocurrency = cryptocurrency
-            new_operations.price = cryptocurrency.cost
-
             logger.info(
                 'Пользователь %s продал %d %s по цене %s и получил %s',
                 user_login,
                 count,
                 cryptocurrency_name,
-                cryptocurrency.cost,
-                cryptocurrency.cost * count,
+                cost,
+                cost * count,
             )
+        TRADE_OPERATIONS.inc(NameOperation.Sell.value, 'ok')
 
-    def get_all_users(self) -> list[tuple[Any, Any, list[tuple[Any, Any]]]]:
+    def _get_cryptocurrency_id(self, cryptocurrency_name: str) -> Optional[int]:
+        cryptocurrency_id = self.get_price_snapshot().ids.get(cryptocurrency_name)
+        if cryptocurrency_id is None:
+            # Валюту мог добавить другой процесс после загрузки снимка цен
+            self.reload_prices()
+            cryptocurrency_id = self.get_price_snapshot().ids.get(cryptocurrency_name)
+        return cryptocurrency_id
+
+    @staticmethod
+    def _select_cost(session: Session, cryptocurrency_id: Optional[int]) -> Any:
+        if cryptocurrency_id is None:
+            return None
+        return (
+            session.query(Cryptocurrency.cost)
+            .where(Cryptocurrency.id == cryptocurrency_id)
+            .scalar()
+        )
+
+    def _get_operation_ids(self) -> dict[str, int]:
+        # Операции - неизменяемый справочник, читаем его из базы один раз
+        if not self._operation_ids:
+            with self._create_session() as session:
+                self._operation_ids = {
+                    name: operation_id
+                    for operation_id, name in session.query(
+                        Operation.id, Operation.name
+                    )
+                }
+        return self._operation_ids
+
+    def _get_operation_id(self, name: str) -> int:
+        operation_id = self._get_operation_ids().get(name)
+        if operation_id is None:
+            logger.error('Операции %s не существует', name)
+            raise ValueError(f'Операции {name} не существует')
+        return operation_id
+
+    def place_limit_order(
+        self,
+        user_login: str,
+        cryptocurrency_name: str,
+        operation_name: str,
+        price: str,
+        count: int,
+    ) -> int:
+        logger.info(
+            'Пользователь %s выставляет заявку %s %d %s по цене %s',
+            user_login,
+            operation_name,
+            count,
+            cryptocurrency_name,
+            price,
+        )
+        if operation_name not in (NameOperation.Buy.value, NameOperation.Sell.value):
+            raise ValueError(f'Неизвестная операция {operation_name}')
+        if count <= 0:
+            raise ValueError('Количество должно быть положительным')
+        try:
+            limit_price = Decimal(price).quantize(Decimal('0.01'))
+        except InvalidOperation as error:
+            raise ValueError(f'Некорректная цена {price}') from error
+        if limit_price <= 0:
+            raise ValueError('Цена должна быть положительной')
+
+        is_buy = operation_name == NameOperation.Buy.value
+        with self._order_lock:
+            matching_engine = self._get_matching_engine()
+            order = None
+            try:
+                with self._create_write_session() as session:
+                    user = session.query(User).where(User.login == user_login).first()
+                    if user is None:
+                        logger.error('Пользователя %s не существует', user_login)
+                        raise ValueError(f'Пользователя {user_login} не существует')
+
+                    cryptocurrency = (
+                        session.query(Cryptocurrency)
+                        .where(Cryptocurrency.name == cryptocurrency_name)
+                        .first()
+                    )
+                    if cryptocurrency is None:
+                        logger.error(
+                            'Криптовалюты %s не существует', cryptocurrency_name
+                        )
+                        raise ValueError('Такой криптовалюты не существует')
+
+                    # Резервируем деньги или криптовалюту под заявку
+                    if is_buy:
+                        if user.balance < limit_price * count:
+                            logger.error(
+                                'У пользователя %s на счету %s, а для заявки надо %s',
+                                user_login,
+                                user.balance,
+                                limit_price * count,
+                            )
+                            raise ValueError('Недостаточно средств')
+                        user.balance -= limit_price * count
+                    else:
+                        notes_user_crypto = session.get(
+                            UserCryptocurrency, (user.id, cryptocurrency.id)
+                        )
+                        if notes_user_crypto is None or notes_user_crypto.count < count:
+                            logger.error(
+                                'У пользователя %s недостаточно %s для заявки',
+                                user_login,
+                                cryptocurrency_name,
+                            )
+                            raise ValueError(
+                                f'У пользователя {user_login} недостаточно {cryptocurrency_name}'
+                            )
+                        # Стоимость монет уходит с позиции вместе с ними
+                        cost_basis, _ = sell_position(
+                            to_cents(notes_user_crypto.cost_basis),
+                            notes_user_crypto.count,
+                            0,
+                            count,
+                        )
+                        reserved_cost = notes_user_crypto.cost_basis - from_cents(
+                            cost_basis
+                        )
+                        notes_user_crypto.count -= count
+                        notes_user_crypto.cost_basis = from_cents(cost_basis)
+
+                    user.version += 1
+                    limit_order = LimitOrder(
+                        user_id=user.id,
+                        operation_id=self._get_operation_id(operation_name),
+                        cryptocurrency_id=cryptocurrency.id,
+                        price=limit_price,
+                        count=count,
+                        cost_basis=0 if is_buy else reserved_cost,
+                    )
+                    session.add(limit_order)
+                    session.flush()
+
+                    order = Order(
+                        limit_order.id, user.id, is_buy, int(limit_price * 100), count
+                    )
+                    fills = matching_engine.submit(cryptocurrency.id, order)
+                    self._settle_fills(session, cryptocurrency.id, order, fills)
+                    if order.count == 0:
+                        session.delete(limit_order)
+                    else:
+                        limit_order.count = order.count
+            except Exception:
+                if order is not None:
+                    # Книга в памяти разошлась с базой, перечитаем её заново
+                    self.matching_engine = None
+                raise
+
+        logger.info('Заявка %d исполнена сделками: %d', order.id, len(fills))
+        return order.id
+
+    def _settle_fills(
+        self,
+        session: Session,
+        cryptocurrency_id: int,
+        incoming: Order,
+        fills: list[Fill],
+    ) -> None:
+        for fill in fills:
+            price = Decimal(fill.price).scaleb(-2)
+
+            buyer = session.get(User, fill.buy_order.user_id)
+            buyer.version += 1
+            # Покупатель резервировал деньги по своей цене, вернём разницу
+            buyer.balance += (
+                Decimal(fill.buy_order.price - fill.price).scaleb(-2) * fill.count
+            )
+            notes_user_crypto = session.get(
+                UserCryptocurrency, (buyer.id, cryptocurrency_id)
+            )
+            if notes_user_crypto is None:
+                session.add(
+                    UserCryptocurrency(
+                        user_id=buyer.id,
+                        cryptocurrency_id=cryptocurrency_id,
+                        count=fill.count,
+                        cost_basis=price * fill.count,
+                        realised_pnl=0,
+                    )
+                )
+            else:
+                notes_user_crypto.count += fill.count
+                notes_user_crypto.cost_basis += price * fill.count
+
+            seller = session.get(User, fill.sell_order.user_id)
+            seller.balance += price * fill.count
+            seller.version += 1
+            # Прибыль продавца считается от стоимости, зарезервированной
+            # заявкой. Количество в заявке здесь ещё до этой сделки
+            sell_limit_order = session.get(LimitOrder, fill.sell_order.id)
+            cost_basis, realised_pnl = sell_position(
+                to_cents(sell_limit_order.cost_basis),
+                sell_limit_order.count,
+                fill.price,
+                fill.count,
+            )
+            sell_limit_order.cost_basis = from_cents(cost_basis)
+            sell_limit_order.count -= fill.count
+            session.get(
+                UserCryptocurrency, (seller.id, cryptocurrency_id)
+            ).realised_pnl += from_cents(realised_pnl)
+
+            for user_id, operation_name in (
+                (buyer.id, NameOperation.Buy.value),
+                (seller.id, NameOperation.Sell.value),
+            ):
+                session.add(
+                    HistoryOperation(
+                        user_id=user_id,
+                        operation_id=self._get_operation_id(operation_name),
+                        cryptocurrency_id=cryptocurrency_id,
+                        count=fill.count,
+                        price=price,
+                    )
+                )
+
+            # Обновим остаток заявки, стоявшей в книге
+            resting = fill.sell_order if incoming.is_buy else fill.buy_order
+            limit_order = session.get(LimitOrder, resting.id)
+            if resting.count == 0:
+                session.delete(limit_order)
+            else:
+                limit_order.count = resting.count
+
+    def cancel_limit_order(self, user_login: str, order_id: int) -> None:
+        logger.info('Пользователь %s снимает заявку %d', user_login, order_id)
+        with self._order_lock:
+            matching_engine = self._get_matching_engine()
+            cancelled = False
+            try:
+                with self._create_write_session() as session:
+                    limit_order = session.get(LimitOrder, order_id)
+                    if limit_order is None or limit_order.user.login != user_login:
+                        logger.error(
+                            'У пользователя %s нет заявки %d', user_login, order_id
+                        )
+                        raise ValueError(f'Заявки {order_id} не существует')
+
+                    if limit_order.operation.name == NameOperation.Buy.value:
+                        limit_order.user.balance += (
+                            limit_order.price * limit_order.count
+                        )
+                    else:
+                        notes_user_crypto = session.get(
+                            UserCryptocurrency,
+                            (limit_order.user_id, limit_order.cryptocurrency_id),
+                        )
+                        notes_user_crypto.count += limit_order.count
+                        notes_user_crypto.cost_basis += limit_order.cost_basis
+
+                    limit_order.user.version += 1
+                    matching_engine.cancel(limit_order.cryptocurrency_id, order_id)
+                    cancelled = True
+                    session.delete(limit_order)
+            except Exception:
+                if cancelled:
+                    self.matching_engine = None
+                raise
+
+    def get_order_book(
+        self, cryptocurrency_name: str, depth: int = 10
+    ) -> tuple[list[tuple[Decimal, int]], list[tuple[Decimal, int]]]:
+        with self._create_session() as session:
+            cryptocurrency_id = (
+                session.query(Cryptocurrency.id)
+                .where(Cryptocurrency.name == cryptocurrency_name)
+                .scalar()
+            )
+        if cryptocurrency_id is None:
+            raise ValueError('Такой криптовалюты не существует')
+
+        with self._order_lock:
+            book = self._get_matching_engine().get_book(cryptocurrency_id)
+            bids = book.depth(True, depth)
+            asks = book.depth(False, depth)
+        return (
+            [(Decimal(level.price).scaleb(-2), level.count) for level in bids],
+            [(Decimal(level.price).scaleb(-2), level.count) for level in asks],
+        )
+
+    def _get_matching_engine(self) -> MatchingEngine:
+        if self.matching_engine is not None:
+            return self.matching_engine
+
+        logger.info('Загрузим книги лимитных заявок')
+        matching_engine = MatchingEngine()
         with self._create_session() as session:
-            users = session.query(User).all()
+            rows = (
+                session.query(
+                    LimitOrder.id,
+                    LimitOrder.user_id,
+                    Operation.name,
+                    LimitOrder.cryptocurrency_id,
+                    LimitOrder.price,
+                    LimitOrder.count,
+                )
+                .join(Operation, LimitOrder.operation_id == Operation.id)
+                .order_by(LimitOrder.id)
+            )
+            for order_id, user_id, operation_name, crypto_id, price, count in rows:
+                matching_engine.get_book(crypto_id).add(
+                    Order(
+                        order_id,
+                        user_id,
+                        operation_name == NameOperation.Buy.value,
+                        int(price * 100),
+                        count,
+                    )
+                )
+        self.matching_engine = matching_engine
+        return matching_engine
 
-            res = []
+    def get_all_users(self) -> list[tuple[Any, Any, list[tuple[Any, Any]]]]:
+        # Пользователи и их портфели одним запросом, без ленивой загрузки связей
+        with self._create_session() as session:
+            rows = (
+                session.query(
+                    User.id,
+                    User.login,
+                    User.balance,
+                    Cryptocurrency.name,
+                    UserCryptocurrency.count,
+                )
+                .outerjoin(UserCryptocurrency, UserCryptocurrency.user_id == User.id)
+                .outerjoin(
+                    Cryptocurrency,
+                    UserCryptocurrency.cryptocurrency_id == Cryptocurrency.id,
+                )
+                .order_by(User.id, UserCryptocurrency.cryptocurrency_id)
+            )
 
-            for user in users:
-                user_crypto = []
-                for crypto in user.portfolio:
-                    cryptocurrency_name = crypto.cryptocurrencies.name
-                    crypto_count = crypto.count
-                    user_crypto.append((cryptocurrency_name, crypto_count))
-                res.append((user.login, user.balance, user_crypto))
+            res: list[tuple[Any, Any, list[tuple[Any, Any]]]] = []
+            last_user_id = None
+            for user_id, login, balance, cryptocurrency_name, crypto_count in rows:
+                if user_id != last_user_id:
+                    res.append((login, balance, []))
+                    last_user_id = user_id
+                if cryptocurrency_name is not None:
+                    res[-1][2].append((cryptocurrency_name, crypto_count))
 
             return res
 
     def get_all_crypto(self) -> list[tuple[str, str]]:
-        with self._create_session() as session:
-            cryptocurrencies = session.query(Cryptocurrency).all()
-            return [(crypto.name, crypto.cost) for crypto in cryptocurrencies]
+        return list(self.get_price_snapshot().prices)
 
     def get_all_operations(self) -> list[str]:
         with self._create_session() as session:
@@ -307,73 +1059,263 @@ class Trade:
 
     def get_all_history(self) -> list[tuple[str, str, str, str, str]]:
         with self._create_session() as session:
-            history = session.query(HistoryOperation).all()
-
-            return [
-                (
-                    i.user.login,
-                    i.operation.name,
-                    i.count,
-                    i.cryptocurrency.name,
-                    i.price,
+            history = (
+                session.query(
+                    User.login,
+                    Operation.name,
+                    HistoryOperation.count,
+                    Cryptocurrency.name,
+                    HistoryOperation.price,
                 )
-                for i in history
-            ]
+                .join(User, HistoryOperation.user_id == User.id)
+                .join(Operation, HistoryOperation.operation_id == Operation.id)
+                .join(
+                    Cryptocurrency,
+                    HistoryOperation.cryptocurrency_id == Cryptocurrency.id,
+                )
+                .order_by(HistoryOperation.id)
+            )
+
+            return [tuple(row) for row in history]
+
+    def iter_history(
+        self, history_filter: HistoryFilter, chunk_size: int = 10000
+    ) -> Iterator[list[tuple[Any, ...]]]:
+        # История отдаётся порциями по chunk_size строк. Каждая порция читается
+        # отдельным коротким запросом по ключу (id > последнего выданного), так
+        # что память не зависит от размера истории, а медленный потребитель не
+        # держит открытой транзакцию чтения
+        logger.info('Выгрузим историю операций: %s', history_filter)
+        with self._create_session() as session:
+            query = session.query(
+                HistoryOperation.id,
+                HistoryOperation.created_at,
+                User.login,
+                Operation.name,
+                Cryptocurrency.name,
+                HistoryOperation.count,
+                HistoryOperation.price,
+            )
+            if history_filter.user_login is not None:
+                user_id = (
+                    session.query(User.id)
+                    .where(User.login == history_filter.user_login)
+                    .scalar()
+                )
+                if user_id is None:
+                    logger.error(
+                        'Пользователя %s не существует', history_filter.user_login
+                    )
+                    raise ValueError(
+                        f'Пользователя {history_filter.user_login} не существует'
+                    )
+                query = query.where(HistoryOperation.user_id == user_id)
+            if history_filter.cryptocurrency_name is not None:
+                cryptocurrency_id = self._get_cryptocurrency_id(
+                    history_filter.cryptocurrency_name
+                )
+                if cryptocurrency_id is None:
+                    logger.error(
+                        'Криптовалюты %s не существует',
+                        history_filter.cryptocurrency_name,
+                    )
+                    raise ValueError('Такой криптовалюты не существует')
+                query = query.where(
+                    HistoryOperation.cryptocurrency_id == cryptocurrency_id
+                )
+        if history_filter.end_id is not None:
+            query = query.where(HistoryOperation.id <= history_filter.end_id)
+        if history_filter.start_time is not None:
+            query = query.where(
+                HistoryOperation.created_at >= history_filter.start_time
+            )
+        if history_filter.end_time is not None:
+            query = query.where(HistoryOperation.created_at <= history_filter.end_time)
+        query = (
+            query.join(User, HistoryOperation.user_id == User.id)
+            .join(Operation, HistoryOperation.operation_id == Operation.id)
+            .join(
+                Cryptocurrency, HistoryOperation.cryptocurrency_id == Cryptocurrency.id
+            )
+        )
+
+        # Фильтры проверяются сразу, а не при первом чтении из генератора,
+        # чтобы ошибку можно было вернуть до начала потоковой выдачи
+        return self._iter_history_chunks(
+            query, (history_filter.start_id or 1) - 1, chunk_size
+        )
+
+    def _iter_history_chunks(
+        self, query: Any, last_id: int, chunk_size: int
+    ) -> Iterator[list[tuple[Any, ...]]]:
+        while True:
+            with self._create_session() as session:
+                rows = [
+                    tuple(row)
+                    for row in query.with_session(session)
+                    .where(HistoryOperation.id > last_id)
+                    .order_by(HistoryOperation.id)
+                    .limit(chunk_size)
+                ]
+            if not rows:
+                return
+            yield rows
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1][0]
 
     def get_user_balance(self, user_login: str) -> str:
-        logger.info('Получим баланс пользователя %s', user_login)
+        logger.debug('Получим баланс пользователя %s', user_login)
         with self._create_session() as session:
-            user = session.query(User).where(User.login == user_login).first()
+            balance = session.execute(select_user_balance(user_login)).scalar()
 
-            if user is None:
-                logger.error('Пользователя %s не существует', user_login)
-                raise ValueError(f'Пользователя {user_login} не существует')
+        if balance is None:
+            logger.error('Пользователя %s не существует', user_login)
+            raise ValueError(f'Пользователя {user_login} не существует')
 
-            logger.info('Баланс пользователя %s равен %s', user_login, user.balance)
+        logger.debug('Баланс пользователя %s равен %s', user_login, balance)
+        return balance
 
-            return user.balance
+    def get_user_balance_and_version(self, user_login: str) -> tuple[Any, int]:
+        with self._create_session() as session:
+            row = session.execute(select_user_balance_and_version(user_login)).first()
+
+        if row is None:
+            logger.error('Пользователя %s не существует', user_login)
+            raise ValueError(f'Пользователя {user_login} не существует')
+        return row[0], row[1]
 
     def get_user_portfolio(self, user_login: str) -> list[tuple[str, str]]:
-        logger.info('Получим портфель пользователя %s', user_login)
+        logger.debug('Получим портфель пользователя %s', user_login)
         with self._create_session() as session:
-            user = session.query(User).where(User.login == user_login).first()
+            # Внешнее соединение оставит строку пользователя и при пустом портфеле
+            rows = (
+                session.query(UserCryptocurrency.count, Cryptocurrency.name)
+                .select_from(User)
+                .outerjoin(
+                    UserCryptocurrency,
+                    sa.and_(
+                        UserCryptocurrency.user_id == User.id,
+                        UserCryptocurrency.count != 0,
+                    ),
+                )
+                .outerjoin(
+                    Cryptocurrency,
+                    UserCryptocurrency.cryptocurrency_id == Cryptocurrency.id,
+                )
+                .where(User.login == user_login)
+                .order_by(UserCryptocurrency.cryptocurrency_id)
+                .all()
+            )
 
-            if user is None:
+            if not rows:
                 logger.error('Пользователя %s не существует', user_login)
                 raise ValueError(f'Пользователя {user_login} не существует')
 
-            res = []
-            for portfolio in user.portfolio:
-                if portfolio.count == 0:
-                    continue
-                res.append((portfolio.count, portfolio.cryptocurrencies.name))
+            res = [(count, name) for count, name in rows if count is not None]
 
-            logger.info('Баланс пользователя %s состоит из %s', user_login, res)
+            logger.debug('Баланс пользователя %s состоит из %s', user_login, res)
             return res
 
+    def get_user_positions(self, user_login: str) -> list[PositionSummary]:
+        # Позиции со стоимостью и прибылью
+        logger.debug('Получим позиции пользователя %s', user_login)
+        prices = self.get_price_snapshot().by_name
+        with self._create_session() as session:
+            rows = session.execute(select_user_positions(user_login)).all()
+        return summarize_positions(user_login, rows, prices)
+
     def is_user_exist(self, user_login: str) -> bool:
-        logger.info('Узнаем, существует ли пользователь %s', user_login)
+        logger.debug('Узнаем, существует ли пользователь %s', user_login)
         with self._create_session() as session:
             user = session.query(User).where(User.login == user_login).first()
             return user is not None
 
     def get_cryptocurrency_cost(self, cryptocurrency_name: str) -> str:
-        logger.info('Получим стоимость %s', cryptocurrency_name)
-        with self._create_session() as session:
-            cryptocurrency = (
-                session.query(Cryptocurrency)
-                .where(Cryptocurrency.name == cryptocurrency_name)
-                .first()
+        logger.debug('Получим стоимость %s', cryptocurrency_name)
+        prices = self.get_price_snapshot().by_name
+        if cryptocurrency_name not in prices:
+            logger.error('Криптовалюты %s не существует', cryptocurrency_name)
+            raise ValueError('Такой криптовалюты не существует')
+        return prices[cryptocurrency_name]
+
+    def get_candles(
+        self,
+        cryptocurrency_name: str,
+        interval: int,
+        start: int,
+        end: int,
+        max_points: Optional[int] = None,
+    ) -> list[Candle]:
+        logger.debug(
+            'Получим свечи %s по %d с за [%d, %d)',
+            cryptocurrency_name,
+            interval,
+            start,
+            end,
+        )
+        cryptocurrency_id = self._get_cryptocurrency_id(cryptocurrency_name)
+        if cryptocurrency_id is None:
+            logger.error('Криптовалюты %s не существует', cryptocurrency_name)
+            raise ValueError('Такой криптовалюты не существует')
+        if interval <= 0 or end <= start:
+            raise ValueError('Неверный интервал свечей')
+        if max_points is not None and max_points <= 0:
+            raise ValueError('Неверное количество точек')
+
+        with self.engine.connect() as connection:
+            return select_candles(
+                connection, cryptocurrency_id, interval, start, end, max_points
             )
-            return cryptocurrency.cost
 
     def get_user_history_operation(self, user_login: str) -> list[tuple[str, str, str]]:
-        logger.info('Получим историю операций пользователя %s', user_login)
+        logger.debug('Получим историю операций пользователя %s', user_login)
         with self._create_session() as session:
-            user = session.query(User).where(User.login == user_login).first()
-            list_operation = user.history_operations
-            res = [
-                (op.operation.name, op.cryptocurrency.name, op.count)
-                for op in list_operation
-            ]
-            return res
+            user_id = session.query(User.id).where(User.login == user_login).scalar()
+            if user_id is None:
+                logger.error('Пользователя %s не существует', user_login)
+                raise ValueError(f'Пользователя {user_login} не существует')
+
+            list_operation = (
+                session.query(
+                    Operation.name, Cryptocurrency.name, HistoryOperation.count
+                )
+                .join(Operation, HistoryOperation.operation_id == Operation.id)
+                .join(
+                    Cryptocurrency,
+                    HistoryOperation.cryptocurrency_id == Cryptocurrency.id,
+                )
+                .where(HistoryOperation.user_id == user_id)
+                .order_by(HistoryOperation.id)
+            )
+            return [tuple(row) for row in list_operation]
+
+    def get_user_history_operation_page(
+        self,
+        user_login: str,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+    ) -> HistoryPage:
+        logger.debug(
+            'Получим страницу истории операций пользователя %s (before=%s, after=%s)',
+            user_login,
+            before_id,
+            after_id,
+        )
+        with self._create_session() as session:
+            user_id = session.execute(select_user_id(user_login)).scalar()
+            if user_id is None:
+                logger.error('Пользователя %s не существует', user_login)
+                raise ValueError(f'Пользователя {user_login} не существует')
+
+            rows = session.execute(
+                select_history_page(user_id, limit, before_id, after_id)
+            ).all()
+        return make_history_page(rows, limit, before_id, after_id)
+
+    def count_user_history_operation(self, user_login: str) -> int:
+        with self._create_session() as session:
+            return session.execute(
+                select_count_user_history_operation(user_login)
+            ).scalar()
@@ -0,0 +1,15 @@
+import os
+
+try:
+    from app.app import application, init_application
+except ImportError:  # pragma: no cover
+    from app import application, init_application  # type: ignore
+
+# Точка входа для WSGI-сервера с несколькими процессами и потоками:
+#   APP_SECRET_KEY=... gunicorn --workers 4 --threads 8 'app.wsgi:app'
+# Каждый процесс подключается к базе сам, пользователь хранится в cookie.
+# Лог каждый процесс пишет в свой файл, а /metrics показывает счётчики
+# ответившего процесса
+os.environ.setdefault('APP_LOG_FILE', 'app.{pid}.log')
+init_application()
+app = application.app
@@ -0,0 +1,61 @@
+# Сравнение двух файлов результатов `make bench`:
+#
+#     python -m tests.bench.compare old.json new.json --threshold 0.1
+#
+# Сравниваются медианы замеров с одинаковым именем и параметрами. Код
+# возврата 1, если хоть один замер замедлился больше чем на threshold.
+import argparse
+import json
+import sys
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as file:
+        data = json.load(file)
+    return data.get('commit'), {
+        (result['name'], json.dumps(result['params'], sort_keys=True)): result
+        for result in data['results']
+    }
+
+
+def compare(old_path, new_path, threshold):
+    old_commit, old_results = load_results(old_path)
+    new_commit, new_results = load_results(new_path)
+    print(f'{old_commit} -> {new_commit}')
+
+    regressions = []
+    for key in sorted(old_results.keys() & new_results.keys()):
+        old_median = old_results[key]['median']
+        new_median = new_results[key]['median']
+        change = new_median / old_median - 1
+        mark = ''
+        if change > threshold:
+            mark = '  <-- медленнее'
+            regressions.append(key)
+        elif change < -threshold:
+            mark = '  <-- быстрее'
+        print(
+            f'{key[0]}: {old_median * 1000:.2f} ms -> {new_median * 1000:.2f} ms'
+            f' ({change:+.1%}){mark}'
+        )
+    for key in sorted(old_results.keys() ^ new_results.keys()):
+        print(f'{key[0]}: есть только в одном из файлов')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Сравнить результаты бенчмарков')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.1,
+        help='Допустимое относительное замедление медианы',
+    )
+    args = parser.parse_args(argv)
+    return 1 if compare(args.old, args.new, args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
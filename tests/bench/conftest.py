@@ -0,0 +1,92 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+RESULTS_KEY = pytest.StashKey[list]()
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--bench-json',
+        default=None,
+        help='Файл, в который сохранить результаты бенчмарков в JSON',
+    )
+
+
+def pytest_configure(config):
+    config.stash[RESULTS_KEY] = []
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pytest_sessionfinish(session):
+    path = session.config.getoption('bench_json', default=None)
+    results = session.config.stash[RESULTS_KEY]
+    if path is None or not results:
+        return
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(
+            {
+                'commit': get_commit(),
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results,
+            },
+            file,
+            ensure_ascii=False,
+            indent=2,
+        )
+
+
+@pytest.fixture()
+def benchmark(request):
+    # Замер вызывается как benchmark(func, *args, rounds=..., **params):
+    # params попадают в результат и вместе с именем теста образуют его ключ
+    results = request.config.stash[RESULTS_KEY]
+
+    def measure(func, *args, rounds=5, setup=None, **params):
+        # Первый вызов не замеряем: он прогревает кэши и пул соединений
+        if setup is not None:
+            setup()
+        func(*args)
+
+        durations = []
+        for _ in range(rounds):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            func(*args)
+            durations.append(time.perf_counter() - started)
+
+        result = {
+            'name': request.node.name,
+            'params': params,
+            'rounds': rounds,
+            'min': min(durations),
+            'median': statistics.median(durations),
+            'mean': statistics.fmean(durations),
+        }
+        results.append(result)
+        print(
+            f'\n{result["name"]} {params}: median {result["median"] * 1000:.2f} ms,'
+            f' min {result["min"] * 1000:.2f} ms'
+        )
+        return result
+
+    return measure
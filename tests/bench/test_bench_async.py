@@ -0,0 +1,159 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from werkzeug.serving import make_server
+
+from app.app import application
+from app.async_trade import AsyncTrade
+from app.database import DatabaseSettings, create_async_engine, create_engine
+from app.loadgen import HttpClient
+from app.trade import NameOperation, Trade
+
+pytestmark = pytest.mark.bench
+
+COUNT_USERS = 100
+COUNT_CRYPTO = 10
+COUNT_HISTORY = 100_000
+COUNT_READS = 640
+CONCURRENCY = [1, 16, 64]
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    settings = DatabaseSettings(path=str(tmp_path_factory.mktemp('async') / 'db.db'))
+    trade = Trade(create_engine(settings))
+    trade.base_create_all()
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    with trade.engine.begin() as connection:
+        connection.exec_driver_sql(
+            'INSERT INTO user (login, balance) VALUES (?, 1000000000)',
+            [(f'name_{i}',) for i in range(COUNT_USERS)],
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO cryptocurrency (name, cost) VALUES (?, 1)',
+            [(f'crypto_{i}',) for i in range(COUNT_CRYPTO)],
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO "UserCryptocurrency" '
+            '(user_id, cryptocurrency_id, count, cost_basis) VALUES (?, ?, 1000, 1000)',
+            [
+                (user_id, crypto_id)
+                for user_id in range(1, COUNT_USERS + 1)
+                for crypto_id in range(1, COUNT_CRYPTO + 1)
+            ],
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO "HistoryOperation" '
+            '(user_id, operation_id, cryptocurrency_id, count, price, created_at) '
+            'VALUES (?, 1, ?, 1, 1, ?)',
+            [
+                (i % COUNT_USERS + 1, i % COUNT_CRYPTO + 1, i)
+                for i in range(COUNT_HISTORY)
+            ],
+        )
+    async_trade = AsyncTrade(trade, create_async_engine(settings))
+    yield trade, async_trade
+    async_trade.close()
+
+
+def report(name, count, result):
+    print(f'{name}: {count / result["median"]:.0f} чтений/с')
+
+
+# Чтение страницы портфеля: позиции и баланс
+def read_portfolio_sync(trade, index):
+    login = f'name_{index % COUNT_USERS}'
+    trade.get_user_positions(login)
+    trade.get_user_balance(login)
+
+
+async def read_portfolio_async(async_trade, index):
+    login = f'name_{index % COUNT_USERS}'
+    await asyncio.gather(
+        async_trade.get_user_positions(login), async_trade.get_user_balance(login)
+    )
+
+
+@pytest.mark.parametrize('concurrency', CONCURRENCY)
+def test_bench_portfolio_reads_threads(dataset, benchmark, concurrency):
+    trade, _ = dataset
+
+    def run():
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(
+                executor.map(
+                    lambda i: read_portfolio_sync(trade, i), range(COUNT_READS)
+                )
+            )
+
+    result = benchmark(run, rounds=3, path='sync', concurrency=concurrency)
+    report(f'Trade, потоков {concurrency}', COUNT_READS, result)
+
+
+@pytest.mark.parametrize('concurrency', CONCURRENCY)
+def test_bench_portfolio_reads_asyncio(dataset, benchmark, concurrency):
+    _, async_trade = dataset
+
+    async def run_all():
+        # Не больше concurrency чтений одновременно
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def read(index):
+            async with semaphore:
+                await read_portfolio_async(async_trade, index)
+
+        await asyncio.gather(*[read(i) for i in range(COUNT_READS)])
+
+    result = benchmark(
+        lambda: asyncio.run(run_all()), rounds=3, path='async', concurrency=concurrency
+    )
+    report(f'AsyncTrade, одновременно {concurrency}', COUNT_READS, result)
+
+
+@pytest.fixture()
+def server(dataset, monkeypatch):
+    trade, _ = dataset
+    monkeypatch.setattr(application, 'trade', trade)
+    http_server = make_server('127.0.0.1', 0, application.app, threaded=True)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{http_server.server_port}'
+    http_server.shutdown()
+
+
+@pytest.mark.parametrize('path', ['sync', 'async'])
+@pytest.mark.parametrize('concurrency', [1, 16])
+def test_bench_portfolio_route(  # pylint: disable=too-many-arguments
+    dataset, server, benchmark, monkeypatch, path, concurrency
+):
+    # Представление асинхронное в обоих случаях, различается только чтение
+    _, async_trade = dataset
+    monkeypatch.setattr(
+        application, 'async_trade', async_trade if path == 'async' else None
+    )
+    clients = [HttpClient(server) for _ in range(concurrency)]
+    for index, client in enumerate(clients):
+        client.request(
+            'POST', '/authorization_user', {'user_login_in': f'name_{index}'}
+        )
+    count_requests = 20 * concurrency
+
+    def work(client):
+        for _ in range(count_requests // concurrency):
+            assert client.request('GET', '/user_portfolio').status == 200
+
+    def run():
+        threads = [threading.Thread(target=work, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    result = benchmark(run, rounds=3, path=path, concurrency=concurrency)
+    print(
+        f'/user_portfolio, {path}, клиентов {concurrency}: '
+        f'{count_requests / result["median"]:.0f} запросов/с'
+    )
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from app.backtest import (
+    moving_average_crossover,
+    run_orders,
+    run_strategy,
+    simulate_price_series,
+)
+from app.market import MarketModel
+
+pytestmark = pytest.mark.bench
+
+YEAR_OF_TICKS = 365 * 24 * 60 * 60 // 10
+COUNT_CRYPTO = 5
+
+
+@pytest.fixture(scope='module')
+def series():
+    # Три года тиков раз в 10 секунд
+    return simulate_price_series(
+        MarketModel(
+            drift=0.1, volatility=0.8, correlation=0.5, tick_seconds=10, seed=1
+        ),
+        [f'crypto_{i}' for i in range(COUNT_CRYPTO)],
+        np.full(COUNT_CRYPTO, 10000),
+        3 * YEAR_OF_TICKS,
+    )
+
+
+def test_bench_backtest_orders_three_years(series, benchmark):
+    strategy = moving_average_crossover(360, 8640, 1)
+
+    def run():
+        return run_orders(series, strategy(series), 1_000_000)
+
+    result = benchmark(run, rounds=3, steps=len(series.times))
+    summary = run().summary()
+    print(
+        f'\n{len(series.times)} шагов x {COUNT_CRYPTO} валют:'
+        f' {result["median"]:.2f} с, сделок {summary["fills"]}'
+    )
+
+
+class Rebalance:
+    # Раз в час держать поровну монет каждой валюты
+    def on_tick(self, step, prices, account):
+        if step % 360:
+            return
+        for index in range(len(prices)):
+            if account.counts[index] < 1:
+                account.buy(index, 1)
+
+
+def test_bench_backtest_strategy_callbacks(series, benchmark):
+    steps = YEAR_OF_TICKS // 12
+    month = series._replace(times=series.times[:steps], cents=series.cents[:steps])
+
+    result = benchmark(
+        run_strategy, month, Rebalance(), 1_000_000, rounds=3, steps=steps
+    )
+
+    print(f'\nВызовы на каждом шаге: {steps / result["median"] / 1e6:.2f} млн шагов/с')
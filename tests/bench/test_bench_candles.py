@@ -0,0 +1,74 @@
+import time
+
+import numpy as np
+import pytest
+import sqlalchemy as sa
+
+from app.candles import CANDLE_INTERVALS
+from app.trade import Trade
+
+pytestmark = pytest.mark.bench
+
+YEAR = 365 * 24 * 60 * 60
+TICK = 10
+
+
+def fill_year_of_candles(engine, cryptocurrency_id):
+    # Свечи года тиков раз в 10 секунд, собранные так же, как их собирает тик
+    prices = np.round(
+        100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 1e-3, YEAR // TICK))),
+        2,
+    )  # pylint: disable=line-too-long
+    times = np.arange(0, YEAR, TICK)
+    rows = []
+    for interval in CANDLE_INTERVALS:
+        starts = times - times % interval
+        bounds = np.flatnonzero(np.diff(starts)) + 1
+        first = np.concatenate(([0], bounds))
+        last = np.concatenate((bounds, [len(times)])) - 1
+        rows += zip(
+            [cryptocurrency_id] * len(first),
+            [interval] * len(first),
+            starts[first].tolist(),
+            prices[first].tolist(),
+            np.maximum.reduceat(prices, first).tolist(),
+            np.minimum.reduceat(prices, first).tolist(),
+            prices[last].tolist(),
+        )
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'INSERT INTO "PriceCandle" VALUES (?, ?, ?, ?, ?, ?, ?)', rows
+        )
+    return len(rows)
+
+
+def test_bench_get_candles_year(tmp_path):
+    engine = sa.create_engine(f'sqlite:///{tmp_path / "candles.db"}')
+    trade = Trade(engine)
+    trade.base_create_all()
+    trade.create_cryptocurrency('crypto_1', '100')
+    count_rows = fill_year_of_candles(engine, 1)
+
+    for interval, max_points in [(3600, None), (3600, 500), (86400, None), (300, 1000)]:
+        trade.get_candles('crypto_1', interval, 0, YEAR, max_points)
+        started = time.perf_counter()
+        candles = trade.get_candles('crypto_1', interval, 0, YEAR, max_points)
+        elapsed = time.perf_counter() - started
+        print(
+            f'\n{count_rows} свечей в базе, интервал {interval}, max_points {max_points}:'
+            f' {len(candles)} точек за {elapsed * 1000:.1f} мс'
+        )
+
+
+def test_bench_tick_with_candles(tmp_path):
+    engine = sa.create_engine(f'sqlite:///{tmp_path / "ticks.db"}')
+    trade = Trade(engine, bulk_tick=True)
+    trade.base_create_all()
+    for i in range(1000):
+        trade.create_cryptocurrency(f'crypto_{i}', '100')
+
+    started = time.perf_counter()
+    for tick_time in range(0, 100 * TICK, TICK):
+        trade.update_cost(tick_time=tick_time)
+    elapsed = time.perf_counter() - started
+    print(f'\n100 тиков по 1000 валют со свечами: {elapsed / 100 * 1000:.1f} мс на тик')
@@ -0,0 +1,70 @@
+import pytest
+
+from app.app import application
+from app.database import DatabaseSettings, create_engine
+from app.render_cache import RenderCache
+from app.trade import NameOperation, Trade
+
+pytestmark = pytest.mark.bench
+
+COUNT_CRYPTO = 100
+COUNT_REQUESTS = 200
+URLS = ['/index', '/user_portfolio', '/history_operations']
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    settings = DatabaseSettings(path=str(tmp_path_factory.mktemp('etag') / 'db.db'))
+    trade = Trade(create_engine(settings))
+    trade.base_create_all()
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    trade.create_user('name_1')
+    with trade.engine.begin() as connection:
+        connection.exec_driver_sql(
+            'INSERT INTO cryptocurrency (name, cost) VALUES (?, 1.5)',
+            [(f'crypto_{i}',) for i in range(COUNT_CRYPTO)],
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO "UserCryptocurrency" '
+            '(user_id, cryptocurrency_id, count, cost_basis) VALUES (1, ?, 10, 10)',
+            [(crypto_id,) for crypto_id in range(1, COUNT_CRYPTO + 1)],
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO "HistoryOperation" '
+            '(user_id, operation_id, cryptocurrency_id, count, price, created_at) '
+            'VALUES (1, 1, ?, 1, 1, ?)',
+            [(i % COUNT_CRYPTO + 1, i) for i in range(1000)],
+        )
+    return trade
+
+
+@pytest.mark.parametrize('url', URLS)
+@pytest.mark.parametrize('mode', ['full', 'gzip', 'not_modified'])
+def test_bench_conditional_get(  # pylint: disable=too-many-arguments
+    dataset, benchmark, monkeypatch, url, mode
+):
+    # Опрос страницы, которая не менялась: полный ответ, сжатый ответ и 304
+    monkeypatch.setattr(application, 'trade', dataset)
+    monkeypatch.setattr(application, 'async_trade', None)
+    monkeypatch.setattr(application, 'render_cache', RenderCache())
+    client = application.app.test_client()
+    client.post('/authorization_user', data={'user_login_in': 'name_1'})
+    headers = {}
+    if mode != 'full':
+        headers['Accept-Encoding'] = 'gzip'
+    if mode == 'not_modified':
+        headers['If-None-Match'] = client.get(url, headers=headers).headers['ETag']
+    sizes = []
+
+    def run():
+        sizes.clear()
+        for _ in range(COUNT_REQUESTS):
+            sizes.append(len(client.get(url, headers=headers).data))
+
+    result = benchmark(run, rounds=5, url=url, mode=mode)
+
+    print(
+        f'\n{url}, {mode}: {COUNT_REQUESTS / result["median"]:.0f} запросов/с, '
+        f'{sizes[0]} байт тела'
+    )
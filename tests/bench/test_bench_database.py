@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.exc import OperationalError
+
+from app.database import DatabaseSettings, create_engine
+from app.trade import NameOperation, Trade
+
+pytestmark = pytest.mark.bench
+
+COUNT_THREADS = 8
+DURATION = 3
+
+
+def run_load(engine):
+    trade = Trade(engine)
+    trade.base_create_all()
+    for i in range(COUNT_THREADS):
+        trade.create_user(f'name_{i}')
+    for i in range(10):
+        trade.create_cryptocurrency(f'crypto_{i}', '1')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+
+    stop = threading.Event()
+    counters = {'trades': 0, 'reads': 0, 'ticks': 0, 'locked': 0}
+    lock = threading.Lock()
+
+    def count(name):
+        with lock:
+            counters[name] += 1
+
+    def trader(user_login):
+        while not stop.is_set():
+            try:
+                trade.user_buy_cryptocurrency(user_login, 'crypto_1', 1)
+                trade.user_sell_cryptocurrency(user_login, 'crypto_1', 1)
+                count('trades')
+                trade.get_user_history_operation_page(user_login, 5)
+                count('reads')
+            except OperationalError:
+                count('locked')
+
+    def ticker():
+        while not stop.is_set():
+            try:
+                trade.update_cost()
+                count('ticks')
+            except OperationalError:
+                count('locked')
+
+    threads = [
+        threading.Thread(target=trader, args=(f'name_{i}',))
+        for i in range(COUNT_THREADS)
+    ]
+    threads.append(threading.Thread(target=ticker))
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return counters
+
+
+@pytest.mark.parametrize('profile', ['default', 'tuned'])
+def test_bench_concurrent_trades(tmp_path, profile):
+    path = tmp_path / f'{profile}.db'
+    if profile == 'default':
+        engine = sa.create_engine(f'sqlite:///{path}')
+    else:
+        engine = create_engine(DatabaseSettings(path=str(path)))
+
+    counters = run_load(engine)
+
+    print(
+        f'\n{profile}: {counters["trades"] / DURATION:.0f} trades/s, '
+        f'{counters["reads"] / DURATION:.0f} reads/s, '
+        f'{counters["ticks"] / DURATION:.1f} ticks/s, '
+        f'{counters["locked"]} "database is locked" errors'
+    )
+    assert counters['trades'] > 0
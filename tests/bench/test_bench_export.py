@@ -0,0 +1,47 @@
+import time
+import tracemalloc
+
+import pytest
+import sqlalchemy as sa
+
+from app.export import format_csv
+from app.trade import HistoryFilter, NameOperation, Trade
+
+pytestmark = pytest.mark.bench
+
+COUNT_ROWS = 1_000_000
+
+
+def test_bench_export_history_memory(tmp_path):
+    engine = sa.create_engine(f'sqlite:///{tmp_path / "export.db"}')
+    trade = Trade(engine)
+    trade.base_create_all()
+    for i in range(100):
+        trade.create_user(f'name_{i}')
+    for i in range(10):
+        trade.create_cryptocurrency(f'crypto_{i}', '1')
+    trade.create_operation(NameOperation.Buy.value)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'INSERT INTO "HistoryOperation" '
+            '(user_id, operation_id, cryptocurrency_id, count, price, created_at) '
+            'VALUES (?, 1, ?, 1, 1.5, ?)',
+            [(i % 100 + 1, i % 10 + 1, i) for i in range(COUNT_ROWS)],
+        )
+
+    started = time.perf_counter()
+    size = sum(len(text) for text in format_csv(trade.iter_history(HistoryFilter())))
+    elapsed = time.perf_counter() - started
+
+    # Память меряем отдельным проходом: tracemalloc сильно замедляет выгрузку
+    tracemalloc.start()
+    for _ in format_csv(trade.iter_history(HistoryFilter())):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f'\n{COUNT_ROWS} строк ({size / 2**20:.0f} МиБ CSV) за {elapsed:.1f} с,'
+        f' пик памяти {peak / 2**20:.1f} МиБ'
+    )
+    assert peak < 64 * 2**20
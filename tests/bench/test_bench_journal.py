@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+from app.journal import (
+    CryptocurrencyListed,
+    JournalWriter,
+    LedgerState,
+    PriceTicked,
+    TradeExecuted,
+    UserCreated,
+    encode_snapshot,
+    list_segments,
+    recover,
+    write_snapshot,
+)
+
+pytestmark = pytest.mark.bench
+
+COUNT_EVENTS = int(os.environ.get('BENCH_JOURNAL_EVENTS', 10_000_000))
+COUNT_USERS = 10_000
+COUNT_CRYPTO = 10
+# Как у леджера по умолчанию: после снимка повторяется не больше этого
+SNAPSHOT_TAIL = 100_000
+
+
+def generate_events(count):
+    seq = 0
+    for user_id in range(1, COUNT_USERS + 1):
+        seq += 1
+        yield UserCreated(seq, user_id, f'name_{user_id}', 10**9)
+    for crypto_id in range(1, COUNT_CRYPTO + 1):
+        seq += 1
+        yield CryptocurrencyListed(seq, crypto_id, f'crypto_{crypto_id}', 10000)
+    while seq < count:
+        seq += 1
+        if seq % 1000 == 0:
+            yield PriceTicked(
+                seq,
+                seq,
+                [(crypto_id, 10000 + seq % 100) for crypto_id in range(1, 11)],
+            )
+        else:
+            yield TradeExecuted(
+                seq,
+                seq,
+                'Buy',
+                seq % COUNT_USERS + 1,
+                seq % COUNT_CRYPTO + 1,
+                1,
+                10000,
+                10**9 - seq,
+                seq // COUNT_USERS,
+                seq // COUNT_USERS * 10000,
+                0,
+            )
+
+
+@pytest.fixture(scope='module')
+def journal(tmp_path_factory):
+    # Один журнал на COUNT_EVENTS событий в двух каталогах: без снимка и
+    # со снимком за SNAPSHOT_TAIL событий до конца. Как и леджер, после
+    # снимка журнал переходит на новый сегмент
+    full_directory = str(tmp_path_factory.mktemp('journal-full'))
+    snapshot_directory = str(tmp_path_factory.mktemp('journal-snapshot'))
+    writer = JournalWriter(full_directory, 1)
+    state = LedgerState()
+    for event in generate_events(COUNT_EVENTS):
+        writer.append(event)
+        if event.seq <= COUNT_EVENTS - SNAPSHOT_TAIL:
+            state.apply(event)
+        if event.seq == COUNT_EVENTS - SNAPSHOT_TAIL:
+            writer.rotate()
+    writer.close()
+
+    for _, path in list_segments(full_directory):
+        os.symlink(path, os.path.join(snapshot_directory, os.path.basename(path)))
+    write_snapshot(snapshot_directory, state.seq, encode_snapshot(state))
+    return full_directory, snapshot_directory, state
+
+
+def report(name, count, result):
+    print(f'{name}: {count / result["median"]:.0f} событий/с')
+
+
+def test_bench_recover_full_journal(journal, benchmark):
+    full_directory, _, _ = journal
+    result = benchmark(recover, full_directory, rounds=1, events=COUNT_EVENTS)
+    report('Повтор всего журнала', COUNT_EVENTS, result)
+    assert recover(full_directory).seq == COUNT_EVENTS
+
+
+def test_bench_recover_from_snapshot(journal, benchmark):
+    _, snapshot_directory, _ = journal
+    result = benchmark(
+        recover,
+        snapshot_directory,
+        rounds=5,
+        events=COUNT_EVENTS,
+        tail=SNAPSHOT_TAIL,
+    )
+    report('Снимок и хвост журнала', SNAPSHOT_TAIL, result)
+    assert recover(snapshot_directory).seq == COUNT_EVENTS
+
+
+def test_bench_write_snapshot(journal, benchmark, tmp_path):
+    _, _, state = journal
+
+    def snapshot():
+        write_snapshot(str(tmp_path), state.seq, encode_snapshot(state))
+
+    benchmark(snapshot, rounds=5, users=COUNT_USERS, crypto=COUNT_CRYPTO)
+
+
+def test_bench_journal_append(benchmark, tmp_path):
+    events = list(generate_events(COUNT_USERS + COUNT_CRYPTO + 100_000))[
+        COUNT_USERS + COUNT_CRYPTO :
+    ]
+
+    def append():
+        writer = JournalWriter(str(tmp_path / str(len(os.listdir(tmp_path)))), 1)
+        for event in events:
+            writer.append(event)
+        writer.close()
+
+    result = benchmark(append, rounds=3, events=len(events))
+    report('Запись в журнал', len(events), result)
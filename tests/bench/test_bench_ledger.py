@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+from app.database import DatabaseSettings, create_engine
+from app.ledger import LedgerSettings, LedgerTrade
+from app.trade import NameOperation, Trade
+
+pytestmark = pytest.mark.bench
+
+COUNT_USERS = 100
+COUNT_TRADES = 1000
+
+# (имя, леджер, sync_commit)
+BACKENDS = [
+    ('sql', False, None),
+    ('ledger-sync', True, True),
+    ('ledger-nosync', True, False),
+]
+
+
+@pytest.fixture(params=BACKENDS, ids=[backend[0] for backend in BACKENDS])
+def backend(request, tmp_path):
+    name, is_ledger, sync_commit = request.param
+    engine = create_engine(DatabaseSettings(path=str(tmp_path / 'ledger.db')))
+    if not is_ledger:
+        trade = Trade(engine)
+    else:
+        trade = LedgerTrade(
+            engine,
+            settings=LedgerSettings(
+                directory=str(tmp_path / 'ledger'),
+                sync_commit=sync_commit,
+            ),
+        )
+    trade.base_create_all()
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    # Пользователей добавляем до того, как леджер загрузит состояние из базы
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'INSERT INTO user (login, balance) VALUES (?, 1000000000)',
+            [(f'name_{i}',) for i in range(COUNT_USERS)],
+        )
+    trade.create_cryptocurrency('crypto_0', '1')
+    yield trade, {'backend': name}
+    if isinstance(trade, LedgerTrade):
+        trade.close()
+
+
+def run_trades(trade, count_threads):
+    # Каждый поток покупает и продаёт за своих пользователей
+    def worker(index):
+        for i in range(COUNT_TRADES // count_threads):
+            login = f'name_{(index + i * count_threads) % COUNT_USERS}'
+            trade.user_buy_cryptocurrency(login, 'crypto_0', 1)
+            trade.user_sell_cryptocurrency(login, 'crypto_0', 1)
+
+    threads = [
+        threading.Thread(target=worker, args=(index,)) for index in range(count_threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+@pytest.mark.parametrize('count_threads', [1, 8])
+def test_bench_trades(backend, benchmark, count_threads):
+    trade, params = backend
+    result = benchmark(
+        run_trades,
+        trade,
+        count_threads,
+        rounds=3,
+        trades=2 * COUNT_TRADES,
+        threads=count_threads,
+        **params,
+    )
+    print(
+        f'{params["backend"]}, потоков {count_threads}: '
+        f'{2 * COUNT_TRADES / result["median"]:.0f} сделок/с'
+    )
+    if isinstance(trade, LedgerTrade):
+        trade.flush()
+        assert Trade(trade.engine).get_all_users() == trade.get_all_users()
@@ -0,0 +1,102 @@
+import logging
+import time
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.pool import StaticPool
+
+from app.logging_config import LoggingSettings, setup_logging, stop_logging
+from app.trade import NameOperation, Trade
+
+pytestmark = pytest.mark.bench
+
+COUNT_TRADES = 2000
+
+
+def create_trade():
+    # База в памяти, чтобы задержку сделки не заслоняла запись на диск
+    engine = sa.create_engine('sqlite://', poolclass=StaticPool)
+    trade = Trade(engine)
+    trade.base_create_all()
+    trade.create_user('name_1')
+    trade.create_cryptocurrency('crypto_1', '1')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    return trade
+
+
+def measure_trades(trade):
+    start = time.perf_counter()
+    for _ in range(COUNT_TRADES // 2):
+        trade.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+        trade.user_sell_cryptocurrency('name_1', 'crypto_1', 1)
+    return (time.perf_counter() - start) / COUNT_TRADES
+
+
+def test_bench_trade_logging(tmp_path):
+    root = logging.getLogger()
+    level = root.level
+    trade = create_trade()
+    results = {}
+
+    # Как было: синхронная запись в файл на уровне DEBUG
+    file_handler = logging.FileHandler(tmp_path / 'sync.log', encoding='utf-8')
+    file_handler.setFormatter(
+        logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+    )
+    root.addHandler(file_handler)
+    root.setLevel(logging.DEBUG)
+    try:
+        results['sync DEBUG'] = measure_trades(trade)
+    finally:
+        root.removeHandler(file_handler)
+        file_handler.close()
+
+    try:
+        for level_name in ('DEBUG', 'INFO'):
+            setup_logging(
+                LoggingSettings(
+                    level=level_name, filename=str(tmp_path / f'{level_name}.log')
+                )
+            )
+            results[f'queue {level_name}'] = measure_trades(trade)
+    finally:
+        stop_logging()
+        root.setLevel(level)
+
+    for name, latency in results.items():
+        print(f'\n{name}: {latency * 1e6:.0f} us per trade')
+
+
+def measure_log_calls(logger, count=20_000):
+    start = time.perf_counter()
+    for i in range(count):
+        logger.info('Пользователь %s купил %d %s', 'name_1', i, 'crypto_1')
+    return (time.perf_counter() - start) / count
+
+
+def test_bench_log_call_on_request_thread(tmp_path):
+    root = logging.getLogger()
+    level = root.level
+    logger = logging.getLogger('app.bench')
+
+    file_handler = logging.FileHandler(tmp_path / 'sync.log', encoding='utf-8')
+    root.addHandler(file_handler)
+    root.setLevel(logging.DEBUG)
+    try:
+        sync_latency = measure_log_calls(logger)
+    finally:
+        root.removeHandler(file_handler)
+        file_handler.close()
+
+    try:
+        setup_logging(
+            LoggingSettings(level='DEBUG', filename=str(tmp_path / 'queue.log'))
+        )
+        queue_latency = measure_log_calls(logger)
+    finally:
+        stop_logging()
+        root.setLevel(level)
+
+    print(f'\nsync log call: {sync_latency * 1e6:.1f} us')
+    print(f'queue log call: {queue_latency * 1e6:.1f} us')
@@ -0,0 +1,64 @@
+import pytest
+import sqlalchemy as sa
+
+from app.market import MarketModel
+from app.models import Cryptocurrency
+from app.trade import Trade
+
+pytestmark = pytest.mark.bench
+
+DAY_OF_TICKS = 24 * 60 * 60 // 10
+
+
+@pytest.mark.parametrize(
+    'count_crypto, steps', [(5, 1_000_000), (1000, 10_000), (10_000, 100)]
+)
+def test_bench_market_log_returns(benchmark, count_crypto, steps):
+    model = MarketModel(tick_seconds=10, seed=1)
+
+    result = benchmark(
+        model.log_returns,
+        count_crypto,
+        steps,
+        rounds=5,
+        count_crypto=count_crypto,
+        steps=steps,
+    )
+
+    print(
+        f'\n{count_crypto} валют x {steps} шагов:'
+        f' {count_crypto * steps / result["median"] / 1e6:.1f} млн тиков/с'
+    )
+
+
+@pytest.mark.parametrize('count_crypto', [5, 100])
+def test_bench_simulate_history_day(tmp_path, benchmark, count_crypto):
+    engine = sa.create_engine(f'sqlite:///{tmp_path / "market.db"}')
+    trade = Trade(engine)
+    model = MarketModel(tick_seconds=10, seed=1)
+
+    def setup():
+        trade.base_drop_all()
+        trade.base_create_all()
+        with engine.begin() as connection:
+            connection.execute(
+                Cryptocurrency.__table__.insert(),
+                [
+                    {'name': f'crypto_{i}', 'cost': '123.45'}
+                    for i in range(count_crypto)
+                ],
+            )
+
+    result = benchmark(
+        trade.simulate_history,
+        model,
+        DAY_OF_TICKS,
+        rounds=3,
+        setup=setup,
+        count_crypto=count_crypto,
+    )
+
+    print(
+        f'\nДень истории {count_crypto} валют:'
+        f' {count_crypto * DAY_OF_TICKS / result["median"]:.0f} тиков/с в базу'
+    )
@@ -0,0 +1,20 @@
+import pytest
+
+from app.metrics import Counter, Histogram
+
+pytestmark = pytest.mark.bench
+
+COUNT = 100_000
+
+
+def test_bench_metrics_record(benchmark):
+    counter = Counter('requests_total', 'Запросы', ('endpoint', 'method', 'status'))
+    histogram = Histogram('duration_seconds', 'Время', ('endpoint', 'method'))
+
+    def record():
+        for _ in range(COUNT):
+            counter.inc('list_cryptocurrency', 'GET', '200')
+            histogram.observe(0.003, 'list_cryptocurrency', 'GET')
+
+    result = benchmark(record, rounds=5, count=COUNT)
+    print(f'запись счётчика и гистограммы: {result["median"] / COUNT * 1e9:.0f} нс')
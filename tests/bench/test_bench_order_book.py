@@ -0,0 +1,39 @@
+import random
+import time
+
+import pytest
+
+from app.order_book import MatchingEngine, Order
+
+pytestmark = pytest.mark.bench
+
+
+@pytest.mark.parametrize('count_orders', [100_000])
+def test_bench_matching_engine(count_orders):
+    rnd = random.Random(1)
+    orders = [
+        (
+            rnd.randrange(5),
+            Order(
+                i,
+                rnd.randrange(1000),
+                rnd.random() < 0.5,
+                rnd.randint(9900, 10100),
+                rnd.randint(1, 10),
+            ),
+        )
+        for i in range(count_orders)
+    ]
+    engine = MatchingEngine()
+
+    start = time.perf_counter()
+    count_fills = 0
+    for cryptocurrency_id, order in orders:
+        count_fills += len(engine.submit(cryptocurrency_id, order))
+        if order.id % 10 == 0:
+            engine.cancel(cryptocurrency_id, order.id - 5)
+    duration = time.perf_counter() - start
+
+    orders_per_second = count_orders / duration
+    print(f'\nmatching engine: {orders_per_second:.0f} orders/s, {count_fills} fills')
+    assert orders_per_second > 20_000
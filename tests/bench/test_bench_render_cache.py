@@ -0,0 +1,66 @@
+import pytest
+
+from app.app import application
+from app.database import DatabaseSettings, create_engine
+from app.metrics import DB_QUERIES
+from app.render_cache import RenderCache
+from app.trade import NameOperation, Trade
+
+pytestmark = pytest.mark.bench
+
+COUNT_CRYPTO = 100
+COUNT_HISTORY = 10_000
+COUNT_REQUESTS = 200
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    settings = DatabaseSettings(path=str(tmp_path_factory.mktemp('render') / 'db.db'))
+    trade = Trade(create_engine(settings))
+    trade.base_create_all()
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    trade.create_user('name_1')
+    with trade.engine.begin() as connection:
+        connection.exec_driver_sql(
+            'INSERT INTO cryptocurrency (name, cost) VALUES (?, 1.5)',
+            [(f'crypto_{i}',) for i in range(COUNT_CRYPTO)],
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO "UserCryptocurrency" '
+            '(user_id, cryptocurrency_id, count, cost_basis) VALUES (1, ?, 10, 10)',
+            [(crypto_id,) for crypto_id in range(1, COUNT_CRYPTO + 1)],
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO "HistoryOperation" '
+            '(user_id, operation_id, cryptocurrency_id, count, price, created_at) '
+            'VALUES (1, 1, ?, 1, 1, ?)',
+            [(i % COUNT_CRYPTO + 1, i) for i in range(COUNT_HISTORY)],
+        )
+    return trade
+
+
+@pytest.mark.parametrize('url', ['/index', '/user_portfolio', '/history_operations'])
+@pytest.mark.parametrize('max_entries', [0, 1024])
+def test_bench_page_render_cache(  # pylint: disable=too-many-arguments
+    dataset, benchmark, monkeypatch, url, max_entries
+):
+    monkeypatch.setattr(application, 'trade', dataset)
+    monkeypatch.setattr(application, 'async_trade', None)
+    monkeypatch.setattr(application, 'render_cache', RenderCache(max_entries))
+    client = application.app.test_client()
+    client.post('/authorization_user', data={'user_login_in': 'name_1'})
+
+    def run():
+        for _ in range(COUNT_REQUESTS):
+            assert client.get(url).status_code == 200
+
+    queries = DB_QUERIES.get()
+    result = benchmark(run, rounds=5, url=url, max_entries=max_entries)
+    queries = (DB_QUERIES.get() - queries) / (6 * COUNT_REQUESTS)
+
+    print(
+        f'\n{url}, кэш {"выключен" if max_entries == 0 else "включён"}: '
+        f'{COUNT_REQUESTS / result["median"]:.0f} запросов/с, '
+        f'{queries:.1f} запросов к базе на страницу'
+    )
@@ -0,0 +1,137 @@
+import pytest
+import sqlalchemy as sa
+
+from app.app import application
+from app.migrations import backfill_position_costs
+from app.trade import NameOperation, Trade
+
+pytestmark = pytest.mark.bench
+
+# (пользователи, валюты, строки истории)
+SIZES = [(10, 10, 1_000), (1_000, 100, 100_000)]
+
+
+@pytest.fixture(
+    scope='module', params=SIZES, ids=['{}u-{}c-{}h'.format(*size) for size in SIZES]
+)
+def dataset(request, tmp_path_factory):
+    count_users, count_crypto, count_history = request.param
+    engine = sa.create_engine(
+        f'sqlite:///{tmp_path_factory.mktemp("bench") / "trade.db"}'
+    )
+    trade = Trade(engine)
+    trade.base_create_all()
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'INSERT INTO user (login, balance) VALUES (?, 1000000000)',
+            [(f'name_{i}',) for i in range(count_users)],
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO cryptocurrency (name, cost) VALUES (?, 1)',
+            [(f'crypto_{i}',) for i in range(count_crypto)],
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO "UserCryptocurrency" (user_id, cryptocurrency_id, count) '
+            'VALUES (?, ?, 1000000)',
+            [
+                (user_id, crypto_id)
+                for user_id in range(1, count_users + 1)
+                for crypto_id in range(1, min(count_crypto, 5) + 1)
+            ],
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO "HistoryOperation" '
+            '(user_id, operation_id, cryptocurrency_id, count, price, created_at) '
+            'VALUES (?, ?, ?, 1, 1, ?)',
+            [
+                (i % count_users + 1, i % 2 + 1, i % count_crypto + 1, i)
+                for i in range(count_history)
+            ],
+        )
+    params = {'users': count_users, 'crypto': count_crypto, 'history': count_history}
+    return trade, params
+
+
+def test_bench_user_buy_cryptocurrency(dataset, benchmark):
+    trade, params = dataset
+    benchmark(
+        trade.user_buy_cryptocurrency, 'name_0', 'crypto_0', 1, rounds=50, **params
+    )
+
+
+def test_bench_user_sell_cryptocurrency(dataset, benchmark):
+    trade, params = dataset
+    benchmark(
+        trade.user_sell_cryptocurrency, 'name_0', 'crypto_0', 1, rounds=50, **params
+    )
+
+
+@pytest.mark.parametrize('bulk_tick', [False, True])
+def test_bench_update_cost(dataset, benchmark, bulk_tick):
+    trade, params = dataset
+    trade.bulk_tick = bulk_tick
+    try:
+        benchmark(trade.update_cost, rounds=5, bulk_tick=bulk_tick, **params)
+    finally:
+        trade.bulk_tick = False
+
+
+def test_bench_get_user_history_operation(dataset, benchmark):
+    trade, params = dataset
+    benchmark(trade.get_user_history_operation, 'name_0', rounds=10, **params)
+
+
+def test_bench_get_user_history_operation_page(dataset, benchmark):
+    trade, params = dataset
+    benchmark(trade.get_user_history_operation_page, 'name_0', 5, rounds=50, **params)
+
+
+def test_bench_get_user_positions(dataset, benchmark):
+    trade, params = dataset
+    benchmark(trade.get_user_positions, 'name_0', rounds=50, **params)
+
+
+def test_bench_backfill_position_costs(dataset, benchmark):
+    trade, params = dataset
+
+    def backfill():
+        with trade.engine.begin() as connection:
+            backfill_position_costs(connection)
+
+    benchmark(backfill, rounds=3, **params)
+
+
+def test_bench_get_all_users(dataset, benchmark):
+    trade, params = dataset
+    benchmark(trade.get_all_users, rounds=5, **params)
+
+
+@pytest.mark.parametrize(
+    'method, url, data',
+    [
+        ('get', '/index', None),
+        ('get', '/user_portfolio', None),
+        ('get', '/history_operations', None),
+        (
+            'post',
+            '/user_buy_cryptocurrency?crypto_name=crypto_0&crypto_cost={cost}',
+            {'count_buy_crypto': '1'},
+        ),
+    ],
+    ids=['index', 'user_portfolio', 'history_operations', 'user_buy_cryptocurrency'],
+)
+def test_bench_route(dataset, benchmark, monkeypatch, method, url, data):
+    trade, params = dataset
+    monkeypatch.setattr(application, 'trade', trade)
+    client = application.app.test_client()
+    with client.session_transaction() as session:
+        session['user_login'] = 'name_0'
+
+    def request():
+        cost = trade.get_cryptocurrency_cost('crypto_0')
+        res = getattr(client, method)(url.format(cost=cost), data=data)
+        assert res.status_code in (200, 302)
+
+    benchmark(request, rounds=20, url=url.split('?')[0], **params)
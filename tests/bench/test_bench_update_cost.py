@@ -0,0 +1,89 @@
+import time
+
+import pytest
+import sqlalchemy as sa
+
+from app.models import Cryptocurrency
+from app.scheduler import PriceTickScheduler, SchedulerSettings
+from app.trade import Trade
+
+pytestmark = pytest.mark.bench
+
+
+def create_trade(tmp_path, count_crypto, bulk_tick):
+    engine = sa.create_engine(f'sqlite:///{tmp_path / "bench.db"}')
+    trade = Trade(engine, bulk_tick=bulk_tick)
+    trade.base_create_all()
+    with engine.begin() as connection:
+        connection.execute(
+            Cryptocurrency.__table__.insert(),
+            [{'name': f'crypto_{i}', 'cost': '123.45'} for i in range(count_crypto)],
+        )
+    return trade
+
+
+def measure_tick(trade, repeat=3):
+    durations = []
+    for seed in range(repeat):
+        start = time.perf_counter()
+        trade.update_cost(seed=seed)
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+@pytest.mark.parametrize('count_crypto', [10, 10_000, 100_000])
+def test_bench_update_cost_bulk(tmp_path, count_crypto):
+    trade = create_trade(tmp_path, count_crypto, bulk_tick=True)
+
+    duration = measure_tick(trade)
+
+    print(f'\nbulk tick, {count_crypto} currencies: {duration * 1000:.1f} ms')
+    assert len(trade.get_all_crypto()) == count_crypto
+
+
+@pytest.mark.parametrize('count_crypto', [10, 10_000])
+def test_bench_update_cost_orm(tmp_path, count_crypto):
+    trade = create_trade(tmp_path, count_crypto, bulk_tick=False)
+
+    duration = measure_tick(trade, repeat=1)
+
+    print(f'\nORM tick, {count_crypto} currencies: {duration * 1000:.1f} ms')
+    assert len(trade.get_all_crypto()) == count_crypto
+
+
+def record_tick_starts(trade, starts):
+    update_cost = trade.update_cost
+
+    def recorded(*args, **kwargs):
+        starts.append(time.perf_counter())
+        update_cost(*args, **kwargs)
+
+    trade.update_cost = recorded
+
+
+@pytest.mark.parametrize('count_ticks', [20])
+def test_bench_tick_drift(tmp_path, count_ticks):
+    # Насколько последний тик отстаёт от расписания start + k * interval:
+    # прежний цикл со sleep после тика против PriceTickScheduler
+    interval = 0.1
+    trade = create_trade(tmp_path, 1000, bulk_tick=True)
+    delay_starts = []
+    record_tick_starts(trade, delay_starts)
+    for _ in range(count_ticks):
+        trade.update_cost()
+        time.sleep(interval)
+
+    rate_starts = []
+    record_tick_starts(trade, rate_starts)
+    scheduler = PriceTickScheduler(
+        trade,
+        SchedulerSettings(interval=interval, lock_path=str(tmp_path / 'tick.lock')),
+    )
+    scheduler.start()
+    while len(rate_starts) < count_ticks:
+        time.sleep(interval)
+    scheduler.stop()
+
+    for name, starts in [('fixed delay', delay_starts), ('fixed rate', rate_starts)]:
+        drift = starts[count_ticks - 1] - starts[0] - (count_ticks - 1) * interval
+        print(f'\n{name}, {count_ticks} ticks: drift {drift * 1000:.1f} ms')
@@ -0,0 +1,37 @@
+import json
+
+from tests.bench.compare import main
+
+
+def write_results(path, results):
+    path.write_text(
+        json.dumps(
+            {
+                'commit': path.stem,
+                'results': [
+                    {'name': name, 'params': {'users': 10}, 'median': median}
+                    for name, median in results.items()
+                ],
+            }
+        ),
+        encoding='utf-8',
+    )
+    return str(path)
+
+
+def test_compare(tmp_path, capsys):
+    old = write_results(tmp_path / 'old.json', {'test_buy': 1.0, 'test_sell': 1.0})
+    new = write_results(tmp_path / 'new.json', {'test_buy': 1.05, 'test_sell': 0.5})
+
+    assert main([old, new]) == 0
+    assert '(-50.0%)  <-- быстрее' in capsys.readouterr().out
+
+
+def test_compare_regression(tmp_path, capsys):
+    old = write_results(tmp_path / 'old.json', {'test_buy': 1.0, 'test_old': 1.0})
+    new = write_results(tmp_path / 'new.json', {'test_buy': 1.5, 'test_new': 1.0})
+
+    assert main([old, new, '--threshold', '0.2']) == 1
+    out = capsys.readouterr().out
+    assert 'test_buy: 1000.00 ms -> 1500.00 ms (+50.0%)  <-- медленнее' in out
+    assert 'test_new: есть только в одном из файлов' in out
@@ -0,0 +1,203 @@
+import asyncio
+import importlib
+import json
+import os
+import sys
+import threading
+
+import pytest
+import sqlalchemy as sa
+
+from app.app import application
+from app.price_stream import AsyncPriceFeed, PricePublisher, PriceUpdate
+from app.trade import Trade
+
+
+@pytest.fixture()
+def init_application(mocker):
+    return mocker.patch('app.app.init_application')
+
+
+@pytest.fixture()
+def asgi(init_application, mocker):
+    mocker.patch.dict(os.environ)
+    os.environ.pop('APP_LOG_FILE', None)
+    sys.modules.pop('app.asgi', None)
+    return importlib.import_module('app.asgi')
+
+
+@pytest.fixture()
+def trade(mocker, tmp_path):
+    trade = Trade(sa.create_engine(f'sqlite:///{tmp_path / "asgi.db"}'))
+    trade.base_create_all()
+    trade.create_cryptocurrency('crypto_1', '10')
+    mocker.patch.object(application, 'trade', new=trade)
+    return trade
+
+
+class Connection:
+    # Клиент ASGI-приложения: запрос без тела, ответ копится в messages
+    def __init__(self, app, path):
+        self.messages = []
+        self._received = asyncio.Queue()
+        self._received.put_nowait({'type': 'http.request', 'body': b''})
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(b'host', b'testserver')],
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 1234),
+        }
+        self.task = asyncio.ensure_future(app(scope, self._receive, self._send))
+
+    async def _receive(self):
+        return await self._received.get()
+
+    async def _send(self, message):
+        self.messages.append(message)
+
+    @property
+    def body(self):
+        return b''.join(
+            message.get('body', b'')
+            for message in self.messages
+            if message['type'] == 'http.response.body'
+        )
+
+    async def wait_for_body(self, count):
+        while self.body.count(b'\n\n') < count:
+            await asyncio.sleep(0.001)
+
+    async def disconnect(self):
+        self._received.put_nowait({'type': 'http.disconnect'})
+        await self.task
+
+
+def parse_events(body):
+    return [
+        json.loads(line[len(b'data: ') :])
+        for line in body.split(b'\n')
+        if line.startswith(b'data: ')
+    ]
+
+
+def test_stream_prices(asgi, trade):
+    async def scenario():
+        connection = Connection(asgi.app, '/stream/prices')
+        await connection.wait_for_body(1)
+        # Тик идёт в своём потоке, как у планировщика
+        await asyncio.get_running_loop().run_in_executor(None, trade.update_cost, 1)
+        await connection.wait_for_body(2)
+        await connection.disconnect()
+        return connection
+
+    connection = asyncio.run(scenario())
+
+    start = connection.messages[0]
+    assert start['status'] == 200
+    assert (b'content-type', b'text/event-stream; charset=utf-8') in start['headers']
+    first, second = parse_events(connection.body)
+    assert first['prices'] == {'crypto_1': '10.00'}
+    assert second['epoch'] == first['epoch'] + 1
+    assert second['prices'] == {
+        'crypto_1': str(trade.get_cryptocurrency_cost('crypto_1'))
+    }
+
+
+def test_stream_prices_many_subscribers_without_threads(asgi, trade):
+    async def scenario():
+        threads = threading.active_count()
+        connections = [Connection(asgi.app, '/stream/prices') for _ in range(2000)]
+        for connection in connections:
+            await connection.wait_for_body(1)
+        feed = asgi.get_price_feed()
+        assert feed.count_subscribers == 2000
+        # Подписчикам не нужны потоки: остаются только потоки для снимков цен
+        assert threading.active_count() - threads < 50
+
+        trade.price_publisher.publish(100, [('crypto_1', '11.00')])
+        for connection in connections:
+            await connection.wait_for_body(2)
+        for connection in connections:
+            await connection.disconnect()
+        return connections, feed
+
+    connections, feed = asyncio.run(scenario())
+
+    assert all(
+        parse_events(connection.body)[1]['prices'] == {'crypto_1': '11.00'}
+        for connection in connections
+    )
+    assert feed.count_subscribers == 0
+
+
+def test_stream_prices_heartbeat(asgi, trade, mocker):
+    mocker.patch.object(asgi, 'HEARTBEAT_SECONDS', new=0.01)
+
+    async def scenario():
+        connection = Connection(asgi.app, '/stream/prices')
+        while b': heartbeat\n\n' not in connection.body:
+            await asyncio.sleep(0.005)
+        await connection.disconnect()
+
+    asyncio.run(scenario())
+
+
+def test_flask_routes_through_asgi(asgi, trade):
+    async def scenario():
+        connection = Connection(asgi.app, '/index')
+        await connection.task
+        return connection
+
+    connection = asyncio.run(scenario())
+
+    assert connection.messages[0]['status'] == 200
+    assert 'crypto_1' in connection.body.decode()
+
+
+def test_lifespan(asgi):
+    sent = []
+    messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(asgi.app({'type': 'lifespan'}, receive, send))
+
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+
+
+def test_asgi_entry_point(asgi, init_application):
+    init_application.assert_called_once_with()
+    assert os.environ['APP_LOG_FILE'] == 'app.{pid}.log'
+
+
+def test_async_price_feed_resyncs_lagging_subscriber():
+    async def scenario():
+        publisher = PricePublisher()
+        feed = AsyncPriceFeed(publisher, asyncio.get_running_loop(), queue_size=2)
+        queue = feed.subscribe()
+        for epoch in range(1, 4):
+            publisher.publish(epoch, [('crypto_1', str(epoch))])
+        await asyncio.sleep(0)
+        # Третье обновление не поместилось: подписчику нужны все цены заново
+        assert [queue.get_nowait() for _ in range(queue.qsize())] == [None]
+
+        publisher.publish(4, [('crypto_1', '4')])
+        await asyncio.sleep(0)
+        assert queue.get_nowait() == PriceUpdate(4, [('crypto_1', '4')])
+        feed.unsubscribe(queue)
+        feed.close()
+        publisher.publish(5, [])
+
+    asyncio.run(scenario())
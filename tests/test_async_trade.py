@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from app.async_trade import AsyncTrade, SyncTradeReader
+from app.database import DatabaseSettings, create_async_engine, create_engine
+from app.trade import NameOperation, Trade
+
+
+@pytest.fixture()
+def trade(tmp_path):
+    settings = DatabaseSettings(path=str(tmp_path / 'async.db'))
+    trade = Trade(create_engine(settings))
+    trade.base_create_all()
+    trade.create_cryptocurrency('crypto_1', '100')
+    trade.create_cryptocurrency('crypto_2', '10')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    trade.create_user('name_1')
+    trade.create_user('name_2')
+    for _ in range(3):
+        trade.user_buy_cryptocurrency('name_1', 'crypto_1', 2)
+        trade.user_buy_cryptocurrency('name_1', 'crypto_2', 1)
+    trade.user_sell_cryptocurrency('name_1', 'crypto_1', 5)
+    async_trade = AsyncTrade(trade, create_async_engine(settings))
+    yield trade, async_trade
+    async_trade.close()
+
+
+READS = [
+    ('get_all_crypto', ()),
+    ('get_user_balance', ('name_1',)),
+    ('get_user_balance', ('name_2',)),
+    ('get_user_balance_and_version', ('name_1',)),
+    ('get_user_balance_and_version', ('name_2',)),
+    ('get_user_positions', ('name_1',)),
+    ('get_user_positions', ('name_2',)),
+    ('get_user_history_operation_page', ('name_1', 3)),
+    ('get_user_history_operation_page', ('name_1', 3, 4)),
+    ('get_user_history_operation_page', ('name_1', 3, None, 2)),
+    ('get_user_history_operation_page', ('name_2', 3)),
+    ('count_user_history_operation', ('name_1',)),
+]
+
+
+@pytest.mark.parametrize('method, args', READS)
+def test_async_trade_matches_trade(trade, method, args):
+    sync_trade, async_trade = trade
+
+    expected = getattr(sync_trade, method)(*args)
+
+    assert asyncio.run(getattr(async_trade, method)(*args)) == expected
+    assert asyncio.run(getattr(SyncTradeReader(sync_trade), method)(*args)) == expected
+
+
+@pytest.mark.parametrize(
+    'method, args',
+    [
+        ('get_user_balance', ('name_3',)),
+        ('get_user_balance_and_version', ('name_3',)),
+        ('get_user_positions', ('name_3',)),
+        ('get_user_history_operation_page', ('name_3', 3)),
+    ],
+)
+def test_async_trade_unknown_user(trade, method, args):
+    _, async_trade = trade
+
+    with pytest.raises(ValueError):
+        asyncio.run(getattr(async_trade, method)(*args))
+
+
+def test_async_trade_concurrent_reads(trade):
+    sync_trade, async_trade = trade
+
+    async def read_all():
+        return await asyncio.gather(
+            *[async_trade.get_user_positions('name_1') for _ in range(20)]
+        )
+
+    assert asyncio.run(read_all()) == [sync_trade.get_user_positions('name_1')] * 20
@@ -0,0 +1,214 @@
+import numpy as np
+import pytest
+import sqlalchemy as sa
+
+from app.backtest import (
+    BacktestAccount,
+    BacktestFill,
+    PriceSeries,
+    load_price_series,
+    moving_average_crossover,
+    run_orders,
+    run_strategy,
+    simulate_price_series,
+)
+from app.market import MarketModel
+from app.positions import to_cents
+from app.trade import NameOperation, Trade
+
+
+@pytest.fixture()
+def trade(tmp_path):
+    trade = Trade(sa.create_engine(f'sqlite:///{tmp_path / "backtest.db"}'))
+    trade.base_create_all()
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    return trade
+
+
+def test_account_matches_trade(trade):
+    trade.create_user('name_1')
+    trade.create_cryptocurrency('crypto_1', '10')
+    account = BacktestAccount(['crypto_1'], 100000)
+    # Цена, покупка или продажа, количество
+    operations = [
+        (1000, 'buy', 5),
+        (1250, 'sell', 3),
+        (1250, 'sell', 5),
+        (999, 'buy', 1000),
+        (333, 'buy', 7),
+        (400, 'sell', 9),
+    ]
+
+    for price, operation, count in operations:
+        with trade.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'UPDATE cryptocurrency SET cost = ?', (price / 100,)
+            )
+        account.prices = [price]
+        try:
+            getattr(trade, f'user_{operation}_cryptocurrency')(
+                'name_1', 'crypto_1', count
+            )
+            trade_ok = True
+        except ValueError:
+            trade_ok = False
+        assert getattr(account, operation)(0, count) == trade_ok
+
+    trade.price_cache.invalidate()
+    (position,) = trade.get_user_positions('name_1')
+    assert to_cents(trade.get_user_balance('name_1')) == account.balance
+    assert position.count == account.counts[0]
+    assert to_cents(position.cost_basis) == account.cost_basis[0]
+    assert to_cents(position.realised_pnl) == account.realised_pnl[0]
+    assert account.rejected == {
+        'insufficient_cryptocurrency': 1,
+        'insufficient_funds': 1,
+    }
+
+
+def test_account_rejects_without_price():
+    account = BacktestAccount(['crypto_1'], 1000)
+
+    assert not account.buy(0, 1)
+    assert not account.sell(0, 1)
+    assert account.rejected == {'no_price': 2}
+    with pytest.raises(ValueError):
+        account.buy(0, 0)
+    with pytest.raises(ValueError):
+        account.sell(0, -1)
+
+
+def test_load_price_series(trade):
+    trade.create_cryptocurrency('crypto_1', '1')
+    trade.create_cryptocurrency('crypto_2', '2')
+    with trade.engine.begin() as connection:
+        connection.exec_driver_sql('DELETE FROM "PriceTick"')
+        connection.exec_driver_sql(
+            'INSERT INTO "PriceTick" (cryptocurrency_id, time, cost) VALUES (?, ?, ?)',
+            [(1, 10, 1.5), (2, 20, 2.25), (1, 30, 1.75), (2, 40, 2.5), (1, 50, 9)],
+        )
+
+    series = load_price_series(trade.engine)
+    assert series.names == ['crypto_1', 'crypto_2']
+    assert series.times.tolist() == [10, 20, 30, 40, 50]
+    # До первого тика у валюты цены нет, дальше протягивается последняя
+    assert series.cents.tolist() == [
+        [150, 0],
+        [150, 225],
+        [175, 225],
+        [175, 250],
+        [900, 250],
+    ]
+
+    series = load_price_series(trade.engine, ['crypto_2'], start=20, end=50)
+    assert series.times.tolist() == [20, 40]
+    assert series.cents.tolist() == [[225], [250]]
+    assert load_price_series(trade.engine, ['crypto_1'], start=100).cents.shape == (
+        0,
+        1,
+    )
+
+
+def test_simulate_price_series():
+    series = simulate_price_series(
+        MarketModel(tick_seconds=10, seed=1),
+        ['a', 'b'],
+        np.array([100, 5000]),
+        50,
+        1000,
+    )
+
+    assert series.cents.shape == (50, 2)
+    assert series.cents[0].tolist() == [100, 5000]
+    assert series.times[:3].tolist() == [1000, 1010, 1020]
+    assert series.cents.min() >= 1
+
+
+def test_run_orders():
+    series = PriceSeries(
+        ['a', 'b'],
+        np.arange(5),
+        np.array([[100, 10], [110, 10], [120, 20], [90, 20], [100, 30]]),
+    )
+    orders = np.zeros((5, 2), dtype=np.int64)
+    orders[0, 0] = 5
+    orders[1, 1] = 100
+    orders[2, 0] = -2
+    orders[3, 1] = 10
+    orders[4, 0] = -10
+
+    result = run_orders(series, orders, 1500)
+
+    assert result.account.fills == [
+        BacktestFill(0, 0, 5, 100),
+        BacktestFill(1, 1, 100, 10),
+        BacktestFill(2, 0, -2, 120),
+        BacktestFill(3, 1, 10, 20),
+    ]
+    assert result.equity.tolist() == [1500, 1550, 2600, 2510, 3640]
+    assert result.pnl == 2140
+    assert result.max_drawdown == 90
+    assert result.realised_pnl == 40
+    assert result.summary() == {
+        'steps': 5,
+        'fills': 4,
+        'rejected': {'insufficient_cryptocurrency': 1},
+        'balance': 40,
+        'equity': 3640,
+        'pnl': 2140,
+        'realised_pnl': 40,
+        'max_drawdown': 90,
+    }
+    with pytest.raises(ValueError):
+        run_orders(series, orders[:4], 1500)
+
+
+class BuyThenSell:
+    def on_tick(self, step, prices, account):
+        if step == 0:
+            account.buy(0, 3)
+        elif step == 3:
+            account.sell(0, account.counts[0])
+
+
+def test_run_strategy_matches_orders():
+    series = simulate_price_series(MarketModel(seed=2), ['a'], np.array([1000]), 10)
+    orders = np.zeros((10, 1), dtype=np.int64)
+    orders[0, 0] = 3
+    orders[3, 0] = -3
+
+    by_strategy = run_strategy(series, BuyThenSell(), 10000)
+    by_orders = run_orders(series, orders, 10000)
+
+    assert by_strategy.account.fills == by_orders.account.fills
+    assert by_strategy.equity.tolist() == by_orders.equity.tolist()
+    assert by_strategy.account.counts == [0]
+
+
+def test_moving_average_crossover():
+    prices = np.array([10, 10, 10, 10, 20, 30, 30, 20, 10, 5, 5])[:, None] * 100
+    series = PriceSeries(['a'], np.arange(len(prices)), prices)
+
+    orders = moving_average_crossover(1, 3, 2)(series)
+
+    # Цена выше средней за 3 шага с шага 4, ниже - с шага 7
+    assert np.flatnonzero(orders[:, 0]).tolist() == [4, 7]
+    assert orders[[4, 7], 0].tolist() == [2, -2]
+    result = run_orders(series, orders, 10000)
+    assert result.account.counts == [0]
+    assert result.equity.tolist()[-1] == 10000
+    with pytest.raises(ValueError):
+        moving_average_crossover(5, 5, 1)
+
+
+def test_empty_series():
+    series = PriceSeries(
+        ['a'], np.zeros(0, dtype=np.int64), np.zeros((0, 1), dtype=np.int64)
+    )
+
+    result = run_orders(series, np.zeros((0, 1), dtype=np.int64), 100)
+
+    assert result.pnl == 0
+    assert result.max_drawdown == 0
+    assert result.summary()['equity'] == 100
@@ -1,14 +1,36 @@
+import gzip
+import importlib
+import os
+import sys
+import threading
+
 import pytest
 import sqlalchemy as sa
 
-from app.app import application
-from app.trade import Trade
+from app.app import application, create_async_trade, create_market
+from app.async_trade import AsyncTrade
+from app.candles import Candle
+from app.database import DatabaseSettings, create_engine
+from app.ledger import LedgerSettings, LedgerTrade
+from app.market import MarketModel
+from app.metrics import DB_QUERIES, REQUEST_DURATION, REQUESTS, TRADE_OPERATIONS
+from app.positions import summarize_position
+from app.price_cache import PriceSnapshot
+from app.trade import HistoryFilter, HistoryPage, NameOperation, Trade
 
 client = application.app.test_client()
 engine = sa.create_engine('sqlite:///test_client.db')
 application.trade = Trade(engine)
 
 
+def login_user(user_login):
+    # Логин хранится в cookie сессии тестового клиента
+    with client.session_transaction() as session:
+        session.clear()
+        if user_login:
+            session['user_login'] = user_login
+
+
 @pytest.fixture(
     autouse=True,
     params=[
@@ -47,8 +69,10 @@ application.trade = Trade(engine)
 )
 def mocker_trade(mocker, request):
     mocker.patch('app.trade', autospec=True)
+    # Фрагменты страниц не должны переживать тест с другими заглушками
+    application.render_cache.clear()
 
-    mocker.patch.object(application, 'now_user_login', new=request.param['user_login'])
+    login_user(request.param['user_login'])
     mocker.patch.object(
         application.trade,
         'get_user_balance',
@@ -56,19 +80,32 @@ def mocker_trade(mocker, request):
     )
     mocker.patch.object(
         application.trade,
-        'get_all_crypto',
-        return_value=[
-            ('crypto_1', '123.23'),
-            ('crypto_2', '13.23'),
-            ('crypto_3', '12'),
-            ('crypto_4', '1.23'),
-            ('crypto_5', '163.23'),
-        ],
+        'get_user_balance_and_version',
+        return_value=(request.param['user_balance'], 0),
+    )
+    prices = [
+        ('crypto_1', '123.23'),
+        ('crypto_2', '13.23'),
+        ('crypto_3', '12'),
+        ('crypto_4', '1.23'),
+        ('crypto_5', '163.23'),
+    ]
+    mocker.patch.object(application.trade, 'get_all_crypto', return_value=prices)
+    mocker.patch.object(
+        application.trade,
+        'get_price_snapshot',
+        return_value=PriceSnapshot(1, prices, dict(prices), {}, 'prices'),
+    )
+    history_operation = request.param['history_operation'] or []
+    mocker.patch.object(
+        application.trade,
+        'get_user_history_operation_page',
+        return_value=HistoryPage(history_operation[:5], 7, 13),
     )
     mocker.patch.object(
         application.trade,
-        'get_user_history_operation',
-        return_value=request.param['history_operation'],
+        'count_user_history_operation',
+        return_value=len(history_operation),
     )
     mocker.patch.object(
         application.trade, 'is_user_exist', return_value=request.param['user_exist']
@@ -81,7 +118,7 @@ def mocker_trade(mocker, request):
     mocker.patch.object(
         application.trade, 'user_sell_cryptocurrency', return_value=None
     )
-    mocker.patch.object(application.trade, 'get_user_portfolio', return_value=[])
+    mocker.patch.object(application.trade, 'get_user_positions', return_value=[])
     mocker.patch.object(application.trade, 'create_cryptocurrency', return_value=None)
     return request.param
 
@@ -97,15 +134,32 @@ def test_authorization_user(mocker_trade):
         '/authorization_user', data={'user_login_in': mocker_trade['user_login']}
     )
     assert res.status_code == 302
+    with client.session_transaction() as session:
+        assert session['user_login'] == mocker_trade['user_login']
     assert application.trade.create_user.call_count == int(  # type: ignore
         not mocker_trade['user_exist']
     )
 
 
+def test_authorization_user_created_concurrently(mocker, mocker_trade):
+    # Пользователя создал другой процесс между проверкой и созданием
+    mocker.patch.object(application.trade, 'is_user_exist', return_value=False)
+    mocker.patch.object(
+        application.trade, 'create_user', side_effect=ValueError('уже существует')
+    )
+
+    res = client.post('/authorization_user', data={'user_login_in': 'user_1'})
+
+    assert res.status_code == 302
+    with client.session_transaction() as session:
+        assert session['user_login'] == 'user_1'
+
+
 def test_exit_user():
     res = client.post('/exit_user')
     assert res.status_code == 302
-    assert application.now_user_login == ''
+    with client.session_transaction() as session:
+        assert 'user_login' not in session
 
 
 @pytest.mark.parametrize(
@@ -157,34 +211,70 @@ def test_get_user_portfolio():
     assert res.status_code == 200
 
 
+def test_get_user_portfolio_positions(mocker):
+    login_user('user_1')
+    mocker.patch.object(
+        application.trade,
+        'get_user_positions',
+        return_value=[
+            summarize_position('crypto_1', 2, 19314, -1286, 9400),
+            summarize_position('crypto_2', 0, 0, 150, 940),
+        ],
+    )
+
+    res = client.get('/user_portfolio')
+
+    assert res.status_code == 200
+    assert '<th>96.57</th>' in res.text
+    assert '<th>-5.14</th>' in res.text
+    assert '<th>-</th>' in res.text
+
+
 def test_get_history_operation():
     res = client.get('/history_operations')
     assert res.status_code == 200
 
 
-def test_get_history_operation_with_page_error_val():
-    res = client.get('/history_operations?page=njh')
+def test_get_history_operation_with_cursor_error_val():
+    res = client.get('/history_operations?before=njh')
     assert res.status_code == 200
+    assert 'Error 404' in res.get_data(as_text=True)
 
 
-def test_get_history_operation_with_page_error_int_m_12():
-    res = client.get('/history_operations?page=-12')
+def test_get_history_operation_with_cursor_error_int_m_12():
+    res = client.get('/history_operations?after=-12')
     assert res.status_code == 200
+    assert 'Error 404' in res.get_data(as_text=True)
 
 
-def test_get_history_operation_with_page_error_int_p_12():
-    res = client.get('/history_operations?page=12')
+def test_get_history_operation_with_cursor_before(mocker_trade):
+    res = client.get('/history_operations?before=12')
     assert res.status_code == 200
+    if mocker_trade['user_login'] != '':
+        application.trade.get_user_history_operation_page.assert_called_once_with(  # type: ignore
+            mocker_trade['user_login'], 5, before_id=12, after_id=None
+        )
 
 
-def test_get_history_operation_with_page_error_big_int():
-    res = client.get('/history_operations?page=12')
+def test_get_history_operation_with_cursor_after(mocker_trade):
+    res = client.get('/history_operations?after=2')
     assert res.status_code == 200
+    if mocker_trade['history_operation']:
+        text = res.get_data(as_text=True)
+        assert 'history_operations?before=7' in text
+        assert 'history_operations?after=13' in text
 
 
-def test_get_history_operation_with_page_error_min_int():
-    res = client.get('/history_operations?page=2')
+def test_get_history_operation_with_cursor_no_page(mocker, mocker_trade):
+    mocker.patch.object(
+        application.trade,
+        'get_user_history_operation_page',
+        return_value=HistoryPage([], None, None),
+    )
+    res = client.get('/history_operations?before=2')
     assert res.status_code == 200
+    if mocker_trade['user_login'] != '':
+        assert 'Error 404' in res.get_data(as_text=True)
 
 
 def test_get_history_operation_without_page():
@@ -213,3 +303,565 @@ def test_add_cryptocurrency(mocker, crypto_name, crypto_cost, stats_code):
         },
     )
     assert res.status_code == stats_code
+
+
+def test_stream_prices(mocker):
+    mocker.patch.object(
+        application.trade,
+        'get_price_snapshot',
+        return_value=PriceSnapshot(
+            1, [('crypto_1', '123.23')], {'crypto_1': '123.23'}, {'crypto_1': 1}
+        ),
+    )
+    application.trade.price_publisher.publish(2, [('crypto_1', '125.01')])
+
+    res = client.get('/stream/prices')
+    chunks = iter(res.response)
+
+    assert res.mimetype == 'text/event-stream'
+    assert (
+        next(chunks)
+        == b'id: 1\ndata: {"epoch": 1, "prices": {"crypto_1": "123.23"}}\n\n'
+    )
+    assert (
+        next(chunks)
+        == b'id: 2\ndata: {"epoch": 2, "prices": {"crypto_1": "125.01"}}\n\n'
+    )
+    res.close()
+
+
+def test_stream_prices_resync_and_heartbeat(mocker):
+    mocker.patch.object(
+        application.trade,
+        'get_price_snapshot',
+        return_value=PriceSnapshot(5, [('crypto_1', '1')], {}, {}),
+    )
+    mocker.patch.object(
+        application.trade.price_publisher, 'wait_for_updates', side_effect=[None, []]
+    )
+
+    res = client.get('/stream/prices')
+    chunks = iter(res.response)
+
+    assert next(chunks).startswith(b'id: 5\n')
+    assert next(chunks).startswith(b'id: 5\n')
+    assert next(chunks) == b': heartbeat\n\n'
+    res.close()
+    assert application.trade.price_publisher.count_subscribers == 0
+
+
+def test_stream_prices_subscriber_limit(mocker):
+    publisher = application.trade.price_publisher
+    mocker.patch.object(publisher, 'max_subscribers', new=1)
+    mocker.patch.object(
+        application.trade,
+        'get_price_snapshot',
+        return_value=PriceSnapshot(1, [('crypto_1', '1')], {}, {}),
+    )
+
+    first = client.get('/stream/prices')
+    res = client.get('/stream/prices')
+    assert res.status_code == 503
+    assert res.headers['Retry-After'] == '60'
+
+    # Закрытое соединение освобождает место, даже если его не читали
+    first.close()
+    assert publisher.count_subscribers == 0
+    res = client.get('/stream/prices')
+    assert res.status_code == 200
+    res.close()
+
+
+def test_get_candles(mocker):
+    mocker.patch.object(
+        application.trade,
+        'get_candles',
+        return_value=[Candle(0, '1.00', '2.00', '0.50', '1.50')],
+    )
+
+    res = client.get('/candles?crypto_name=crypto_1&interval=300&start=0&end=600')
+
+    assert res.status_code == 200
+    assert res.json == {
+        'crypto_name': 'crypto_1',
+        'candles': [[0, '1.00', '2.00', '0.50', '1.50']],
+    }
+    application.trade.get_candles.assert_called_once_with(  # type: ignore
+        'crypto_1', 300, 0, 600, None
+    )
+
+
+@pytest.mark.parametrize(
+    'query',
+    [
+        '',
+        'crypto_name=crypto_1&interval=we',
+        'crypto_name=crypto_1&max_points=we',
+    ],
+)
+def test_get_candles_error(mocker, query):
+    mocker.patch.object(application.trade, 'get_candles', return_value=[])
+
+    res = client.get(f'/candles?{query}')
+
+    assert res.status_code == 400
+    assert 'error' in res.json
+
+
+HISTORY_CHUNKS = [
+    [(1, 100, 'user_1', 'Buy', 'crypto_1', 5, '123.23')],
+    [(2, 101, 'user_1', 'Sell', 'crypto_1', 1, '125.00')],
+]
+
+
+@pytest.mark.parametrize(
+    'export_format, body',
+    [
+        (
+            'csv',
+            'id,created_at,user_login,operation,cryptocurrency,count,price\n'
+            '1,100,user_1,Buy,crypto_1,5,123.23\n'
+            '2,101,user_1,Sell,crypto_1,1,125.00\n',
+        ),
+        (
+            'jsonl',
+            '{"id": 1, "created_at": 100, "user_login": "user_1", "operation": "Buy",'
+            ' "cryptocurrency": "crypto_1", "count": 5, "price": "123.23"}\n'
+            '{"id": 2, "created_at": 101, "user_login": "user_1", "operation": "Sell",'
+            ' "cryptocurrency": "crypto_1", "count": 1, "price": "125.00"}\n',
+        ),
+    ],
+)
+def test_export_history(mocker, mocker_trade, export_format, body):
+    mocker.patch.object(
+        application.trade, 'iter_history', return_value=iter(HISTORY_CHUNKS)
+    )
+
+    res = client.get(f'/export/history?format={export_format}&start_id=2')
+
+    if mocker_trade['user_login'] == '':
+        assert res.status_code == 403
+        return
+    assert res.status_code == 200
+    assert res.get_data(as_text=True) == body
+    application.trade.iter_history.assert_called_once_with(  # type: ignore
+        HistoryFilter(user_login='user_1', start_id=2)
+    )
+
+
+@pytest.mark.parametrize('query', ['format=xml', 'start_time=we'])
+def test_export_history_error(mocker, mocker_trade, query):
+    mocker.patch.object(application.trade, 'iter_history', return_value=iter([]))
+
+    res = client.get(f'/export/history?{query}')
+
+    assert res.status_code == 400 if mocker_trade['user_login'] else 403
+
+
+def test_export_history_command(mocker):
+    mocker.patch.object(
+        application.trade, 'iter_history', return_value=iter(HISTORY_CHUNKS)
+    )
+
+    res = application.app.test_cli_runner().invoke(
+        args=['export-history', '--format', 'jsonl', '--crypto-name', 'crypto_1']
+    )
+
+    assert res.exit_code == 0
+    assert res.output.count('\n') == 2
+    application.trade.iter_history.assert_called_once_with(  # type: ignore
+        HistoryFilter(cryptocurrency_name='crypto_1'), 10000
+    )
+
+
+def test_export_history_command_error(mocker):
+    mocker.patch.object(application.trade, 'iter_history', side_effect=ValueError)
+
+    res = application.app.test_cli_runner().invoke(args=['export-history'])
+
+    assert res.exit_code == 1
+
+
+def test_export_history_command_no_base(mocker, monkeypatch, tmp_path):
+    mocker.patch.object(application, 'trade', new=None)
+    monkeypatch.setenv('APP_DB_PATH', str(tmp_path / 'missing.db'))
+
+    res = application.app.test_cli_runner().invoke(args=['export-history'])
+
+    assert res.exit_code == 1
+    assert 'не найдена' in res.output
+
+
+def test_simulate_history_command(monkeypatch, tmp_path):
+    settings = DatabaseSettings(path=str(tmp_path / 'market.db'))
+    trade = Trade(create_engine(settings))
+    trade.base_create_all()
+    trade.create_cryptocurrency('crypto_1', '10')
+    trade.create_cryptocurrency('crypto_2', '20')
+    monkeypatch.setenv('APP_DB_PATH', settings.path)
+
+    res = application.app.test_cli_runner().invoke(
+        args=['simulate-history', '--steps', '10', '--seed', '1']
+    )
+
+    assert res.exit_code == 0
+    assert 'Записали тиков: 20' in res.output
+    with trade.engine.connect() as connection:
+        assert (
+            connection.exec_driver_sql('SELECT count(*) FROM "PriceTick"').scalar()
+            == 22
+        )
+
+
+def test_simulate_history_command_no_base(monkeypatch, tmp_path):
+    monkeypatch.setenv('APP_DB_PATH', str(tmp_path / 'missing.db'))
+
+    res = application.app.test_cli_runner().invoke(
+        args=['simulate-history', '--steps', '10']
+    )
+
+    assert res.exit_code == 1
+    assert 'не найдена' in res.output
+
+
+def test_create_market(monkeypatch):
+    assert create_market() is None
+    monkeypatch.setenv('APP_PRICE_MODEL', 'gbm')
+    monkeypatch.setenv('APP_TICK_INTERVAL', '5')
+    market = create_market()
+    assert isinstance(market, MarketModel)
+    assert market.tick_seconds == 5
+    monkeypatch.setenv('APP_PRICE_MODEL', 'walk')
+    with pytest.raises(ValueError):
+        create_market()
+
+
+def test_metrics():
+    count = REQUEST_DURATION.get_count('list_cryptocurrency', 'GET')
+    ok = REQUESTS.get('list_cryptocurrency', 'GET', '200')
+    client.get('/index')
+
+    res = client.get('/metrics')
+
+    assert res.status_code == 200
+    assert res.mimetype == 'text/plain'
+    assert REQUEST_DURATION.get_count('list_cryptocurrency', 'GET') == count + 1
+    assert REQUESTS.get('list_cryptocurrency', 'GET', '200') == ok + 1
+    text = res.get_data(as_text=True)
+    assert text.startswith(f'# process {os.getpid()}\n')
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert 'http_request_db_queries_count{endpoint="list_cryptocurrency"}' in text
+
+
+def test_trade_route_metrics():
+    stale = TRADE_OPERATIONS.get('Buy', 'stale_price')
+    invalid = TRADE_OPERATIONS.get('Sell', 'invalid_count')
+
+    client.post(
+        '/user_buy_cryptocurrency?crypto_name=crypto_1&crypto_cost=1',
+        data={'count_buy_crypto': '1'},
+    )
+    client.post(
+        '/user_sell_cryptocurrency?crypto_name=crypto_1',
+        data={'count_sell_crypto': 'we'},
+    )
+
+    assert TRADE_OPERATIONS.get('Buy', 'stale_price') == stale + 1
+    assert TRADE_OPERATIONS.get('Sell', 'invalid_count') == invalid + 1
+
+
+@pytest.fixture(params=['sync', 'async'])
+def real_trade(mocker, tmp_path, request):
+    # Представления читают через асинхронный движок или через сам Trade
+    settings = DatabaseSettings(path=str(tmp_path / 'sessions.db'))
+    trade = Trade(create_engine(settings))
+    trade.base_create_all()
+    trade.create_cryptocurrency('crypto_1', '10')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    mocker.patch.object(application, 'trade', new=trade)
+    mocker.patch.dict(os.environ, {'APP_ASYNC_READS': '1'})
+    async_trade = (
+        create_async_trade(trade, settings) if request.param == 'async' else None
+    )
+    mocker.patch.object(application, 'async_trade', new=async_trade)
+    yield trade
+    if async_trade is not None:
+        async_trade.close()
+
+
+def test_users_trade_simultaneously(real_trade):
+    # У каждого клиента своя cookie, как у разных браузеров
+    barrier = threading.Barrier(2)
+    statuses = {}
+    pages = {}
+
+    def user(login, count):
+        user_client = application.app.test_client()
+        user_client.post('/authorization_user', data={'user_login_in': login})
+        barrier.wait()
+        statuses[login] = [
+            user_client.post(
+                '/user_buy_cryptocurrency?crypto_name=crypto_1&crypto_cost=10.00',
+                data={'count_buy_crypto': '1'},
+            ).status_code
+            for _ in range(count)
+        ]
+        pages[login] = user_client.get('/user_portfolio').get_data(as_text=True)
+
+    threads = [
+        threading.Thread(target=user, args=args)
+        for args in (('name_1', 3), ('name_2', 5))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == {'name_1': [302] * 3, 'name_2': [302] * 5}
+    assert str(real_trade.get_user_portfolio('name_1')) == "[(3, 'crypto_1')]"
+    assert str(real_trade.get_user_portfolio('name_2')) == "[(5, 'crypto_1')]"
+    for login, other_login, count in (('name_1', 'name_2', 3), ('name_2', 'name_1', 5)):
+        assert f'<label for="user_login_in">{login}</label>' in pages[login]
+        assert f'<th>{count}</th>' in pages[login]
+        assert other_login not in pages[login]
+
+
+def test_read_routes_with_real_trade(real_trade):
+    user_client = application.app.test_client()
+    user_client.post('/authorization_user', data={'user_login_in': 'name_1'})
+    for _ in range(12):
+        user_client.post(
+            '/user_buy_cryptocurrency?crypto_name=crypto_1&crypto_cost=10.00',
+            data={'count_buy_crypto': '1'},
+        )
+
+    def get_page(url):
+        return user_client.get(url).get_data(as_text=True)
+
+    index = get_page('/index')
+    assert '880.00' in index
+    assert 'crypto_1' in index
+    # По 5 операций на странице, от новых к старым
+    assert 'history_operations?before=8' in get_page('/history_operations')
+    assert 'history_operations?before=3' in get_page('/history_operations?before=8')
+    last_page = get_page('/history_operations?before=3')
+    assert 'history_operations?after=2' in last_page
+    assert 'before=' not in last_page
+
+
+def test_pages_from_render_cache(real_trade, mocker):
+    user_client = application.app.test_client()
+    user_client.post('/authorization_user', data={'user_login_in': 'name_1'})
+    get_all_crypto = mocker.spy(real_trade, 'get_all_crypto')
+
+    def get_page(url):
+        return user_client.get(url).get_data(as_text=True)
+
+    pages = [get_page(url) for url in ('/index', '/user_portfolio')]
+    assert get_page('/history_operations').count('Всего операций') == 1
+    hits = application.render_cache.hits
+    assert [get_page(url) for url in ('/index', '/user_portfolio')] == pages
+    assert 'Вы пока не совершали операции' in get_page('/history_operations')
+    assert application.render_cache.hits - hits == 3
+    assert get_all_crypto.call_count == 1
+
+    # Сделка меняет версию пользователя, тик цен - эпоху
+    user_client.post(
+        '/user_buy_cryptocurrency?crypto_name=crypto_1&crypto_cost=10.00',
+        data={'count_buy_crypto': '2'},
+    )
+    assert '<th>2</th>' in get_page('/user_portfolio')
+    assert '<label for="count_operation">1</label>' in get_page('/history_operations')
+    real_trade.update_cost(seed=1)
+    ((_, cost),) = real_trade.get_all_crypto()
+    assert f'>{cost}</label>' in get_page('/index')
+    assert f'<th>{cost}</th>' in get_page('/user_portfolio')
+
+
+def test_conditional_get(real_trade):
+    user_client = application.app.test_client()
+    user_client.post('/authorization_user', data={'user_login_in': 'name_1'})
+    etags = {}
+    for url in ('/index', '/user_portfolio', '/history_operations'):
+        res = user_client.get(url)
+        etags[url] = res.get_etag()[0]
+        assert res.cache_control.private and res.cache_control.no_cache
+        assert {'Cookie', 'Accept-Encoding'} <= set(res.vary)
+
+        queries = DB_QUERIES.get()
+        res = user_client.get(url, headers={'If-None-Match': f'"{etags[url]}"'})
+        assert res.status_code == 304
+        assert res.data == b''
+        assert res.get_etag()[0] == etags[url]
+        # Для 304 нужен только баланс пользователя
+        assert DB_QUERIES.get() - queries == 1
+
+    # После сделки ETag меняется у всех страниц пользователя
+    user_client.post(
+        '/user_buy_cryptocurrency?crypto_name=crypto_1&crypto_cost=10.00',
+        data={'count_buy_crypto': '1'},
+    )
+    for url, etag in etags.items():
+        res = user_client.get(url, headers={'If-None-Match': f'"{etag}"'})
+        assert res.status_code == 200
+        assert res.get_etag()[0] != etag
+
+    # Другой пользователь с той же страницей получает свой ETag
+    other_client = application.app.test_client()
+    assert other_client.get('/index').get_etag()[0] != etags['/index']
+
+
+def test_conditional_get_after_render_cache_miss(real_trade, mocker):
+    user_client = application.app.test_client()
+    user_client.post('/authorization_user', data={'user_login_in': 'name_1'})
+    user_client.post(
+        '/user_buy_cryptocurrency?crypto_name=crypto_1&crypto_cost=10.00',
+        data={'count_buy_crypto': '1'},
+    )
+    urls = (
+        '/index',
+        '/user_portfolio',
+        '/history_operations',
+        '/history_operations?before=2',
+    )
+    etags = {url: user_client.get(url).get_etag()[0] for url in urls}
+    assert len(set(etags.values())) == len(urls)
+
+    # Холодный процесс: фрагментов в кэше нет, но ETag строится по версии
+    # пользователя из базы, и страница не рендерится
+    application.render_cache.clear()
+    render_template = mocker.patch('app.app.render_template')
+    for url, etag in etags.items():
+        queries = DB_QUERIES.get()
+        res = user_client.get(url, headers={'If-None-Match': f'"{etag}"'})
+        assert res.status_code == 304
+        # Только версия и баланс пользователя, без запросов страницы
+        assert DB_QUERIES.get() - queries == 1
+    render_template.assert_not_called()
+
+
+def test_gzip_response(real_trade):
+    user_client = application.app.test_client()
+    plain = user_client.get('/index')
+
+    res = user_client.get('/index', headers={'Accept-Encoding': 'gzip'})
+
+    assert res.headers['Content-Encoding'] == 'gzip'
+    assert len(res.data) < len(plain.data)
+    assert gzip.decompress(res.data) == plain.data
+    etag = res.get_etag()[0]
+    assert etag == f'{plain.get_etag()[0]}-gzip'
+    # Клиент может прислать любой из двух ETag
+    for tag in (etag, plain.get_etag()[0]):
+        res = user_client.get(
+            '/index', headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'"{tag}"'}
+        )
+        assert res.status_code == 304
+        assert res.get_etag()[0] == tag
+
+
+@pytest.fixture()
+def ledger_trade(mocker, tmp_path):
+    # Сделки попадают в базу только через flush_interval
+    engine = create_engine(DatabaseSettings(path=str(tmp_path / 'ledger.db')))
+    settings = LedgerSettings(str(tmp_path / 'ledger'), flush_interval=1.0)
+    trade = LedgerTrade(engine, settings=settings)
+    trade.base_create_all()
+    trade.create_cryptocurrency('crypto_1', '10')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    mocker.patch.object(application, 'trade', new=trade)
+    mocker.patch.object(application, 'async_trade', new=None)
+    yield trade
+    trade.close()
+
+
+def test_history_with_ledger_trade(ledger_trade):
+    user_client = application.app.test_client()
+    user_client.post('/authorization_user', data={'user_login_in': 'name_1'})
+    assert 'Вы пока не совершали операции' in user_client.get(
+        '/history_operations'
+    ).get_data(as_text=True)
+
+    user_client.post(
+        '/user_buy_cryptocurrency?crypto_name=crypto_1&crypto_cost=10.00',
+        data={'count_buy_crypto': '1'},
+    )
+    page = user_client.get('/history_operations').get_data(as_text=True)
+    ledger_trade.flush()
+
+    assert '<label for="count_operation">1</label>' in page
+    assert user_client.get('/history_operations').get_data(as_text=True) == page
+
+
+def test_conditional_get_with_ledger_trade(ledger_trade):
+    user_client = application.app.test_client()
+    user_client.post('/authorization_user', data={'user_login_in': 'name_1'})
+    etag = user_client.get('/history_operations').get_etag()[0]
+
+    user_client.post(
+        '/user_buy_cryptocurrency?crypto_name=crypto_1&crypto_cost=10.00',
+        data={'count_buy_crypto': '1'},
+    )
+    res = user_client.get('/history_operations', headers={'If-None-Match': f'"{etag}"'})
+    ledger_trade.flush()
+
+    # ETag считается по странице уже со сделкой, а не по устаревшей
+    assert res.status_code == 200
+    assert '<label for="count_operation">1</label>' in res.get_data(as_text=True)
+    new_etag = res.get_etag()[0]
+    assert new_etag != etag
+    res = user_client.get(
+        '/history_operations', headers={'If-None-Match': f'"{new_etag}"'}
+    )
+    assert res.status_code == 304
+
+
+def test_create_async_trade(tmp_path, monkeypatch):
+    settings = DatabaseSettings(path=str(tmp_path / 'backend.db'))
+    engine = create_engine(settings)
+    # Асинхронные чтения по умолчанию выключены
+    monkeypatch.delenv('APP_ASYNC_READS', raising=False)
+    assert create_async_trade(Trade(engine), settings) is None
+
+    monkeypatch.setenv('APP_ASYNC_READS', '1')
+    async_trade = create_async_trade(Trade(engine), settings)
+    assert isinstance(async_trade, AsyncTrade)
+    async_trade.close()
+    assert (
+        create_async_trade(
+            LedgerTrade(engine, settings=LedgerSettings(str(tmp_path / 'ledger'))),
+            settings,
+        )
+        is None
+    )
+
+
+def test_session_cookie_is_signed(real_trade):
+    real_trade.create_user('name_1')
+    user_client = application.app.test_client()
+    user_client.post('/authorization_user', data={'user_login_in': 'name_1'})
+    cookie = user_client.get_cookie('session')
+
+    # Cookie подходит любому процессу с тем же ключом, а подделанная
+    # cookie не принимается
+    other_client = application.app.test_client()
+    other_client.set_cookie('session', cookie.value)
+    assert 'name_1' in other_client.get('/user_portfolio').get_data(as_text=True)
+    tampered = cookie.value[:-1] + ('y' if cookie.value.endswith('x') else 'x')
+    other_client.set_cookie('session', tampered)
+    assert 'name_1' not in other_client.get('/user_portfolio').get_data(as_text=True)
+
+
+def test_wsgi_entry_point(mocker):
+    init_application = mocker.patch('app.app.init_application')
+    mocker.patch.dict(os.environ)
+    os.environ.pop('APP_LOG_FILE', None)
+    sys.modules.pop('app.wsgi', None)
+
+    wsgi = importlib.import_module('app.wsgi')
+
+    assert wsgi.app is application.app
+    init_application.assert_called_once_with()
+    assert os.environ['APP_LOG_FILE'] == 'app.{pid}.log'
@@ -0,0 +1,67 @@
+import asyncio
+
+from app.database import DatabaseSettings, create_async_engine, create_engine
+from app.trade import Trade
+
+
+def test_create_engine_sets_pragmas(tmp_path):
+    engine = create_engine(
+        DatabaseSettings(path=str(tmp_path / 'tuned.db'), busy_timeout_ms=1234)
+    )
+
+    with engine.connect() as connection:
+        pragmas = {
+            name: connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+            for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size')
+        }
+
+    assert pragmas == {
+        'journal_mode': 'wal',
+        'synchronous': 1,
+        'busy_timeout': 1234,
+        'cache_size': -64 * 1024,
+    }
+    assert engine.pool.size() == 5
+
+
+def test_create_async_engine_sets_pragmas(tmp_path):
+    engine = create_async_engine(
+        DatabaseSettings(path=str(tmp_path / 'async.db'), busy_timeout_ms=1234)
+    )
+
+    async def get_pragmas():
+        async with engine.connect() as connection:
+            return [
+                (await connection.exec_driver_sql(f'PRAGMA {name}')).scalar()
+                for name in ('journal_mode', 'busy_timeout')
+            ]
+
+    assert asyncio.run(get_pragmas()) == ['wal', 1234]
+
+
+def test_create_engine_works_with_trade(tmp_path):
+    trade = Trade(create_engine(DatabaseSettings(path=str(tmp_path / 'trade.db'))))
+    trade.base_create_all()
+    trade.create_user('name_1')
+
+    assert trade.is_user_exist('name_1')
+
+
+def test_settings_from_env(monkeypatch, tmp_path):
+    monkeypatch.setenv('APP_DB_PATH', str(tmp_path / 'env.db'))
+    monkeypatch.setenv('APP_DB_JOURNAL_MODE', '')
+    monkeypatch.setenv('APP_DB_MMAP_SIZE', '')
+    monkeypatch.setenv('APP_DB_BUSY_TIMEOUT_MS', '100')
+    monkeypatch.setenv('APP_DB_POOL_SIZE', '2')
+
+    settings = DatabaseSettings.from_env()
+
+    assert settings.journal_mode is None
+    assert settings.pool_size == 2
+    assert settings.get_pragmas() == [
+        ('synchronous', 'NORMAL'),
+        ('busy_timeout', 100),
+        ('cache_size', -64 * 1024),
+    ]
+    with create_engine().connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'delete'
@@ -0,0 +1,53 @@
+import gzip
+
+from flask import Response
+
+from app.http_cache import (
+    compress_response,
+    directory_digest,
+    is_compressible,
+    make_etag,
+)
+
+
+def test_make_etag():
+    assert make_etag('index', 'name_1', '10.00') == make_etag(
+        'index', 'name_1', '10.00'
+    )
+    assert make_etag('index', 'name_1', '10.00') != make_etag(
+        'index', 'name_1', '10.01'
+    )
+
+
+def test_directory_digest(tmp_path):
+    (tmp_path / 'index.html').write_text('<html></html>')
+    (tmp_path / 'partials').mkdir()
+    (tmp_path / 'partials' / 'list.html').write_text('<ul></ul>')
+    digest = directory_digest(str(tmp_path))
+
+    assert directory_digest(str(tmp_path)) == digest
+    (tmp_path / 'partials' / 'list.html').write_text('<ol></ol>')
+    assert directory_digest(str(tmp_path)) != digest
+
+
+def test_compress_response():
+    body = '<li>crypto_1</li>' * 100
+    response = Response(body, mimetype='text/html')
+
+    assert is_compressible(response)
+    compress_response(response)
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert response.content_length < len(body)
+    assert gzip.decompress(response.get_data()).decode() == body
+    assert not is_compressible(response)
+
+
+def test_is_compressible():
+    body = 'x' * 1000
+
+    assert not is_compressible(Response('x' * 10, mimetype='text/html'))
+    assert not is_compressible(Response(body, status=404, mimetype='text/html'))
+    assert not is_compressible(Response(body, mimetype='image/png'))
+    assert not is_compressible(Response(iter([body]), mimetype='text/plain'))
@@ -0,0 +1,165 @@
+import os
+
+import pytest
+
+from app.journal import (
+    CryptocurrencyListed,
+    JournalWriter,
+    PriceTicked,
+    TradeExecuted,
+    UserCreated,
+    decode_event,
+    encode_event,
+    encode_snapshot,
+    iter_events,
+    list_segments,
+    list_snapshots,
+    load_snapshot,
+    prune,
+    recover,
+    write_snapshot,
+)
+
+EVENTS = [
+    UserCreated(1, 1, 'name_1', 100000),
+    CryptocurrencyListed(2, 1, 'crypto_1', 12323),
+    UserCreated(3, 2, 'пользователь', 100000),
+    PriceTicked(4, 100, [(1, 12400)]),
+    TradeExecuted(5, 101, 'Buy', 1, 1, 2, 12400, 75200, 2, 24800, 0),
+    TradeExecuted(6, 102, 'Buy', 2, 1, 1, 12400, 87600, 1, 12400, 0),
+    PriceTicked(7, 200, [(1, 13000)]),
+    TradeExecuted(8, 201, 'Sell', 1, 1, 1, 13000, 88200, 1, 12400, 600),
+]
+
+
+def write_events(directory, events, next_seq=1):
+    writer = JournalWriter(directory, next_seq)
+    for event in events:
+        writer.append(event)
+    writer.sync(events[-1].seq)
+    return writer
+
+
+@pytest.mark.parametrize('event', EVENTS)
+def test_encode_decode_event(event):
+    encoded = encode_event(event)
+
+    assert decode_event(encoded[8:]) == event
+
+
+def test_decode_unknown_event():
+    with pytest.raises(ValueError):
+        decode_event(b'\x09' + bytes(8))
+
+
+def test_recover(tmp_path):
+    write_events(str(tmp_path), EVENTS).close()
+
+    state = recover(str(tmp_path))
+
+    assert list(iter_events(str(tmp_path))) == EVENTS
+    assert state.seq == 8
+    assert state.time == 201
+    assert state.cryptocurrencies == {1: ('crypto_1', 13000)}
+    assert {
+        login: (account.balance, account.positions)
+        for login, account in state.accounts.items()
+    } == {'name_1': (88200, {1: 1}), 'пользователь': (87600, {1: 1})}
+    assert state.accounts['name_1'].costs == {1: (12400, 600)}
+
+
+@pytest.mark.parametrize(
+    'until_seq, until_time, seq, balance',
+    [(5, None, 5, 75200), (None, 150, 6, 75200), (None, 99, 3, 100000)],
+)
+def test_recover_to_point_in_time(tmp_path, until_seq, until_time, seq, balance):
+    writer = write_events(str(tmp_path), EVENTS[:5])
+    write_snapshot(str(tmp_path), 5, encode_snapshot(recover(str(tmp_path))))
+    writer.rotate()
+    for event in EVENTS[5:]:
+        writer.append(event)
+    writer.close()
+
+    state = recover(str(tmp_path), until_seq=until_seq, until_time=until_time)
+
+    assert state.seq == seq
+    assert state.accounts['name_1'].balance == balance
+
+
+def test_journal_stops_at_torn_record(tmp_path):
+    write_events(str(tmp_path), EVENTS[:3]).close()
+    _, path = list_segments(str(tmp_path))[0]
+    size = os.path.getsize(path)
+    with open(path, 'ab') as file:
+        file.write(encode_event(EVENTS[3])[:-1])
+
+    assert list(iter_events(str(tmp_path))) == EVENTS[:3]
+
+    # Перед дописыванием повреждённый хвост отрезается
+    write_events(str(tmp_path), EVENTS[3:5], next_seq=4).close()
+    assert os.path.getsize(path) > size
+    assert list(iter_events(str(tmp_path))) == EVENTS[:5]
+
+
+def test_journal_stops_at_corrupted_record(tmp_path):
+    write_events(str(tmp_path), EVENTS).close()
+    _, path = list_segments(str(tmp_path))[0]
+    offset = sum(len(encode_event(event)) for event in EVENTS[:4])
+    with open(path, 'r+b') as file:
+        file.seek(offset + 10)
+        file.write(b'\xff')
+
+    assert list(iter_events(str(tmp_path))) == EVENTS[:4]
+
+
+def test_iter_events_skips_old_segments(tmp_path):
+    writer = write_events(str(tmp_path), EVENTS[:4])
+    writer.rotate()
+    for event in EVENTS[4:]:
+        writer.append(event)
+    writer.close()
+
+    assert [seq for seq, _ in list_segments(str(tmp_path))] == [1, 5]
+    assert list(iter_events(str(tmp_path), after_seq=5)) == EVENTS[5:]
+
+
+def test_load_snapshot_skips_corrupted(tmp_path):
+    write_events(str(tmp_path), EVENTS).close()
+    state = recover(str(tmp_path), until_seq=5)
+    write_snapshot(str(tmp_path), 5, encode_snapshot(state))
+    path = write_snapshot(str(tmp_path), 8, encode_snapshot(recover(str(tmp_path))))
+    with open(path, 'r+b') as file:
+        file.seek(20)
+        file.write(b'\xff')
+
+    snapshot = load_snapshot(str(tmp_path))
+
+    assert snapshot.seq == 5
+    assert snapshot.accounts['name_1'].positions == {1: 2}
+    assert snapshot.accounts['name_1'].costs == {1: (24800, 0)}
+    assert recover(str(tmp_path)).seq == 8
+    assert load_snapshot(str(tmp_path), until_seq=4).seq == 0
+
+
+def test_prune(tmp_path):
+    writer = write_events(str(tmp_path), EVENTS[:2])
+    for event in EVENTS[2:]:
+        write_snapshot(
+            str(tmp_path), event.seq - 1, encode_snapshot(recover(str(tmp_path)))
+        )
+        writer.rotate()
+        writer.append(event)
+        writer.sync(event.seq)
+    writer.close()
+
+    # События после 4 ещё не перенесены в базу
+    prune(str(tmp_path), 2, applied_seq=4)
+
+    assert [seq for seq, _ in list_snapshots(str(tmp_path))] == [6, 7]
+    assert [seq for seq, _ in list_segments(str(tmp_path))] == [5, 6, 7, 8]
+    assert list(iter_events(str(tmp_path), after_seq=4)) == EVENTS[4:]
+
+    prune(str(tmp_path), 2, applied_seq=8)
+
+    assert [seq for seq, _ in list_segments(str(tmp_path))] == [7, 8]
+    assert recover(str(tmp_path)).seq == 8
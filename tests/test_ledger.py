@@ -0,0 +1,423 @@
+import os
+import threading
+import time
+from decimal import Decimal
+
+import pytest
+import sqlalchemy as sa
+
+from app.app import application, create_trade
+from app.journal import list_segments, list_snapshots, recover
+from app.ledger import LedgerSettings, LedgerTrade
+from app.metrics import TRADE_OPERATIONS
+from app.scheduler import LeaderLock
+from app.trade import NameOperation, Trade
+
+
+@pytest.fixture()
+def settings(tmp_path):
+    return LedgerSettings(directory=str(tmp_path / 'ledger'))
+
+
+@pytest.fixture()
+def engine(tmp_path):
+    return sa.create_engine(
+        f'sqlite:///{tmp_path / "ledger.db"}',
+        connect_args={'check_same_thread': False},
+    )
+
+
+@pytest.fixture()
+def ledger(engine, settings):
+    trade = LedgerTrade(engine, settings=settings)
+    trade.base_create_all()
+    trade.create_cryptocurrency('crypto_1', '123.23')
+    trade.create_cryptocurrency('crypto_2', '12.3')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    trade.create_user('name_1')
+    trade.create_user('name_2')
+    yield trade
+    trade.close()
+
+
+def test_ledger_trades_in_memory(ledger):
+    ledger.user_buy_cryptocurrency('name_1', 'crypto_1', 2)
+    ledger.user_buy_cryptocurrency('name_1', 'crypto_2', 5)
+    ledger.user_sell_cryptocurrency('name_1', 'crypto_2', 3)
+
+    assert ledger.get_user_balance('name_1') == Decimal('728.94')
+    assert ledger.get_user_portfolio('name_1') == [(2, 'crypto_1'), (2, 'crypto_2')]
+    assert str(ledger.get_all_users()) == (
+        "[('name_1', Decimal('728.94'), [('crypto_1', 2), ('crypto_2', 2)]),"
+        " ('name_2', Decimal('1000.00'), [])]"
+    )
+    assert ledger.is_user_exist('name_1')
+    assert not ledger.is_user_exist('name_3')
+
+
+def test_ledger_matches_sql_trade(ledger, engine):
+    ledger.user_buy_cryptocurrency('name_1', 'crypto_1', 2)
+    ledger.user_sell_cryptocurrency('name_1', 'crypto_1', 2)
+    ledger.user_buy_cryptocurrency('name_2', 'crypto_2', 10)
+    ledger.flush()
+
+    sql_trade = Trade(engine)
+    assert sql_trade.get_all_users() == ledger.get_all_users()
+    assert sql_trade.get_user_portfolio('name_1') == ledger.get_user_portfolio('name_1')
+    assert sql_trade.get_user_positions('name_2') == ledger.get_user_positions('name_2')
+    assert ledger.get_user_history_operation('name_1') == [
+        ('Buy', 'crypto_1', 2),
+        ('Sell', 'crypto_1', 2),
+    ]
+    with engine.connect() as connection:
+        assert (
+            connection.exec_driver_sql('SELECT seq FROM "LedgerCheckpoint"').scalar()
+            == 6
+        )
+
+
+@pytest.mark.parametrize(
+    'operation, user_login, crypto_name, count, result',
+    [
+        ('Buy', 'name_3', 'crypto_1', 1, 'unknown_user'),
+        ('Buy', 'name_1', 'crypto_3', 1, 'unknown_cryptocurrency'),
+        ('Buy', 'name_1', 'crypto_1', 9, 'insufficient_funds'),
+        ('Sell', 'name_1', 'crypto_1', 1, 'insufficient_cryptocurrency'),
+        ('Sell', 'name_2', 'crypto_2', 2, 'insufficient_cryptocurrency'),
+    ],
+)
+def test_ledger_rejects_trade(
+    ledger, operation, user_login, crypto_name, count, result
+):
+    ledger.user_buy_cryptocurrency('name_2', 'crypto_2', 1)
+    before = TRADE_OPERATIONS.get(operation, result)
+    method = (
+        ledger.user_buy_cryptocurrency
+        if operation == 'Buy'
+        else ledger.user_sell_cryptocurrency
+    )
+
+    with pytest.raises(ValueError):
+        method(user_login, crypto_name, count)
+
+    assert TRADE_OPERATIONS.get(operation, result) == before + 1
+    assert ledger.get_user_balance('name_1') == Decimal('1000')
+
+
+def test_ledger_positions_match_sql_trade(ledger, engine, settings):
+    sql_trade = Trade(engine)
+    sql_trade.create_user('name_3')
+    ledger.user_buy_cryptocurrency('name_1', 'crypto_2', 3)
+    sql_trade.user_buy_cryptocurrency('name_3', 'crypto_2', 3)
+    ledger.update_cost(seed=1)
+    for trade, login in ((ledger, 'name_1'), (sql_trade, 'name_3')):
+        trade.user_buy_cryptocurrency(login, 'crypto_2', 4)
+        trade.user_sell_cryptocurrency(login, 'crypto_2', 5)
+    ledger.flush()
+
+    # Снимок цен sql_trade устарел после тика леджера
+    sql_trade = Trade(engine)
+    positions = ledger.get_user_positions('name_1')
+    assert positions == sql_trade.get_user_positions('name_3')
+    assert sql_trade.get_user_positions('name_1') == positions
+    assert str(positions[0].realised_pnl) == '-1.59'
+    assert ledger.get_user_positions('name_2') == []
+
+    # Стоимость переживает снимок и повтор журнала
+    ledger.snapshot()
+    ledger.user_sell_cryptocurrency('name_1', 'crypto_2', 1)
+    ledger.close()
+    recovered = LedgerTrade(engine, settings=settings)
+    assert str(recovered.get_user_positions('name_1')[0].cost_basis) == '11.87'
+    recovered.close()
+
+
+def test_ledger_unknown_user(ledger):
+    with pytest.raises(ValueError):
+        ledger.get_user_balance('name_3')
+    with pytest.raises(ValueError):
+        ledger.get_user_portfolio('name_3')
+    with pytest.raises(ValueError):
+        ledger.get_user_positions('name_3')
+    with pytest.raises(ValueError):
+        ledger.create_user('name_1')
+    with pytest.raises(ValueError, match='Лимитные заявки'):
+        ledger.place_limit_order('name_1', 'crypto_1', 'Buy', '100', 1)
+    with pytest.raises(ValueError):
+        ledger.cancel_limit_order('name_1', 1)
+
+
+def test_ledger_user_version(ledger):
+    balance, version = ledger.get_user_balance_and_version('name_1')
+    assert balance == Decimal('1000.00')
+    assert ledger.get_user_balance_and_version('name_2')[1] == version
+
+    ledger.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+    with pytest.raises(ValueError):
+        ledger.user_sell_cryptocurrency('name_2', 'crypto_1', 1)
+
+    balance, bought_version = ledger.get_user_balance_and_version('name_1')
+    assert balance == Decimal('876.77')
+    assert bought_version != version
+    assert ledger.get_user_balance_and_version('name_2')[1] == version
+    with pytest.raises(ValueError):
+        ledger.get_user_balance_and_version('name_3')
+
+    # После перезагрузки состояния версии не повторяют прежние
+    ledger.close()
+    reloaded = {
+        ledger.get_user_balance_and_version(login)[1] for login in ('name_1', 'name_2')
+    }
+    assert not reloaded & {version, bought_version}
+
+
+def test_ledger_history_includes_own_trades(engine, tmp_path):
+    # Запись в базу отложена, но свою сделку пользователь видит сразу
+    settings = LedgerSettings(str(tmp_path / 'ledger'), flush_interval=60.0)
+    ledger = LedgerTrade(engine, settings=settings)
+    ledger.base_create_all()
+    ledger.create_cryptocurrency('crypto_1', '123.23')
+    ledger.create_operation(NameOperation.Buy.value)
+    ledger.create_user('name_1')
+
+    ledger.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+    started = time.monotonic()
+    page = ledger.get_user_history_operation_page('name_1', 5)
+
+    assert page.operations == [('Buy', 'crypto_1', 1)]
+    assert ledger.count_user_history_operation('name_1') == 1
+    assert ledger.get_user_history_operation('name_1') == [('Buy', 'crypto_1', 1)]
+    assert time.monotonic() - started < 5
+    ledger.close()
+
+
+def test_ledger_refuses_open_limit_orders(engine, settings):
+    trade = Trade(engine)
+    trade.base_create_all()
+    trade.create_cryptocurrency('crypto_1', '100')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    trade.create_user('name_1')
+    order_id = trade.place_limit_order(
+        'name_1', 'crypto_1', NameOperation.Buy.value, '50', 2
+    )
+
+    # Заявка держит деньги пользователя, а исполнять её леджер не умеет
+    with pytest.raises(ValueError, match='лимитных заявок'):
+        LedgerTrade(engine, settings=settings).get_user_balance('name_1')
+    assert not list_segments(settings.directory)
+
+    trade.cancel_limit_order('name_1', order_id)
+    ledger = LedgerTrade(engine, settings=settings)
+    assert ledger.get_user_balance('name_1') == trade.get_user_balance('name_1')
+    ledger.close()
+
+
+def test_ledger_refuses_second_process(engine, tmp_path):
+    settings = LedgerSettings(str(tmp_path / 'locked'))
+    os.makedirs(settings.directory)
+    # Блокировку держит другой процесс сервера
+    other = LeaderLock(os.path.join(settings.directory, 'ledger.lock'))
+    assert other.acquire()
+    ledger = LedgerTrade(engine, settings=settings)
+    ledger.base_create_all()
+
+    with pytest.raises(RuntimeError, match='другим процессом'):
+        ledger.open()
+    other.release()
+    ledger.open()
+    ledger.close()
+
+
+def test_ledger_concurrent_buys_do_not_overdraw(ledger):
+    # 1000 / 123.23 - хватает ровно на 8 монет
+    def buy():
+        try:
+            ledger.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+        except ValueError:
+            pass
+
+    threads = [threading.Thread(target=buy) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ledger.flush()
+
+    assert ledger.get_user_portfolio('name_1') == [(8, 'crypto_1')]
+    assert Trade(ledger.engine).get_user_balance('name_1') == Decimal('14.16')
+
+
+def test_ledger_recovers_from_journal(ledger, engine, settings, mocker):
+    ledger.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+    ledger.flush()
+    # Процесс упал до того, как фоновый поток перенёс сделки в базу
+    mocker.patch.object(ledger, '_write_pending')
+    ledger.user_buy_cryptocurrency('name_1', 'crypto_2', 4)
+    ledger.user_sell_cryptocurrency('name_1', 'crypto_1', 1)
+    _, segment = list_segments(settings.directory)[-1]
+    with open(segment, 'ab') as file:
+        file.write(b'\x30\x00\x00')
+
+    assert Trade(engine).get_user_portfolio('name_1') == [(1, 'crypto_1')]
+
+    recovered = LedgerTrade(engine, settings=settings)
+    assert recovered.get_user_portfolio('name_1') == [(4, 'crypto_2')]
+    assert recovered.get_user_balance('name_1') == Decimal('950.80')
+    assert Trade(engine).get_user_balance('name_1') == Decimal('950.80')
+    assert [
+        operation for operation, _, _ in recovered.get_user_history_operation('name_1')
+    ] == ['Buy', 'Buy', 'Sell']
+
+    # Недописанный хвост отрезан, новые события читаются после восстановления
+    recovered.user_buy_cryptocurrency('name_1', 'crypto_2', 1)
+    recovered.close()
+    assert Trade(engine).get_user_portfolio('name_1') == [(5, 'crypto_2')]
+    state = recover(settings.directory)
+    assert state.accounts['name_1'].positions == {1: 0, 2: 5}
+
+
+def test_ledger_snapshots_and_prunes_journal(engine, tmp_path):
+    settings = LedgerSettings(
+        directory=str(tmp_path / 'ledger'), snapshot_every=1000, keep_snapshots=2
+    )
+    ledger = LedgerTrade(engine, settings=settings)
+    ledger.base_create_all()
+    ledger.create_operation(NameOperation.Buy.value)
+    ledger.create_operation(NameOperation.Sell.value)
+    ledger.create_cryptocurrency('crypto_1', '10')
+    ledger.create_user('name_1')
+    for _ in range(4):
+        for _ in range(5):
+            ledger.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+        ledger.snapshot()
+    ledger.update_cost(seed=1, tick_time=100)
+    ledger.close()
+
+    snapshots = list_snapshots(settings.directory)
+    assert [seq for seq, _ in snapshots] == [21, 22]
+    assert [seq for seq, _ in list_segments(settings.directory)] == [22, 23]
+
+    recovered = LedgerTrade(engine, settings=settings)
+    assert recovered.get_user_portfolio('name_1') == [(20, 'crypto_1')]
+    assert recovered.get_user_balance('name_1') == Decimal('800')
+    state = recover(settings.directory)
+    assert state.time == 100
+    assert state.cryptocurrencies == {1: ('crypto_1', 940)}
+    recovered.close()
+
+
+def test_ledger_journals_users_missing_after_crash(ledger, engine, settings):
+    ledger.close()
+    # Пользователь попал в базу, а процесс упал до записи в журнал
+    Trade(engine).create_user('name_3')
+
+    recovered = LedgerTrade(engine, settings=settings)
+    recovered.user_buy_cryptocurrency('name_3', 'crypto_2', 1)
+    recovered.close()
+
+    state = recover(settings.directory)
+    assert state.accounts['name_3'].balance == 98770
+    assert state.accounts['name_3'].positions == {2: 1}
+
+
+def test_ledger_loads_database_ahead_of_journal(ledger, engine, settings):
+    ledger.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+    ledger.flush()
+    # Журнал потерян, а база уже содержит сделки
+    for _, path in list_segments(settings.directory) + list_snapshots(
+        settings.directory
+    ):
+        with open(path, 'wb'):
+            pass
+
+    recovered = LedgerTrade(engine, settings=settings)
+    assert recovered.get_user_portfolio('name_1') == [(1, 'crypto_1')]
+    recovered.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+    recovered.close()
+    assert recover(settings.directory).accounts['name_1'].positions == {1: 2}
+
+
+def test_ledger_snapshots_in_background(ledger, settings):
+    settings.snapshot_every = 3
+    for _ in range(3):
+        ledger.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+    # Первый снимок был при загрузке, на событии 0
+    for _ in range(100):
+        if list_snapshots(settings.directory)[-1][0] > 0:
+            break
+        time.sleep(0.01)
+
+    assert list_snapshots(settings.directory)[-1][0] >= 4
+
+
+def test_ledger_retries_failed_write(ledger, mocker):
+    apply_records = ledger._apply_events  # pylint: disable=protected-access
+    calls = []
+
+    def fail_once(connection, records):
+        calls.append(len(records))
+        if len(calls) == 1:
+            raise sa.exc.OperationalError('', {}, Exception())
+        apply_records(connection, records)
+
+    mocker.patch.object(ledger, '_apply_events', side_effect=fail_once)
+    ledger.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+    ledger.flush()
+
+    assert calls == [1, 1]
+    assert Trade(ledger.engine).get_user_portfolio('name_1') == [(1, 'crypto_1')]
+
+
+def test_create_trade_backend(engine, monkeypatch):
+    monkeypatch.setenv('APP_TRADE_BACKEND', 'ledger')
+    assert isinstance(create_trade(engine), LedgerTrade)
+    monkeypatch.setenv('APP_TRADE_BACKEND', 'sql')
+    assert not isinstance(create_trade(engine), LedgerTrade)
+    monkeypatch.setenv('APP_TRADE_BACKEND', 'redis')
+    with pytest.raises(ValueError):
+        create_trade(engine)
+
+
+def test_ledger_settings_from_env(monkeypatch):
+    monkeypatch.setenv('APP_LEDGER_DIR', 'other')
+    monkeypatch.setenv('APP_LEDGER_SYNC_COMMIT', '0')
+    monkeypatch.setenv('APP_LEDGER_FLUSH_INTERVAL', '1.5')
+
+    settings = LedgerSettings.from_env()
+
+    assert settings.directory == 'other'
+    assert not settings.sync_commit
+    assert settings.flush_interval == 1.5
+    assert settings.batch_size == LedgerSettings.batch_size
+
+
+def test_restore_ledger_cli(ledger, settings, tmp_path, monkeypatch):
+    ledger.user_buy_cryptocurrency('name_1', 'crypto_1', 2)
+    ledger.user_buy_cryptocurrency('name_2', 'crypto_2', 3)
+    ledger.user_sell_cryptocurrency('name_1', 'crypto_1', 1)
+    ledger.close()
+    monkeypatch.setenv('APP_LEDGER_DIR', settings.directory)
+    output = str(tmp_path / 'restored.db')
+
+    # Событие 5 - вторая сделка
+    res = application.app.test_cli_runner().invoke(
+        args=['restore-ledger', '--until-seq', '5', '--output', output]
+    )
+
+    assert res.exit_code == 0, res.output
+    assert 'Восстановили событие 5' in res.output
+    restored = Trade(sa.create_engine(f'sqlite:///{output}'))
+    assert str(restored.get_all_users()) == (
+        "[('name_1', Decimal('753.54'), [('crypto_1', 2)]),"
+        " ('name_2', Decimal('963.10'), [('crypto_2', 3)])]"
+    )
+    assert restored.get_cryptocurrency_cost('crypto_2') == Decimal('12.30')
+    restored.user_sell_cryptocurrency('name_1', 'crypto_1', 2)
+
+    res = application.app.test_cli_runner().invoke(
+        args=['restore-ledger', '--output', output]
+    )
+    assert res.exit_code != 0
+    assert 'уже существует' in res.output
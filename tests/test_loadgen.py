@@ -0,0 +1,179 @@
+import json
+import threading
+
+import pytest
+import sqlalchemy as sa
+from werkzeug.serving import make_server
+
+from app.app import application
+from app.loadgen import (
+    HttpClient,
+    InProcessClient,
+    Response,
+    TraceOperation,
+    generate_trace,
+    load_trace,
+    main,
+    replay,
+)
+from app.logging_config import stop_logging
+from app.trade import NameOperation, Trade
+
+TRACE = [
+    TraceOperation('login', 'name_1'),
+    TraceOperation('index', 'name_1'),
+    TraceOperation('buy', 'name_1', 'crypto_1', 2),
+    TraceOperation('buy', 'name_1', 'crypto_1', 1, cost='0.01'),
+    TraceOperation('buy', 'name_1', 'crypto_1', 1),
+    TraceOperation('sell', 'name_1', 'crypto_1', 100),
+    TraceOperation('sell', 'name_1', 'crypto_1', 1),
+    TraceOperation('portfolio', 'name_1'),
+    TraceOperation('history', 'name_1'),
+    TraceOperation('history', 'name_1', before=3),
+]
+
+
+@pytest.fixture()
+def trade(mocker, tmp_path):
+    trade = Trade(sa.create_engine(f'sqlite:///{tmp_path / "loadgen.db"}'))
+    trade.base_create_all()
+    trade.create_cryptocurrency('crypto_1', '10')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    mocker.patch.object(application, 'trade', new=trade)
+    return trade
+
+
+def get_outcomes(report):
+    return {route: dict(stats.outcomes) for route, stats in report.routes.items()}
+
+
+EXPECTED_OUTCOMES = {
+    '/authorization_user': {'ok': 1},
+    '/index': {'ok': 1},
+    '/user_buy_cryptocurrency': {'ok': 2, 'stale_price': 1},
+    '/user_sell_cryptocurrency': {'ok': 1, 'rejected': 1},
+    '/user_portfolio': {'ok': 1},
+    '/history_operations': {'ok': 2},
+}
+
+
+def test_replay_in_process(trade):
+    report = replay(TRACE, InProcessClient)
+
+    assert get_outcomes(report) == EXPECTED_OUTCOMES
+    assert str(trade.get_user_portfolio('name_1')) == "[(2, 'crypto_1')]"
+    data = report.to_dict()
+    assert data['count'] == len(TRACE)
+    assert data['routes']['/user_sell_cryptocurrency']['error_rate'] == 0.5
+    assert 0 < data['routes']['/index']['p50'] <= data['routes']['/index']['p99']
+    assert '/user_buy_cryptocurrency' in report.format()
+
+
+def test_replay_http(trade):
+    server = make_server('127.0.0.1', 0, application.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        report = replay(
+            TRACE, lambda: HttpClient(f'http://127.0.0.1:{server.port}'), rate=500
+        )
+    finally:
+        server.shutdown()
+        thread.join()
+
+    assert get_outcomes(report) == EXPECTED_OUTCOMES
+
+
+def test_replay_concurrency(trade):
+    trace = [TraceOperation(**entry) for entry in generate_trace(50, 1, ['crypto_1'])]
+
+    report = replay(trace, InProcessClient, concurrency=4)
+
+    assert sum(len(stats.latencies) for stats in report.routes.values()) == 50
+    assert 'error' not in get_outcomes(report)['/authorization_user']
+
+
+def test_replay_error(trade, mocker):
+    mocker.patch.object(
+        InProcessClient, 'request', side_effect=[Response(500, ''), OSError]
+    )
+
+    report = replay(
+        [TraceOperation('portfolio', 'name_1'), TraceOperation('index', 'name_1')],
+        InProcessClient,
+    )
+
+    assert get_outcomes(report) == {
+        '/user_portfolio': {'error': 1},
+        'index': {'error': 1},
+    }
+
+
+def test_generate_and_load_trace(tmp_path):
+    path = tmp_path / 'trace.jsonl'
+
+    assert main(['generate', str(path), '--operations', '20', '--seed', '1']) == 0
+
+    trace = load_trace(str(path))
+    assert len(trace) == 20
+    assert trace[0] == TraceOperation('login', 'load_user_0')
+    assert {operation.op for operation in trace} <= {
+        'login',
+        'index',
+        'buy',
+        'sell',
+        'portfolio',
+        'history',
+    }
+
+
+@pytest.mark.parametrize(
+    'line', ['{"op": "trade", "user": "name_1"}', '{"op": "index"}']
+)
+def test_load_trace_error(tmp_path, line):
+    path = tmp_path / 'trace.jsonl'
+    path.write_text(f'\n{line}\n', encoding='utf-8')
+
+    with pytest.raises(ValueError, match=':2:'):
+        load_trace(str(path))
+
+
+@pytest.mark.parametrize('db_name', [None, 'load.db'])
+def test_main_replay_in_process(mocker, monkeypatch, tmp_path, capsys, db_name):
+    mocker.patch.object(application, 'trade', new=None)
+    monkeypatch.setenv('APP_DB_PATH', str(tmp_path / 'main.db'))
+    monkeypatch.setenv('APP_LOG_FILE', str(tmp_path / 'app.log'))
+    monkeypatch.setenv('APP_TICK_LOCK', str(tmp_path / 'tick.lock'))
+    trace_path = tmp_path / 'trace.jsonl'
+    trace_path.write_text(
+        '{"op": "login", "user": "name_1"}\n'
+        '{"op": "buy", "user": "name_1", "crypto": "crypto_1"}\n',
+        encoding='utf-8',
+    )
+    report_path = tmp_path / 'report.json'
+
+    try:
+        assert (
+            main(
+                [
+                    'replay',
+                    str(trace_path),
+                    '--tick-interval',
+                    '0.01',
+                    '--json',
+                    str(report_path),
+                ]
+                + ([] if db_name is None else ['--db', str(tmp_path / db_name)])
+            )
+            == 0
+        )
+    finally:
+        stop_logging()
+
+    report = json.loads(report_path.read_text(encoding='utf-8'))
+    assert report['count'] == 2
+    assert '/user_buy_cryptocurrency' in capsys.readouterr().out
+    # Без --db рабочая база из APP_DB_PATH не трогается
+    assert not (tmp_path / 'main.db').exists()
+    assert (tmp_path / 'load.db').exists() == (db_name is not None)
@@ -0,0 +1,94 @@
+import logging
+import os
+
+import pytest
+
+from app.logging_config import LoggingSettings, setup_logging, stop_logging
+
+
+@pytest.fixture()
+def restore_root_level():
+    level = logging.getLogger().level
+    yield
+    stop_logging()
+    logging.getLogger().setLevel(level)
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv('APP_LOG_LEVEL', 'debug')
+    monkeypatch.setenv('APP_LOG_MAX_BYTES', '100')
+    monkeypatch.setenv('APP_LOG_ROTATE_WHEN', 'midnight')
+
+    settings = LoggingSettings.from_env()
+
+    assert settings.level == 'DEBUG'
+    assert settings.max_bytes == 100
+    assert settings.when == 'midnight'
+    assert LoggingSettings().level == 'INFO'
+
+
+def test_setup_logging_writes_through_queue(tmp_path, restore_root_level):
+    log_file = tmp_path / 'app.log'
+    setup_logging(LoggingSettings(level='INFO', filename=str(log_file)))
+    logger = logging.getLogger('app.test')
+
+    logger.debug('скрытое сообщение')
+    logger.info('сообщение %d', 1)
+    stop_logging()
+
+    text = log_file.read_text(encoding='utf-8')
+    assert 'app.test - INFO - сообщение 1' in text
+    assert 'скрытое сообщение' not in text
+
+
+def test_setup_logging_formats_message_in_caller_thread(tmp_path, restore_root_level):
+    log_file = tmp_path / 'app.log'
+    setup_logging(LoggingSettings(filename=str(log_file)))
+    portfolio = ['crypto_1']
+
+    # Аргумент меняется сразу после вызова, а в лог попадает значение на момент вызова
+    logging.getLogger('app.test').info('портфель %s', portfolio)
+    portfolio.append('crypto_2')
+    stop_logging()
+
+    assert "портфель ['crypto_1']\n" in log_file.read_text(encoding='utf-8')
+
+
+def test_setup_logging_rotation(tmp_path, restore_root_level):
+    log_file = tmp_path / 'app.log'
+    listener = setup_logging(
+        LoggingSettings(filename=str(log_file), max_bytes=200, backup_count=2)
+    )
+    assert isinstance(listener.handlers[0], logging.handlers.RotatingFileHandler)
+    for i in range(50):
+        logging.getLogger('app.test').info('строка номер %d', i)
+    stop_logging()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'app.log',
+        'app.log.1',
+        'app.log.2',
+    ]
+
+
+def test_setup_logging_timed_rotation(tmp_path, restore_root_level):
+    listener = setup_logging(
+        LoggingSettings(filename=str(tmp_path / 'app.log'), when='midnight')
+    )
+    assert isinstance(listener.handlers[0], logging.handlers.TimedRotatingFileHandler)
+    setup_logging(LoggingSettings(filename=str(tmp_path / 'app.log')))
+    assert (
+        sum(
+            isinstance(handler, logging.handlers.QueueHandler)
+            for handler in logging.getLogger().handlers
+        )
+        == 1
+    )
+
+
+def test_setup_logging_file_per_process(tmp_path, restore_root_level):
+    setup_logging(LoggingSettings(filename=str(tmp_path / 'app.{pid}.log')))
+    logging.getLogger('app.test').info('сообщение')
+    stop_logging()
+
+    assert [path.name for path in tmp_path.iterdir()] == [f'app.{os.getpid()}.log']
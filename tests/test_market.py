@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from app.market import SECONDS_PER_YEAR, MarketModel, MarketSettings
+
+
+def test_log_returns_moments():
+    model = MarketModel(drift=0.5, volatility=0.8, correlation=0.3, seed=1)
+    dt = 3600
+
+    returns = model.log_returns(4, 200_000, dt)
+
+    years = dt / SECONDS_PER_YEAR
+    assert returns.shape == (200_000, 4)
+    assert np.allclose(returns.mean(axis=0), (0.5 - 0.32) * years, atol=3e-5)
+    assert np.allclose(returns.std(axis=0), 0.8 * np.sqrt(years), rtol=0.01)
+    correlation = np.corrcoef(returns.T)
+    assert np.allclose(correlation[np.triu_indices(4, 1)], 0.3, atol=0.01)
+
+
+def test_log_returns_correlation_matrix():
+    correlation = np.array([[1, 0.9, 0], [0.9, 1, 0.2], [0, 0.2, 1]])
+    model = MarketModel(volatility=[0.5, 1, 2], correlation=correlation, seed=2)
+
+    returns = model.log_returns(3, 200_000)
+
+    assert np.allclose(np.corrcoef(returns.T), correlation, atol=0.01)
+    ratio = returns.std(axis=0) / returns.std(axis=0)[0]
+    assert np.allclose(ratio, [1, 2, 4], rtol=0.02)
+    # Подмножество валют: своя волатильность и корреляция между ними
+    subset = model.log_returns(2, 200_000, index=np.array([0, 2]))
+    assert abs(np.corrcoef(subset.T)[0, 1]) < 0.01
+    assert np.isclose(subset.std(axis=0)[1] / subset.std(axis=0)[0], 4, rtol=0.02)
+
+
+def test_paths_are_reproducible_and_consistent():
+    start = np.array([100.0, 5.0])
+
+    returns = MarketModel(seed=3).log_returns(2, 50, 60)
+    paths = MarketModel(seed=3).paths(start, 50, 60)
+    backward = MarketModel(seed=3).backward_paths(start, 50, 60)
+
+    assert np.allclose(paths[0], start * np.exp(returns[0]))
+    assert np.allclose(paths[-1], start * np.exp(returns.sum(axis=0)))
+    # Путь в прошлое приходит ровно в start
+    assert np.allclose(backward[-1] * np.exp(returns[-1]), start)
+    assert np.allclose(backward[0] * np.exp(returns.sum(axis=0)), start)
+
+
+def test_next_cents_not_below_one_cent():
+    model = MarketModel(drift=-50, volatility=0, tick_seconds=SECONDS_PER_YEAR)
+
+    assert model.next_cents(np.array([1, 250])).tolist() == [1, 1]
+
+
+def test_next_cents_cheap_currency_volatility():
+    # Сутки десятисекундных тиков: дешёвая валюта должна двигаться как дорогая
+    model = MarketModel(volatility=0.8, correlation=0, tick_seconds=10, seed=3)
+    cents = np.array([330, 12343])
+    path = []
+    for _ in range(8640):
+        cents = model.next_cents(cents, keys=['cheap', 'dear'])
+        path.append(cents)
+
+    # Волатильность за тик оцениваем по минутам, где округление уже не важно
+    returns = np.diff(np.log(np.array(path)[::60]), axis=0)
+    expected = 0.8 * np.sqrt(10 / SECONDS_PER_YEAR)
+    assert np.allclose(returns.std(axis=0) / np.sqrt(60), expected, rtol=0.15)
+    assert np.count_nonzero(np.diff(np.array(path)[:, 0])) > 500
+
+
+def test_next_cents_restarts_from_changed_price():
+    model = MarketModel(volatility=0, tick_seconds=10)
+    assert model.next_cents(np.array([330]), keys=[1]).tolist() == [330]
+
+    # Цену поменяли в обход модели - путь продолжается от новой цены
+    assert model.next_cents(np.array([500]), keys=[1]).tolist() == [500]
+
+
+@pytest.mark.parametrize(
+    'params',
+    [
+        {'volatility': -0.1},
+        {'correlation': 1.5},
+        {'correlation': np.array([[1, 0.5], [0.4, 1]])},
+        {'correlation': np.array([[1, 2], [2, 1]])},
+        {'correlation': np.ones((2, 3))},
+    ],
+)
+def test_invalid_parameters(params):
+    with pytest.raises(ValueError):
+        MarketModel(**params)
+
+
+def test_parameters_for_other_count():
+    model = MarketModel(volatility=[0.5, 0.8], correlation=np.eye(2))
+
+    with pytest.raises(ValueError):
+        model.log_returns(3, 1)
+    with pytest.raises(ValueError):
+        MarketModel(correlation=np.eye(2)).log_returns(3, 1)
+
+
+def test_market_settings(monkeypatch):
+    monkeypatch.setenv('APP_MARKET_DRIFT', '0.1')
+    monkeypatch.setenv('APP_MARKET_VOLATILITY', '1.2')
+    monkeypatch.setenv('APP_MARKET_CORRELATION', '0')
+
+    settings = MarketSettings.from_env()
+    model = MarketModel.from_settings(settings, 10, seed=1)
+
+    assert settings == MarketSettings(0.1, 1.2, 0)
+    assert model.tick_seconds == 10
+    returns = model.log_returns(2, 100_000)
+    assert abs(np.corrcoef(returns.T)[0, 1]) < 0.02
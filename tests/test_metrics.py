@@ -0,0 +1,71 @@
+import sqlalchemy as sa
+
+from app.metrics import (
+    DB_QUERIES,
+    Counter,
+    Histogram,
+    Registry,
+    finish_request_queries,
+    instrument_engine,
+    start_request_queries,
+)
+
+
+def test_counter():
+    counter = Counter('trades_total', 'Сделки', ('operation', 'result'))
+    counter.inc('Buy', 'ok')
+    counter.inc('Buy', 'ok', amount=2)
+    counter.inc('Sell', 'stale "price"\n')
+
+    assert counter.get('Buy', 'ok') == 3
+    assert counter.collect() == [
+        '# HELP trades_total Сделки',
+        '# TYPE trades_total counter',
+        'trades_total{operation="Buy",result="ok"} 3',
+        'trades_total{operation="Sell",result="stale \\"price\\"\\n"} 1',
+    ]
+
+
+def test_histogram():
+    histogram = Histogram('duration_seconds', 'Время', ('endpoint',), (0.1, 1))
+    histogram.observe(0.05, 'index')
+    histogram.observe(0.1, 'index')
+    histogram.observe(5, 'index')
+
+    assert histogram.get_count('index') == 3
+    assert histogram.collect() == [
+        '# HELP duration_seconds Время',
+        '# TYPE duration_seconds histogram',
+        'duration_seconds_bucket{endpoint="index",le="0.1"} 2',
+        'duration_seconds_bucket{endpoint="index",le="1"} 2',
+        'duration_seconds_bucket{endpoint="index",le="+Inf"} 3',
+        'duration_seconds_sum{endpoint="index"} 5.15',
+        'duration_seconds_count{endpoint="index"} 3',
+    ]
+
+
+def test_registry():
+    registry = Registry()
+    registry.register(Counter('a_total', 'A')).inc()
+    registry.register(Histogram('b_seconds', 'B', buckets=(1.5,)))
+
+    assert registry.render() == (
+        '# HELP a_total A\n# TYPE a_total counter\na_total 1\n'
+        '# HELP b_seconds B\n# TYPE b_seconds histogram\n'
+    )
+
+
+def test_instrument_engine():
+    engine = sa.create_engine('sqlite://')
+    instrument_engine(engine)
+    instrument_engine(engine)
+    total = DB_QUERIES.get()
+
+    start_request_queries()
+    with engine.connect() as connection:
+        connection.exec_driver_sql('SELECT 1')
+        connection.exec_driver_sql('SELECT 2')
+
+    assert finish_request_queries() == 2
+    assert finish_request_queries() == 0
+    assert DB_QUERIES.get() == total + 2
@@ -0,0 +1,210 @@
+from decimal import Decimal
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from app.migrations import (
+    MIGRATIONS,
+    backfill_position_costs,
+    get_schema_version,
+    upgrade,
+)
+from app.models import (
+    Base,
+    Cryptocurrency,
+    HistoryOperation,
+    Operation,
+    User,
+    UserCryptocurrency,
+)
+from app.trade import NameOperation, Trade
+
+
+@pytest.fixture()
+def legacy_engine(tmp_path):
+    # База в том виде, в котором она была до появления миграций
+    engine = sa.create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+    legacy_tables = [
+        User.__table__,
+        Cryptocurrency.__table__,
+        Operation.__table__,
+        UserCryptocurrency.__table__,
+        HistoryOperation.__table__,
+    ]
+    Base.metadata.create_all(engine, tables=legacy_tables)
+    for index in HistoryOperation.__table__.indexes:
+        index.drop(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'ALTER TABLE "HistoryOperation" DROP COLUMN created_at'
+        )
+        for column in ('cost_basis', 'realised_pnl'):
+            connection.exec_driver_sql(
+                f'ALTER TABLE "UserCryptocurrency" DROP COLUMN {column}'
+            )
+        connection.exec_driver_sql('ALTER TABLE user DROP COLUMN version')
+    return engine
+
+
+def test_upgrade_legacy_base(legacy_engine):
+    with Session(legacy_engine) as session, session.begin():
+        crypto = Cryptocurrency(name='crypto_1', cost='10')
+        session.add_all([crypto, Operation(name=NameOperation.Buy.value)])
+        session.flush()
+        # Модели уже с версией пользователя и стоимостью позиции, которых
+        # в старой базе нет
+        session.execute(
+            sa.text("INSERT INTO user (id, login, balance) VALUES (1, 'name_1', 950)")
+        )
+        session.execute(
+            sa.text(
+                'INSERT INTO "UserCryptocurrency" '
+                '(user_id, cryptocurrency_id, count) VALUES (1, :crypto, 5)'
+            ),
+            {'crypto': crypto.id},
+        )
+    trade = Trade(legacy_engine)
+    assert get_schema_version(legacy_engine) == 0
+
+    assert trade.base_migrate() == [migration.version for migration in MIGRATIONS]
+
+    inspector = sa.inspect(legacy_engine)
+    assert inspector.has_table('LimitOrder')
+    assert inspector.has_table('PriceTick')
+    assert inspector.has_table('PriceCandle')
+    assert inspector.has_table('LedgerCheckpoint')
+    assert 'created_at' in {
+        column['name'] for column in inspector.get_columns('HistoryOperation')
+    }
+    assert 'ix_HistoryOperation_user_id_id' in {
+        index['name'] for index in inspector.get_indexes('HistoryOperation')
+    }
+    assert get_schema_version(legacy_engine) == MIGRATIONS[-1].version
+    assert str(trade.get_all_users()) == (
+        "[('name_1', Decimal('950.00'), [('crypto_1', 5)])]"
+    )
+    assert trade.get_user_balance_and_version('name_1') == (Decimal('950.00'), 0)
+    assert upgrade(legacy_engine) == []
+
+
+def test_upgrade_backfills_position_costs(legacy_engine):
+    with legacy_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO user (id, login, balance) VALUES (1, 'name_1', 950)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO cryptocurrency (id, name, cost) VALUES (1, 'crypto_1', 12)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO operation (id, name) VALUES (1, 'Buy'), (2, 'Sell')"
+        )
+        # По истории 2 монеты, а в портфеле 4: стоимость растягивается
+        # на весь портфель по средней цене
+        connection.exec_driver_sql(
+            'INSERT INTO "UserCryptocurrency" (user_id, cryptocurrency_id, count) '
+            'VALUES (1, 1, 4)'
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO "HistoryOperation" '
+            '(user_id, operation_id, cryptocurrency_id, count, price) '
+            'VALUES (1, 1, 1, 3, 10), (1, 1, 1, 1, 14), (1, 2, 1, 2, 12)'
+        )
+
+    Trade(legacy_engine).base_migrate()
+
+    [position] = Trade(legacy_engine).get_user_positions('name_1')
+    assert (position.count, str(position.cost_basis), str(position.realised_pnl)) == (
+        4,
+        '44.00',
+        '2.00',
+    )
+
+
+def test_backfill_matches_incremental_costs(tmp_path):
+    engine = sa.create_engine(f'sqlite:///{tmp_path / "costs.db"}')
+    trade = Trade(engine)
+    trade.base_create_all()
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    trade.create_cryptocurrency('crypto_1', '10')
+    trade.create_user('name_1')
+    for seed in range(3):
+        trade.user_buy_cryptocurrency('name_1', 'crypto_1', 3)
+        trade.update_cost(seed=seed)
+        trade.user_sell_cryptocurrency('name_1', 'crypto_1', 1)
+    trade.place_limit_order('name_1', 'crypto_1', NameOperation.Sell.value, '100', 2)
+    expected = trade.get_user_positions('name_1')
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'UPDATE "UserCryptocurrency" SET cost_basis = 0, realised_pnl = 0'
+        )
+        connection.exec_driver_sql('UPDATE "LimitOrder" SET cost_basis = 0')
+        backfill_position_costs(connection)
+
+    assert trade.get_user_positions('name_1') == expected
+    with engine.connect() as connection:
+        assert (
+            connection.exec_driver_sql('SELECT cost_basis FROM "LimitOrder"').scalar()
+            > 0
+        )
+
+
+def test_create_all_is_latest_version(tmp_path):
+    engine = sa.create_engine(f'sqlite:///{tmp_path / "new.db"}')
+    trade = Trade(engine)
+    trade.base_create_all()
+
+    assert get_schema_version(engine) == MIGRATIONS[-1].version
+    assert trade.base_migrate() == []
+
+
+def explain_trade_queries(trade, method, *args):
+    statements = []
+
+    def save_statement(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    sa.event.listen(trade.engine, 'before_cursor_execute', save_statement)
+    try:
+        method(*args)
+    finally:
+        sa.event.remove(trade.engine, 'before_cursor_execute', save_statement)
+
+    plans = []
+    with trade.engine.connect() as connection:
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql(
+                f'EXPLAIN QUERY PLAN {statement}', parameters
+            ).all()
+            plans.append(' / '.join(row[-1] for row in plan))
+    return plans
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    engine = sa.create_engine(f'sqlite:///{tmp_path / "explain.db"}')
+    trade = Trade(engine)
+    trade.base_create_all()
+    trade.create_user('name_1')
+    trade.create_cryptocurrency('crypto_1', '10')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    trade.user_buy_cryptocurrency('name_1', 'crypto_1', 5)
+
+    plans = explain_trade_queries(
+        trade, trade.get_user_history_operation_page, 'name_1', 5, 100
+    )
+    plans += explain_trade_queries(trade, trade.count_user_history_operation, 'name_1')
+    plans += explain_trade_queries(
+        trade, trade.user_sell_cryptocurrency, 'name_1', 'crypto_1', 1
+    )
+
+    assert plans
+    for plan in plans:
+        assert 'SCAN HistoryOperation' not in plan
+        assert 'SCAN user' not in plan
+        assert 'SCAN cryptocurrency' not in plan
+        assert 'SCAN UserCryptocurrency' not in plan
+    assert any('ix_HistoryOperation_user_id_id' in plan for plan in plans)
@@ -0,0 +1,76 @@
+from app.order_book import MatchingEngine, Order, OrderBook, PriceLevel
+
+
+def test_price_time_priority():
+    book = OrderBook()
+    book.submit(Order(1, 1, False, 101, 5))
+    book.submit(Order(2, 2, False, 100, 5))
+    book.submit(Order(3, 3, False, 100, 5))
+
+    fills = book.submit(Order(4, 4, True, 101, 12))
+
+    assert [(f.sell_order.id, f.price, f.count) for f in fills] == [
+        (2, 100, 5),
+        (3, 100, 5),
+        (1, 101, 2),
+    ]
+    assert book.best_ask() == 101
+    assert book.get_order(1).count == 3
+    assert book.get_order(4) is None
+
+
+def test_no_cross_rests_in_book():
+    book = OrderBook()
+    book.submit(Order(1, 1, False, 105, 5))
+
+    assert book.submit(Order(2, 2, True, 100, 5)) == []
+    assert book.best_bid() == 100
+    assert book.best_ask() == 105
+    assert len(book) == 2
+
+
+def test_sell_matches_best_bid():
+    book = OrderBook()
+    book.submit(Order(1, 1, True, 99, 5))
+    book.submit(Order(2, 2, True, 100, 5))
+
+    fills = book.submit(Order(3, 3, False, 99, 7))
+
+    assert [(f.buy_order.id, f.price, f.count) for f in fills] == [
+        (2, 100, 5),
+        (1, 99, 2),
+    ]
+    assert book.depth(True, 10) == [PriceLevel(99, 3)]
+
+
+def test_cancel():
+    book = OrderBook()
+    book.submit(Order(1, 1, False, 100, 5))
+    book.submit(Order(2, 2, False, 100, 5))
+    book.submit(Order(3, 3, False, 102, 5))
+
+    assert book.cancel(1).id == 1
+    assert book.cancel(1) is None
+    fills = book.submit(Order(4, 4, True, 102, 6))
+
+    assert [(f.sell_order.id, f.count) for f in fills] == [(2, 5), (3, 1)]
+    book.cancel(3)
+    assert book.best_ask() is None
+    assert book.depth(False, 10) == []
+
+
+def test_depth_limit():
+    book = OrderBook()
+    for i, price in enumerate([103, 101, 102]):
+        book.submit(Order(i, i, False, price, 1))
+
+    assert book.depth(False, 2) == [PriceLevel(101, 1), PriceLevel(102, 1)]
+
+
+def test_matching_engine_books_per_cryptocurrency():
+    engine = MatchingEngine()
+    engine.submit(1, Order(1, 1, False, 100, 5))
+
+    assert engine.submit(2, Order(2, 2, True, 100, 5)) == []
+    assert len(engine.submit(1, Order(3, 2, True, 100, 5))) == 1
+    assert engine.cancel(2, 2).id == 2
@@ -0,0 +1,56 @@
+import threading
+
+from app.price_stream import PricePublisher, PriceUpdate
+
+
+def test_wait_for_updates_returns_newer_updates():
+    publisher = PricePublisher()
+    publisher.publish(1, [('crypto_1', '1')])
+    publisher.publish(3, [('crypto_2', '2')])
+
+    assert publisher.wait_for_updates(1, timeout=0) == [
+        PriceUpdate(3, [('crypto_2', '2')])
+    ]
+    assert publisher.wait_for_updates(3, timeout=0) == []
+    assert publisher.epoch == 3
+
+
+def test_wait_for_updates_wakes_up_subscribers():
+    publisher = PricePublisher()
+    results = []
+
+    def subscriber():
+        publisher.subscribe()
+        results.append(publisher.wait_for_updates(0, timeout=5))
+        publisher.unsubscribe()
+
+    threads = [threading.Thread(target=subscriber) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    publisher.publish(1, [('crypto_1', '1')])
+    for thread in threads:
+        thread.join()
+
+    assert results == [[PriceUpdate(1, [('crypto_1', '1')])]] * 10
+    assert publisher.count_subscribers == 0
+
+
+def test_lagging_subscriber_gets_none():
+    publisher = PricePublisher(history_size=2)
+    for epoch in range(1, 5):
+        publisher.publish(epoch, [('crypto_1', str(epoch))])
+
+    assert publisher.wait_for_updates(1, timeout=0) is None
+    assert [update.epoch for update in publisher.wait_for_updates(2, timeout=0)] == [
+        3,
+        4,
+    ]
+
+
+def test_subscribe_limit():
+    publisher = PricePublisher(max_subscribers=2)
+
+    assert [publisher.subscribe() for _ in range(3)] == [True, True, False]
+    assert publisher.count_subscribers == 2
+    publisher.unsubscribe()
+    assert publisher.subscribe()
@@ -0,0 +1,50 @@
+from app.metrics import RENDER_CACHE
+from app.render_cache import RenderCache
+
+
+def test_render_cache_hit_and_miss():
+    cache = RenderCache()
+    hits = RENDER_CACHE.get('test_fragment', 'hit')
+
+    assert cache.get('test_fragment', (1, 'name_1')) is None
+    cache.put('test_fragment', (1, 'name_1'), 'table')
+
+    assert cache.get('test_fragment', (1, 'name_1')) == 'table'
+    assert cache.get('test_fragment', (2, 'name_1')) is None
+    assert cache.get('other_fragment', (1, 'name_1')) is None
+    assert cache.stats() == {'entries': 1, 'hits': 1, 'misses': 3, 'evictions': 0}
+    assert RENDER_CACHE.get('test_fragment', 'hit') - hits == 1
+
+
+def test_render_cache_evicts_least_recently_used():
+    cache = RenderCache(max_entries=2)
+    cache.put('fragment', (1,), 'first')
+    cache.put('fragment', (2,), 'second')
+
+    # Чтение делает запись самой свежей, вытесняется вторая
+    assert cache.get('fragment', (1,)) == 'first'
+    cache.put('fragment', (3,), 'third')
+
+    assert cache.get('fragment', (2,)) is None
+    assert cache.get('fragment', (1,)) == 'first'
+    assert cache.get('fragment', (3,)) == 'third'
+    assert len(cache) == 2
+    assert cache.evictions == 1
+
+
+def test_render_cache_disabled():
+    cache = RenderCache(max_entries=0)
+
+    cache.put('fragment', (1,), 'table')
+
+    assert cache.get('fragment', (1,)) is None
+    assert len(cache) == 0
+
+
+def test_render_cache_clear():
+    cache = RenderCache()
+    cache.put('fragment', (1,), 'table')
+
+    cache.clear()
+
+    assert cache.get('fragment', (1,)) is None
@@ -0,0 +1,170 @@
+import threading
+import time
+
+import pytest
+
+from app.metrics import PRICE_TICK_LAG, PRICE_TICKS, PRICE_TICKS_SKIPPED
+from app.price_cache import PriceSnapshot
+from app.scheduler import LeaderLock, PriceTickScheduler, SchedulerSettings
+from app.trade import Trade
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture()
+def trade(mocker):
+    trade = mocker.Mock(spec=Trade)
+    trade.get_price_snapshot.return_value = PriceSnapshot(
+        1, [('crypto_1', 1), ('crypto_2', 2), ('crypto_3', 3)], {}, {}
+    )
+    return trade
+
+
+@pytest.fixture()
+def make_scheduler(tmp_path, trade, clock):
+    schedulers = []
+
+    def make(**settings):
+        settings.setdefault('lock_path', str(tmp_path / 'tick.lock'))
+        scheduler = PriceTickScheduler(trade, SchedulerSettings(**settings), clock)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.stop()
+
+
+def test_ticks_at_fixed_rate(make_scheduler, trade, clock):
+    scheduler = make_scheduler(interval=10)
+    lag_count = PRICE_TICK_LAG.get_count('10')
+    ticks = PRICE_TICKS.get('10', 'tick')
+
+    clock.now = 5
+    assert scheduler.run_pending() == 10
+    trade.update_cost.assert_not_called()
+
+    # Тик опоздал на 0.5 с и шёл 2 с, но следующий всё равно в 20
+    clock.now = 10.5
+
+    def slow_tick(**kwargs):
+        clock.now += 2
+
+    trade.update_cost.side_effect = slow_tick
+    assert scheduler.run_pending() == 20
+    trade.update_cost.assert_called_once_with(names=None)
+    assert PRICE_TICK_LAG.get_count('10') == lag_count + 1
+    assert PRICE_TICKS.get('10', 'tick') == ticks + 1
+
+
+def test_overrun_coalesces_missed_ticks(make_scheduler, trade, clock):
+    scheduler = make_scheduler(interval=10)
+    skipped = PRICE_TICKS_SKIPPED.get('10')
+
+    def slow_tick(**kwargs):
+        clock.now = 35
+
+    trade.update_cost.side_effect = slow_tick
+    clock.now = 10
+    # Тики в 20 и 30 не догоняем, следующий в 40
+    assert scheduler.run_pending() == 40
+    assert trade.update_cost.call_count == 1
+    assert PRICE_TICKS_SKIPPED.get('10') == skipped + 2
+
+
+def test_per_currency_intervals(make_scheduler, trade, clock):
+    scheduler = make_scheduler(interval=10, intervals={'crypto_1': 4})
+
+    clock.now = 4
+    assert scheduler.run_pending() == 8
+    clock.now = 10
+    assert scheduler.run_pending() == 12
+
+    assert [call.kwargs['names'] for call in trade.update_cost.call_args_list] == [
+        ['crypto_1'],
+        ['crypto_2', 'crypto_3'],
+        ['crypto_1'],
+    ]
+
+
+def test_tick_error_keeps_schedule(make_scheduler, trade, clock):
+    scheduler = make_scheduler(interval=10)
+    trade.update_cost.side_effect = RuntimeError('database is locked')
+
+    clock.now = 10
+    assert scheduler.run_pending() == 20
+    clock.now = 20
+    assert scheduler.run_pending() == 30
+    assert trade.update_cost.call_count == 2
+
+
+def test_only_leader_ticks(make_scheduler, trade, clock):
+    leader = make_scheduler(interval=10)
+    follower = make_scheduler(interval=10)
+
+    clock.now = 10
+    leader.run_pending()
+    follower.run_pending()
+    assert trade.update_cost.call_count == 1
+    trade.reload_prices.assert_called_once_with()
+    assert leader.leader_lock.held
+    assert not follower.leader_lock.held
+
+    # После остановки лидера тик подхватывает другой процесс
+    leader.stop()
+    clock.now = 20
+    follower.run_pending()
+    assert follower.leader_lock.held
+    assert trade.update_cost.call_count == 2
+
+
+def test_leader_lock_between_files(tmp_path):
+    first = LeaderLock(str(tmp_path / 'tick.lock'))
+    second = LeaderLock(str(tmp_path / 'tick.lock'))
+
+    assert first.acquire()
+    assert first.acquire()
+    assert not second.acquire()
+    first.release()
+    assert second.acquire()
+    second.release()
+
+
+def test_start_and_stop(tmp_path, trade):
+    ticked = threading.Event()
+    trade.update_cost.side_effect = lambda **kwargs: ticked.set()
+    scheduler = PriceTickScheduler(
+        trade, SchedulerSettings(interval=0.01, lock_path=str(tmp_path / 'tick.lock'))
+    )
+
+    scheduler.start()
+    assert ticked.wait(5)
+    scheduler.stop(timeout=5)
+    calls = trade.update_cost.call_count
+    time.sleep(0.05)
+
+    assert trade.update_cost.call_count == calls
+    assert not scheduler.leader_lock.held
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv('APP_TICK_INTERVAL', '2.5')
+    monkeypatch.setenv('APP_TICK_INTERVALS', 'crypto_1=1, crypto_2=30')
+    monkeypatch.setenv('APP_TICK_LOCK', '/tmp/tick.lock')
+
+    assert SchedulerSettings.from_env() == SchedulerSettings(
+        interval=2.5,
+        intervals={'crypto_1': 1.0, 'crypto_2': 30.0},
+        lock_path='/tmp/tick.lock',
+    )
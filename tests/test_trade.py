@@ -1,12 +1,36 @@
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+import numpy as np
 import pytest
 import sqlalchemy as sa
 
-from app.trade import NameOperation, Trade
+from app.database import DatabaseSettings, create_engine
+from app.market import MarketModel
+from app.metrics import PRICE_TICK_DURATION, TRADE_OPERATIONS
+from app.trade import HistoryFilter, NameOperation, Trade
 
 engine = sa.create_engine('sqlite:///test.db')
 trade = Trade(engine)
 
 
+@contextmanager
+def count_queries():
+    # Запросы к базе, выполненные внутри блока
+    statements = []
+
+    def save_statement(*params):
+        statements.append(params[2])
+
+    sa.event.listen(engine, 'before_cursor_execute', save_statement)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(engine, 'before_cursor_execute', save_statement)
+
+
 @pytest.fixture(autouse=True)
 def clear_trade_base():
     trade.base_create_all()
@@ -207,11 +231,44 @@ def test_get_user_portfolio_error_no_user():
         trade.get_user_portfolio('name_1')
 
 
+def test_get_user_positions():
+    trade.create_user('name_1')
+    trade.create_cryptocurrency('crypto_1', '100')
+    trade.create_cryptocurrency('crypto_2', '10')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+
+    trade.user_buy_cryptocurrency('name_1', 'crypto_1', 3)
+    trade.update_cost(seed=1)
+    trade.user_buy_cryptocurrency('name_1', 'crypto_1', 4)
+    trade.user_sell_cryptocurrency('name_1', 'crypto_1', 5)
+    trade.user_buy_cryptocurrency('name_1', 'crypto_2', 2)
+    trade.user_sell_cryptocurrency('name_1', 'crypto_2', 2)
+
+    # 300 + 4 * 94 за 7 монет, продано 5 по 94. Закрытая позиция без прибыли
+    # не показывается
+    assert [
+        tuple(map(str, position)) for position in trade.get_user_positions('name_1')
+    ] == [('crypto_1', '2', '193.14', '96.57', '-12.86', '94.00', '-5.14')]
+
+
+def test_get_user_positions_error_no_user():
+    with pytest.raises(ValueError):
+        trade.get_user_positions('name_1')
+
+
 def test_is_user_exist():
     trade.create_user('name_1')
     assert trade.is_user_exist('name_1') is True
 
 
+def test_create_user_error_user_exist():
+    trade.create_user('name_1')
+    with pytest.raises(ValueError):
+        trade.create_user('name_1')
+    assert len(trade.get_all_users()) == 1
+
+
 def test_get_cryptocurrency_cost():
     trade.create_cryptocurrency('crypto_1', '123.23')
     cost = trade.get_cryptocurrency_cost('crypto_1')
@@ -246,3 +303,707 @@ def test_update_cost():
 
     assert str(trade.get_cryptocurrency_cost('crypto_1')) == '133.09'
     assert str(trade.get_cryptocurrency_cost('crypto_2')) == '14.36'
+
+
+def test_get_all_crypto_from_price_cache():
+    trade.create_cryptocurrency('crypto_1', '123.23')
+    trade.create_cryptocurrency('crypto_2', '12.3')
+
+    hits = trade.price_cache.hits
+    with count_queries() as statements:
+        for _ in range(10):
+            trade.get_all_crypto()
+            trade.get_cryptocurrency_cost('crypto_2')
+
+    assert statements == []
+    assert trade.price_cache.hits - hits == 20
+
+
+def test_price_cache_epoch_after_update_cost():
+    trade.create_cryptocurrency('crypto_1', '123.23')
+    epoch = trade.price_cache.epoch
+
+    trade.update_cost(seed=10)
+
+    assert trade.price_cache.epoch == epoch + 1
+    assert str(trade.get_all_crypto()) == "[('crypto_1', Decimal('133.09'))]"
+
+
+def test_price_cache_miss_after_drop():
+    trade.create_cryptocurrency('crypto_1', '123.23')
+    trade.base_drop_all()
+    trade.base_create_all()
+    misses = trade.price_cache.misses
+
+    assert trade.get_all_crypto() == []
+    assert trade.price_cache.misses - misses == 1
+    assert trade.price_cache.stats()['misses'] == trade.price_cache.misses
+
+
+def test_get_cryptocurrency_cost_error_no_crypto():
+    trade.create_cryptocurrency('crypto_1', '123.23')
+
+    with pytest.raises(ValueError):
+        trade.get_cryptocurrency_cost('crypto_2')
+
+
+def test_update_cost_bulk():
+    trade.create_cryptocurrency('crypto_1', '123.23')
+    trade.create_cryptocurrency('crypto_2', '13.3')
+    trade.create_cryptocurrency('crypto_3', '0.5')
+    old_prices = trade.get_all_crypto()
+    epoch = trade.price_cache.epoch
+
+    trade.update_cost_bulk(seed=10)
+
+    moves = np.random.default_rng(10).integers(-10, 11, size=3)
+    expected = [
+        (name, round(int(move) * cost / 100 + cost, 2))
+        for (name, cost), move in zip(old_prices, moves)
+    ]
+    assert trade.get_all_crypto() == expected
+    assert trade.price_cache.epoch == epoch + 1
+
+    trade.price_cache.invalidate()
+    assert trade.get_all_crypto() == expected
+
+
+def test_update_cost_bulk_is_seedable():
+    bulk_trade = Trade(engine, bulk_tick=True)
+    bulk_trade.create_cryptocurrency('crypto_1', '123.23')
+
+    bulk_trade.update_cost(seed=3)
+    first = bulk_trade.get_cryptocurrency_cost('crypto_1')
+    trade.base_drop_all()
+    trade.base_create_all()
+    bulk_trade.price_cache.invalidate()
+    bulk_trade.create_cryptocurrency('crypto_1', '123.23')
+    bulk_trade.update_cost(seed=3)
+
+    assert bulk_trade.get_cryptocurrency_cost('crypto_1') == first
+
+
+def test_update_cost_bulk_without_crypto():
+    epoch = trade.price_cache.epoch
+    trade.update_cost_bulk(seed=1)
+    assert trade.price_cache.epoch == epoch
+
+
+@pytest.mark.parametrize('bulk_tick', [False, True])
+def test_update_cost_only_selected_names(bulk_tick):
+    names_trade = Trade(engine, bulk_tick=bulk_tick)
+    names_trade.create_cryptocurrency('crypto_1', '123.23')
+    names_trade.create_cryptocurrency('crypto_2', '13.3')
+    names_trade.create_cryptocurrency('crypto_3', '0.5')
+
+    names_trade.update_cost(seed=10, tick_time=600, names=['crypto_2'])
+
+    prices = dict(names_trade.get_all_crypto())
+    assert str(prices['crypto_1']) == '123.23'
+    assert str(prices['crypto_2']) != '13.30'
+    assert str(prices['crypto_3']) == '0.50'
+    names_trade.price_cache.invalidate()
+    assert dict(names_trade.get_all_crypto()) == prices
+    # Тик записан только для изменённой валюты
+    assert names_trade.get_candles('crypto_1', 60, 600, 660) == []
+    assert len(names_trade.get_candles('crypto_2', 60, 600, 660)) == 1
+
+
+def test_reload_prices_from_other_process():
+    trade.create_cryptocurrency('crypto_1', '123.23')
+    other = Trade(engine)
+    other.get_all_crypto()
+    epoch = other.price_cache.epoch
+
+    assert not other.reload_prices()
+    assert other.price_cache.epoch == epoch
+
+    trade.update_cost(seed=10)
+    assert other.reload_prices()
+    assert other.get_all_crypto() == trade.get_all_crypto()
+    assert other.price_cache.epoch == epoch + 1
+
+
+@pytest.fixture
+def two_processes(tmp_path):
+    # Два Trade с разными движками на одном файле - как два процесса сервера
+    settings = DatabaseSettings(path=str(tmp_path / 'processes.db'))
+    first = Trade(create_engine(settings))
+    first.base_create_all()
+    first.create_user('name_1')
+    first.create_cryptocurrency('crypto_1', '10')
+    first.create_operation(NameOperation.Buy.value)
+    first.create_operation(NameOperation.Sell.value)
+    second = Trade(create_engine(settings))
+    second.get_all_crypto()
+    return first, second
+
+
+@pytest.mark.parametrize('operation', ['buy', 'sell'])
+def test_trades_of_one_user_from_two_processes(two_processes, mocker, operation):
+    first, second = two_processes
+    if operation == 'sell':
+        first.user_buy_cryptocurrency('name_1', 'crypto_1', 60)
+    read = threading.Event()
+
+    # Первая сделка прочитала баланс и задержалась перед записью
+    def select_cost(session, cryptocurrency_id):
+        read.set()
+        time.sleep(0.3)
+        return Trade._select_cost(session, cryptocurrency_id)
+
+    mocker.patch.object(first, '_select_cost', side_effect=select_cost)
+    errors = []
+
+    def trade_second():
+        read.wait()
+        try:
+            getattr(second, f'user_{operation}_cryptocurrency')(
+                'name_1', 'crypto_1', 60
+            )
+        except ValueError as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=trade_second)
+    thread.start()
+    getattr(first, f'user_{operation}_cryptocurrency')('name_1', 'crypto_1', 60)
+    thread.join()
+
+    # Вторая сделка ждёт первую и видит её результат
+    assert len(errors) == 1
+    assert str(second.get_user_balance('name_1')) == (
+        '400.00' if operation == 'buy' else '1000.00'
+    )
+    assert len(second.get_user_history_operation('name_1')) == (
+        1 if operation == 'buy' else 2
+    )
+
+
+def test_trade_cryptocurrency_created_by_other_process(two_processes):
+    first, second = two_processes
+    first.create_cryptocurrency('crypto_2', '5')
+
+    second.user_buy_cryptocurrency('name_1', 'crypto_2', 2)
+
+    assert str(second.get_user_balance('name_1')) == '990.00'
+    assert 'crypto_2' in dict(second.get_all_crypto())
+    with pytest.raises(ValueError, match='Такой криптовалюты не существует'):
+        second.user_buy_cryptocurrency('name_1', 'crypto_3', 1)
+
+
+def create_limit_order_market():
+    trade.create_user('name_1')
+    trade.create_user('name_2')
+    trade.create_cryptocurrency('crypto_1', '100')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    trade.user_buy_cryptocurrency('name_1', 'crypto_1', 5)
+
+
+def test_limit_order_match():
+    create_limit_order_market()
+
+    trade.place_limit_order('name_1', 'crypto_1', NameOperation.Sell.value, '90', 3)
+    trade.place_limit_order('name_2', 'crypto_1', NameOperation.Buy.value, '95.5', 5)
+
+    assert (
+        str(trade.get_all_users())
+        == "[('name_1', Decimal('770.00'), [('crypto_1', 2)]), ('name_2', Decimal('539.00'), [('crypto_1', 3)])]"  # pylint: disable=line-too-long
+    )
+    assert str(trade.get_all_history()[1:]) == (
+        "[('name_2', 'Buy', 3, 'crypto_1', Decimal('90.00')),"
+        " ('name_1', 'Sell', 3, 'crypto_1', Decimal('90.00'))]"
+    )
+    assert str(trade.get_order_book('crypto_1')) == "([(Decimal('95.50'), 2)], [])"
+
+
+def test_limit_order_partial_fill_of_resting_order():
+    create_limit_order_market()
+
+    trade.place_limit_order('name_1', 'crypto_1', NameOperation.Sell.value, '90', 5)
+    trade.place_limit_order('name_2', 'crypto_1', NameOperation.Buy.value, '90', 2)
+
+    assert str(trade.get_order_book('crypto_1')) == "([], [(Decimal('90.00'), 3)])"
+    assert str(trade.get_user_balance('name_1')) == '680.00'
+
+
+def test_limit_order_book_reloaded_from_base():
+    create_limit_order_market()
+    trade.place_limit_order('name_1', 'crypto_1', NameOperation.Sell.value, '110', 2)
+    order_id = trade.place_limit_order(
+        'name_1', 'crypto_1', NameOperation.Sell.value, '120', 3
+    )
+
+    trade.matching_engine = None
+    trade.place_limit_order('name_2', 'crypto_1', NameOperation.Buy.value, '115', 2)
+
+    assert str(trade.get_order_book('crypto_1')) == ("([], [(Decimal('120.00'), 3)])")
+    trade.cancel_limit_order('name_1', order_id)
+    assert str(trade.get_order_book('crypto_1')) == '([], [])'
+    assert str(trade.get_user_portfolio('name_1')) == "[(3, 'crypto_1')]"
+
+
+def test_limit_order_positions():
+    create_limit_order_market()
+    order_id = trade.place_limit_order(
+        'name_1', 'crypto_1', NameOperation.Sell.value, '90', 4
+    )
+    trade.place_limit_order('name_2', 'crypto_1', NameOperation.Buy.value, '95.5', 3)
+
+    # Стоимость зарезервированных монет уходит с позиции в заявку и
+    # списывается при исполнении
+    def positions(user_login):
+        return [
+            (position.count, str(position.cost_basis), str(position.realised_pnl))
+            for position in trade.get_user_positions(user_login)
+        ]
+
+    assert positions('name_1') == [(1, '100.00', '-30.00')]
+    assert positions('name_2') == [(3, '270.00', '0.00')]
+
+    trade.cancel_limit_order('name_1', order_id)
+
+    assert positions('name_1') == [(2, '200.00', '-30.00')]
+
+
+def test_cancel_buy_limit_order_returns_money():
+    create_limit_order_market()
+    order_id = trade.place_limit_order(
+        'name_2', 'crypto_1', NameOperation.Buy.value, '50', 4
+    )
+    assert str(trade.get_user_balance('name_2')) == '800.00'
+
+    trade.cancel_limit_order('name_2', order_id)
+
+    assert str(trade.get_user_balance('name_2')) == '1000.00'
+    with pytest.raises(ValueError):
+        trade.cancel_limit_order('name_2', order_id)
+
+
+@pytest.mark.parametrize(
+    ('user_login', 'crypto_name', 'operation_name', 'price', 'count'),
+    [
+        ['name_3', 'crypto_1', 'Buy', '10', 1],
+        ['name_2', 'crypto_2', 'Buy', '10', 1],
+        ['name_2', 'crypto_1', 'Swap', '10', 1],
+        ['name_2', 'crypto_1', 'Buy', '10', 0],
+        ['name_2', 'crypto_1', 'Buy', 'abc', 1],
+        ['name_2', 'crypto_1', 'Buy', '-1', 1],
+        ['name_2', 'crypto_1', 'Buy', '1000', 2],
+        ['name_2', 'crypto_1', 'Sell', '10', 1],
+        ['name_1', 'crypto_1', 'Sell', '10', 6],
+    ],
+)
+def test_limit_order_errors(user_login, crypto_name, operation_name, price, count):
+    create_limit_order_market()
+
+    with pytest.raises(ValueError):
+        trade.place_limit_order(user_login, crypto_name, operation_name, price, count)
+    with pytest.raises(ValueError):
+        trade.get_order_book('crypto_2')
+
+
+def test_get_user_history_operation_page():
+    trade.create_user('name_1')
+    trade.create_user('name_2')
+    trade.create_cryptocurrency('crypto_1', '1')
+    trade.create_operation(NameOperation.Buy.value)
+    for count in range(1, 8):
+        trade.user_buy_cryptocurrency('name_1', 'crypto_1', count)
+        trade.user_buy_cryptocurrency('name_2', 'crypto_1', count)
+
+    first = trade.get_user_history_operation_page('name_1', 3)
+    assert [op[2] for op in first.operations] == [7, 6, 5]
+    assert first.prev_cursor is None
+
+    second = trade.get_user_history_operation_page(
+        'name_1', 3, before_id=first.next_cursor
+    )
+    assert [op[2] for op in second.operations] == [4, 3, 2]
+
+    last = trade.get_user_history_operation_page(
+        'name_1', 3, before_id=second.next_cursor
+    )
+    assert last.operations == [('Buy', 'crypto_1', 1)]
+    assert last.next_cursor is None
+
+    back = trade.get_user_history_operation_page('name_1', 3, after_id=last.prev_cursor)
+    assert back == second
+    back = trade.get_user_history_operation_page('name_1', 3, after_id=back.prev_cursor)
+    assert back.operations == first.operations
+    assert back.prev_cursor is None
+
+    assert trade.count_user_history_operation('name_1') == 7
+
+
+def test_get_user_history_operation_page_error_no_user():
+    with pytest.raises(ValueError):
+        trade.get_user_history_operation_page('name_1', 5)
+
+
+@pytest.mark.parametrize(
+    ('method', 'args'),
+    [
+        ['get_all_users', ()],
+        ['get_all_history', ()],
+        ['get_user_portfolio', ('name_0',)],
+        ['get_user_history_operation', ('name_0',)],
+    ],
+)
+def test_report_queries_do_not_depend_on_rows(method, args):
+    trade.create_operation(NameOperation.Buy.value)
+    for i in range(3):
+        trade.create_cryptocurrency(f'crypto_{i}', '1')
+    trade.create_user('name_0')
+    trade.user_buy_cryptocurrency('name_0', 'crypto_0', 1)
+    with count_queries() as statements:
+        getattr(trade, method)(*args)
+    few_rows = len(statements)
+
+    for i in range(1, 10):
+        trade.create_user(f'name_{i}')
+        for j in range(3):
+            trade.user_buy_cryptocurrency(f'name_{i}', f'crypto_{j}', 1)
+            trade.user_buy_cryptocurrency('name_0', f'crypto_{j}', 1)
+
+    with count_queries() as statements:
+        getattr(trade, method)(*args)
+    assert len(statements) == few_rows <= 2
+
+
+def test_get_user_history_operation_error_no_user():
+    with pytest.raises(ValueError):
+        trade.get_user_history_operation('name_1')
+
+
+def test_trade_uses_reference_cache():
+    trade.create_user('name_1')
+    trade.create_cryptocurrency('crypto_1', '1')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    trade.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+
+    # Пользователь, цена и запись портфеля; операции и id валюты из кэша
+    with count_queries() as statements:
+        trade.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+        trade.user_sell_cryptocurrency('name_1', 'crypto_1', 1)
+
+    selects = [s for s in statements if s.startswith('SELECT')]
+    assert len(selects) == 6
+    assert not any('FROM operation' in s for s in selects)
+
+
+def test_user_buy_cryptocurrency_error_no_operation():
+    trade.create_user('name_1')
+    trade.create_cryptocurrency('crypto_1', '1')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+
+    with pytest.raises(ValueError):
+        trade.user_sell_cryptocurrency('name_1', 'crypto_1', 1)
+
+    trade.create_operation(NameOperation.Sell.value)
+    trade.user_sell_cryptocurrency('name_1', 'crypto_1', 1)
+    assert str(trade.get_user_portfolio('name_1')) == '[]'
+
+
+def test_update_cost_publishes_changed_prices():
+    trade.create_cryptocurrency('crypto_1', '123.23')
+    trade.create_cryptocurrency('crypto_2', '0.01')
+    epoch = trade.price_publisher.epoch
+
+    trade.update_cost(seed=10)
+
+    updates = trade.price_publisher.wait_for_updates(epoch, timeout=0)
+    assert str(updates) == (
+        f"[PriceUpdate(epoch={trade.price_cache.epoch},"
+        " prices=[('crypto_1', Decimal('133.09'))])]"
+    )
+
+
+def test_update_cost_builds_candles():
+    trade.create_cryptocurrency('crypto_1', '100')
+    # Тики в двух минутах одного пятиминутного интервала
+    for tick_time, seed in [(600, 10), (630, 1), (660, 2), (690, 5)]:
+        trade.update_cost(seed=seed, tick_time=tick_time)
+
+    assert str(trade.get_candles('crypto_1', 60, 600, 720)) == (
+        "[Candle(start=600, open=Decimal('108.00'), high=Decimal('108.00'),"
+        " low=Decimal('101.52'), close=Decimal('101.52')),"
+        " Candle(start=660, open=Decimal('92.38'), high=Decimal('100.69'),"
+        " low=Decimal('92.38'), close=Decimal('100.69'))]"
+    )
+    assert str(trade.get_candles('crypto_1', 300, 600, 720)) == (
+        "[Candle(start=600, open=Decimal('108.00'), high=Decimal('108.00'),"
+        " low=Decimal('92.38'), close=Decimal('100.69'))]"
+    )
+    with engine.connect() as connection:
+        assert (
+            connection.execute(sa.text('SELECT count(*) FROM PriceTick')).scalar() == 5
+        )
+
+
+def test_update_cost_bulk_builds_candles():
+    trade.bulk_tick = True
+    try:
+        trade.create_cryptocurrency('crypto_1', '100')
+        trade.create_cryptocurrency('crypto_2', '10')
+        for tick_time in range(0, 3600 * 3, 600):
+            trade.update_cost(seed=tick_time, tick_time=tick_time)
+    finally:
+        trade.bulk_tick = False
+
+    hourly = trade.get_candles('crypto_2', 3600, 0, 3600 * 3)
+    assert [candle.start for candle in hourly] == [0, 3600, 7200]
+    minutely = trade.get_candles('crypto_2', 60, 0, 3600 * 3)
+    assert len(minutely) == 18
+    assert hourly[1].open == minutely[6].open
+    assert hourly[1].close == minutely[11].close
+    assert hourly[1].high == max(candle.high for candle in minutely[6:12])
+    assert hourly[1].low == min(candle.low for candle in minutely[6:12])
+
+
+def test_get_candles_downsampling():
+    trade.create_cryptocurrency('crypto_1', '100')
+    for tick_time in range(0, 3600 * 24, 3600):
+        trade.update_cost(seed=tick_time, tick_time=tick_time)
+
+    hourly = trade.get_candles('crypto_1', 3600, 0, 3600 * 24)
+    daily = trade.get_candles('crypto_1', 3600, 0, 3600 * 24, max_points=5)
+    assert [candle.start for candle in daily] == [0, 18000, 36000, 54000, 72000]
+    assert daily[0] == (
+        0,
+        hourly[0].open,
+        max(candle.high for candle in hourly[:5]),
+        min(candle.low for candle in hourly[:5]),
+        hourly[4].close,
+    )
+
+
+def test_get_candles_downsampling_uses_daily_candles():
+    trade.create_cryptocurrency('crypto_1', '100')
+    for tick_time in range(0, 3600 * 72, 3600):
+        trade.update_cost(seed=tick_time, tick_time=tick_time)
+
+    # 18 часов на точку округляются до дневных свечей
+    daily = trade.get_candles('crypto_1', 3600, 0, 3600 * 72, max_points=4)
+    assert daily == trade.get_candles('crypto_1', 86400, 0, 3600 * 72)
+    assert [candle.start for candle in daily] == [0, 86400, 172800]
+
+
+@pytest.mark.parametrize(
+    'crypto_name, interval, start, end, max_points',
+    [
+        ('crypto_2', 60, 0, 60, None),
+        ('crypto_1', 90, 0, 60, None),
+        ('crypto_1', 60, 60, 0, None),
+        ('crypto_1', 0, 0, 60, None),
+        ('crypto_1', 60, 0, 60, 0),
+    ],
+)
+def test_get_candles_error(crypto_name, interval, start, end, max_points):
+    trade.create_cryptocurrency('crypto_1', '100')
+
+    with pytest.raises(ValueError):
+        trade.get_candles(crypto_name, interval, start, end, max_points)
+
+
+def fill_history_for_export():
+    trade.create_user('name_1')
+    trade.create_user('name_2')
+    trade.create_cryptocurrency('crypto_1', '10')
+    trade.create_cryptocurrency('crypto_2', '20')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    for _ in range(3):
+        trade.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+        trade.user_buy_cryptocurrency('name_2', 'crypto_2', 2)
+        trade.user_sell_cryptocurrency('name_1', 'crypto_1', 1)
+
+
+def test_iter_history():
+    fill_history_for_export()
+
+    chunks = list(trade.iter_history(HistoryFilter(), chunk_size=4))
+    assert [len(rows) for rows in chunks] == [4, 4, 1]
+    rows = [row for rows in chunks for row in rows]
+    assert [row[0] for row in rows] == list(range(1, 10))
+    assert all(isinstance(row[1], int) for row in rows)
+    assert str(rows[0][2:]) == "('name_1', 'Buy', 'crypto_1', 1, Decimal('10.00'))"
+    assert [row[2:] for row in rows] == [
+        row[:2] + row[3:4] + row[2:3] + row[4:] for row in trade.get_all_history()
+    ]
+
+
+@pytest.mark.parametrize(
+    'history_filter, ids',
+    [
+        (HistoryFilter(user_login='name_2'), [2, 5, 8]),
+        (HistoryFilter(cryptocurrency_name='crypto_1', start_id=4), [4, 6, 7, 9]),
+        (HistoryFilter(user_login='name_1', end_id=4), [1, 3, 4]),
+        (HistoryFilter(start_time=0, end_time=2**31), list(range(1, 10))),
+        (HistoryFilter(end_time=0), []),
+    ],
+)
+def test_iter_history_filter(history_filter, ids):
+    fill_history_for_export()
+
+    chunks = trade.iter_history(history_filter, chunk_size=2)
+    assert [row[0] for rows in chunks for row in rows] == ids
+
+
+@pytest.mark.parametrize(
+    'history_filter',
+    [HistoryFilter(user_login='name_3'), HistoryFilter(cryptocurrency_name='crypto_3')],
+)
+def test_iter_history_error(history_filter):
+    fill_history_for_export()
+
+    with pytest.raises(ValueError):
+        trade.iter_history(history_filter)
+
+
+def test_trade_operations_metrics():
+    trade.create_user('name_1')
+    trade.create_cryptocurrency('crypto_1', '100')
+    trade.create_operation(NameOperation.Buy.value)
+    trade.create_operation(NameOperation.Sell.value)
+    before = {
+        (operation, result): TRADE_OPERATIONS.get(operation, result)
+        for operation in ('Buy', 'Sell')
+        for result in (
+            'ok',
+            'unknown_user',
+            'unknown_cryptocurrency',
+            'insufficient_funds',
+            'insufficient_cryptocurrency',
+        )
+    }
+
+    trade.user_buy_cryptocurrency('name_1', 'crypto_1', 1)
+    trade.user_sell_cryptocurrency('name_1', 'crypto_1', 1)
+    for method, args in [
+        (trade.user_buy_cryptocurrency, ('name_2', 'crypto_1', 1)),
+        (trade.user_buy_cryptocurrency, ('name_1', 'crypto_2', 1)),
+        (trade.user_buy_cryptocurrency, ('name_1', 'crypto_1', 100)),
+        (trade.user_sell_cryptocurrency, ('name_2', 'crypto_1', 1)),
+        (trade.user_sell_cryptocurrency, ('name_1', 'crypto_2', 1)),
+        (trade.user_sell_cryptocurrency, ('name_1', 'crypto_1', 1)),
+    ]:
+        with pytest.raises(ValueError):
+            method(*args)
+
+    changed = {
+        key: TRADE_OPERATIONS.get(*key) - count
+        for key, count in before.items()
+        if TRADE_OPERATIONS.get(*key) != count
+    }
+    assert changed == {
+        ('Buy', 'ok'): 1,
+        ('Sell', 'ok'): 1,
+        ('Buy', 'unknown_user'): 1,
+        ('Buy', 'unknown_cryptocurrency'): 1,
+        ('Buy', 'insufficient_funds'): 1,
+        ('Sell', 'unknown_user'): 1,
+        ('Sell', 'unknown_cryptocurrency'): 1,
+        ('Sell', 'insufficient_cryptocurrency'): 1,
+    }
+
+
+def test_update_cost_metrics():
+    trade.create_cryptocurrency('crypto_1', '100')
+    count_orm = PRICE_TICK_DURATION.get_count('orm')
+    count_bulk = PRICE_TICK_DURATION.get_count('bulk')
+
+    trade.update_cost()
+    trade.bulk_tick = True
+    try:
+        trade.update_cost()
+    finally:
+        trade.bulk_tick = False
+
+    assert PRICE_TICK_DURATION.get_count('orm') == count_orm + 1
+    assert PRICE_TICK_DURATION.get_count('bulk') == count_bulk + 1
+
+
+def test_update_cost_with_market():
+    market = MarketModel(volatility=2, tick_seconds=86400, seed=1)
+    market_trade = Trade(engine, market=market)
+    market_trade.create_cryptocurrency('crypto_1', '123.23')
+    market_trade.create_cryptocurrency('crypto_2', '13.3')
+    count = PRICE_TICK_DURATION.get_count('market')
+
+    market_trade.update_cost(seed=5)
+
+    expected = MarketModel(volatility=2, tick_seconds=86400).next_cents(
+        np.array([12323, 1330]), rng=np.random.default_rng(5)
+    )
+    assert [str(cost) for _, cost in market_trade.get_all_crypto()] == [
+        f'{cents / 100:.2f}' for cents in expected
+    ]
+    assert PRICE_TICK_DURATION.get_count('market') == count + 1
+
+
+def test_simulate_history():
+    trade.create_cryptocurrency('crypto_1', '100')
+    trade.create_cryptocurrency('crypto_2', '3.3')
+    with engine.connect() as connection:
+        created = connection.exec_driver_sql(
+            'SELECT min(time) FROM "PriceTick"'
+        ).scalar()
+    prices = trade.get_all_crypto()
+
+    count = trade.simulate_history(MarketModel(tick_seconds=60, seed=1), 10)
+
+    assert count == 20
+    assert trade.get_all_crypto() == prices
+    start = created - 600
+    minutes = trade.get_candles('crypto_1', 60, start - start % 60, created + 1)
+    assert len(minutes) >= 10
+    assert [candle.open for candle in minutes] == [candle.close for candle in minutes]
+    # Новые тики легли перед тиком создания валюты и пришли в его цену
+    day = trade.get_candles('crypto_1', 86400, start - 86400, created + 1)
+    assert day[-1].close == Decimal('100.00')
+    assert day[0].open == minutes[0].open
+    assert trade.simulate_history(MarketModel(), 0) == 0
+
+
+def test_simulate_history_without_crypto():
+    assert trade.simulate_history(MarketModel(), 10) == 0
+
+
+def test_user_version_changes_with_trades():
+    create_limit_order_market()
+
+    def versions():
+        return [trade.get_user_balance_and_version(login)[1] for login in users]
+
+    users = ['name_1', 'name_2']
+    assert trade.get_user_balance_and_version('name_2') == (Decimal('1000.00'), 0)
+    assert versions() == [1, 0]
+
+    with pytest.raises(ValueError):
+        trade.user_buy_cryptocurrency('name_2', 'crypto_1', 100)
+    trade.user_sell_cryptocurrency('name_1', 'crypto_1', 1)
+    assert versions() == [2, 0]
+
+    order_id = trade.place_limit_order(
+        'name_2', 'crypto_1', NameOperation.Buy.value, '50', 2
+    )
+    assert versions() == [2, 1]
+    # Сделка по заявке меняет версии обоих участников
+    trade.place_limit_order('name_1', 'crypto_1', NameOperation.Sell.value, '50', 1)
+    assert versions() == [4, 2]
+    trade.cancel_limit_order('name_2', order_id)
+    assert versions() == [4, 3]
+    with pytest.raises(ValueError):
+        trade.get_user_balance_and_version('name_3')
+
+
+def test_price_cache_epoch_after_drop():
+    trade.create_cryptocurrency('crypto_1', '123.23')
+    epoch = trade.price_cache.epoch
+
+    trade.base_drop_all()
+
+    assert trade.price_cache.epoch > epoch